@@ -0,0 +1,130 @@
+"""
+Receivable aging: bucket open sale dues by days overdue in one pass.
+
+Both backends feed age_receivables() one projected list of open-due sales
+and the retailer list; per-retailer rows and the per-SR / per-market-route
+totals all come from that single pass. Bucket lookup is a bisect over the
+sorted edges (the stdlib equivalent of numpy.digitize), so any edge list
+costs the same per sale.
+
+Edges are inclusive upper bounds in days. The default (7, 15, 30, 60)
+yields the legacy columns current, bucket_8_15, bucket_16_30, bucket_31_60,
+bucket_60_plus; override with RECEIVABLE_AGING_EDGES="7,15,30,60" or per
+request.
+"""
+
+import os
+from bisect import bisect_left
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+def parse_aging_edges(text: Optional[str]) -> Tuple[int, ...]:
+    """'7,15,30,60' -> (7, 15, 30, 60). Raises ValueError unless strictly ascending non-negative ints."""
+    try:
+        edges = tuple(int(part) for part in str(text).split(",") if part.strip())
+    except ValueError:
+        raise ValueError("Aging edges must be comma-separated whole days")
+    if not edges or edges[0] < 0 or any(b <= a for a, b in zip(edges, edges[1:])):
+        raise ValueError("Aging edges must be ascending, non-negative days")
+    return edges
+
+
+DEFAULT_AGING_EDGES = parse_aging_edges(os.environ.get("RECEIVABLE_AGING_EDGES", "7,15,30,60"))
+
+
+def bucket_keys(edges: Sequence[int]) -> List[str]:
+    """Column names for edges: current, bucket_<lo>_<hi>..., bucket_<last>_plus."""
+    keys = ["current"]
+    for low, high in zip(edges, edges[1:]):
+        keys.append(f"bucket_{low + 1}_{high}")
+    keys.append(f"bucket_{edges[-1]}_plus")
+    return keys
+
+
+def _as_date(value) -> Optional[date]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).date()
+    except ValueError:
+        return None
+
+
+def _empty(keys: List[str], **fields) -> dict:
+    return {**fields, "total_due": 0.0, "sale_count": 0, **{key: 0.0 for key in keys}}
+
+
+def age_receivables(
+    sales: Iterable[dict],
+    retailers: Iterable[dict],
+    edges: Sequence[int] = DEFAULT_AGING_EDGES,
+    as_of: Optional[date] = None,
+    market_routes: Optional[Dict[str, str]] = None,
+) -> dict:
+    """
+    Age open sale dues as of `as_of` (default today).
+
+    Sales created after as_of are ignored; a sale without a due_date counts as
+    current. Every retailer gets a row, even with nothing due. Returns
+    {"as_of", "bucket_keys", "rows", "by_sr", "by_market_route", "totals"}.
+    """
+    as_of = as_of or datetime.now().date()
+    market_routes = market_routes or {}
+    keys = bucket_keys(edges)
+
+    rows: Dict[str, dict] = {}
+    route_of: Dict[str, Optional[str]] = {}
+    for retailer in retailers:
+        retailer_id = str(retailer.get("id"))
+        route_of[retailer_id] = retailer.get("market_route_id")
+        rows[retailer_id] = _empty(
+            keys,
+            retailer_id=retailer_id,
+            retailer_name=retailer.get("shop_name") or retailer.get("name") or "",
+        )
+    by_sr: Dict[str, dict] = {}
+    by_route: Dict[str, dict] = {}
+    totals = _empty(keys)
+
+    for sale in sales:
+        due = float(sale.get("due_amount") or 0)
+        retailer_id = str(sale.get("retailer_id"))
+        if due <= 0 or retailer_id not in rows:
+            continue
+        created = _as_date(sale.get("created_at"))
+        if created and created > as_of:
+            continue
+        due_date = _as_date(sale.get("due_date"))
+        days = (as_of - due_date).days if due_date else 0
+        key = keys[bisect_left(edges, days)]
+
+        sr_id = str(sale.get("assigned_to") or "")
+        sr = by_sr.get(sr_id)
+        if sr is None:
+            sr = by_sr[sr_id] = _empty(keys, user_id=sr_id or None, user_name=sale.get("assigned_to_name") or "Unassigned")
+        route_id = str(route_of.get(retailer_id) or "")
+        route = by_route.get(route_id)
+        if route is None:
+            route = by_route[route_id] = _empty(
+                keys,
+                market_route_id=route_id or None,
+                market_route_name=market_routes.get(route_id) or ("Unassigned" if not route_id else ""),
+            )
+        for group in (rows[retailer_id], sr, route, totals):
+            group[key] += due
+            group["total_due"] += due
+            group["sale_count"] += 1
+
+    return {
+        "as_of": as_of.isoformat(),
+        "bucket_keys": keys,
+        "rows": list(rows.values()),
+        "by_sr": sorted(by_sr.values(), key=lambda g: -g["total_due"]),
+        "by_market_route": sorted(by_route.values(), key=lambda g: -g["total_due"]),
+        "totals": totals,
+    }
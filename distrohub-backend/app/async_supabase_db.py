@@ -0,0 +1,250 @@
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from app.dataloader import current_loader, loader_cached
+from app.models import PaymentStatus, OrderStatus, normalize_user_role
+from app.reference_cache import reference_cache
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+
+# Pool sizing: keep-alive HTTP/1.1 connections to PostgREST plus a bounded
+# thread pool for the methods that still run on the sync supabase-py client.
+DB_HTTP_MAX_CONNECTIONS = int(os.environ.get("DB_HTTP_MAX_CONNECTIONS", "50"))
+DB_HTTP_MAX_KEEPALIVE = int(os.environ.get("DB_HTTP_MAX_KEEPALIVE", "20"))
+DB_HTTP_TIMEOUT_SECONDS = float(os.environ.get("DB_HTTP_TIMEOUT_SECONDS", "15"))
+DB_THREAD_POOL_SIZE = int(os.environ.get("DB_THREAD_POOL_SIZE", "16"))
+
+
+class AsyncDatabase:
+    """
+    Awaitable view of a sync database backend.
+
+    Every public method of the wrapped backend is exposed as a coroutine
+    function, so handlers can always `await adb.<method>(...)` regardless of
+    which backend is configured. `hasattr(adb, name)` mirrors the wrapped
+    backend, which keeps the optional-capability checks in main.py working.
+
+    The base class runs calls inline, which is right for InMemoryDatabase
+    (dict lookups, no I/O, not thread-safe).
+    """
+
+    def __init__(self, sync_db):
+        self.sync = sync_db
+
+    async def startup(self) -> None:
+        return None
+
+    async def shutdown(self) -> None:
+        return None
+
+    async def _call(self, fn, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+    async def run_sync(self, fn, *args, **kwargs):
+        """Run a sync helper that talks to the backend (e.g. ledger writers in main.py)."""
+        return await self._call(fn, *args, **kwargs)
+
+    async def prime(self, table: str, ids) -> None:
+        """Batch-load ids into the request loader (one chunked query per table)."""
+        loader = current_loader()
+        if loader is not None:
+            await self._call(loader.prime, table, list(ids))
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.sync, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def _method(*args, **kwargs):
+            return await self._call(attr, *args, **kwargs)
+
+        return _method
+
+
+class ThreadedAsyncDatabase(AsyncDatabase):
+    """
+    Dispatches every call of a blocking backend to a bounded thread pool,
+    so a slow round-trip only occupies a worker thread, never the event loop.
+    """
+
+    def __init__(self, sync_db, max_workers: int = DB_THREAD_POOL_SIZE):
+        super().__init__(sync_db)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+
+    async def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
+        close = getattr(self.sync, "close", None)
+        if callable(close):
+            close()
+
+    async def _call(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        # Carry the request context (request loader) into the worker thread
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, functools.partial(context.run, fn, *args, **kwargs))
+
+
+class AsyncSupabaseDatabase(ThreadedAsyncDatabase):
+    """
+    Async Supabase backend.
+
+    Hot point lookups and list reads go straight to PostgREST over a pooled
+    httpx.AsyncClient, so they never block the event loop. Everything else
+    (multi-step writes, reports) is dispatched to a bounded thread pool
+    running the existing SupabaseDatabase implementation, which keeps one
+    source of truth for business logic while freeing the loop during I/O.
+    """
+
+    def __init__(self, sync_db, url: Optional[str] = None, key: Optional[str] = None):
+        super().__init__(sync_db)
+        self.url = (url or SUPABASE_URL or "").rstrip("/")
+        self.key = key or SUPABASE_KEY
+        if not self.url or not self.key:
+            raise ValueError("Supabase credentials not configured")
+        self._http: Optional[httpx.AsyncClient] = None
+
+    async def startup(self) -> None:
+        if self._http is not None:
+            return
+        self._http = httpx.AsyncClient(
+            base_url=f"{self.url}/rest/v1",
+            headers={
+                "apikey": self.key,
+                "Authorization": f"Bearer {self.key}",
+                "Accept": "application/json",
+            },
+            limits=httpx.Limits(
+                max_connections=DB_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=DB_HTTP_MAX_KEEPALIVE,
+            ),
+            timeout=DB_HTTP_TIMEOUT_SECONDS,
+        )
+        print(f"[Supabase] Async HTTP pool ready (max_connections={DB_HTTP_MAX_CONNECTIONS})")
+
+    async def shutdown(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        await super().shutdown()
+
+    async def _select(
+        self,
+        table: str,
+        filters: Optional[Dict[str, str]] = None,
+        select: str = "*",
+        order: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> List[dict]:
+        if self._http is None:
+            await self.startup()
+        params: Dict[str, Any] = {"select": select}
+        if filters:
+            params.update(filters)
+        if order:
+            params["order"] = order
+        if limit is not None:
+            params["limit"] = str(limit)
+        response = await self._http.get(f"/{table}", params=params)
+        response.raise_for_status()
+        return response.json() or []
+
+    # Users
+    @loader_cached("users")
+    async def get_user_by_id(self, user_id: str) -> Optional[dict]:
+        rows = await self._select("users", {"id": f"eq.{user_id}"}, limit=1)
+        if not rows:
+            return None
+        user = rows[0]
+        user["role"] = normalize_user_role(user.get("role"))
+        return user
+
+    async def get_user_by_email(self, email: str) -> Optional[dict]:
+        rows = await self._select("users", {"email": f"eq.{email}"}, limit=1)
+        if not rows:
+            return None
+        user = rows[0]
+        user["role"] = normalize_user_role(user.get("role"))
+        return user
+
+    async def get_users(self) -> List[dict]:
+        users = await self._select("users", order="created_at.desc")
+        for user in users:
+            user["role"] = normalize_user_role(user.get("role"))
+        return users
+
+    # Products & batches
+    async def get_products(self) -> List[dict]:
+        return await reference_cache.get_or_load_async("products", lambda: self._select("products"))
+
+    @loader_cached("products")
+    async def get_product(self, product_id: str) -> Optional[dict]:
+        rows = await self._select("products", {"id": f"eq.{product_id}"}, limit=1)
+        return rows[0] if rows else None
+
+    @loader_cached("product_batches")
+    async def get_batch(self, batch_id: str) -> Optional[dict]:
+        rows = await self._select("product_batches", {"id": f"eq.{batch_id}"}, limit=1)
+        return rows[0] if rows else None
+
+    async def get_batches_by_product(self, product_id: str, warehouse_id: Optional[str] = None) -> List[dict]:
+        filters = {"product_id": f"eq.{product_id}"}
+        if warehouse_id:
+            filters["warehouse_id"] = f"eq.{warehouse_id}"
+        return await self._select("product_batches", filters)
+
+    # Retailers & warehouses
+    async def get_retailers(self) -> List[dict]:
+        return await self._select("retailers")
+
+    async def get_retailer(self, retailer_id: str) -> Optional[dict]:
+        rows = await self._select("retailers", {"id": f"eq.{retailer_id}"}, limit=1)
+        return rows[0] if rows else None
+
+    async def get_warehouses(self) -> List[dict]:
+        return await reference_cache.get_or_load_async(
+            "warehouses", lambda: self._select("warehouses", order="name.asc")
+        )
+
+    @loader_cached("warehouses")
+    async def get_warehouse(self, warehouse_id: str) -> Optional[dict]:
+        rows = await self._select("warehouses", {"id": f"eq.{warehouse_id}"}, limit=1)
+        return rows[0] if rows else None
+
+    # Sales
+    @staticmethod
+    def _normalize_sale(sale: dict) -> dict:
+        sale["payment_status"] = PaymentStatus(sale["payment_status"]) if sale.get("payment_status") else PaymentStatus.DUE
+        sale["status"] = OrderStatus(sale["status"]) if sale.get("status") else OrderStatus.PENDING
+        sale["items"] = sale.pop("sale_items", None) or []
+        return sale
+
+    async def get_sales(self) -> List[dict]:
+        sales = await self._select("sales", select="*,sale_items(*)", order="created_at.desc")
+        return [self._normalize_sale(s) for s in sales]
+
+    @loader_cached("sales")
+    async def get_sale(self, sale_id: str) -> Optional[dict]:
+        rows = await self._select("sales", {"id": f"eq.{sale_id}"}, select="*,sale_items(*)", limit=1)
+        return self._normalize_sale(rows[0]) if rows else None
+
+
+def get_async_database(sync_db) -> AsyncDatabase:
+    """Wrap the configured sync backend in its awaitable counterpart."""
+    backend = type(sync_db).__name__
+    if backend == "SupabaseDatabase":
+        try:
+            return AsyncSupabaseDatabase(sync_db)
+        except Exception as e:
+            print(f"[DB] Async Supabase pool unavailable, using thread offload only: {e}")
+            return ThreadedAsyncDatabase(sync_db)
+    if backend == "PostgresDatabase":
+        return ThreadedAsyncDatabase(sync_db)
+    return AsyncDatabase(sync_db)
@@ -6,6 +6,7 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from app.database import db
 from app.models import UserRole, normalize_user_role
+from app.session_cache import token_versions
 
 _jwt_secret_from_env = os.environ.get("JWT_SECRET_KEY")
 if not _jwt_secret_from_env:
@@ -20,22 +21,63 @@ else:
 
 JWT_SECRET = _jwt_secret_from_env or "distrohub_super_secret_key_123456789"
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24
+# Access tokens are short-lived; clients renew them with POST /api/auth/refresh
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get("REFRESH_TOKEN_EXPIRE_DAYS", "14"))
 # Clock skew between client and server (serverless / devices) — reduces spurious exp failures
 JWT_DECODE_OPTIONS = {"leeway": 120}
 
 security = HTTPBearer()
 
+def _token_version(user: dict) -> int:
+    try:
+        return int(user.get("token_version") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def user_claims(user: dict) -> dict:
+    """Signed identity claims so get_current_user can skip the users lookup."""
+    role = normalize_user_role(user.get("role"))
+    created_at = user.get("created_at")
+    return {
+        "sub": user["id"],
+        "role": role.value if isinstance(role, UserRole) else str(role),
+        "name": user.get("name"),
+        "email": user.get("email"),
+        "phone": user.get("phone"),
+        "created_at": created_at.isoformat() if isinstance(created_at, datetime) else created_at,
+        "tv": _token_version(user),
+    }
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    to_encode.setdefault("typ", "access")
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=ALGORITHM)
     return encoded_jwt
 
+
+def create_refresh_token(user: dict) -> str:
+    return create_access_token(
+        data={"sub": user["id"], "tv": _token_version(user), "typ": "refresh"},
+        expires_delta=timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    )
+
+
+def issue_tokens(user: dict) -> dict:
+    """Access + refresh token pair for a freshly loaded user row."""
+    token_versions.put(user["id"], _token_version(user))
+    return {
+        "access_token": create_access_token(data=user_claims(user)),
+        "refresh_token": create_refresh_token(user),
+    }
+
 def verify_token(token: str) -> dict:
     """
     Verify and decode JWT token.
@@ -79,43 +121,96 @@ def verify_token(token: str) -> dict:
         )
 
 
+def _load_user(user_id: str) -> Optional[dict]:
+    # Support both InMemoryDatabase and SupabaseDatabase
+    if hasattr(db, 'users'):
+        # InMemoryDatabase
+        user = db.users.get(user_id)
+        if user:
+            user["role"] = normalize_user_role(user.get("role"))
+        return user
+    # SupabaseDatabase - get user by ID
+    try:
+        result = db.client.table("users").select("*").eq("id", user_id).execute()
+        user = result.data[0] if result.data else None
+        if user:
+            user["role"] = normalize_user_role(user.get("role"))
+        return user
+    except Exception as e:
+        # Transient DB/network errors must NOT return 401 (frontend clears session on 401)
+        print(f"[AUTH] Error fetching user from Supabase: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Database temporarily unavailable. Please retry.",
+        )
+
+
+def _session_revoked() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Session revoked. Please login again.",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+def refresh_session(refresh_token: str) -> dict:
+    """Validate a refresh token against the current user row and return a new token pair plus the user."""
+    payload = verify_token(refresh_token)
+    user_id = payload.get("sub")
+    if payload.get("typ") != "refresh" or user_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid refresh token",
+        )
+    user = _load_user(user_id)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User not found",
+        )
+    if int(payload.get("tv") or 0) != _token_version(user):
+        token_versions.put(user_id, _token_version(user))
+        raise _session_revoked()
+    return {**issue_tokens(user), "user": user}
+
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials
     # verify_token now raises HTTPException internally on error
     payload = verify_token(token)
     
     user_id = payload.get("sub")
-    if user_id is None:
+    if user_id is None or payload.get("typ") == "refresh":
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid token payload",
         )
-    
-    # Support both InMemoryDatabase and SupabaseDatabase
-    if hasattr(db, 'users'):
-        # InMemoryDatabase
-        user = db.users.get(user_id)
-        if user:
-            user["role"] = normalize_user_role(user.get("role"))
-    else:
-        # SupabaseDatabase - get user by ID
-        try:
-            result = db.client.table("users").select("*").eq("id", user_id).execute()
-            user = result.data[0] if result.data else None
-            if user:
-                user["role"] = normalize_user_role(user.get("role"))
-        except Exception as e:
-            # Transient DB/network errors must NOT return 401 (frontend clears session on 401)
-            print(f"[AUTH] Error fetching user from Supabase: {e}")
-            raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail="Database temporarily unavailable. Please retry.",
-            )
-    
+
+    token_version = int(payload.get("tv") or 0)
+    if "role" in payload:
+        cached_version = token_versions.get(user_id)
+        if cached_version is not None:
+            if cached_version != token_version:
+                raise _session_revoked()
+            return {
+                "id": user_id,
+                "role": normalize_user_role(payload.get("role")),
+                "name": payload.get("name"),
+                "email": payload.get("email"),
+                "phone": payload.get("phone"),
+                "created_at": payload.get("created_at"),
+            }
+
+    # Cache miss or legacy token without claims: load the row and re-cache its version
+    user = _load_user(user_id)
     if user is None:
+        token_versions.revoke(user_id)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found",
         )
+    token_versions.put(user_id, _token_version(user))
+    if "role" in payload and token_version != _token_version(user):
+        raise _session_revoked()
     
     return user
@@ -0,0 +1,50 @@
+"""
+Latest-batch summaries for the product list.
+
+A product's "latest batch" (batch_number / expiry_date shown on the product
+list) is its newest batch by created_at, falling back to expiry_date for
+rows without one. latest_batch_rows() reduces any batch list to one summary
+row per product in a single pass; the Supabase backend reads the same rows
+from the latest_product_batches view when it exists and caches them in
+reference_cache under that name (create_batch / delete_product invalidate it).
+"""
+
+from datetime import date, datetime
+from typing import Dict, Iterable, List
+
+LATEST_BATCH_FIELDS = ("product_id", "batch_number", "expiry_date", "created_at")
+
+
+def batch_sort_key(batch: dict) -> datetime:
+    created_at = batch.get("created_at")
+    if isinstance(created_at, datetime):
+        return created_at.replace(tzinfo=None) if created_at.tzinfo else created_at
+    if isinstance(created_at, str):
+        try:
+            parsed = datetime.fromisoformat(created_at.replace("Z", "+00:00"))
+            return parsed.replace(tzinfo=None) if parsed.tzinfo else parsed
+        except ValueError:
+            pass
+    expiry_date = batch.get("expiry_date")
+    if isinstance(expiry_date, date):
+        return datetime.combine(expiry_date, datetime.min.time())
+    if isinstance(expiry_date, str):
+        try:
+            return datetime.fromisoformat(expiry_date)
+        except ValueError:
+            pass
+    return datetime.min
+
+
+def latest_batch_rows(batches: Iterable[dict]) -> List[dict]:
+    """One {product_id, batch_number, expiry_date, created_at} row per product: its latest batch."""
+    latest: Dict[str, tuple] = {}
+    for batch in batches:
+        product_id = batch.get("product_id")
+        if not product_id:
+            continue
+        key = batch_sort_key(batch)
+        current = latest.get(str(product_id))
+        if current is None or key > current[0]:
+            latest[str(product_id)] = (key, batch)
+    return [{field: batch.get(field) for field in LATEST_BATCH_FIELDS} for _, batch in latest.values()]
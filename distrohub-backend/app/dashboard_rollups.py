@@ -0,0 +1,77 @@
+"""
+Dashboard statistics from maintained rollups.
+
+The Supabase backend reads /api/dashboard/stats as one row of the
+dashboard_stats view: the dashboard_rollups base row plus the pending
+dashboard_rollup_deltas (appended by statement triggers on the source
+tables, so writers never share a counter row), joined with the current month
+of dashboard_monthly_rollups. stats_from_rollup() turns that row into
+DashboardStats.
+
+Low-stock and expiring-soon counts depend on batch totals and on today's
+date, and trigger deltas can drift after manual fixes, so
+DashboardRollupRefresher calls refresh_dashboard_rollups() every
+DASHBOARD_ROLLUP_REFRESH_SECONDS as the repair job (started from main.py).
+The refresh recounts the base figures and folds the deltas without locking
+the source tables.
+"""
+
+import asyncio
+import logging
+import os
+from typing import Any
+
+from app.models import DashboardStats
+
+DASHBOARD_ROLLUP_REFRESH_SECONDS = float(os.environ.get("DASHBOARD_ROLLUP_REFRESH_SECONDS", "600"))
+
+logger = logging.getLogger(__name__)
+
+
+def _num(value: Any) -> float:
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def stats_from_rollup(row: dict) -> DashboardStats:
+    """DashboardStats from a dashboard_stats row; payables fall back to unpaid purchases when suppliers carry no dues."""
+    payable = _num(row.get("supplier_due")) or _num(row.get("purchases_unpaid"))
+    receivable = _num(row.get("receivable_from_customers"))
+    return DashboardStats(
+        total_sales=_num(row.get("total_sales")),
+        total_due=receivable,
+        total_products=int(_num(row.get("total_products"))),
+        total_categories=int(_num(row.get("total_categories"))),
+        total_purchases=int(_num(row.get("total_purchases"))),
+        active_retailers=int(_num(row.get("total_retailers"))),  # retailers carry no active flag
+        low_stock_count=int(_num(row.get("low_stock_count"))),
+        expiring_soon_count=int(_num(row.get("expiring_soon_count"))),
+        payable_to_supplier=payable,
+        receivable_from_customers=receivable,
+        sales_this_month=_num(row.get("sales_this_month")),
+        collections_this_month=_num(row.get("collections_this_month")),
+    )
+
+
+class DashboardRollupRefresher:
+    """Background repair loop for the dashboard rollups."""
+
+    def __init__(self):
+        self.running = False
+
+    async def start(self, db) -> None:
+        self.running = True
+        while self.running:
+            await asyncio.sleep(DASHBOARD_ROLLUP_REFRESH_SECONDS)
+            try:
+                await asyncio.to_thread(db.refresh_dashboard_rollups)
+            except Exception as e:
+                logger.error(f"Dashboard rollup refresh failed: {e}")
+
+    def stop(self) -> None:
+        self.running = False
+
+
+dashboard_rollups = DashboardRollupRefresher()
@@ -1,8 +1,15 @@
-from datetime import datetime, date, timedelta
+from datetime import datetime, date, timedelta, timezone
 from typing import Dict, List, Optional, Tuple
 import uuid
-import hashlib
 import bcrypt as _bcrypt_lib
+from app.session_cache import token_versions
+from app.password_pool import hash_password as _hash_password, verify_password as _verify_password
+from app.batches import latest_batch_rows
+from app.stock_reconciliation import fold_reconciliation_aggregates, ledger_balance_rows, product_ledger_totals
+from app.aging import DEFAULT_AGING_EDGES, age_receivables
+from app.margins import margin_row, summarize_margin_rows
+from app.pricing import PriceIndex, default_price
+from app.pagination import keyset_page, sort_key
 from app.models import (
     User, UserRole, normalize_user_role, Product, ProductBatch, Retailer, Purchase, PurchaseItem,
     Sale, SaleItem, Payment, PaymentStatus, OrderStatus, ExpiryStatus,
@@ -10,6 +17,9 @@ from app.models import (
     Warehouse
 )
 
+# Changing any of these bumps users.token_version and revokes outstanding JWTs
+_TOKEN_CLAIM_FIELDS = ("name", "email", "phone", "role", "password_hash")
+
 def generate_id() -> str:
     return str(uuid.uuid4())[:8]
 
@@ -46,6 +56,8 @@ class InMemoryDatabase:
         self.sms_logs: List[dict] = []
         self.audit_logs: List[dict] = []
         self.stock_ledger: List[dict] = []
+        self.stock_ledger_backfill_jobs: Dict[str, dict] = {}
+        self.stock_ledger_write_queue: Dict[str, dict] = {}
         self.sr_risk_adjustments: Dict[str, dict] = {}
         self._seed_data()
     
@@ -200,26 +212,12 @@ class InMemoryDatabase:
         }
     
     def hash_password(self, password: str) -> str:
-        """Hash password using bcrypt."""
-        pwd_bytes = password.encode("utf-8")[:72]
-        salt = _bcrypt_lib.gensalt(rounds=12)
-        return _bcrypt_lib.hashpw(pwd_bytes, salt).decode("utf-8")
+        """Hash password using bcrypt (cost from BCRYPT_ROUNDS)."""
+        return _hash_password(password)
 
     def verify_password(self, plain_password: str, hashed_password: str) -> bool:
         """Verify password. Supports both bcrypt (new) and SHA-256 (legacy) hashes."""
-        if not hashed_password:
-            return False
-        if hashed_password.startswith("$2b$") or hashed_password.startswith("$2a$"):
-            try:
-                return _bcrypt_lib.checkpw(
-                    plain_password.encode("utf-8")[:72],
-                    hashed_password.encode("utf-8")
-                )
-            except Exception:
-                return False
-        else:
-            # Legacy SHA-256 fallback
-            return hashlib.sha256(plain_password.encode()).hexdigest() == hashed_password
+        return _verify_password(plain_password, hashed_password)
 
     def log_audit_event(
         self,
@@ -257,7 +255,9 @@ class InMemoryDatabase:
     def get_users(self) -> List[dict]:
         return sorted(self.users.values(), key=lambda user: user.get("created_at", datetime.min), reverse=True)
     
-    def create_user(self, email: str, name: str, password: str, role: UserRole, phone: str = None) -> dict:
+    def create_user(
+        self, email: str, name: str, password: str, role: UserRole, phone: str = None, password_hash: str = None
+    ) -> dict:
         user_id = generate_id()
         user = {
             "id": user_id,
@@ -265,7 +265,7 @@ class InMemoryDatabase:
             "name": name,
             "role": role,
             "phone": phone,
-            "password_hash": self.hash_password(password),
+            "password_hash": password_hash or self.hash_password(password),
             "sr_guarantee_limit": 0.0,
             "sr_guarantee_enforcement": "off",
             "created_at": datetime.now()
@@ -277,13 +277,16 @@ class InMemoryDatabase:
         user = self.users.get(user_id)
         if not user:
             return None
+        before = {k: user.get(k) for k in _TOKEN_CLAIM_FIELDS}
         if "name" in data and data["name"] is not None:
             user["name"] = data["name"]
         if "email" in data and data["email"] is not None:
             user["email"] = data["email"]
         if "phone" in data:
             user["phone"] = data["phone"] if data["phone"] else None
-        if "password" in data and data.get("password"):
+        if data.get("password_hash"):
+            user["password_hash"] = data["password_hash"]
+        elif "password" in data and data.get("password"):
             user["password_hash"] = self.hash_password(data["password"])
         if "role" in data and data["role"] is not None:
             r = data["role"]
@@ -293,12 +296,16 @@ class InMemoryDatabase:
         if "sr_guarantee_enforcement" in data and data["sr_guarantee_enforcement"] is not None:
             e = data["sr_guarantee_enforcement"]
             user["sr_guarantee_enforcement"] = e.value if hasattr(e, "value") else str(e)
+        if any(user.get(k) != before.get(k) for k in _TOKEN_CLAIM_FIELDS):
+            user["token_version"] = int(user.get("token_version") or 0) + 1
+            token_versions.revoke(user_id)
         return user
 
     def delete_user(self, user_id: str) -> bool:
         if user_id not in self.users:
             return False
         del self.users[user_id]
+        token_versions.revoke(user_id)
 
         for sale in self.sales.values():
             if sale.get("assigned_to") == user_id:
@@ -311,6 +318,15 @@ class InMemoryDatabase:
                 payment["collected_by_name"] = None
 
         return True
+
+    def apply_password_rehashes(self, updates: List[dict]) -> int:
+        written = 0
+        for item in updates or []:
+            user = self.users.get(item.get("id"))
+            if user and user.get("password_hash") == item.get("old_hash"):
+                user["password_hash"] = item["password_hash"]
+                written += 1
+        return written
     
     def get_products(self) -> List[dict]:
         return list(self.products.values())
@@ -355,6 +371,9 @@ class InMemoryDatabase:
         if warehouse_id:
             batches = [b for b in batches if b.get("warehouse_id") == warehouse_id]
         return batches
+
+    def get_latest_batches(self) -> Dict[str, dict]:
+        return {str(row["product_id"]): row for row in latest_batch_rows(self.batches.values())}
     
     def get_batch(self, batch_id: str) -> Optional[dict]:
         return self.batches.get(batch_id)
@@ -374,6 +393,39 @@ class InMemoryDatabase:
             self.batches[batch_id]["quantity"] += quantity_change
             return self.batches[batch_id]
         return None
+
+    def apply_stock_movements(self, movements: List[dict], guard_non_negative: bool = False) -> dict:
+        """Apply batch/product stock deltas all-or-nothing (no warehouse_stock table in memory)."""
+        batch_deltas: Dict[str, int] = {}
+        product_deltas: Dict[str, int] = {}
+        for movement in movements or []:
+            delta = int(movement.get("delta") or 0)
+            if delta == 0:
+                continue
+            if movement.get("batch_id") in self.batches:
+                batch_deltas[movement["batch_id"]] = batch_deltas.get(movement["batch_id"], 0) + delta
+            if movement.get("product_id") in self.products:
+                product_deltas[movement["product_id"]] = product_deltas.get(movement["product_id"], 0) + delta
+
+        if guard_non_negative:
+            for batch_id, delta in batch_deltas.items():
+                if int(self.batches[batch_id].get("quantity") or 0) + delta < 0:
+                    raise ValueError(f"Insufficient stock in batch {self.batches[batch_id].get('batch_number')}")
+            for product_id, delta in product_deltas.items():
+                if int(self.products[product_id].get("stock_quantity") or 0) + delta < 0:
+                    raise ValueError(f"Insufficient stock for product {self.products[product_id].get('name')}")
+
+        return {
+            "batches": {
+                batch_id: self.update_batch_quantity(batch_id, delta)["quantity"]
+                for batch_id, delta in batch_deltas.items()
+            },
+            "products": {
+                product_id: self.update_product_stock(product_id, delta)["stock_quantity"]
+                for product_id, delta in product_deltas.items()
+            },
+            "warehouse_stock": {},
+        }
     
     def get_retailers(self) -> List[dict]:
         return list(self.retailers.values())
@@ -381,6 +433,22 @@ class InMemoryDatabase:
     def get_retailer(self, retailer_id: str) -> Optional[dict]:
         return self.retailers.get(retailer_id)
     
+    def calculate_previous_due(self, retailer_id: str, exclude_route_id: Optional[str] = None) -> float:
+        return self.calculate_previous_dues([retailer_id], exclude_route_id).get(str(retailer_id), 0.0)
+
+    def calculate_previous_dues(self, retailer_ids: List[str], exclude_route_id: Optional[str] = None) -> Dict[str, float]:
+        """Due on each retailer's unpaid sales outside any route (or outside exclude_route_id only)."""
+        dues = {str(r): 0.0 for r in retailer_ids if r}
+        for sale in self.sales.values():
+            retailer_id = str(sale.get("retailer_id"))
+            route_id = sale.get("route_id")
+            if retailer_id not in dues or sale.get("payment_status") == PaymentStatus.PAID:
+                continue
+            if route_id and (not exclude_route_id or route_id == exclude_route_id):
+                continue
+            dues[retailer_id] += float(sale.get("due_amount") or 0)
+        return dues
+    
     def create_retailer(self, data: dict) -> dict:
         retailer_id = generate_id()
         retailer = {
@@ -403,6 +471,44 @@ class InMemoryDatabase:
             self.retailers[retailer_id]["total_due"] += amount_change
             return self.retailers[retailer_id]
         return None
+
+    def apply_balance_deltas(self, deltas: List[dict], ledger_entries: Optional[List[dict]] = None) -> dict:
+        """Apply retailer_due / sale_payment / sr_cash deltas plus receivable ledger rows."""
+        result = {"retailers": {}, "sales": {}, "sr_cash": {}, "ledger": []}
+        for delta in deltas or []:
+            kind = delta.get("kind")
+            row_id = delta.get("id")
+            amount = float(delta.get("amount") or 0)
+            if kind == "retailer_due":
+                if self.update_retailer_due(row_id, amount):
+                    result["retailers"][row_id] = self.retailers[row_id]
+            elif kind == "sale_payment":
+                sale = self.sales.get(row_id)
+                if sale:
+                    sale["paid_amount"] = float(sale.get("paid_amount", 0) or 0) + amount
+                    sale["due_amount"] = max(0, float(sale.get("due_amount", 0) or 0) - amount)
+                    sale["payment_status"] = PaymentStatus.PAID if sale["due_amount"] <= 0.01 else PaymentStatus.PARTIAL
+                    result["sales"][row_id] = sale
+            elif kind == "sr_cash":
+                user = self.users.get(row_id)
+                if not user:
+                    raise ValueError("User not found")
+                before_balance = float(user.get("current_cash_holding", 0) or 0)
+                user["current_cash_holding"] = before_balance + amount
+                result["sr_cash"][row_id] = {
+                    "user_id": row_id,
+                    "amount": amount,
+                    "before_balance": before_balance,
+                    "after_balance": user["current_cash_holding"],
+                    "source": delta.get("source") or "manual_adjustment",
+                    "reference_id": delta.get("reference_id"),
+                    "notes": delta.get("notes"),
+                }
+            else:
+                raise ValueError(f"Unknown balance delta kind: {kind}")
+        for entry in ledger_entries or []:
+            result["ledger"].append(self.add_receivable_ledger_entry(entry))
+        return result
     
     def delete_retailer(self, retailer_id: str) -> bool:
         if retailer_id in self.retailers:
@@ -462,7 +568,7 @@ class InMemoryDatabase:
                 "purchase_price": item["unit_price"]
             })
 
-            self.update_product_stock(item["product_id"], item["quantity"])
+            self.apply_stock_movements([{"product_id": item["product_id"], "delta": item["quantity"]}])
             
             purchase_items.append({
                 "id": generate_id(),
@@ -520,8 +626,11 @@ class InMemoryDatabase:
             subtotal += item_subtotal
             total_discount += item_discount
             
-            self.update_batch_quantity(item["batch_id"], -item["quantity"])
-            self.update_product_stock(item["product_id"], -item["quantity"])
+            self.apply_stock_movements([{
+                "batch_id": item["batch_id"],
+                "product_id": item["product_id"],
+                "delta": -item["quantity"],
+            }])
             
             sale_items.append({
                 "id": generate_id(),
@@ -720,6 +829,40 @@ class InMemoryDatabase:
         
         return payments
     
+    def get_collection_payments(
+        self,
+        user_id: Optional[str] = None,
+        from_date: Optional[str] = None,
+        to_date: Optional[str] = None,
+        approval_status: Optional[str] = "approved",
+        cursor: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> dict:
+        payments = self.get_payments(from_date=from_date, to_date=to_date, approval_status=approval_status)
+        rows = []
+        for payment in payments:
+            sale = self.sales.get(payment.get("sale_id")) if payment.get("sale_id") else None
+            if user_id and user_id not in (payment.get("collected_by"), sale and sale.get("assigned_to")):
+                continue
+            row = dict(payment)
+            if sale:
+                row["invoice_number"] = sale.get("invoice_number")
+                row["retailer_name"] = sale.get("retailer_name") or payment.get("retailer_name")
+            collector_id = payment.get("collected_by") or (sale and sale.get("assigned_to"))
+            collector = self.users.get(collector_id) if collector_id else None
+            if not row.get("collected_by_name") and collector:
+                row["collected_by_name"] = collector.get("name")
+                row["collected_by"] = collector_id
+            rows.append(row)
+        rows.sort(key=sort_key, reverse=True)
+        page, next_cursor = keyset_page(rows, cursor, limit)
+        return {
+            "payments": page,
+            "total_payments": len(rows),
+            "total_amount": sum(float(p.get("amount") or 0) for p in rows),
+            "next_cursor": next_cursor,
+        }
+
     def create_payment(self, data: dict) -> dict:
         payment_id = generate_id()
         retailer = self.get_retailer(data["retailer_id"])
@@ -850,12 +993,49 @@ class InMemoryDatabase:
         self.stock_ledger.append(entry)
         return entry
 
-    def get_stock_ledger(self, product_id: Optional[str] = None, limit: int = 200) -> List[dict]:
-        records = self.stock_ledger
-        if product_id:
-            records = [row for row in records if row.get("product_id") == product_id]
-        records = sorted(records, key=lambda row: row.get("created_at", datetime.min), reverse=True)
-        return records[:limit]
+    def get_stock_ledger(self, product_id: Optional[str] = None, limit: int = 200, **filters) -> List[dict]:
+        return self.get_stock_ledger_page(product_id=product_id, limit=limit, **filters)["entries"]
+
+    def get_stock_ledger_page(
+        self,
+        product_id: Optional[str] = None,
+        warehouse_id: Optional[str] = None,
+        batch_id: Optional[str] = None,
+        voucher_type: Optional[str] = None,
+        voucher_id: Optional[str] = None,
+        from_date: Optional[str] = None,
+        to_date: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: int = 200,
+        opening_balance: bool = False,
+    ) -> dict:
+        start = datetime.fromisoformat(from_date).replace(tzinfo=None) if from_date else None
+        end = datetime.fromisoformat(to_date).replace(tzinfo=None) + timedelta(days=1) if to_date else None
+
+        def at(row: dict) -> datetime:
+            return row["created_at"].replace(tzinfo=None)
+
+        filters = {
+            "product_id": product_id,
+            "warehouse_id": warehouse_id,
+            "batch_id": batch_id,
+            "voucher_type": voucher_type,
+            "voucher_id": voucher_id,
+        }
+        matched = [
+            row for row in self.stock_ledger
+            if all(not value or str(row.get(column)) == value for column, value in filters.items())
+        ]
+        in_range = [
+            row for row in matched
+            if (not start or at(row) >= start) and (not end or at(row) < end)
+        ]
+        in_range.sort(key=sort_key, reverse=True)
+        page, next_cursor = keyset_page(in_range, cursor, limit)
+        opening = None
+        if opening_balance and not cursor:
+            opening = sum(int(row.get("quantity_change") or 0) for row in matched if start and at(row) < start)
+        return {"entries": page, "next_cursor": next_cursor, "opening_balance": opening}
 
     def get_stock_ledger_backfill_keys(self) -> set[str]:
         keys: set[str] = set()
@@ -868,6 +1048,8 @@ class InMemoryDatabase:
     def get_stock_ledger_voucher_keys(self) -> set[tuple[str, str]]:
         keys: set[tuple[str, str]] = set()
         for row in self.stock_ledger:
+            if str(row.get("remarks") or "").startswith("backfill:"):
+                continue
             vt = row.get("voucher_type")
             vid = row.get("voucher_id")
             if vt is not None and vid is not None:
@@ -883,17 +1065,67 @@ class InMemoryDatabase:
 
     def get_stock_ledger_aggregates_by_product(self) -> Tuple[Dict[str, int], Dict[str, int], int]:
         """Sum quantity_change and row counts per product_id over the full ledger."""
-        net: Dict[str, int] = {}
-        cnt: Dict[str, int] = {}
-        for row in self.stock_ledger:
-            pid = row.get("product_id")
-            if not pid:
-                continue
-            pid = str(pid)
-            q = int(row.get("quantity_change") or 0)
-            net[pid] = net.get(pid, 0) + q
-            cnt[pid] = cnt.get(pid, 0) + 1
-        return net, cnt, len(self.stock_ledger)
+        return product_ledger_totals(self.get_stock_ledger_balances())
+
+    def get_stock_ledger_balances(self) -> List[dict]:
+        return ledger_balance_rows(self.stock_ledger)
+
+    def rebuild_stock_ledger_balances(self) -> dict:
+        balances = self.get_stock_ledger_balances()
+        return {"balances": len(balances), "ledger_rows": len(self.stock_ledger)}
+
+    def get_all_batches(self) -> List[dict]:
+        return list(self.batches.values())
+
+    def iter_stock_ledger_backfill_vouchers(self, phase: str, after_id: Optional[str] = None, page_size: int = 200):
+        vouchers = {"purchase": self.purchases, "sale": self.sales}.get(phase, {})
+        ids = sorted(voucher_id for voucher_id in vouchers if after_id is None or voucher_id > after_id)
+        for start in range(0, len(ids), page_size):
+            yield [vouchers[voucher_id] for voucher_id in ids[start:start + page_size]]
+
+    def save_stock_ledger_backfill_job(self, job: dict) -> dict:
+        self.stock_ledger_backfill_jobs[job["id"]] = dict(job)
+        return job
+
+    def get_stock_ledger_backfill_job(self, job_id: Optional[str] = None) -> Optional[dict]:
+        if job_id:
+            job = self.stock_ledger_backfill_jobs.get(job_id)
+        else:
+            job = max(self.stock_ledger_backfill_jobs.values(), key=lambda j: j.get("started_at") or "", default=None)
+        return dict(job) if job else None
+
+    def claim_stock_ledger_backfill_job(self, job_id: str, heartbeat_at: Optional[str]) -> bool:
+        job = self.stock_ledger_backfill_jobs.get(job_id)
+        if not job or job.get("heartbeat_at") != heartbeat_at:
+            return False
+        job["heartbeat_at"] = datetime.now(timezone.utc).isoformat()
+        return True
+
+    def enqueue_stock_ledger_write(self, entry: dict) -> dict:
+        self.stock_ledger_write_queue[entry["id"]] = dict(entry)
+        return entry
+
+    def get_due_stock_ledger_writes(self, now: str, limit: int = 20) -> List[dict]:
+        due = [
+            e for e in self.stock_ledger_write_queue.values()
+            if e.get("status") == "pending" and str(e.get("next_attempt_at") or "") <= now
+        ]
+        due.sort(key=lambda e: str(e.get("next_attempt_at") or ""))
+        return [dict(e) for e in due[:limit]]
+
+    def claim_stock_ledger_write(self, entry_id: str, next_attempt_at: Optional[str], lease_until: str) -> bool:
+        entry = self.stock_ledger_write_queue.get(entry_id)
+        if not entry or entry.get("status") != "pending" or entry.get("next_attempt_at") != next_attempt_at:
+            return False
+        entry["next_attempt_at"] = lease_until
+        return True
+
+    def update_stock_ledger_write(self, entry_id: str, data: dict) -> None:
+        if entry_id in self.stock_ledger_write_queue:
+            self.stock_ledger_write_queue[entry_id].update(data)
+
+    def get_stock_reconciliation_aggregates(self) -> dict:
+        return fold_reconciliation_aggregates(self.batches.values(), self.get_stock_ledger_balances())
     
     def get_expiry_alerts(self) -> List[ExpiryAlert]:
         alerts = []
@@ -1255,44 +1487,20 @@ class InMemoryDatabase:
         self.retailer_price_list_assignments[assignment_id] = row
         return row
 
+    def resolve_prices(self, retailer_id: str, lines: List[dict]) -> List[dict]:
+        index = PriceIndex(
+            self.price_lists.values(), self.price_list_items.values(), self.retailer_price_list_assignments.values()
+        )
+        resolved = []
+        for line in lines:
+            price = index.resolve(retailer_id, line["product_id"], line.get("variant_id"), line.get("quantity", 0), line.get("uom"))
+            resolved.append(price if price is not None else default_price(self.get_product(line["product_id"])))
+        return resolved
+
     def resolve_price(self, retailer_id: str, product_id: str, variant_id: Optional[str], quantity: float, uom: Optional[str]) -> dict:
-        assignments = [
-            a for a in self.retailer_price_list_assignments.values()
-            if a.get("retailer_id") == retailer_id
-        ]
-        price_lists = [self.price_lists.get(a.get("price_list_id")) for a in assignments]
-        price_lists = [pl for pl in price_lists if pl and pl.get("is_active", True)]
-        price_lists = sorted(price_lists, key=lambda pl: pl.get("priority", 100))
-        for pl in price_lists:
-            items = [
-                i for i in self.price_list_items.values()
-                if i.get("price_list_id") == pl.get("id")
-                and i.get("product_id") == product_id
-                and (not i.get("variant_id") or i.get("variant_id") == variant_id)
-                and (not i.get("uom") or i.get("uom") == uom)
-                and float(quantity) >= float(i.get("min_qty", 0) or 0)
-            ]
-            if items:
-                item = sorted(items, key=lambda i: float(i.get("min_qty", 0) or 0), reverse=True)[0]
-                base_price = float(item.get("unit_price", 0) or 0)
-                discount_percent = float(item.get("discount_percent", 0) or 0)
-                resolved_price = base_price * (1 - (discount_percent / 100))
-                return {
-                    "price_list_id": pl.get("id"),
-                    "price_source": "price_list",
-                    "base_price": base_price,
-                    "resolved_price": round(resolved_price, 2),
-                    "discount_percent": discount_percent,
-                }
-        product = self.get_product(product_id) or {}
-        fallback = float(product.get("selling_price", 0) or 0)
-        return {
-            "price_list_id": None,
-            "price_source": "product_default",
-            "base_price": fallback,
-            "resolved_price": fallback,
-            "discount_percent": 0,
-        }
+        return self.resolve_prices(
+            retailer_id, [{"product_id": product_id, "variant_id": variant_id, "quantity": quantity, "uom": uom}]
+        )[0]
 
     # ERP upgrade: reorder
     def upsert_reorder_policy(self, data: dict) -> dict:
@@ -1346,40 +1554,13 @@ class InMemoryDatabase:
         return row
 
     def get_receivable_aging(self) -> List[dict]:
-        now = datetime.now()
-        rows = []
-        for retailer in self.retailers.values():
-            dues = [s for s in self.sales.values() if s.get("retailer_id") == retailer.get("id") and float(s.get("due_amount", 0) or 0) > 0]
-            bucket = {"current": 0.0, "bucket_8_15": 0.0, "bucket_16_30": 0.0, "bucket_31_60": 0.0, "bucket_60_plus": 0.0}
-            for sale in dues:
-                due = float(sale.get("due_amount", 0) or 0)
-                due_date = sale.get("due_date")
-                if isinstance(due_date, str):
-                    try:
-                        due_date = datetime.fromisoformat(due_date).date()
-                    except Exception:
-                        due_date = None
-                days = 0
-                if due_date:
-                    days = (now.date() - due_date).days
-                if days <= 7:
-                    bucket["current"] += due
-                elif days <= 15:
-                    bucket["bucket_8_15"] += due
-                elif days <= 30:
-                    bucket["bucket_16_30"] += due
-                elif days <= 60:
-                    bucket["bucket_31_60"] += due
-                else:
-                    bucket["bucket_60_plus"] += due
-            total_due = sum(bucket.values())
-            rows.append({
-                "retailer_id": retailer.get("id"),
-                "retailer_name": retailer.get("shop_name") or retailer.get("name"),
-                "total_due": total_due,
-                **bucket,
-            })
-        return rows
+        return self.get_receivable_aging_report()["rows"]
+
+    def get_receivable_aging_report(self, as_of: Optional[date] = None, edges: Optional[Tuple[int, ...]] = None) -> dict:
+        market_routes = {str(r["id"]): r.get("name") for r in self.market_routes.values()}
+        return age_receivables(
+            self.sales.values(), self.retailers.values(), edges or DEFAULT_AGING_EDGES, as_of, market_routes
+        )
 
     def check_credit_limit(self, retailer_id: str, new_order_amount: float) -> dict:
         retailer = self.get_retailer(retailer_id)
@@ -1509,43 +1690,29 @@ class InMemoryDatabase:
         self.sale_item_cost_snapshots[row_id] = row
         return row
 
-    def get_margin_report(self, from_date: Optional[str] = None, to_date: Optional[str] = None) -> dict:
-        rows = []
-        total_net_sales = 0.0
-        total_cogs = 0.0
+    def get_margin_report(
+        self,
+        from_date: Optional[str] = None,
+        to_date: Optional[str] = None,
+        group_by: Optional[str] = None,
+        include_rows: bool = True,
+    ) -> dict:
+        return summarize_margin_rows(self.iter_margin_rows(from_date, to_date), group_by, include_rows)
+
+    def iter_margin_rows(self, from_date: Optional[str] = None, to_date: Optional[str] = None):
+        snapshots_by_sale: Dict[str, List[dict]] = {}
+        for snap in self.sale_item_cost_snapshots.values():
+            snapshots_by_sale.setdefault(snap.get("sale_id"), []).append(snap)
         for sale in self.sales.values():
             created_at = sale.get("created_at")
             if from_date and isinstance(created_at, datetime) and created_at.isoformat() < from_date:
                 continue
             if to_date and isinstance(created_at, datetime) and created_at.isoformat() > to_date:
                 continue
-            for item in [si for si in self.sale_item_cost_snapshots.values() if si.get("sale_id") == sale.get("id")]:
-                net_sales = float(item.get("net_sales", 0) or 0)
-                cogs_total = float(item.get("cogs_total", 0) or 0)
-                margin_amount = net_sales - cogs_total
-                margin_percent = (margin_amount / net_sales * 100) if net_sales > 0 else 0
-                rows.append({
-                    "sale_id": sale.get("id"),
-                    "invoice_number": sale.get("invoice_number"),
-                    "product_id": item.get("product_id"),
-                    "product_name": item.get("product_name"),
-                    "quantity": int(item.get("quantity", 0) or 0),
-                    "net_sales": net_sales,
-                    "cogs_total": cogs_total,
-                    "margin_amount": margin_amount,
-                    "margin_percent": margin_percent,
-                    "created_at": sale.get("created_at") or datetime.now(),
-                })
-                total_net_sales += net_sales
-                total_cogs += cogs_total
-        total_margin = total_net_sales - total_cogs
-        return {
-            "total_net_sales": total_net_sales,
-            "total_cogs": total_cogs,
-            "total_margin": total_margin,
-            "margin_percent": (total_margin / total_net_sales * 100) if total_net_sales > 0 else 0,
-            "rows": rows,
-        }
+            for item in snapshots_by_sale.get(sale.get("id"), []):
+                product = self.products.get(item.get("product_id")) or {}
+                line = {**item, "total": item.get("net_sales", 0)}
+                yield margin_row(item, line, {**sale, "created_at": created_at or datetime.now()}, product.get("category"))
     
     # SMS methods
     def add_to_sms_queue(self, recipient_phone: str, message: str, event_type: str, scheduled_at: datetime) -> str:
@@ -1592,7 +1759,20 @@ def get_database():
     use_supabase = os.environ.get("USE_SUPABASE", "").lower() == "true"
     supabase_url = os.environ.get("SUPABASE_URL")
     supabase_key = os.environ.get("SUPABASE_KEY")
-    
+    use_postgres = os.environ.get("USE_POSTGRES", "").lower() == "true"
+    database_url = os.environ.get("DATABASE_URL")
+
+    if use_postgres and database_url:
+        try:
+            from app.postgres_db import PostgresDatabase
+            print("[DB] Initializing PostgresDatabase (asyncpg pool)")
+            return PostgresDatabase(database_url)
+        except Exception as e:
+            print(f"[DB] Failed to connect to Postgres: {e}")
+            import traceback
+            traceback.print_exc()
+            print("[DB] Falling back to next configured backend")
+
     if use_supabase and supabase_url and supabase_key:
         try:
             from app.supabase_db import SupabaseDatabase
@@ -1608,3 +1788,6 @@ def get_database():
     return InMemoryDatabase()
 
 db = get_database()
+
+from app.async_supabase_db import get_async_database
+adb = get_async_database(db)
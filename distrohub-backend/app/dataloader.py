@@ -0,0 +1,168 @@
+"""
+Request-scoped loader for point lookups (get_product, get_batch, get_sale, ...).
+
+A RequestLoader lives for one HTTP request (see request_loader_middleware in
+main.py). Backend getters decorated with @loader_cached(table) consult it
+first, so repeated lookups of the same row inside a request cost one
+round-trip. Hot loops call prime(table, ids) up front, which fetches every
+missing id with one chunked `in_("id", ...)` query per table.
+
+Write methods decorated with @invalidates(table, ...) drop that table's
+memoized rows so later reads in the same request see the new values, and
+invalidate the process-wide reference cache for the same tables.
+
+The loader travels in a ContextVar, so it is visible both in async handlers
+and in sync helpers dispatched to the db thread pool (ThreadedAsyncDatabase
+copies the context into the worker).
+"""
+
+import asyncio
+import copy
+import functools
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from app.reference_cache import reference_cache
+
+REQUEST_LOADER_ENABLED = os.environ.get("REQUEST_LOADER_ENABLED", "true").lower() == "true"
+LOADER_CHUNK_SIZE = int(os.environ.get("REQUEST_LOADER_CHUNK_SIZE", "200"))
+
+_MISSING = object()
+_current_loader: ContextVar[Optional["RequestLoader"]] = ContextVar("request_loader", default=None)
+
+
+class RequestLoader:
+    """Per-request memo of rows by (table, id) with hit/miss counters."""
+
+    def __init__(self, db):
+        self.db = db
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+        self._rows: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, table: str, key: Any) -> Any:
+        with self._lock:
+            value = self._rows.get(table, {}).get(str(key), _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return _MISSING
+            self.hits += 1
+        return copy.deepcopy(value)
+
+    def put(self, table: str, key: Any, value: Any) -> None:
+        with self._lock:
+            self._rows.setdefault(table, {})[str(key)] = copy.deepcopy(value)
+
+    def invalidate(self, *tables: str) -> None:
+        with self._lock:
+            for table in tables:
+                self._rows.pop(table, None)
+
+    def missing(self, table: str, ids: Iterable[Any]) -> List[str]:
+        with self._lock:
+            known = self._rows.get(table, {})
+            return list(dict.fromkeys(str(i) for i in ids if i is not None and str(i) not in known))
+
+    def prime(self, table: str, ids: Iterable[Any]) -> None:
+        """Fetch every id not yet memoized with one chunked query; unknown ids are memoized as None."""
+        todo = self.missing(table, ids)
+        if not todo or not hasattr(self.db, "get_rows_by_ids"):
+            return
+        for start in range(0, len(todo), LOADER_CHUNK_SIZE):
+            chunk = todo[start:start + LOADER_CHUNK_SIZE]
+            rows = self.db.get_rows_by_ids(table, chunk)
+            with self._lock:
+                self.batches += 1
+            for key in chunk:
+                self.put(table, key, rows.get(key))
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "batches": self.batches,
+            "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+def current_loader() -> Optional[RequestLoader]:
+    return _current_loader.get()
+
+
+@contextmanager
+def request_scope(db):
+    """Activate a fresh RequestLoader for the duration of the block."""
+    if not REQUEST_LOADER_ENABLED:
+        yield None
+        return
+    loader = RequestLoader(db)
+    token = _current_loader.set(loader)
+    try:
+        yield loader
+    finally:
+        _current_loader.reset(token)
+
+
+def prime(table: str, ids: Iterable[Any]) -> None:
+    loader = current_loader()
+    if loader is not None:
+        loader.prime(table, ids)
+
+
+def loader_cached(table: str) -> Callable:
+    """Memoize a single-key getter `fn(self, key)` in the active RequestLoader."""
+
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(self, key, *args, **kwargs):
+                loader = current_loader()
+                if loader is None or key is None or args or kwargs:
+                    return await fn(self, key, *args, **kwargs)
+                value = loader.get(table, key)
+                if value is _MISSING:
+                    value = await fn(self, key)
+                    loader.put(table, key, value)
+                return value
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(self, key, *args, **kwargs):
+            loader = current_loader()
+            if loader is None or key is None or args or kwargs:
+                return fn(self, key, *args, **kwargs)
+            value = loader.get(table, key)
+            if value is _MISSING:
+                value = fn(self, key)
+                loader.put(table, key, value)
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+def invalidates(*tables: str) -> Callable:
+    """Drop the active loader's rows and the reference cache for `tables` after a write method runs."""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                reference_cache.invalidate(*tables)
+                loader = current_loader()
+                if loader is not None:
+                    loader.invalidate(*tables)
+
+        return wrapper
+
+    return decorator
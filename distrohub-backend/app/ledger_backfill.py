@@ -0,0 +1,351 @@
+"""
+Resumable stock-ledger backfill job.
+
+Rebuilds stock_ledger rows from historical purchases, sales and sales-return
+lines without holding the whole history in memory:
+
+    voucher pages (backend keyset generator, ordered by id)
+      -> plan_voucher_rows() per voucher, using lookups preloaded once
+         (batches by id and by product + batch number, warehouse names)
+      -> add_stock_ledger_entries_bulk() in LEDGER_BACKFILL_INSERT_BATCH chunks
+      -> checkpoint {"phase", "after_id"} saved after every page
+
+Rows carry remarks 'backfill:<line kind>:<line id>' and the job skips keys
+that already exist, so re-running a page after a crash is harmless. The job
+record (stock_ledger_backfill_jobs) holds status, checkpoint and counters;
+a "running" job whose heartbeat is older than LEDGER_BACKFILL_STALE_SECONDS
+was interrupted (timeout, deploy) and is resumed from its checkpoint on
+startup or on request.
+"""
+
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+LEDGER_BACKFILL_PAGE_SIZE = int(os.environ.get("LEDGER_BACKFILL_PAGE_SIZE", "200"))
+LEDGER_BACKFILL_INSERT_BATCH = int(os.environ.get("LEDGER_BACKFILL_INSERT_BATCH", "500"))
+LEDGER_BACKFILL_STALE_SECONDS = float(os.environ.get("LEDGER_BACKFILL_STALE_SECONDS", "120"))
+LEDGER_BACKFILL_AUTO_RESUME = os.environ.get("LEDGER_BACKFILL_AUTO_RESUME", "true").lower() == "true"
+LEDGER_BACKFILL_SAMPLE_SIZE = 25
+
+logger = logging.getLogger(__name__)
+
+# Phases run in this order: (phase / voucher_type, option that enables it)
+BACKFILL_PHASES = (
+    ("purchase", "include_purchases"),
+    ("sale", "include_sales"),
+    ("sale_return", "include_returns"),
+)
+
+# phase -> (lines seen stat, lines planned stat, remarks prefix, quantity sign)
+_PHASE_FIELDS = {
+    "purchase": ("purchases_lines_seen", "purchases_lines_planned", "backfill:purchase_item", 1),
+    "sale": ("sales_lines_seen", "sales_lines_planned", "backfill:sale_item", -1),
+    "sale_return": (None, "return_lines_planned", "backfill:sreturn_item", 1),
+}
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+def _to_int(value: Any) -> int:
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _ts(value: Any) -> str:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, str) and value.strip():
+        return value
+    return datetime.now().isoformat()
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _parse_ts(value: Any) -> Optional[datetime]:
+    """Aware UTC datetime from a datetime or ISO string (naive values are taken as UTC)."""
+    if isinstance(value, str) and value:
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def new_stats() -> Dict[str, Any]:
+    return {
+        "purchases_lines_seen": 0,
+        "purchases_lines_planned": 0,
+        "sales_lines_seen": 0,
+        "sales_lines_planned": 0,
+        "return_lines_seen": 0,
+        "return_lines_planned": 0,
+        "skipped_missing_line_id": 0,
+        "skipped_duplicate_remark": 0,
+        "skipped_whole_voucher": 0,
+        "vouchers_seen": 0,
+        "pages": 0,
+        "rows_planned": 0,
+        "rows_inserted": 0,
+    }
+
+
+class BackfillLookups:
+    """Batches and warehouse names loaded once per job instead of per line."""
+
+    def __init__(self, batches: Iterable[dict], warehouses: Iterable[dict]):
+        self.batches_by_id: Dict[str, dict] = {}
+        self.batches_by_number: Dict[Tuple[str, str], dict] = {}
+        for batch in batches:
+            if batch.get("id"):
+                self.batches_by_id[str(batch["id"])] = batch
+            if batch.get("product_id") and batch.get("batch_number"):
+                self.batches_by_number.setdefault((str(batch["product_id"]), str(batch["batch_number"])), batch)
+        self.warehouse_names = {str(w["id"]): w.get("name") for w in warehouses if w.get("id")}
+
+    def batch(self, product_id: str, batch_id: Optional[str], batch_number: Optional[str]):
+        """(batch_id, batch_number, batch row or None), the same lookup order as the live ledger hooks."""
+        if batch_id:
+            return batch_id, batch_number, self.batches_by_id.get(str(batch_id))
+        if batch_number:
+            batch = self.batches_by_number.get((str(product_id), str(batch_number)))
+            if batch:
+                return batch.get("id"), batch.get("batch_number") or batch_number, batch
+        return batch_id, batch_number, None
+
+    def warehouse_name(self, warehouse_id: Optional[str], name: Optional[str]) -> Optional[str]:
+        if warehouse_id and not name:
+            return self.warehouse_names.get(str(warehouse_id))
+        return name
+
+
+def plan_voucher_rows(
+    phase: str,
+    voucher: dict,
+    lookups: BackfillLookups,
+    backfill_keys: set,
+    voucher_keys: set,
+    skip_voucher_if_ledger_exists: bool,
+    stats: Dict[str, Any],
+) -> Iterator[dict]:
+    """
+    stock_ledger rows for one voucher: a purchase or sale with "items", or one
+    flat sales-return line (get_all_sales_return_items_flat shape).
+    """
+    if phase == "sale_return":
+        stats["return_lines_seen"] += 1
+        voucher_id = str(voucher.get("return_id")) if voucher.get("return_id") is not None else None
+        if not voucher_id:
+            stats["skipped_missing_line_id"] += 1
+            return
+        if skip_voucher_if_ledger_exists and ("sale_return", voucher_id) in voucher_keys:
+            stats["skipped_whole_voucher"] += 1
+            return
+        lines = [voucher]
+        ts = _ts(voucher.get("_return_created_at"))
+    else:
+        voucher_id = str(voucher.get("id")) if voucher.get("id") is not None else None
+        if not voucher_id:
+            return
+        lines = voucher.get("items") or []
+        if skip_voucher_if_ledger_exists and (phase, voucher_id) in voucher_keys:
+            stats["skipped_whole_voucher"] += len(lines)
+            return
+        ts = _ts(voucher.get("created_at"))
+
+    seen_key, planned_key, prefix, sign = _PHASE_FIELDS[phase]
+    for item in lines:
+        if seen_key:
+            stats[seen_key] += 1
+        line_id = item.get("id")
+        if not line_id:
+            stats["skipped_missing_line_id"] += 1
+            continue
+        remark = f"{prefix}:{line_id}"
+        if remark in backfill_keys:
+            stats["skipped_duplicate_remark"] += 1
+            continue
+        product_id = item.get("product_id")
+        if not product_id:
+            stats["skipped_missing_line_id"] += 1
+            continue
+        qty = _to_int(item.get("quantity_returned" if phase == "sale_return" else "quantity"))
+        if qty == 0:
+            continue
+        batch_id, batch_number, batch = lookups.batch(str(product_id), item.get("batch_id"), item.get("batch_number"))
+        if phase == "purchase":
+            warehouse_id = item.get("warehouse_id") or voucher.get("warehouse_id")
+            warehouse_name = item.get("warehouse_name") or voucher.get("warehouse_name")
+            if batch:
+                warehouse_id = warehouse_id or batch.get("warehouse_id")
+                warehouse_name = warehouse_name or batch.get("warehouse_name")
+        else:
+            warehouse_id = batch.get("warehouse_id") if batch else None
+            warehouse_name = batch.get("warehouse_name") if batch else None
+        stats[planned_key] += 1
+        stats["rows_planned"] += 1
+        yield {
+            "product_id": str(product_id),
+            "product_name": item.get("product_name"),
+            "batch_id": batch_id,
+            "batch_number": batch_number,
+            "warehouse_id": warehouse_id,
+            "warehouse_name": lookups.warehouse_name(warehouse_id, warehouse_name),
+            "voucher_type": phase,
+            "voucher_id": voucher_id,
+            "quantity_change": sign * qty,
+            "quantity_after": None,
+            "unit_cost": item.get("unit_price"),
+            "remarks": remark,
+            "created_by": None,
+            "created_at": ts,
+        }
+
+
+def _chunks(rows: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    chunk: List[dict] = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def job_progress(job: dict) -> dict:
+    """Job record plus elapsed time and throughput for the status endpoint."""
+    stats = job.get("stats") or {}
+    started = _parse_ts(job.get("started_at"))
+    ended = _parse_ts(job.get("finished_at")) or (_now() if job.get("status") in ACTIVE_STATUSES else _parse_ts(job.get("heartbeat_at")))
+    elapsed = max(0.0, (ended - started).total_seconds()) if started and ended else 0.0
+    vouchers = _to_int(stats.get("vouchers_seen"))
+    rows = _to_int(stats.get("rows_inserted")) if not job.get("dry_run") else _to_int(stats.get("rows_planned"))
+    return {
+        **job,
+        "elapsed_seconds": round(elapsed, 1),
+        "vouchers_per_second": round(vouchers / elapsed, 1) if elapsed else 0.0,
+        "rows_per_second": round(rows / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def is_stale(job: dict, now: Optional[datetime] = None) -> bool:
+    heartbeat = _parse_ts(job.get("heartbeat_at")) or _parse_ts(job.get("started_at"))
+    if heartbeat is None:
+        return True
+    return (now or _now()) - heartbeat > timedelta(seconds=LEDGER_BACKFILL_STALE_SECONDS)
+
+
+class StockLedgerBackfill:
+    """Starts, runs and resumes backfill jobs; one active job per process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active_job_id: Optional[str] = None
+
+    @staticmethod
+    def new_job(options: dict, dry_run: bool, created_by: Optional[str]) -> dict:
+        return {
+            "id": str(uuid.uuid4()),
+            "status": "queued",
+            "dry_run": bool(dry_run),
+            "options": dict(options),
+            "checkpoint": {"phase": None, "after_id": None},
+            "stats": new_stats(),
+            "sample": [],
+            "error": None,
+            "created_by": created_by,
+            "started_at": _now().isoformat(),
+            "heartbeat_at": _now().isoformat(),
+            "finished_at": None,
+        }
+
+    def active_job_id(self) -> Optional[str]:
+        return self._active_job_id
+
+    def claim(self, job_id: str) -> bool:
+        """Mark job_id as this process's active job; False if another job is running here."""
+        with self._lock:
+            if self._active_job_id and self._active_job_id != job_id:
+                return False
+            self._active_job_id = job_id
+            return True
+
+    def release(self, job_id: str) -> None:
+        with self._lock:
+            if self._active_job_id == job_id:
+                self._active_job_id = None
+
+    def run(self, db, job: dict) -> dict:
+        """Run (or resume) job to completion, checkpointing after every voucher page."""
+        if not self.claim(job["id"]):
+            raise RuntimeError("Another stock ledger backfill job is running")
+        try:
+            job["status"] = "running"
+            job["error"] = None
+            job["finished_at"] = None
+            self._save(db, job)
+            self._run_phases(db, job)
+            job["status"] = "completed"
+            job["finished_at"] = _now().isoformat()
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = f"{type(e).__name__}: {e}"
+            job["finished_at"] = _now().isoformat()
+            logger.error(f"Stock ledger backfill job {job['id']} failed: {job['error']}")
+        finally:
+            self._save(db, job)
+            self.release(job["id"])
+        return job
+
+    def _save(self, db, job: dict) -> None:
+        job["heartbeat_at"] = _now().isoformat()
+        db.save_stock_ledger_backfill_job(job)
+
+    def _run_phases(self, db, job: dict) -> None:
+        options = job.get("options") or {}
+        stats = job["stats"]
+        skip_vouchers = bool(options.get("skip_voucher_if_ledger_exists", True))
+        lookups = BackfillLookups(db.get_all_batches(), db.get_warehouses())
+        backfill_keys = db.get_stock_ledger_backfill_keys() if hasattr(db, "get_stock_ledger_backfill_keys") else set()
+        voucher_keys = set()
+        if skip_vouchers and hasattr(db, "get_stock_ledger_voucher_keys"):
+            voucher_keys = db.get_stock_ledger_voucher_keys()
+        self._save(db, job)  # heartbeat after the preload
+
+        phases = [phase for phase, option in BACKFILL_PHASES if options.get(option, True)]
+        checkpoint = job.get("checkpoint") or {}
+        if checkpoint.get("phase") in phases:
+            phases = phases[phases.index(checkpoint["phase"]):]
+        after_id = checkpoint.get("after_id") if checkpoint.get("phase") else None
+
+        for phase in phases:
+            for page in db.iter_stock_ledger_backfill_vouchers(phase, after_id=after_id, page_size=LEDGER_BACKFILL_PAGE_SIZE):
+                rows = (
+                    row
+                    for voucher in page
+                    for row in plan_voucher_rows(phase, voucher, lookups, backfill_keys, voucher_keys, skip_vouchers, stats)
+                )
+                for chunk in _chunks(rows, LEDGER_BACKFILL_INSERT_BATCH):
+                    if len(job["sample"]) < LEDGER_BACKFILL_SAMPLE_SIZE:
+                        job["sample"].extend(chunk[: LEDGER_BACKFILL_SAMPLE_SIZE - len(job["sample"])])
+                    if not job.get("dry_run"):
+                        stats["rows_inserted"] += int(db.add_stock_ledger_entries_bulk(chunk))
+                stats["vouchers_seen"] += len(page)
+                stats["pages"] += 1
+                job["checkpoint"] = {"phase": phase, "after_id": str(page[-1]["id"])}
+                self._save(db, job)
+            after_id = None
+        job["checkpoint"] = {"phase": "done", "after_id": None}
+
+
+ledger_backfill = StockLedgerBackfill()
@@ -0,0 +1,285 @@
+"""
+Per-voucher stock-ledger writer with a durable retry queue.
+
+Purchases, sales and sales returns record their ledger rows through
+StockLedgerWriter.record():
+
+    voucher lines
+      -> load_voucher_lookups(): products and batches by id in one query per
+         table, batch-number-only lines with one batch list per product,
+         warehouse names from the reference cache
+      -> plan_voucher_ledger_rows() (no reads)
+      -> one add_stock_ledger_entries_bulk() call
+
+When the insert fails the planned rows are saved to stock_ledger_write_queue
+instead of being dropped; when planning itself fails (a lookup read errors)
+the voucher's lines and arguments are queued instead and planned again on
+retry. drain() (run by the background loop started
+in main.py) replays them with backoff. Each queue entry knows how many rows
+the voucher should have; a retry first counts the voucher's ledger rows and
+only inserts the ones still missing, so an insert that committed but
+reported an error is not written twice. Entries are claimed with a lease
+(next_attempt_at), so a worker that dies mid-retry only delays the entry.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.ledger_backfill import BackfillLookups
+
+LEDGER_WRITE_RETRY_INTERVAL = float(os.environ.get("LEDGER_WRITE_RETRY_INTERVAL", "30"))
+LEDGER_WRITE_RETRY_BATCH = int(os.environ.get("LEDGER_WRITE_RETRY_BATCH", "20"))
+LEDGER_WRITE_MAX_ATTEMPTS = int(os.environ.get("LEDGER_WRITE_MAX_ATTEMPTS", "8"))
+LEDGER_WRITE_LEASE_SECONDS = float(os.environ.get("LEDGER_WRITE_LEASE_SECONDS", "120"))
+
+# Line fields plan_voucher_ledger_rows reads, kept when a voucher is queued unplanned
+VOUCHER_ITEM_FIELDS = (
+    "product_id", "product_name", "batch_id", "batch_number", "warehouse_id", "warehouse_name",
+    "quantity", "quantity_returned", "unit_price",
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(3600, LEDGER_WRITE_RETRY_INTERVAL * 2 ** max(0, attempts - 1)))
+
+
+def load_voucher_lookups(db, items: Iterable[dict]) -> Tuple[Dict[str, dict], BackfillLookups]:
+    """(products by id, batch / warehouse lookups) for a voucher's lines, loaded in bulk."""
+    items = list(items)
+    product_ids = list(dict.fromkeys(str(i["product_id"]) for i in items if i.get("product_id")))
+    batch_ids = list(dict.fromkeys(str(i["batch_id"]) for i in items if i.get("batch_id")))
+
+    def rows_by_id(table: str, ids: List[str], getter: str) -> Dict[str, dict]:
+        if not ids:
+            return {}
+        if hasattr(db, "get_rows_by_ids"):
+            return db.get_rows_by_ids(table, ids)
+        rows = (getattr(db, getter)(row_id) for row_id in ids)
+        return {str(row["id"]): row for row in rows if row}
+
+    products = rows_by_id("products", product_ids, "get_product")
+    batches = list(rows_by_id("product_batches", batch_ids, "get_batch").values())
+    by_number = {str(i["product_id"]) for i in items if i.get("product_id") and not i.get("batch_id") and i.get("batch_number")}
+    for product_id in by_number:
+        batches.extend(db.get_batches_by_product(product_id))
+    warehouses = db.get_warehouses() if hasattr(db, "get_warehouses") else []
+    return products, BackfillLookups(batches, warehouses)
+
+
+def plan_voucher_ledger_rows(
+    *,
+    voucher_type: str,
+    voucher_id: Optional[str],
+    items: Iterable[dict],
+    quantity_key: str,
+    quantity_multiplier: int,
+    products: Dict[str, dict],
+    lookups: BackfillLookups,
+    warehouse_id: Optional[str] = None,
+    warehouse_name: Optional[str] = None,
+    created_by: Optional[str] = None,
+    remarks: Optional[str] = None,
+    created_at: Optional[str] = None,
+) -> List[dict]:
+    """
+    stock_ledger rows for one voucher's lines. A line's warehouse is its own,
+    else the voucher's, else its batch's; quantity_after is the product's
+    stock after the voucher was applied.
+    """
+    created_at = created_at or datetime.now().isoformat()  # same clock as add_stock_ledger_entry's default
+    rows = []
+    for item in items:
+        product_id = item.get("product_id")
+        if not product_id:
+            continue
+        try:
+            quantity_change = int(item.get(quantity_key) or item.get("quantity")) * quantity_multiplier
+        except (TypeError, ValueError):
+            continue
+        product = products.get(str(product_id))
+        batch_id, batch_number, batch = lookups.batch(str(product_id), item.get("batch_id"), item.get("batch_number"))
+        item_warehouse_id = item.get("warehouse_id") or warehouse_id
+        item_warehouse_name = item.get("warehouse_name") or warehouse_name
+        if not item_warehouse_id and batch:
+            item_warehouse_id = batch.get("warehouse_id")
+            item_warehouse_name = item_warehouse_name or batch.get("warehouse_name")
+        rows.append(
+            {
+                "product_id": product_id,
+                "product_name": item.get("product_name") or (product.get("name") if product else None),
+                "batch_id": batch_id,
+                "batch_number": batch_number,
+                "warehouse_id": item_warehouse_id,
+                "warehouse_name": lookups.warehouse_name(item_warehouse_id, item_warehouse_name),
+                "voucher_type": voucher_type,
+                "voucher_id": voucher_id,
+                "quantity_change": quantity_change,
+                "quantity_after": product.get("stock_quantity") if product else None,
+                "unit_cost": item.get("unit_price"),
+                "remarks": remarks,
+                "created_by": created_by,
+                "created_at": created_at,
+            }
+        )
+    return rows
+
+
+def _queued_voucher(voucher: dict) -> dict:
+    """JSON-safe copy of record()'s keyword arguments, with only the line fields planning reads."""
+    items = [
+        {key: item.get(key) for key in (*VOUCHER_ITEM_FIELDS, voucher.get("quantity_key")) if key and key in item}
+        for item in voucher.get("items") or []
+    ]
+    return json.loads(json.dumps({**voucher, "items": items}, default=str))
+
+
+def _plan(db, voucher: dict) -> List[dict]:
+    products, lookups = load_voucher_lookups(db, voucher["items"])
+    return plan_voucher_ledger_rows(products=products, lookups=lookups, **voucher)
+
+
+class StockLedgerWriter:
+    """Writes a voucher's ledger rows in one insert; failed writes go to the retry queue."""
+
+    def __init__(self):
+        self.running = False
+
+    def record(self, db, **voucher) -> int:
+        """
+        Plan and insert the ledger rows of one voucher (keyword arguments of
+        plan_voucher_ledger_rows, without the lookups). Returns the rows
+        written now; 0 when they were queued for retry.
+        """
+        if not hasattr(db, "add_stock_ledger_entries_bulk"):
+            return 0
+        voucher_type, voucher_id = voucher["voucher_type"], voucher.get("voucher_id")
+        voucher.setdefault("created_at", datetime.now().isoformat())
+        try:
+            rows = _plan(db, voucher)
+        except Exception as e:
+            self.enqueue(db, voucher_type, voucher_id, None, e, voucher=_queued_voucher(voucher))
+            return 0
+        if not rows:
+            return 0
+        try:
+            return db.add_stock_ledger_entries_bulk(rows)
+        except Exception as e:
+            self.enqueue(db, voucher_type, voucher_id, rows, e)
+            return 0
+
+    @staticmethod
+    def enqueue(
+        db,
+        voucher_type: str,
+        voucher_id: Optional[str],
+        rows: Optional[List[dict]],
+        error: Exception,
+        voucher: Optional[dict] = None,
+    ) -> None:
+        """Queue planned rows, or (rows=None) the voucher to plan again on retry."""
+        logger.warning(f"Stock ledger write for {voucher_type} {voucher_id} failed, queued for retry: {error}")
+        now = _now().isoformat()
+        entry = {
+            "id": str(uuid.uuid4()),
+            "voucher_type": voucher_type,
+            "voucher_id": voucher_id,
+            "rows": rows or [],
+            "expected_rows": len(rows or []),
+            "voucher": voucher,
+            "status": "pending",
+            "attempts": 0,
+            "last_error": str(error),
+            "next_attempt_at": now,
+            "created_at": now,
+            "updated_at": now,
+        }
+        try:
+            db.enqueue_stock_ledger_write(entry)
+        except Exception as e:
+            logger.error(f"Could not queue stock ledger write for {voucher_type} {voucher_id}: {e}")
+
+    def _missing_rows(self, db, entry: dict) -> List[dict]:
+        """The queued rows not yet in the ledger (inserts run in order, so a prefix may have landed)."""
+        rows = entry.get("rows") or []
+        if not entry.get("voucher_id"):
+            return rows
+        expected = int(entry.get("expected_rows") or len(rows))
+        existing = db.get_stock_ledger_page(
+            voucher_type=entry["voucher_type"], voucher_id=entry["voucher_id"], limit=expected
+        )["entries"]
+        return rows[len(existing):]
+
+    def retry(self, db, entry: dict) -> str:
+        """Replay one claimed queue entry (planning it first if it was queued unplanned); returns its new status."""
+        now = _now()
+        attempts = int(entry.get("attempts") or 0) + 1
+        planned: Dict[str, object] = {}
+        try:
+            if entry.get("voucher") and not entry.get("rows"):
+                rows = _plan(db, entry["voucher"])
+                planned = {"rows": rows, "expected_rows": len(rows), "voucher": None}
+                entry = {**entry, **planned}
+            missing = self._missing_rows(db, entry)
+            if missing:
+                db.add_stock_ledger_entries_bulk(missing)
+        except Exception as e:
+            status = "failed" if attempts >= LEDGER_WRITE_MAX_ATTEMPTS else "pending"
+            db.update_stock_ledger_write(entry["id"], {
+                **planned,
+                "status": status,
+                "attempts": attempts,
+                "last_error": str(e),
+                "next_attempt_at": (now + _backoff(attempts)).isoformat(),
+                "updated_at": now.isoformat(),
+            })
+            logger.warning(f"Retry {attempts} of stock ledger write {entry['id']} failed ({status}): {e}")
+            return status
+        db.update_stock_ledger_write(entry["id"], {
+            **planned,
+            "status": "done",
+            "attempts": attempts,
+            "last_error": None,
+            "updated_at": now.isoformat(),
+        })
+        return "done"
+
+    def drain(self, db, limit: Optional[int] = None) -> Dict[str, int]:
+        """Retry the queue entries that are due; returns counts by resulting status."""
+        counts: Dict[str, int] = {}
+        if not hasattr(db, "get_due_stock_ledger_writes"):
+            return counts
+        now = _now()
+        lease_until = (now + timedelta(seconds=LEDGER_WRITE_LEASE_SECONDS)).isoformat()
+        for entry in db.get_due_stock_ledger_writes(now.isoformat(), limit or LEDGER_WRITE_RETRY_BATCH):
+            if not db.claim_stock_ledger_write(entry["id"], entry.get("next_attempt_at"), lease_until):
+                continue
+            status = self.retry(db, entry)
+            counts[status] = counts.get(status, 0) + 1
+        return counts
+
+    async def start(self, db) -> None:
+        """Background loop: drain the queue every LEDGER_WRITE_RETRY_INTERVAL seconds."""
+        self.running = True
+        while self.running:
+            try:
+                await asyncio.to_thread(self.drain, db)
+            except Exception as e:
+                logger.error(f"Stock ledger retry loop error: {e}")
+            await asyncio.sleep(LEDGER_WRITE_RETRY_INTERVAL)
+
+    def stop(self) -> None:
+        self.running = False
+
+
+ledger_writer = StockLedgerWriter()
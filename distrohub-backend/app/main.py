@@ -1,7 +1,7 @@
 from fastapi import FastAPI, HTTPException, Depends, status, Request, Body
 from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Set
 from enum import Enum
 import asyncio
 import logging
@@ -14,7 +14,7 @@ from datetime import datetime, date
 logger = logging.getLogger(__name__)
 
 from app.models import (
-    UserCreate, UserUpdate, User, UserLogin, Token, UserRole, normalize_user_role,
+    UserCreate, UserUpdate, User, UserLogin, Token, RefreshTokenRequest, UserRole, normalize_user_role,
     CreditRiskBearer, GuaranteeEnforcement, PaymentApprovalStatus, PaymentRejectBody,
     SrLiabilitySummary, SrRiskAdjustment, SrRiskAdjustmentCreate,
     ProductCreate, Product, ProductBatchCreate, ProductBatch,
@@ -29,12 +29,12 @@ from app.models import (
     ProductTemplateCreate, ProductTemplate,
     ProductVariantCreate, ProductVariant,
     UomConversionCreate, UomConversion,
-    PriceListCreate, PriceList,
+    PriceListCreate, PriceList, PriceResolveRequest,
     PriceListItemCreate, PriceListItem,
     RetailerPriceListAssignmentCreate,
     ReorderPolicyCreate, ReorderPolicy, ReorderSuggestion,
     ReceivableAgingRow, CreditCheckResponse,
-    MarginReportSummary,
+    MarginReportRow, MarginReportSummary,
     SmsSettings, SmsSettingsCreate, SmsSettingsUpdate,
     SmsTemplate, SmsTemplateCreate, SmsTemplateUpdate,
     SmsLog, SmsSendRequest, SmsBulkSendRequest,
@@ -45,14 +45,31 @@ from app.models import (
     SaleUpdate, CollectionReport, CollectionReportSummary,
     RouteCreate, Route, RouteUpdate, RouteWithSales, RouteStatus,
     RouteReconciliationCreate, RouteReconciliation, RouteReconciliationUpdate,
-    MarketRouteCreate, MarketRoute, StockLedgerEntry,
+    MarketRouteCreate, MarketRoute, StockLedgerEntry, StockLedgerPage, StockVoucherType,
     SrAccountability
 )
-from app.database import db
-from app.auth import create_access_token, get_current_user
+from app.database import db, adb
+from app.dataloader import request_scope
+from app.reference_cache import reference_cache
+from app.batches import batch_sort_key
+from app.stock_reconciliation import build_reconciliation_report
+from app.ledger_backfill import (
+    ACTIVE_STATUSES,
+    LEDGER_BACKFILL_AUTO_RESUME,
+    is_stale,
+    job_progress,
+    ledger_backfill,
+)
+from app.ledger_writer import ledger_writer
+from app.dashboard_rollups import dashboard_rollups
+from app.aging import parse_aging_edges
+from app.margins import MARGIN_GROUP_BY
+from app.pricing import price_indexes
+from app.password_pool import is_bcrypt_hash, password_pool
+from app.auth import get_current_user, issue_tokens, refresh_session
 from app.sms_service import SmsService, SmsTemplateRenderer, SmsQueueManager
 from app.sms_worker import start_sms_worker
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 import sentry_sdk
 from sentry_sdk.integrations.fastapi import FastApiIntegration
 
@@ -91,6 +108,18 @@ async def request_logging_middleware(request: Request, call_next):
     )
     return response
 
+@app.middleware("http")
+async def request_loader_middleware(request: Request, call_next):
+    """One RequestLoader per request: memoized point lookups, exposed as hit/miss headers."""
+    with request_scope(db) as loader:
+        response = await call_next(request)
+    if loader is not None:
+        stats = loader.stats()
+        response.headers["x-loader-hits"] = str(stats["hits"])
+        response.headers["x-loader-misses"] = str(stats["misses"])
+        response.headers["x-loader-batches"] = str(stats["batches"])
+    return response
+
 RATE_LIMIT_WINDOW_SECONDS = int(os.environ.get("LOGIN_RATE_LIMIT_WINDOW_SECONDS", "300"))
 RATE_LIMIT_MAX_ATTEMPTS = int(os.environ.get("LOGIN_RATE_LIMIT_MAX_ATTEMPTS", "5"))
 _login_attempts: Dict[str, List[float]] = {}
@@ -119,37 +148,33 @@ def _generate_batch_number() -> str:
     rand = uuid.uuid4().hex[:4].upper()
     return f"B{year}{month}-{rand}"
 
-def _batch_sort_key(batch: dict) -> datetime:
-    created_at = batch.get("created_at")
-    if isinstance(created_at, datetime):
-        return created_at
-    if isinstance(created_at, str):
-        try:
-            return datetime.fromisoformat(created_at.replace("Z", "+00:00"))
-        except ValueError:
-            pass
-    expiry_date = batch.get("expiry_date")
-    if isinstance(expiry_date, date):
-        return datetime.combine(expiry_date, datetime.min.time())
-    if isinstance(expiry_date, str):
-        try:
-            return datetime.fromisoformat(expiry_date)
-        except ValueError:
-            pass
-    return datetime.min
-
-def _attach_latest_batch(product: dict) -> dict:
+async def _attach_latest_batch(product: dict) -> dict:
     try:
-        batches = db.get_batches_by_product(product["id"])
+        batches = await adb.get_batches_by_product(product["id"])
     except Exception:
         return product
     if not batches:
         return product
-    latest_batch = max(batches, key=_batch_sort_key)
+    latest_batch = max(batches, key=batch_sort_key)
     product["batch_number"] = latest_batch.get("batch_number")
     product["expiry_date"] = latest_batch.get("expiry_date")
     return product
 
+async def _attach_latest_batches(products: List[dict]) -> List[dict]:
+    """Attach latest-batch fields to a product list from one bulk summary read."""
+    if not hasattr(adb, "get_latest_batches"):
+        return [await _attach_latest_batch(p) for p in products]
+    try:
+        latest = await adb.get_latest_batches()
+    except Exception:
+        return products
+    for product in products:
+        latest_batch = latest.get(str(product["id"]))
+        if latest_batch:
+            product["batch_number"] = latest_batch.get("batch_number")
+            product["expiry_date"] = latest_batch.get("expiry_date")
+    return products
+
 def _clear_login_failures(client_ip: str) -> None:
     _login_attempts.pop(client_ip, None)
 
@@ -171,11 +196,11 @@ def _user_for_api(user: dict) -> User:
     return User(**d)
 
 
-def _net_sr_exposure_for_user(sr_user_id: str) -> float:
-    if not sr_user_id or not hasattr(db, "get_sr_open_liability"):
+async def _net_sr_exposure_for_user(sr_user_id: str) -> float:
+    if not sr_user_id or not hasattr(adb, "get_sr_open_liability"):
         return 0.0
-    open_due = float(db.get_sr_open_liability(sr_user_id) or 0)
-    adj = float(db.get_sr_adjustments_total(sr_user_id) or 0) if hasattr(db, "get_sr_adjustments_total") else 0.0
+    open_due = float(await adb.get_sr_open_liability(sr_user_id) or 0)
+    adj = float(await adb.get_sr_adjustments_total(sr_user_id) or 0) if hasattr(adb, "get_sr_adjustments_total") else 0.0
     return max(0.0, open_due - adj)
 
 
@@ -241,20 +266,27 @@ def _route_belongs_to_dsr(route: Optional[dict], current_user: dict) -> bool:
         return False
     return route.get("assigned_to") == current_user.get("id")
 
-def _sale_belongs_to_dsr(sale: Optional[dict], current_user: dict) -> bool:
+async def _route_assignees(sales: List[Optional[dict]], current_user: dict) -> Dict[str, Optional[str]]:
+    """{route_id: assigned_to} for the routes a DSR visibility check of `sales` needs, in one bulk read."""
+    route_ids = list(dict.fromkeys(
+        str(sale["route_id"]) for sale in sales
+        if sale and sale.get("route_id") and sale.get("assigned_to") != current_user.get("id")
+    ))
+    if not route_ids or not hasattr(adb, "get_route_assignees"):
+        return {}
+    return await adb.get_route_assignees(route_ids)
+
+def _sale_belongs_to_dsr(sale: Optional[dict], current_user: dict, route_assignees: Dict[str, Optional[str]]) -> bool:
     if not sale:
         return False
     if sale.get("assigned_to") == current_user.get("id"):
         return True
     route_id = sale.get("route_id")
-    if not route_id:
+    if not route_id or str(route_id) not in route_assignees:
         return False
-    if not hasattr(db, "get_route"):
-        return False
-    route = db.get_route(route_id)
-    return _route_belongs_to_dsr(route, current_user)
+    return _route_belongs_to_dsr({"assigned_to": route_assignees[str(route_id)]}, current_user)
 
-def _sale_visible_to_user(sale: Optional[dict], current_user: dict) -> bool:
+def _sale_visible_to_user(sale: Optional[dict], current_user: dict, route_assignees: Dict[str, Optional[str]]) -> bool:
     if not sale:
         return False
     role = _user_role_enum(current_user)
@@ -263,10 +295,13 @@ def _sale_visible_to_user(sale: Optional[dict], current_user: dict) -> bool:
     if role == UserRole.SR:
         return sale.get("created_by") == current_user.get("id")
     if role == UserRole.DSR:
-        return _sale_belongs_to_dsr(sale, current_user)
+        return _sale_belongs_to_dsr(sale, current_user, route_assignees)
     return False
 
-def _log_audit_event(
+async def _can_view_sale(sale: Optional[dict], current_user: dict) -> bool:
+    return _sale_visible_to_user(sale, current_user, await _route_assignees([sale], current_user))
+
+async def _log_audit_event(
     action: str,
     request: Request,
     actor_id: Optional[str] = None,
@@ -274,12 +309,12 @@ def _log_audit_event(
     entity_id: Optional[str] = None,
     metadata: Optional[dict] = None,
 ) -> None:
-    if not hasattr(db, "log_audit_event"):
+    if not hasattr(adb, "log_audit_event"):
         return
     client_ip = request.client.host if request.client else "unknown"
     user_agent = request.headers.get("user-agent", "unknown")
     try:
-        db.log_audit_event(
+        await adb.log_audit_event(
             actor_id=actor_id,
             action=action,
             entity_type=entity_type,
@@ -303,58 +338,19 @@ def _record_stock_ledger_entries(
     created_by: Optional[str] = None,
     remarks: Optional[str] = None,
 ) -> None:
-    if not hasattr(db, "add_stock_ledger_entry"):
-        return
-    for item in items:
-        product_id = item.get("product_id")
-        if not product_id:
-            continue
-        quantity_raw = item.get(quantity_key) or item.get("quantity")
-        try:
-            quantity_change = int(quantity_raw) * quantity_multiplier
-        except (TypeError, ValueError):
-            continue
-        try:
-            product = db.get_product(product_id)
-            item_batch_id = item.get("batch_id")
-            item_batch_number = item.get("batch_number")
-            if not item_batch_id and item_batch_number:
-                matched_batch = _find_batch_by_product_and_number(str(product_id), item_batch_number)
-                if matched_batch:
-                    item_batch_id = matched_batch.get("id")
-                    item_batch_number = matched_batch.get("batch_number") or item_batch_number
-            item_warehouse_id = item.get("warehouse_id") or warehouse_id
-            item_warehouse_name = item.get("warehouse_name") or warehouse_name
-            if not item_warehouse_id and item_batch_id and hasattr(db, "get_batch"):
-                batch = db.get_batch(str(item_batch_id))
-                if batch:
-                    item_warehouse_id = batch.get("warehouse_id")
-                    if not item_warehouse_name:
-                        item_warehouse_name = batch.get("warehouse_name")
-            if item_warehouse_id and not item_warehouse_name and hasattr(db, "get_warehouse"):
-                wh = db.get_warehouse(str(item_warehouse_id))
-                if wh:
-                    item_warehouse_name = wh.get("name")
-            quantity_after = product.get("stock_quantity") if product else None
-            db.add_stock_ledger_entry(
-                {
-                    "product_id": product_id,
-                    "product_name": item.get("product_name") or (product.get("name") if product else None),
-                    "batch_id": item_batch_id,
-                    "batch_number": item_batch_number,
-                    "warehouse_id": item_warehouse_id,
-                    "warehouse_name": item_warehouse_name,
-                    "voucher_type": voucher_type,
-                    "voucher_id": voucher_id,
-                    "quantity_change": quantity_change,
-                    "quantity_after": quantity_after,
-                    "unit_cost": item.get("unit_price"),
-                    "remarks": remarks,
-                    "created_by": created_by,
-                }
-            )
-        except Exception as e:
-            print(f"[LEDGER] Failed to record stock ledger entry for {product_id}: {e}")
+    """One bulk ledger insert per voucher (app.ledger_writer); failures are queued for retry."""
+    ledger_writer.record(
+        db,
+        voucher_type=voucher_type,
+        voucher_id=voucher_id,
+        items=items,
+        quantity_key=quantity_key,
+        quantity_multiplier=quantity_multiplier,
+        warehouse_id=warehouse_id,
+        warehouse_name=warehouse_name,
+        created_by=created_by,
+        remarks=remarks,
+    )
 
 
 def _find_batch_by_product_and_number(product_id: str, batch_number: Optional[str]) -> Optional[dict]:
@@ -443,6 +439,7 @@ def _restore_inventory_from_sale_before_delete(
     remark_prefix: str = "sale_delete_restore",
 ) -> None:
     """Put sold quantities back on batches + product summary, then log adjustment ledger lines."""
+    restored = []
     for item in sale.get("items") or []:
         product_id = item.get("product_id")
         if not product_id:
@@ -452,18 +449,20 @@ def _restore_inventory_from_sale_before_delete(
             continue
         batch_number = item.get("batch_number")
         batch = _find_batch_by_product_and_number(str(product_id), batch_number)
-        if batch and hasattr(db, "update_batch_quantity"):
-            try:
-                db.update_batch_quantity(batch["id"], qty)
-            except Exception as e:
-                print(f"[LEDGER] batch restore failed for batch {batch.get('id')}: {e}")
-        if hasattr(db, "update_product_stock"):
-            try:
-                db.update_product_stock(str(product_id), qty)
-            except Exception as e:
-                print(f"[LEDGER] product stock restore failed for {product_id}: {e}")
+        restored.append((item, str(product_id), qty, batch_number, batch))
+
+    if restored and hasattr(db, "apply_stock_movements"):
+        try:
+            db.apply_stock_movements([
+                {"batch_id": batch["id"] if batch else None, "product_id": product_id, "delta": qty}
+                for _, product_id, qty, _, batch in restored
+            ])
+        except Exception as e:
+            print(f"[LEDGER] stock restore failed for sale {sale.get('id')}: {e}")
+
+    for item, product_id, qty, batch_number, batch in restored:
         _record_stock_ledger_adjustment(
-            product_id=str(product_id),
+            product_id=product_id,
             quantity_change=qty,
             created_by=created_by,
             voucher_id=str(sale.get("id")) if sale.get("id") is not None else None,
@@ -485,370 +484,38 @@ def _to_int(value: Any, default: int = 0) -> int:
 
 def _build_stock_reconciliation_report(
     include_only_mismatch: bool = True,
-    ledger_limit: int = 5000,
+    by_warehouse: bool = False,
 ) -> dict:
-    products = db.get_products()
-    ledger_rows_scanned = 0
-    ledger_net_by_product: Dict[str, int] = {}
-    ledger_count_by_product: Dict[str, int] = {}
-
-    if hasattr(db, "get_stock_ledger_aggregates_by_product"):
-        ledger_net_by_product, ledger_count_by_product, ledger_rows_scanned = (
-            db.get_stock_ledger_aggregates_by_product()
-        )
-    else:
-        safe_ledger_limit = max(500, min(ledger_limit, 20000))
-        ledger_rows = db.get_stock_ledger(limit=safe_ledger_limit) if hasattr(db, "get_stock_ledger") else []
-        ledger_rows_scanned = len(ledger_rows)
-        for row in ledger_rows:
-            product_id = row.get("product_id")
-            if not product_id:
-                continue
-            pid = str(product_id)
-            ledger_net_by_product[pid] = ledger_net_by_product.get(pid, 0) + _to_int(row.get("quantity_change"), 0)
-            ledger_count_by_product[pid] = ledger_count_by_product.get(pid, 0) + 1
-
-    items = []
-    mismatch_stock_vs_batch = 0
-    mismatch_batch_vs_ledger = 0
-    total_stock_quantity = 0
-    total_batch_quantity = 0
-    total_ledger_quantity = 0
-
-    for product in products:
-        product_id = product.get("id")
-        if not product_id:
-            continue
-        pid = str(product_id)
-
-        batches = db.get_batches_by_product(product_id)
-        batch_quantity = sum(_to_int(batch.get("quantity"), 0) for batch in batches)
-        stock_quantity = _to_int(product.get("stock_quantity"), 0)
-
-        ledger_quantity = ledger_net_by_product.get(pid)
-        ledger_entries = ledger_count_by_product.get(pid, 0)
-        if ledger_quantity is None:
-            ledger_quantity = 0
-
-        stock_vs_batch_diff = stock_quantity - batch_quantity
-        batch_vs_ledger_diff = batch_quantity - ledger_quantity if ledger_entries > 0 else None
-
-        has_stock_batch_mismatch = stock_vs_batch_diff != 0
-        has_batch_ledger_mismatch = batch_vs_ledger_diff is not None and batch_vs_ledger_diff != 0
-
-        if include_only_mismatch and not (has_stock_batch_mismatch or has_batch_ledger_mismatch):
-            continue
-
-        if has_stock_batch_mismatch:
-            mismatch_stock_vs_batch += 1
-        if has_batch_ledger_mismatch:
-            mismatch_batch_vs_ledger += 1
-
-        if has_stock_batch_mismatch and has_batch_ledger_mismatch:
-            status = "mismatch_both"
-        elif has_stock_batch_mismatch:
-            status = "mismatch_stock_vs_batch"
-        elif has_batch_ledger_mismatch:
-            status = "mismatch_batch_vs_ledger"
-        else:
-            status = "ok"
+    warehouse_names = {}
+    if by_warehouse:
+        warehouse_names = {str(w["id"]): w.get("name") for w in db.get_warehouses() if w.get("id")}
+    return build_reconciliation_report(
+        db.get_products(),
+        db.get_stock_reconciliation_aggregates(),
+        include_only_mismatch=include_only_mismatch,
+        by_warehouse=by_warehouse,
+        warehouse_names=warehouse_names,
+    )
 
-        total_stock_quantity += stock_quantity
-        total_batch_quantity += batch_quantity
-        total_ledger_quantity += ledger_quantity
 
-        items.append(
-            {
-                "product_id": product_id,
-                "product_name": product.get("name"),
-                "sku": product.get("sku"),
-                "stock_quantity": stock_quantity,
-                "batch_quantity": batch_quantity,
-                "ledger_quantity": ledger_quantity,
-                "ledger_entries": ledger_entries,
-                "stock_vs_batch_diff": stock_vs_batch_diff,
-                "batch_vs_ledger_diff": batch_vs_ledger_diff,
-                "status": status,
-            }
+async def _run_stock_ledger_backfill(job: dict, request: Request, actor_id: Optional[str]) -> None:
+    """Background task: run or resume a backfill job, then audit what it inserted."""
+    job = await adb.run_sync(ledger_backfill.run, db, job)
+    inserted = (job.get("stats") or {}).get("rows_inserted", 0)
+    if not job.get("dry_run") and inserted > 0:
+        await _log_audit_event(
+            action="stock_ledger_backfill_applied",
+            request=request,
+            actor_id=actor_id,
+            entity_type="stock_ledger",
+            entity_id=job["id"],
+            metadata={
+                "inserted_rows": inserted,
+                "status": job.get("status"),
+                "stats": job.get("stats"),
+            },
         )
 
-    return {
-        "generated_at": datetime.now().isoformat(),
-        "totals": {
-            "products_checked": len(products),
-            "rows_returned": len(items),
-            "mismatch_stock_vs_batch": mismatch_stock_vs_batch,
-            "mismatch_batch_vs_ledger": mismatch_batch_vs_ledger,
-            "sum_stock_quantity": total_stock_quantity,
-            "sum_batch_quantity": total_batch_quantity,
-            "sum_ledger_quantity": total_ledger_quantity,
-            "ledger_rows_scanned": ledger_rows_scanned,
-        },
-        "items": items,
-    }
-
-
-def _ledger_ts_from_row(row: dict) -> str:
-    ts = row.get("created_at")
-    if isinstance(ts, datetime):
-        return ts.isoformat()
-    if isinstance(ts, str) and ts.strip():
-        return ts
-    return datetime.now().isoformat()
-
-
-def _plan_stock_ledger_backfill(
-    *,
-    include_purchases: bool,
-    include_sales: bool,
-    include_returns: bool,
-    skip_voucher_if_ledger_exists: bool,
-) -> tuple[List[dict], dict]:
-    """
-    Build stock_ledger insert rows for historical data. Each row uses remarks
-    'backfill:...' for idempotent re-runs.
-    """
-    stats: Dict[str, Any] = {
-        "purchases_lines_seen": 0,
-        "purchases_lines_planned": 0,
-        "sales_lines_seen": 0,
-        "sales_lines_planned": 0,
-        "return_lines_seen": 0,
-        "return_lines_planned": 0,
-        "skipped_missing_line_id": 0,
-        "skipped_duplicate_remark": 0,
-        "skipped_whole_voucher": 0,
-        "returns_unavailable": False,
-    }
-    rows: List[dict] = []
-
-    if not hasattr(db, "add_stock_ledger_entry"):
-        return rows, stats
-
-    backfill_keys: set[str] = set()
-    if hasattr(db, "get_stock_ledger_backfill_keys"):
-        backfill_keys = db.get_stock_ledger_backfill_keys()
-
-    voucher_keys: set[tuple[str, str]] = set()
-    if skip_voucher_if_ledger_exists and hasattr(db, "get_stock_ledger_voucher_keys"):
-        voucher_keys = db.get_stock_ledger_voucher_keys()
-
-    if include_purchases and hasattr(db, "get_purchases"):
-        for purchase in db.get_purchases():
-            pid = str(purchase.get("id")) if purchase.get("id") is not None else None
-            if not pid:
-                continue
-            if skip_voucher_if_ledger_exists and ("purchase", pid) in voucher_keys:
-                stats["skipped_whole_voucher"] += len(purchase.get("items") or [])
-                continue
-            ts = _ledger_ts_from_row(purchase)
-            wid = purchase.get("warehouse_id")
-            wname = purchase.get("warehouse_name")
-            for item in purchase.get("items") or []:
-                stats["purchases_lines_seen"] += 1
-                line_id = item.get("id")
-                if not line_id:
-                    stats["skipped_missing_line_id"] += 1
-                    continue
-                remark = f"backfill:purchase_item:{line_id}"
-                if remark in backfill_keys:
-                    stats["skipped_duplicate_remark"] += 1
-                    continue
-                product_id = item.get("product_id")
-                if not product_id:
-                    stats["skipped_missing_line_id"] += 1
-                    continue
-                qty = _to_int(item.get("quantity"), 0)
-                if qty == 0:
-                    continue
-                item_batch_id = item.get("batch_id")
-                item_batch_number = item.get("batch_number")
-                batch_ref = None
-                if item_batch_id and hasattr(db, "get_batch"):
-                    batch_ref = db.get_batch(str(item_batch_id))
-                elif item_batch_number:
-                    batch_ref = _find_batch_by_product_and_number(str(product_id), item_batch_number)
-                    if batch_ref:
-                        item_batch_id = batch_ref.get("id")
-                        item_batch_number = batch_ref.get("batch_number") or item_batch_number
-                row_wid = item.get("warehouse_id") or wid
-                row_wname = item.get("warehouse_name") or wname
-                if batch_ref:
-                    row_wid = row_wid or batch_ref.get("warehouse_id")
-                    row_wname = row_wname or batch_ref.get("warehouse_name")
-                if row_wid and not row_wname and hasattr(db, "get_warehouse"):
-                    wh = db.get_warehouse(str(row_wid))
-                    if wh:
-                        row_wname = wh.get("name")
-                rows.append(
-                    {
-                        "product_id": str(product_id),
-                        "product_name": item.get("product_name"),
-                        "batch_id": item_batch_id,
-                        "batch_number": item_batch_number,
-                        "warehouse_id": row_wid,
-                        "warehouse_name": row_wname,
-                        "voucher_type": "purchase",
-                        "voucher_id": pid,
-                        "quantity_change": qty,
-                        "quantity_after": None,
-                        "unit_cost": item.get("unit_price"),
-                        "remarks": remark,
-                        "created_by": None,
-                        "created_at": ts,
-                    }
-                )
-                stats["purchases_lines_planned"] += 1
-
-    if include_sales and hasattr(db, "get_sales"):
-        for sale in db.get_sales():
-            sid = str(sale.get("id")) if sale.get("id") is not None else None
-            if not sid:
-                continue
-            if skip_voucher_if_ledger_exists and ("sale", sid) in voucher_keys:
-                stats["skipped_whole_voucher"] += len(sale.get("items") or [])
-                continue
-            ts = _ledger_ts_from_row(sale)
-            for item in sale.get("items") or []:
-                stats["sales_lines_seen"] += 1
-                line_id = item.get("id")
-                if not line_id:
-                    stats["skipped_missing_line_id"] += 1
-                    continue
-                remark = f"backfill:sale_item:{line_id}"
-                if remark in backfill_keys:
-                    stats["skipped_duplicate_remark"] += 1
-                    continue
-                product_id = item.get("product_id")
-                if not product_id:
-                    stats["skipped_missing_line_id"] += 1
-                    continue
-                qty = _to_int(item.get("quantity"), 0)
-                if qty == 0:
-                    continue
-                item_batch_id = item.get("batch_id")
-                item_batch_number = item.get("batch_number")
-                batch_ref = None
-                if item_batch_id and hasattr(db, "get_batch"):
-                    batch_ref = db.get_batch(str(item_batch_id))
-                elif item_batch_number:
-                    batch_ref = _find_batch_by_product_and_number(str(product_id), item_batch_number)
-                    if batch_ref:
-                        item_batch_id = batch_ref.get("id")
-                        item_batch_number = batch_ref.get("batch_number") or item_batch_number
-                row_wid = batch_ref.get("warehouse_id") if batch_ref else None
-                row_wname = batch_ref.get("warehouse_name") if batch_ref else None
-                if row_wid and not row_wname and hasattr(db, "get_warehouse"):
-                    wh = db.get_warehouse(str(row_wid))
-                    if wh:
-                        row_wname = wh.get("name")
-                rows.append(
-                    {
-                        "product_id": str(product_id),
-                        "product_name": item.get("product_name"),
-                        "batch_id": item_batch_id,
-                        "batch_number": item_batch_number,
-                        "warehouse_id": row_wid,
-                        "warehouse_name": row_wname,
-                        "voucher_type": "sale",
-                        "voucher_id": sid,
-                        "quantity_change": -qty,
-                        "quantity_after": None,
-                        "unit_cost": item.get("unit_price"),
-                        "remarks": remark,
-                        "created_by": None,
-                        "created_at": ts,
-                    }
-                )
-                stats["sales_lines_planned"] += 1
-
-    if include_returns:
-        if not hasattr(db, "get_all_sales_return_items_flat"):
-            stats["returns_unavailable"] = True
-        else:
-            for item in db.get_all_sales_return_items_flat():
-                stats["return_lines_seen"] += 1
-                rid = str(item.get("return_id")) if item.get("return_id") is not None else None
-                if not rid:
-                    stats["skipped_missing_line_id"] += 1
-                    continue
-                if skip_voucher_if_ledger_exists and ("sale_return", rid) in voucher_keys:
-                    stats["skipped_whole_voucher"] += 1
-                    continue
-                line_id = item.get("id")
-                if not line_id:
-                    stats["skipped_missing_line_id"] += 1
-                    continue
-                remark = f"backfill:sreturn_item:{line_id}"
-                if remark in backfill_keys:
-                    stats["skipped_duplicate_remark"] += 1
-                    continue
-                product_id = item.get("product_id")
-                if not product_id:
-                    stats["skipped_missing_line_id"] += 1
-                    continue
-                qty = _to_int(item.get("quantity_returned"), 0)
-                if qty == 0:
-                    continue
-                item_batch_id = item.get("batch_id")
-                item_batch_number = item.get("batch_number")
-                batch_ref = None
-                if item_batch_id and hasattr(db, "get_batch"):
-                    batch_ref = db.get_batch(str(item_batch_id))
-                elif item_batch_number:
-                    batch_ref = _find_batch_by_product_and_number(str(product_id), item_batch_number)
-                    if batch_ref:
-                        item_batch_id = batch_ref.get("id")
-                        item_batch_number = batch_ref.get("batch_number") or item_batch_number
-                row_wid = batch_ref.get("warehouse_id") if batch_ref else None
-                row_wname = batch_ref.get("warehouse_name") if batch_ref else None
-                if row_wid and not row_wname and hasattr(db, "get_warehouse"):
-                    wh = db.get_warehouse(str(row_wid))
-                    if wh:
-                        row_wname = wh.get("name")
-                ts_raw = item.get("_return_created_at")
-                if isinstance(ts_raw, datetime):
-                    ts = ts_raw.isoformat()
-                elif isinstance(ts_raw, str) and ts_raw.strip():
-                    ts = ts_raw
-                else:
-                    ts = datetime.now().isoformat()
-                rows.append(
-                    {
-                        "product_id": str(product_id),
-                        "product_name": item.get("product_name"),
-                        "batch_id": item_batch_id,
-                        "batch_number": item_batch_number,
-                        "warehouse_id": row_wid,
-                        "warehouse_name": row_wname,
-                        "voucher_type": "sale_return",
-                        "voucher_id": rid,
-                        "quantity_change": qty,
-                        "quantity_after": None,
-                        "unit_cost": item.get("unit_price"),
-                        "remarks": remark,
-                        "created_by": None,
-                        "created_at": ts,
-                    }
-                )
-                stats["return_lines_planned"] += 1
-
-    stats["rows_planned"] = len(rows)
-    return rows, stats
-
-
-def _apply_stock_ledger_backfill(rows: List[dict], dry_run: bool) -> int:
-    if dry_run or not rows:
-        return 0
-    if hasattr(db, "add_stock_ledger_entries_bulk"):
-        return int(db.add_stock_ledger_entries_bulk(rows))
-    inserted = 0
-    if hasattr(db, "add_stock_ledger_entry"):
-        for row in rows:
-            db.add_stock_ledger_entry(row)
-            inserted += 1
-    return inserted
-
 
 # Global exception handler to ensure JSON responses (must be before middleware)
 from fastapi.exceptions import RequestValidationError
@@ -905,9 +572,56 @@ app.add_middleware(
     max_age=600,  # Cache preflight for 10 minutes
 )
 
+# Background loops and jobs started by this app. asyncio keeps only weak
+# references to tasks, so the handles live here until the task finishes;
+# shutdown cancels whatever is still running.
+_background_tasks: Set[asyncio.Task] = set()
+
+
+def _background_task_done(task: asyncio.Task) -> None:
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Background task {task.get_name()} failed: {task.exception()!r}")
+
+
+def _spawn_background_task(coro, name: str) -> asyncio.Task:
+    task = asyncio.create_task(coro, name=name)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_task_done)
+    return task
+
+
 @app.on_event("startup")
 async def startup_event():
     """Start background tasks on application startup"""
+    try:
+        await adb.startup()
+    except Exception as e:
+        logger.error(f"Failed to open async database pool: {e}")
+
+    # Resume a stock-ledger backfill interrupted by a restart or timeout
+    if LEDGER_BACKFILL_AUTO_RESUME and hasattr(db, "get_stock_ledger_backfill_job"):
+        try:
+            job = await adb.get_stock_ledger_backfill_job()
+            if (
+                job
+                and job.get("status") in ACTIVE_STATUSES
+                and is_stale(job)
+                and await adb.claim_stock_ledger_backfill_job(job["id"], job.get("heartbeat_at"))
+            ):
+                logger.info(f"Resuming stock ledger backfill job {job['id']} from {job.get('checkpoint')}")
+                _spawn_background_task(adb.run_sync(ledger_backfill.run, db, job), "stock-ledger-backfill")
+        except Exception as e:
+            logger.error(f"Failed to resume stock ledger backfill: {e}")
+
+    # Retry stock ledger writes that failed during a request
+    if hasattr(db, "get_due_stock_ledger_writes"):
+        _spawn_background_task(ledger_writer.start(db), "stock-ledger-writer")
+
+    # Periodically repair the dashboard rollups (and refresh low-stock / expiry counts)
+    if hasattr(db, "refresh_dashboard_rollups"):
+        _spawn_background_task(dashboard_rollups.start(db), "dashboard-rollups")
+
     # Start SMS worker
     try:
         await start_sms_worker(db)
@@ -916,6 +630,17 @@ async def startup_event():
         logger.error(f"Failed to start SMS worker: {e}")
         pass
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    ledger_writer.stop()
+    dashboard_rollups.stop()
+    tasks = list(_background_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await adb.shutdown()
+    password_pool.shutdown()
+
 @app.get("/healthz")
 async def healthz():
     return {"status": "ok"}
@@ -931,7 +656,7 @@ async def login(credentials: UserLogin, request: Request):
         client_host = request.client.host if request.client else "unknown"
         print(f"[LOGIN] Attempt from origin: {origin}, IP: {client_host}, User-Agent: {user_agent[:50]}")
         if _is_rate_limited(client_host):
-            _log_audit_event(
+            await _log_audit_event(
                 action="login_rate_limited",
                 request=request,
                 metadata={"email": credentials.email},
@@ -942,11 +667,11 @@ async def login(credentials: UserLogin, request: Request):
             )
         pass
         
-        user = db.get_user_by_email(credentials.email)
+        user = await adb.get_user_by_email(credentials.email)
         if not user:
             print(f"[LOGIN] Failed: User not found for email: {credentials.email}")
             _record_login_failure(client_host)
-            _log_audit_event(
+            await _log_audit_event(
                 action="login_failed",
                 request=request,
                 metadata={"email": credentials.email, "reason": "user_not_found"},
@@ -956,11 +681,11 @@ async def login(credentials: UserLogin, request: Request):
                 detail="Invalid email or password"
             )
         
-        password_valid = db.verify_password(credentials.password, user["password_hash"])
+        password_valid = await password_pool.verify(credentials.password, user["password_hash"])
         if not password_valid:
             print(f"[LOGIN] Failed: Invalid password for email: {credentials.email}")
             _record_login_failure(client_host)
-            _log_audit_event(
+            await _log_audit_event(
                 action="login_failed",
                 request=request,
                 actor_id=user.get("id"),
@@ -971,35 +696,22 @@ async def login(credentials: UserLogin, request: Request):
                 detail="Invalid email or password"
             )
 
-        # Auto-upgrade legacy SHA-256 hash → bcrypt on successful login
+        # Auto-upgrade legacy SHA-256 hash → bcrypt on successful login (batched, off the response path)
         current_hash = user.get("password_hash", "")
-        if not (current_hash.startswith("$2b$") or current_hash.startswith("$2a$")):
-            try:
-                new_hash = db.hash_password(credentials.password)
-                if hasattr(db, 'client'):
-                    # SupabaseDatabase
-                    db.client.table("users").update(
-                        {"password_hash": new_hash}
-                    ).eq("id", user["id"]).execute()
-                elif hasattr(db, 'users'):
-                    # InMemoryDatabase
-                    db.users[user["id"]]["password_hash"] = new_hash
-                print(f"[LOGIN] Password hash upgraded to bcrypt for: {credentials.email}")
-            except Exception as upgrade_err:
-                # Non-fatal: login still succeeds even if upgrade fails
-                print(f"[LOGIN] Failed to upgrade password hash: {upgrade_err}")
-        
-        access_token = create_access_token(data={"sub": user["id"]})
+        if not is_bcrypt_hash(current_hash) and hasattr(adb, "apply_password_rehashes"):
+            password_pool.schedule_rehash(adb, user["id"], current_hash, credentials.password)
+        
+        tokens = issue_tokens(user)
         print(f"[LOGIN] Success: User {user['email']} logged in from origin: {origin}")
         _clear_login_failures(client_host)
-        _log_audit_event(
+        await _log_audit_event(
             action="login_success",
             request=request,
             actor_id=user.get("id"),
             metadata={"email": user.get("email")},
         )
         return Token(
-            access_token=access_token,
+            **tokens,
             user=_user_for_api(user)
         )
     except HTTPException:
@@ -1015,23 +727,24 @@ async def login(credentials: UserLogin, request: Request):
 
 @app.post("/api/auth/register", response_model=Token)
 async def register(user_data: UserCreate, request: Request):
-    existing = db.get_user_by_email(user_data.email)
+    existing = await adb.get_user_by_email(user_data.email)
     if existing:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
     
-    user = db.create_user(
+    user = await adb.create_user(
         email=user_data.email,
         name=user_data.name,
         password=user_data.password,
         role=user_data.role,
-        phone=user_data.phone
+        phone=user_data.phone,
+        password_hash=await password_pool.hash(user_data.password),
     )
     
-    access_token = create_access_token(data={"sub": user["id"]})
-    _log_audit_event(
+    tokens = issue_tokens(user)
+    await _log_audit_event(
         action="user_registered",
         request=request,
         actor_id=user.get("id"),
@@ -1040,10 +753,20 @@ async def register(user_data: UserCreate, request: Request):
         metadata={"email": user.get("email")},
     )
     return Token(
-        access_token=access_token,
+        **tokens,
         user=_user_for_api(user)
     )
 
+@app.post("/api/auth/refresh", response_model=Token)
+async def refresh_access_token(body: RefreshTokenRequest):
+    """Exchange a refresh token for a new access/refresh pair (re-reads the user row)."""
+    session = await adb.run_sync(refresh_session, body.refresh_token)
+    return Token(
+        access_token=session["access_token"],
+        refresh_token=session["refresh_token"],
+        user=_user_for_api(session["user"])
+    )
+
 @app.get("/api/auth/google")
 async def google_login():
     """
@@ -1149,18 +872,19 @@ async def google_callback(code: str = None, error: str = None):
                 return RedirectResponse(url=f"{frontend_url}/login?error=no_email")
             
             # Check if user exists, if not create one
-            user = db.get_user_by_email(google_email)
+            user = await adb.get_user_by_email(google_email)
             if not user:
                 # Create new user with Google email
                 # Use a random password since Google OAuth users don't need password
                 import secrets
                 random_password = secrets.token_urlsafe(32)
-                user = db.create_user(
+                user = await adb.create_user(
                     email=google_email,
                     name=google_name,
                     password=random_password,  # Random password, won't be used
                     role=UserRole.DSR,
-                    phone=None
+                    phone=None,
+                    password_hash=await password_pool.hash(random_password),
                 )
                 print(f"[GOOGLE OAUTH] Created new user: {google_email}")
             else:
@@ -1171,12 +895,12 @@ async def google_callback(code: str = None, error: str = None):
                 return RedirectResponse(url=f"{frontend_url}/login?error=database_create_failed")
             
             # Generate JWT token
-            jwt_token = create_access_token(data={"sub": user["id"]})
-
+            tokens = issue_tokens(user)
             
             # Redirect to frontend with token
             return RedirectResponse(
-                url=f"{frontend_url}/login?token={jwt_token}&email={google_email}&name={google_name}"
+                url=f"{frontend_url}/login?token={tokens['access_token']}&refresh_token={tokens['refresh_token']}"
+                f"&email={google_email}&name={google_name}"
             )
             
     except Exception as e:
@@ -1193,8 +917,9 @@ async def get_users(current_user: dict = Depends(get_current_user)):
     """Get all users (admin only or for SR selection)"""
     try:
         if not _is_admin(current_user):
-            return [_user_for_api(current_user)]
-        users = db.get_users()
+            # current_user may be built from token claims; return the full row
+            return [_user_for_api(await adb.get_user_by_id(current_user["id"]) or current_user)]
+        users = await adb.get_users()
         return [_user_for_api(user) for user in users]
     except Exception as e:
         raise HTTPException(
@@ -1208,25 +933,26 @@ async def create_user(user_data: UserCreate, current_user: dict = Depends(get_cu
     try:
         _require_admin(current_user)
         # Check if email already exists
-        existing_users = db.get_users()
+        existing_users = await adb.get_users()
         if any(u.get("email") == user_data.email for u in existing_users):
             raise HTTPException(
                 status_code=status.HTTP_409_CONFLICT,
                 detail="User with this email already exists"
             )
         
-        user = db.create_user(
+        user = await adb.create_user(
             email=user_data.email,
             name=user_data.name,
             password=user_data.password,
             role=user_data.role,
-            phone=user_data.phone
+            phone=user_data.phone,
+            password_hash=await password_pool.hash(user_data.password),
         )
         gupd = {
             "sr_guarantee_limit": user_data.sr_guarantee_limit,
             "sr_guarantee_enforcement": user_data.sr_guarantee_enforcement,
         }
-        user2 = db.update_user(user["id"], gupd)
+        user2 = await adb.update_user(user["id"], gupd)
         return _user_for_api(user2 or user)
     except HTTPException:
         raise
@@ -1249,13 +975,13 @@ async def update_user(
     try:
         _require_admin(current_user)
         # Verify user exists
-        existing_user = db.get_user_by_id(user_id)
+        existing_user = await adb.get_user_by_id(user_id)
         if not existing_user:
             raise HTTPException(status_code=404, detail="User not found")
         
         # Check if email is being changed and if it conflicts
         if user_data.email and user_data.email != existing_user.get("email"):
-            existing_users = db.get_users()
+            existing_users = await adb.get_users()
             if any(u.get("email") == user_data.email and u.get("id") != user_id for u in existing_users):
                 raise HTTPException(
                     status_code=status.HTTP_409_CONFLICT,
@@ -1272,6 +998,7 @@ async def update_user(
             update_data["phone"] = user_data.phone
         if user_data.password is not None:
             update_data["password"] = user_data.password
+            update_data["password_hash"] = await password_pool.hash(user_data.password)
         if user_data.role is not None:
             r = user_data.role
             update_data["role"] = r.value if isinstance(r, UserRole) else r
@@ -1281,7 +1008,7 @@ async def update_user(
             update_data["sr_guarantee_enforcement"] = user_data.sr_guarantee_enforcement
         
         # Update user
-        updated_user = db.update_user(user_id, update_data)
+        updated_user = await adb.update_user(user_id, update_data)
         if not updated_user:
             raise HTTPException(status_code=404, detail="User not found")
         
@@ -1303,7 +1030,7 @@ async def delete_user(user_id: str, current_user: dict = Depends(get_current_use
     try:
         _require_admin(current_user)
         # Verify user exists
-        existing_user = db.get_user_by_id(user_id)
+        existing_user = await adb.get_user_by_id(user_id)
         if not existing_user:
             raise HTTPException(status_code=404, detail="User not found")
         
@@ -1315,7 +1042,7 @@ async def delete_user(user_id: str, current_user: dict = Depends(get_current_use
             )
         
         # Delete user (will automatically clear assigned_to references)
-        db.delete_user(user_id)
+        await adb.delete_user(user_id)
         
         return {
             "message": "User deleted successfully"
@@ -1344,15 +1071,15 @@ async def get_me(current_user: dict = Depends(get_current_user)):
 
 @app.get("/api/products", response_model=List[Product])
 async def get_products(current_user: dict = Depends(get_current_user)):
-    products = db.get_products()
-    return [Product(**_attach_latest_batch(p)) for p in products]
+    products = await adb.get_products()
+    return [Product(**p) for p in await _attach_latest_batches(products)]
 
 @app.get("/api/products/{product_id}", response_model=Product)
 async def get_product(product_id: str, current_user: dict = Depends(get_current_user)):
-    product = db.get_product(product_id)
+    product = await adb.get_product(product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    return Product(**_attach_latest_batch(product))
+    return Product(**await _attach_latest_batch(product))
 
 @app.post("/api/products", response_model=Product, status_code=status.HTTP_201_CREATED)
 async def create_product(product_data: ProductCreate, current_user: dict = Depends(get_current_user)):
@@ -1376,13 +1103,13 @@ async def create_product(product_data: ProductCreate, current_user: dict = Depen
         print(f"[API] Creating product with data: {data}")
         print(f"[API] User: {current_user.get('email', 'unknown')}")
         
-        product = db.create_product(data)
+        product = await adb.create_product(data)
         print(f"[API] Product created in DB: {product.get('id', 'no-id')}")
 
         if expiry_date:
             if not batch_number:
                 batch_number = _generate_batch_number()
-            batch = db.create_batch({
+            batch = await adb.create_batch({
                 "product_id": product["id"],
                 "batch_number": batch_number,
                 "expiry_date": expiry_date,
@@ -1392,7 +1119,7 @@ async def create_product(product_data: ProductCreate, current_user: dict = Depen
             product["batch_number"] = batch.get("batch_number")
             product["expiry_date"] = batch.get("expiry_date")
 
-        _record_opening_stock_ledger_for_product(product, current_user.get("id"))
+        await adb.run_sync(_record_opening_stock_ledger_for_product, product, current_user.get("id"))
         
         # Check for low stock and trigger SMS if needed
         stock_quantity = product.get("stock_quantity", 0)
@@ -1462,15 +1189,16 @@ async def update_product(product_id: str, product_data: ProductCreate, current_u
         print(f"[API] Updating product {product_id} with data: {data}")
         print(f"[API] User: {current_user.get('email', 'unknown')}")
         
-        prior = db.get_product(product_id)
-        product = db.update_product(product_id, data)
+        prior = await adb.get_product(product_id)
+        product = await adb.update_product(product_id, data)
         if not product:
             raise HTTPException(status_code=404, detail="Product not found")
 
         old_q = _to_int((prior or {}).get("stock_quantity"), 0)
         new_q = _to_int(product.get("stock_quantity"), 0)
         if prior is not None and old_q != new_q:
-            _record_stock_ledger_adjustment(
+            await adb.run_sync(
+                _record_stock_ledger_adjustment,
                 product_id=str(product_id),
                 quantity_change=new_q - old_q,
                 created_by=current_user.get("id"),
@@ -1494,7 +1222,7 @@ async def update_product(product_id: str, product_data: ProductCreate, current_u
             ))
         
         print(f"[API] Product updated successfully: {product.get('id', 'no-id')}")
-        return Product(**_attach_latest_batch(product))
+        return Product(**await _attach_latest_batch(product))
     except HTTPException:
         raise
     except ValueError as e:
@@ -1519,12 +1247,12 @@ async def update_product(product_id: str, product_data: ProductCreate, current_u
 async def delete_product(product_id: str, current_user: dict = Depends(get_current_user)):
     try:
         # Check if product exists first
-        product = db.get_product(product_id)
+        product = await adb.get_product(product_id)
         if not product:
             raise HTTPException(status_code=404, detail="Product not found")
         
         # Delete the product
-        success = db.delete_product(product_id)
+        success = await adb.delete_product(product_id)
         if not success:
             raise HTTPException(status_code=500, detail="Failed to delete product")
         
@@ -1539,17 +1267,17 @@ async def delete_product(product_id: str, current_user: dict = Depends(get_curre
 
 @app.get("/api/products/{product_id}/batches", response_model=List[ProductBatch])
 async def get_product_batches(product_id: str, warehouse_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
-    batches = db.get_batches_by_product(product_id, warehouse_id)
+    batches = await adb.get_batches_by_product(product_id, warehouse_id)
     return [ProductBatch(**b) for b in batches]
 
 @app.post("/api/products/{product_id}/batches", response_model=ProductBatch)
 async def create_product_batch(product_id: str, batch_data: ProductBatchCreate, current_user: dict = Depends(get_current_user)):
-    product = db.get_product(product_id)
+    product = await adb.get_product(product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
 
     batch_number = batch_data.batch_number or _generate_batch_number()
-    batch = db.create_batch({
+    batch = await adb.create_batch({
         "product_id": product_id,
         "batch_number": batch_number,
         "expiry_date": batch_data.expiry_date,
@@ -1557,9 +1285,10 @@ async def create_product_batch(product_id: str, batch_data: ProductBatchCreate,
         "purchase_price": batch_data.purchase_price
     })
     qty = int(batch_data.quantity)
-    if hasattr(db, "update_product_stock") and qty != 0:
-        db.update_product_stock(product_id, qty)
-    _record_stock_ledger_adjustment(
+    if hasattr(db, "apply_stock_movements") and qty != 0:
+        await adb.apply_stock_movements([{"product_id": product_id, "delta": qty}])
+    await adb.run_sync(
+        _record_stock_ledger_adjustment,
         product_id=str(product_id),
         quantity_change=qty,
         created_by=current_user.get("id"),
@@ -1574,24 +1303,33 @@ async def create_product_batch(product_id: str, batch_data: ProductBatchCreate,
 
 @app.get("/api/retailers", response_model=List[Retailer])
 async def get_retailers(current_user: dict = Depends(get_current_user)):
-    retailers = db.get_retailers()
+    retailers = await adb.get_retailers()
     return [Retailer(**r) for r in retailers]
 
+@app.get("/api/retailers/previous-due")
+async def get_retailers_previous_due(ids: str, current_user: dict = Depends(get_current_user)):
+    """Get current previous due for many retailers at once (comma-separated ids, for route planning)"""
+    retailer_ids = list(dict.fromkeys(r.strip() for r in ids.split(",") if r.strip()))
+    if len(retailer_ids) > 500:
+        raise HTTPException(status_code=400, detail="At most 500 retailer ids per request")
+    dues = await adb.calculate_previous_dues(retailer_ids)
+    return {"previous_due": {retailer_id: dues.get(retailer_id, 0.0) for retailer_id in retailer_ids}}
+
 @app.get("/api/retailers/{retailer_id}", response_model=Retailer)
 async def get_retailer(retailer_id: str, current_user: dict = Depends(get_current_user)):
-    retailer = db.get_retailer(retailer_id)
+    retailer = await adb.get_retailer(retailer_id)
     if not retailer:
         raise HTTPException(status_code=404, detail="Retailer not found")
     return Retailer(**retailer)
 
 @app.post("/api/retailers", response_model=Retailer)
 async def create_retailer(retailer_data: RetailerCreate, current_user: dict = Depends(get_current_user)):
-    retailer = db.create_retailer(retailer_data.model_dump())
+    retailer = await adb.create_retailer(retailer_data.model_dump())
     return Retailer(**retailer)
 
 @app.put("/api/retailers/{retailer_id}", response_model=Retailer)
 async def update_retailer(retailer_id: str, retailer_data: RetailerCreate, current_user: dict = Depends(get_current_user)):
-    retailer = db.update_retailer(retailer_id, retailer_data.model_dump())
+    retailer = await adb.update_retailer(retailer_id, retailer_data.model_dump())
     if not retailer:
         raise HTTPException(status_code=404, detail="Retailer not found")
     return Retailer(**retailer)
@@ -1599,24 +1337,24 @@ async def update_retailer(retailer_id: str, retailer_data: RetailerCreate, curre
 # Warehouse endpoints
 @app.get("/api/warehouses", response_model=List[Warehouse])
 async def get_warehouses(current_user: dict = Depends(get_current_user)):
-    warehouses = db.get_warehouses()
+    warehouses = await adb.get_warehouses()
     return [Warehouse(**w) for w in warehouses]
 
 @app.get("/api/warehouses/{warehouse_id}", response_model=Warehouse)
 async def get_warehouse(warehouse_id: str, current_user: dict = Depends(get_current_user)):
-    warehouse = db.get_warehouse(warehouse_id)
+    warehouse = await adb.get_warehouse(warehouse_id)
     if not warehouse:
         raise HTTPException(status_code=404, detail="Warehouse not found")
     return Warehouse(**warehouse)
 
 @app.post("/api/warehouses", response_model=Warehouse)
 async def create_warehouse(warehouse_data: WarehouseCreate, current_user: dict = Depends(get_current_user)):
-    warehouse = db.create_warehouse(warehouse_data.model_dump())
+    warehouse = await adb.create_warehouse(warehouse_data.model_dump())
     return Warehouse(**warehouse)
 
 @app.put("/api/warehouses/{warehouse_id}", response_model=Warehouse)
 async def update_warehouse(warehouse_id: str, warehouse_data: WarehouseCreate, current_user: dict = Depends(get_current_user)):
-    warehouse = db.update_warehouse(warehouse_id, warehouse_data.model_dump())
+    warehouse = await adb.update_warehouse(warehouse_id, warehouse_data.model_dump())
     if not warehouse:
         raise HTTPException(status_code=404, detail="Warehouse not found")
     return Warehouse(**warehouse)
@@ -1624,7 +1362,7 @@ async def update_warehouse(warehouse_id: str, warehouse_data: WarehouseCreate, c
 @app.delete("/api/warehouses/{warehouse_id}")
 async def delete_warehouse(warehouse_id: str, current_user: dict = Depends(get_current_user)):
     try:
-        db.delete_warehouse(warehouse_id)
+        await adb.delete_warehouse(warehouse_id)
         return {"message": "Warehouse deleted successfully"}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -1633,40 +1371,40 @@ async def delete_warehouse(warehouse_id: str, current_user: dict = Depends(get_c
 
 @app.get("/api/warehouses/{warehouse_id}/stock", response_model=List[WarehouseStockSummary])
 async def get_warehouse_stock(warehouse_id: str, current_user: dict = Depends(get_current_user)):
-    stock_summary = db.get_warehouse_stock_summary(warehouse_id)
+    stock_summary = await adb.get_warehouse_stock_summary(warehouse_id)
     return [WarehouseStockSummary(**s) for s in stock_summary]
 
 @app.get("/api/warehouses/{warehouse_id}/stock-count")
 async def get_warehouse_stock_count(warehouse_id: str, current_user: dict = Depends(get_current_user)):
-    count = db.get_warehouse_stock_count(warehouse_id)
+    count = await adb.get_warehouse_stock_count(warehouse_id)
     return {"warehouse_id": warehouse_id, "total_stock": count}
 
 @app.delete("/api/retailers/{retailer_id}")
 async def delete_retailer(retailer_id: str, current_user: dict = Depends(get_current_user)):
-    if not db.delete_retailer(retailer_id):
+    if not await adb.delete_retailer(retailer_id):
         raise HTTPException(status_code=404, detail="Retailer not found")
     return {"message": "Retailer deleted"}
 
 @app.get("/api/market-routes", response_model=List[MarketRoute])
 async def get_market_routes(current_user: dict = Depends(get_current_user)):
-    routes = db.get_market_routes()
+    routes = await adb.get_market_routes()
     return [MarketRoute(**r) for r in routes]
 
 @app.post("/api/market-routes", response_model=MarketRoute)
 async def create_market_route(route_data: MarketRouteCreate, current_user: dict = Depends(get_current_user)):
-    route = db.create_market_route(route_data.model_dump())
+    route = await adb.create_market_route(route_data.model_dump())
     return MarketRoute(**route)
 
 @app.put("/api/market-routes/{route_id}", response_model=MarketRoute)
 async def update_market_route(route_id: str, route_data: MarketRouteCreate, current_user: dict = Depends(get_current_user)):
-    route = db.update_market_route(route_id, route_data.model_dump())
+    route = await adb.update_market_route(route_id, route_data.model_dump())
     if not route:
         raise HTTPException(status_code=404, detail="Market route not found")
     return MarketRoute(**route)
 
 @app.delete("/api/market-routes/{route_id}")
 async def delete_market_route(route_id: str, current_user: dict = Depends(get_current_user)):
-    if not db.delete_market_route(route_id):
+    if not await adb.delete_market_route(route_id):
         raise HTTPException(status_code=404, detail="Market route not found")
     return {"message": "Market route deleted"}
 
@@ -1686,7 +1424,7 @@ async def delete_demo_retailers(current_user: dict = Depends(get_current_user)):
         demo_phones = ['01712345678', '01812345678', '01912345678', '01612345678']
         
         # Get all retailers
-        all_retailers = db.get_retailers()
+        all_retailers = await adb.get_retailers()
         
         # Find demo retailers
         demo_retailer_ids = []
@@ -1703,7 +1441,7 @@ async def delete_demo_retailers(current_user: dict = Depends(get_current_user)):
             }
         
         # Delete payments for demo retailers
-        all_payments = db.get_payments()
+        all_payments = await adb.get_payments()
         payments_deleted = 0
         for payment in all_payments:
             if payment.get("retailer_id") in demo_retailer_ids:
@@ -1714,7 +1452,7 @@ async def delete_demo_retailers(current_user: dict = Depends(get_current_user)):
         # Delete retailers
         deleted_count = 0
         for retailer_id in demo_retailer_ids:
-            if db.delete_retailer(retailer_id):
+            if await adb.delete_retailer(retailer_id):
                 deleted_count += 1
         
         return {
@@ -1734,7 +1472,7 @@ async def delete_demo_retailers(current_user: dict = Depends(get_current_user)):
 
 @app.get("/api/purchases", response_model=List[Purchase])
 async def get_purchases(current_user: dict = Depends(get_current_user)):
-    purchases = db.get_purchases()
+    purchases = await adb.get_purchases()
     return [Purchase(**p) for p in purchases]
 
 @app.post("/api/purchases", response_model=Purchase, status_code=status.HTTP_201_CREATED)
@@ -1764,7 +1502,7 @@ async def create_purchase(purchase_data: PurchaseCreate, request: Request, curre
                 # Find the batch to check stock
                 product_id = item.get("product_id")
                 if product_id:
-                    batches = db.get_batches_by_product(product_id)
+                    batches = await adb.get_batches_by_product(product_id)
                     matching_batch = next((b for b in batches if b.get("batch_number") == batch_number), None)
                     
                     if matching_batch:
@@ -1779,7 +1517,7 @@ async def create_purchase(purchase_data: PurchaseCreate, request: Request, curre
                         # No validation needed for new batches
                         pass
         
-        purchase = db.create_purchase(
+        purchase = await adb.create_purchase(
             {
                 "supplier_name": purchase_data.supplier_name,
                 "invoice_number": purchase_data.invoice_number,
@@ -1791,7 +1529,7 @@ async def create_purchase(purchase_data: PurchaseCreate, request: Request, curre
             items
         )
         print(f"[API] Purchase created in DB: {purchase.get('id', 'no-id')}")
-        _log_audit_event(
+        await _log_audit_event(
             action="purchase_created",
             request=request,
             actor_id=current_user.get("id"),
@@ -1799,7 +1537,8 @@ async def create_purchase(purchase_data: PurchaseCreate, request: Request, curre
             entity_id=purchase.get("id"),
             metadata={"invoice_number": purchase.get("invoice_number")},
         )
-        _record_stock_ledger_entries(
+        await adb.run_sync(
+            _record_stock_ledger_entries,
             voucher_type="purchase",
             voucher_id=purchase.get("id"),
             items=purchase.get("items", []),
@@ -1828,7 +1567,7 @@ async def create_purchase(purchase_data: PurchaseCreate, request: Request, curre
                     if expiry_date <= thirty_days_later:
                         days_remaining = (expiry_date - today).days
                         # Trigger expiry alert SMS
-                        product = db.get_product(item.get("product_id"))
+                        product = await adb.get_product(item.get("product_id"))
                         if product:
                             asyncio.create_task(trigger_sms_notification(
                                 event_type=SmsEventType.EXPIRY_ALERT,
@@ -1877,17 +1616,18 @@ async def create_purchase(purchase_data: PurchaseCreate, request: Request, curre
 
 @app.get("/api/sales", response_model=List[Sale])
 async def get_sales(current_user: dict = Depends(get_current_user)):
-    sales = db.get_sales()
+    sales = await adb.get_sales()
     if not _is_admin(current_user):
-        sales = [sale for sale in sales if _sale_visible_to_user(sale, current_user)]
+        route_assignees = await _route_assignees(sales, current_user)
+        sales = [sale for sale in sales if _sale_visible_to_user(sale, current_user, route_assignees)]
     return [Sale(**s) for s in sales]
 
 @app.get("/api/sales/{sale_id}", response_model=Sale)
 async def get_sale(sale_id: str, current_user: dict = Depends(get_current_user)):
-    sale = db.get_sale(sale_id)
+    sale = await adb.get_sale(sale_id)
     if not sale:
         raise HTTPException(status_code=404, detail="Sale not found")
-    if not _is_admin(current_user) and not _sale_visible_to_user(sale, current_user):
+    if not _is_admin(current_user) and not await _can_view_sale(sale, current_user):
         raise HTTPException(status_code=403, detail="You can only view sales you are allowed to see")
     return Sale(**sale)
 
@@ -1932,11 +1672,11 @@ async def update_sale(
                 status_code=status.HTTP_501_NOT_IMPLEMENTED,
                 detail="Sale update is not supported for this database backend",
             )
-        existing_sale = db.get_sale(sale_id)
+        existing_sale = await adb.get_sale(sale_id)
         if not existing_sale:
             raise HTTPException(status_code=404, detail="Sale not found")
         if _is_dsr(current_user) and not _is_admin(current_user):
-            if not _sale_visible_to_user(existing_sale, current_user):
+            if not await _can_view_sale(existing_sale, current_user):
                 raise HTTPException(status_code=403, detail="You can only update sales you are allowed to see")
             full = sale_update.model_dump(exclude_unset=True, exclude_none=True)
             forbidden = {"paid_amount", "due_amount", "payment_status", "assigned_to"}
@@ -1954,12 +1694,12 @@ async def update_sale(
             update_data["delivered_at"] = update_data["delivered_at"].isoformat()
 
         if not update_data:
-            complete_sale = db.get_sale(sale_id)
+            complete_sale = await adb.get_sale(sale_id)
             if not complete_sale:
                 raise HTTPException(status_code=404, detail="Sale not found")
             return Sale(**complete_sale)
 
-        updated_sale = db.update_sale(sale_id, update_data)
+        updated_sale = await adb.update_sale(sale_id, update_data)
         if not updated_sale:
             raise HTTPException(status_code=404, detail="Sale not found after update")
 
@@ -1968,13 +1708,14 @@ async def update_sale(
             nd = ds_new.lower()
             od = str((existing_sale.get("delivery_status") or "")).lower()
             if nd in ("cancelled", "canceled") and od not in ("cancelled", "canceled"):
-                _restore_inventory_from_sale_before_delete(
+                await adb.run_sync(
+                    _restore_inventory_from_sale_before_delete,
                     existing_sale,
                     current_user.get("id"),
                     remark_prefix="sale_cancel_restore",
                 )
 
-        complete_sale = db.get_sale(sale_id)
+        complete_sale = await adb.get_sale(sale_id)
         if not complete_sale:
             raise HTTPException(status_code=404, detail="Sale not found")
 
@@ -2018,20 +1759,28 @@ async def create_sale(sale_data: SaleCreate, request: Request, current_user: dic
         print(f"[API] User: {current_user.get('email', 'unknown')}")
         
         items = [item.model_dump() for item in sale_data.items]
+        if hasattr(db, "resolve_prices"):
+            resolved_prices = await adb.resolve_prices(sale_data.retailer_id, [
+                {
+                    "product_id": item["product_id"],
+                    "variant_id": item.get("variant_id"),
+                    "quantity": float(item.get("quantity", 0) or 0),
+                    "uom": item.get("uom"),
+                }
+                for item in items
+            ])
+        else:
+            resolved_prices = [
+                {
+                    "price_list_id": item.get("price_list_id"),
+                    "price_source": "manual",
+                    "base_price": item.get("unit_price", 0),
+                    "resolved_price": item.get("unit_price", 0),
+                }
+                for item in items
+            ]
         estimated_total = 0.0
-        for item in items:
-            resolved = db.resolve_price(
-                retailer_id=sale_data.retailer_id,
-                product_id=item["product_id"],
-                variant_id=item.get("variant_id"),
-                quantity=float(item.get("quantity", 0) or 0),
-                uom=item.get("uom"),
-            ) if hasattr(db, "resolve_price") else {
-                "price_list_id": item.get("price_list_id"),
-                "price_source": "manual",
-                "base_price": item.get("unit_price", 0),
-                "resolved_price": item.get("unit_price", 0),
-            }
+        for item, resolved in zip(items, resolved_prices):
             item["price_list_id"] = resolved.get("price_list_id")
             item["price_source"] = resolved.get("price_source")
             item["base_price"] = resolved.get("base_price", item.get("unit_price"))
@@ -2043,7 +1792,7 @@ async def create_sale(sale_data: SaleCreate, request: Request, current_user: dic
             estimated_total += line_gross - line_disc
 
         if hasattr(db, "check_credit_limit"):
-            credit_check = db.check_credit_limit(sale_data.retailer_id, estimated_total)
+            credit_check = await adb.check_credit_limit(sale_data.retailer_id, estimated_total)
             if not credit_check.get("can_submit") and not sale_data.credit_override:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
@@ -2069,7 +1818,7 @@ async def create_sale(sale_data: SaleCreate, request: Request, current_user: dic
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="SR-backed credit risk requires a liable user",
                 )
-            if not db.get_user_by_id(liable):
+            if not await adb.get_user_by_id(liable):
                 raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Liable user not found")
             sr_liable_user_id = liable
 
@@ -2091,14 +1840,14 @@ async def create_sale(sale_data: SaleCreate, request: Request, current_user: dic
             and not sale_data.sr_guarantee_override
             and sr_liable_user_id
         ):
-            lu = db.get_user_by_id(sr_liable_user_id) or {}
+            lu = await adb.get_user_by_id(sr_liable_user_id) or {}
             limit = float(lu.get("sr_guarantee_limit", 0) or 0)
             if limit > 0 and hasattr(db, "get_sr_open_liability"):
                 try:
                     enf = GuaranteeEnforcement(str(lu.get("sr_guarantee_enforcement") or "off").lower())
                 except ValueError:
                     enf = GuaranteeEnforcement.OFF
-                net_before = _net_sr_exposure_for_user(sr_liable_user_id)
+                net_before = await _net_sr_exposure_for_user(sr_liable_user_id)
                 projected = net_before + new_due
                 if projected > limit and enf == GuaranteeEnforcement.BLOCK:
                     raise HTTPException(
@@ -2116,7 +1865,7 @@ async def create_sale(sale_data: SaleCreate, request: Request, current_user: dic
                         limit,
                     )
 
-        sale = db.create_sale(
+        sale = await adb.create_sale(
             {
                 "retailer_id": sale_data.retailer_id,
                 "payment_type": sale_data.payment_type,
@@ -2134,7 +1883,7 @@ async def create_sale(sale_data: SaleCreate, request: Request, current_user: dic
             items
         )
         print(f"[API] Sale created in DB: {sale.get('id', 'no-id')}")
-        _log_audit_event(
+        await _log_audit_event(
             action="sale_created",
             request=request,
             actor_id=current_user.get("id"),
@@ -2142,18 +1891,21 @@ async def create_sale(sale_data: SaleCreate, request: Request, current_user: dic
             entity_id=sale.get("id"),
             metadata={"invoice_number": sale.get("invoice_number")},
         )
-        _record_stock_ledger_entries(
-            voucher_type="sale",
-            voucher_id=sale.get("id"),
-            items=sale.get("items", []),
-            quantity_key="quantity",
-            quantity_multiplier=-1,
-            created_by=current_user.get("id"),
-            remarks=f"Sale {sale.get('invoice_number')}",
-        )
+        # create_sale_atomic already wrote the stock ledger in the same transaction
+        if not sale.pop("stock_ledger_recorded", False):
+            await adb.run_sync(
+                _record_stock_ledger_entries,
+                voucher_type="sale",
+                voucher_id=sale.get("id"),
+                items=sale.get("items", []),
+                quantity_key="quantity",
+                quantity_multiplier=-1,
+                created_by=current_user.get("id"),
+                remarks=f"Sale {sale.get('invoice_number')}",
+            )
         
         # Trigger new order SMS notification
-        retailer = db.get_retailer(sale_data.retailer_id)
+        retailer = await adb.get_retailer(sale_data.retailer_id)
         if retailer:
             asyncio.create_task(trigger_sms_notification(
                 event_type=SmsEventType.NEW_ORDER,
@@ -2223,20 +1975,21 @@ async def create_sale_return(
     try:
         print(f"[API] create_sale_return start: sale_id={sale_id}, items={len(return_data.items)}")
         print(f"[API] User: {current_user.get('email', 'unknown')}")
-        existing_sale = db.get_sale(sale_id)
+        existing_sale = await adb.get_sale(sale_id)
         if not existing_sale:
             raise HTTPException(status_code=404, detail="Sale not found")
-        if not _is_admin(current_user) and not _sale_visible_to_user(existing_sale, current_user):
+        if not _is_admin(current_user) and not await _can_view_sale(existing_sale, current_user):
             raise HTTPException(status_code=403, detail="You can only process returns for sales you are allowed to see")
         
         items = [item.model_dump() for item in return_data.items]
-        return_record = db.create_sale_return(
+        return_record = await adb.create_sale_return(
             sale_id=sale_id,
             data=return_data.model_dump(),
             items=items,
             user_id=current_user.get("id")
         )
-        _record_stock_ledger_entries(
+        await adb.run_sync(
+            _record_stock_ledger_entries,
             voucher_type="sale_return",
             voucher_id=return_record.get("id"),
             items=return_record.get("items", []),
@@ -2297,7 +2050,7 @@ async def delete_sale(sale_id: str, current_user: dict = Depends(get_current_use
     try:
         _require_admin(current_user, detail="Only admin can delete sales")
         # Verify sale exists
-        sale = db.get_sale(sale_id)
+        sale = await adb.get_sale(sale_id)
         if not sale:
             raise HTTPException(status_code=404, detail="Sale not found")
 
@@ -2307,10 +2060,10 @@ async def delete_sale(sale_id: str, current_user: dict = Depends(get_current_use
                 detail="Sale delete is not supported for this database backend",
             )
 
-        _restore_inventory_from_sale_before_delete(sale, current_user.get("id"))
+        await adb.run_sync(_restore_inventory_from_sale_before_delete, sale, current_user.get("id"))
 
         # Delete the sale
-        db.delete_sale(sale_id)
+        await adb.delete_sale(sale_id)
         return {"message": "Sale deleted successfully"}
     except HTTPException:
         raise
@@ -2339,13 +2092,13 @@ async def get_sale_returns(sale_id: str, current_user: dict = Depends(get_curren
     """
     try:
         # Verify sale exists
-        sale = db.get_sale(sale_id)
+        sale = await adb.get_sale(sale_id)
         if not sale:
             raise HTTPException(status_code=404, detail="Sale not found")
-        if not _is_admin(current_user) and not _sale_visible_to_user(sale, current_user):
+        if not _is_admin(current_user) and not await _can_view_sale(sale, current_user):
             raise HTTPException(status_code=403, detail="You can only view returns for sales you are allowed to see")
         
-        returns = db.get_sale_returns(sale_id)
+        returns = await adb.get_sale_returns(sale_id)
         return [SaleReturn(**ret) for ret in returns]
     except HTTPException:
         raise
@@ -2374,7 +2127,7 @@ async def get_payments(
         if user_id and user_id != current_user_id:
             raise HTTPException(status_code=403, detail="You can only view your own collections")
         user_id = current_user_id
-    payments = db.get_payments(
+    payments = await adb.get_payments(
         sale_id=sale_id,
         user_id=user_id,
         route_id=route_id,
@@ -2390,12 +2143,12 @@ async def get_sale_payments(
     current_user: dict = Depends(get_current_user)
 ):
     """Get all payment records for a specific sale"""
-    sale = db.get_sale(sale_id)
+    sale = await adb.get_sale(sale_id)
     if not sale:
         raise HTTPException(status_code=404, detail="Sale not found")
-    if not _is_admin(current_user) and not _sale_visible_to_user(sale, current_user):
+    if not _is_admin(current_user) and not await _can_view_sale(sale, current_user):
         raise HTTPException(status_code=403, detail="You can only view payments for sales you are allowed to see")
-    payments = db.get_payments(sale_id=sale_id)
+    payments = await adb.get_payments(sale_id=sale_id)
     return [Payment(**p) for p in payments]
 
 @app.get("/api/users/{user_id}/payments", response_model=List[Payment])
@@ -2408,18 +2161,18 @@ async def get_user_payments(
     """Get all payments collected by a specific SR/user"""
     if not _is_admin(current_user) and user_id != current_user.get("id"):
         raise HTTPException(status_code=403, detail="You can only view your own payments")
-    payments = db.get_payments(user_id=user_id, from_date=from_date, to_date=to_date)
+    payments = await adb.get_payments(user_id=user_id, from_date=from_date, to_date=to_date)
     return [Payment(**p) for p in payments]
 
 @app.post("/api/payments", response_model=Payment)
 async def create_payment(payment_data: PaymentCreate, current_user: dict = Depends(get_current_user)):
     try:
-        sale = db.get_sale(payment_data.sale_id)
+        sale = await adb.get_sale(payment_data.sale_id)
         if not sale:
             raise HTTPException(status_code=404, detail="Sale not found")
         if sale.get("retailer_id") != payment_data.retailer_id:
             raise HTTPException(status_code=400, detail="sale_id does not match retailer_id")
-        if not _is_admin(current_user) and not _sale_visible_to_user(sale, current_user):
+        if not _is_admin(current_user) and not await _can_view_sale(sale, current_user):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="You can only record payments for sales you are allowed to see",
@@ -2441,7 +2194,7 @@ async def create_payment(payment_data: PaymentCreate, current_user: dict = Depen
                         status_code=status.HTTP_403_FORBIDDEN,
                         detail="DSR can only record payments collected by self",
                     )
-                if not _sale_belongs_to_dsr(sale, current_user):
+                if not _sale_belongs_to_dsr(sale, current_user, await _route_assignees([sale], current_user)):
                     raise HTTPException(
                         status_code=status.HTTP_403_FORBIDDEN,
                         detail="You can only collect for your assigned sales",
@@ -2449,7 +2202,7 @@ async def create_payment(payment_data: PaymentCreate, current_user: dict = Depen
             if payload.get("approval_status") in (None, ""):
                 payload["approval_status"] = PaymentApprovalStatus.APPROVED.value
 
-        payment = db.create_payment(payload)
+        payment = await adb.create_payment(payload)
         return Payment(**payment)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -2476,7 +2229,7 @@ async def get_pending_approval_payments(
         )
     if not hasattr(db, "get_payments"):
         return []
-    rows = db.get_payments(approval_status=PaymentApprovalStatus.PENDING.value)
+    rows = await adb.get_payments(approval_status=PaymentApprovalStatus.PENDING.value)
     return [Payment(**p) for p in rows]
 
 
@@ -2492,9 +2245,9 @@ async def approve_pending_payment(
         )
     p = None
     if hasattr(db, "approve_pending_payment"):
-        p = db.approve_pending_payment(payment_id, str(current_user.get("id") or ""))
+        p = await adb.approve_pending_payment(payment_id, str(current_user.get("id") or ""))
     elif hasattr(db, "approve_or_reject_payment"):
-        p = db.approve_or_reject_payment(payment_id, "approve", str(current_user.get("id") or ""))
+        p = await adb.approve_or_reject_payment(payment_id, "approve", str(current_user.get("id") or ""))
     if not p:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -2517,11 +2270,11 @@ async def reject_pending_payment(
     p = None
     reason = ((body.reason if body else None) or "").strip() or None
     if hasattr(db, "reject_pending_payment"):
-        p = db.reject_pending_payment(
+        p = await adb.reject_pending_payment(
             payment_id, str(current_user.get("id") or ""), reason=reason
         )
     elif hasattr(db, "approve_or_reject_payment"):
-        p = db.approve_or_reject_payment(
+        p = await adb.approve_or_reject_payment(
             payment_id, "reject", str(current_user.get("id") or ""), reason
         )
     if not p:
@@ -2555,11 +2308,11 @@ async def get_sr_liability_report(
 
     if not target_id or not hasattr(db, "get_sr_open_liability"):
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Liability not available")
-    u = db.get_user_by_id(target_id)
+    u = await adb.get_user_by_id(target_id)
     if not u:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    open_d = float(db.get_sr_open_liability(target_id) or 0)
-    adj = float(db.get_sr_adjustments_total(target_id) or 0) if hasattr(db, "get_sr_adjustments_total") else 0.0
+    open_d = float(await adb.get_sr_open_liability(target_id) or 0)
+    adj = float(await adb.get_sr_adjustments_total(target_id) or 0) if hasattr(db, "get_sr_adjustments_total") else 0.0
     limit = float(u.get("sr_guarantee_limit", 0) or 0)
     enf = str(u.get("sr_guarantee_enforcement") or "off")
     return SrLiabilitySummary(
@@ -2587,11 +2340,11 @@ async def create_sr_risk_adjustment(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Only admin can post SR risk adjustments",
         )
-    if not db.get_user_by_id(data.sr_user_id):
+    if not await adb.get_user_by_id(data.sr_user_id):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="SR user not found")
     if not hasattr(db, "add_sr_risk_adjustment"):
         raise HTTPException(status_code=500, detail="Adjustments not supported by database layer")
-    row = db.add_sr_risk_adjustment(
+    row = await adb.add_sr_risk_adjustment(
         sr_user_id=data.sr_user_id,
         amount=data.amount,
         adjustment_type=data.adjustment_type,
@@ -2625,36 +2378,103 @@ async def list_sr_risk_adjustments(
         raise HTTPException(status_code=403, detail="Not allowed to view risk adjustments")
     if not hasattr(db, "list_sr_risk_adjustments"):
         return []
-    rows = db.list_sr_risk_adjustments(target)
+    rows = await adb.list_sr_risk_adjustments(target)
     return [SrRiskAdjustment(**r) for r in rows]
 
 
 @app.get("/api/inventory", response_model=List[InventoryItem])
 async def get_inventory(current_user: dict = Depends(get_current_user)):
-    return db.get_inventory()
+    return await adb.get_inventory()
 
 @app.get("/api/stock-ledger", response_model=List[StockLedgerEntry])
 async def get_stock_ledger(
     product_id: Optional[str] = None,
+    warehouse_id: Optional[str] = None,
+    batch_id: Optional[str] = None,
+    voucher_type: Optional[StockVoucherType] = None,
+    voucher_id: Optional[str] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    cursor: Optional[str] = None,
     limit: int = 200,
     current_user: dict = Depends(get_current_user),
 ):
+    """Newest ledger entries first; same filters and cursor as /api/stock-ledger/page."""
+    page = await get_stock_ledger_page(
+        product_id=product_id,
+        warehouse_id=warehouse_id,
+        batch_id=batch_id,
+        voucher_type=voucher_type,
+        voucher_id=voucher_id,
+        from_date=from_date,
+        to_date=to_date,
+        cursor=cursor,
+        limit=limit,
+        opening_balance=False,
+        current_user=current_user,
+    )
+    return page.entries
+
+
+@app.get("/api/stock-ledger/page", response_model=StockLedgerPage)
+async def get_stock_ledger_page(
+    product_id: Optional[str] = None,
+    warehouse_id: Optional[str] = None,
+    batch_id: Optional[str] = None,
+    voucher_type: Optional[StockVoucherType] = None,
+    voucher_id: Optional[str] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 200,
+    opening_balance: bool = True,
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    Stock ledger history, one keyset page at a time (stock cards, batch traceability).
+
+    Query params:
+    - product_id / warehouse_id / batch_id / voucher_type / voucher_id: filters (optional)
+    - from_date / to_date: created_at range, YYYY-MM-DD, to_date inclusive (optional)
+    - limit / cursor: Page size (max 500) and the next_cursor of the previous page
+    - opening_balance: on the first page, the net quantity of matching entries
+      before from_date (0 without from_date); null on later pages
+    """
     safe_limit = max(1, min(limit, 500))
-    if not hasattr(db, "get_stock_ledger"):
-        return []
-    rows = db.get_stock_ledger(product_id=product_id, limit=safe_limit)
-    return [StockLedgerEntry(**row) for row in rows]
+    if not hasattr(db, "get_stock_ledger_page"):
+        return StockLedgerPage(entries=[])
+    try:
+        result = await adb.get_stock_ledger_page(
+            product_id=product_id,
+            warehouse_id=warehouse_id,
+            batch_id=batch_id,
+            voucher_type=voucher_type.value if voucher_type else None,
+            voucher_id=voucher_id,
+            from_date=from_date,
+            to_date=to_date,
+            cursor=cursor,
+            limit=safe_limit,
+            opening_balance=opening_balance,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return StockLedgerPage(
+        entries=[StockLedgerEntry(**row) for row in result["entries"]],
+        next_cursor=result["next_cursor"],
+        opening_balance=result["opening_balance"],
+    )
 
 @app.get("/api/reports/stock-reconciliation")
 async def get_stock_reconciliation_report(
     include_only_mismatch: bool = True,
-    ledger_limit: int = 5000,
+    by_warehouse: bool = False,
     current_user: dict = Depends(get_current_user),
 ):
     try:
-        return _build_stock_reconciliation_report(
+        return await adb.run_sync(
+            _build_stock_reconciliation_report,
             include_only_mismatch=include_only_mismatch,
-            ledger_limit=ledger_limit,
+            by_warehouse=by_warehouse,
         )
     except Exception as e:
         error_msg = str(e)
@@ -2681,7 +2501,7 @@ async def fix_stock_reconciliation(
     if source_key not in {"batch", "ledger"}:
         raise HTTPException(status_code=400, detail="source must be either 'batch' or 'ledger'")
 
-    report = _build_stock_reconciliation_report(include_only_mismatch=False, ledger_limit=10000)
+    report = await adb.run_sync(_build_stock_reconciliation_report, include_only_mismatch=False)
 
     updated_count = 0
     skipped_count = 0
@@ -2707,12 +2527,21 @@ async def fix_stock_reconciliation(
                 "sku": row.get("sku"),
                 "from_stock_quantity": current_stock,
                 "to_stock_quantity": target_stock,
+                "quantity_change": target_stock - current_stock,
             }
         )
 
-        if not dry_run:
-            updated = db.update_product(product_id, {"stock_quantity": target_stock})
-            if updated:
+    if not dry_run and updates:
+        # Corrections are applied as relative deltas in one atomic call so a sale
+        # landing between the report and the fix is not overwritten.
+        applied = await adb.apply_stock_movements([
+            {"product_id": u["product_id"], "delta": u["quantity_change"]}
+            for u in updates
+        ])
+        new_quantities = applied.get("products") or {}
+        for u in updates:
+            if str(u["product_id"]) in new_quantities:
+                u["applied_stock_quantity"] = new_quantities[str(u["product_id"])]
                 updated_count += 1
             else:
                 skipped_count += 1
@@ -2732,7 +2561,32 @@ async def fix_stock_reconciliation(
     }
 
 
-@app.post("/api/admin/stock-ledger/backfill")
+@app.get("/api/admin/cache/stats")
+async def get_reference_cache_stats(current_user: dict = Depends(get_current_user)):
+    """Hit/miss/invalidation counters of the process-wide reference-data cache and compiled price index."""
+    if not _is_admin(current_user):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return {**reference_cache.stats(), "price_index": price_indexes.stats()}
+
+
+@app.post("/api/admin/cache/clear")
+async def clear_reference_cache(current_user: dict = Depends(get_current_user)):
+    """Drop every cached reference table in this process (e.g. after a manual SQL fix)."""
+    if not _is_admin(current_user):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    reference_cache.clear()
+    return reference_cache.stats()
+
+
+@app.get("/api/admin/password-pool/stats")
+async def get_password_pool_stats(current_user: dict = Depends(get_current_user)):
+    """Queue depth, latency and legacy-rehash counters of the password hashing pool."""
+    if not _is_admin(current_user):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return password_pool.stats()
+
+
+@app.post("/api/admin/stock-ledger/backfill", status_code=status.HTTP_202_ACCEPTED)
 async def admin_stock_ledger_backfill(
     request: Request,
     dry_run: bool = True,
@@ -2740,71 +2594,135 @@ async def admin_stock_ledger_backfill(
     include_sales: bool = True,
     include_returns: bool = True,
     skip_voucher_if_ledger_exists: bool = True,
+    resume: bool = False,
     current_user: dict = Depends(get_current_user),
 ):
     """
     One-time / rare: rebuild stock_ledger rows from historical purchases, sales,
     and sales return line items. Idempotent via remarks keys like backfill:*.
 
+    Runs as a background job (app.ledger_backfill) that streams vouchers page by
+    page and checkpoints after each page; returns the job immediately. Poll
+    GET /api/admin/stock-ledger/backfill/status for progress.
+
     Query params:
-    - dry_run: preview only (default True)
+    - dry_run: preview only (default True); the job's sample holds planned rows
     - skip_voucher_if_ledger_exists: if any ledger row already exists for the
       same (voucher_type, voucher_id), skip that whole voucher (avoids doubling
       when live hooks already wrote rows for newer data).
+    - resume: continue the latest unfinished job from its checkpoint instead of
+      starting a new one (the other options are taken from that job).
     """
     if current_user.get("role") != "admin":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Admin access required",
         )
-    if not hasattr(db, "add_stock_ledger_entry"):
+    if not hasattr(db, "add_stock_ledger_entry") or not hasattr(db, "iter_stock_ledger_backfill_vouchers"):
         raise HTTPException(
             status_code=status.HTTP_501_NOT_IMPLEMENTED,
             detail="Stock ledger is not available for this database backend",
         )
 
-    rows, stats = _plan_stock_ledger_backfill(
-        include_purchases=include_purchases,
-        include_sales=include_sales,
-        include_returns=include_returns,
-        skip_voucher_if_ledger_exists=skip_voucher_if_ledger_exists,
-    )
-    inserted = _apply_stock_ledger_backfill(rows, dry_run=dry_run)
+    latest = await adb.get_stock_ledger_backfill_job()
+    if latest and latest.get("status") in ACTIVE_STATUSES and not is_stale(latest):
+        raise HTTPException(status_code=409, detail=f"Stock ledger backfill job {latest['id']} is already running")
 
-    if not dry_run and inserted > 0:
-        _log_audit_event(
-            action="stock_ledger_backfill_applied",
-            request=request,
-            actor_id=current_user.get("id"),
-            entity_type="stock_ledger",
-            entity_id=None,
-            metadata={
-                "inserted_rows": inserted,
-                "stats": stats,
+    if resume:
+        if not latest or latest.get("status") == "completed":
+            raise HTTPException(status_code=404, detail="No unfinished stock ledger backfill job to resume")
+        if not await adb.claim_stock_ledger_backfill_job(latest["id"], latest.get("heartbeat_at")):
+            raise HTTPException(status_code=409, detail=f"Stock ledger backfill job {latest['id']} was resumed elsewhere")
+        job = latest
+    else:
+        job = ledger_backfill.new_job(
+            {
+                "include_purchases": include_purchases,
+                "include_sales": include_sales,
+                "include_returns": include_returns,
+                "skip_voucher_if_ledger_exists": skip_voucher_if_ledger_exists,
             },
+            dry_run=dry_run,
+            created_by=current_user.get("id"),
         )
+        await adb.save_stock_ledger_backfill_job(job)
 
-    sample = rows[:25]
-    return {
-        "dry_run": dry_run,
-        "inserted_rows": inserted if not dry_run else 0,
-        "would_insert_rows": len(rows) if dry_run else 0,
-        "stats": stats,
-        "sample": sample,
-    }
+    _spawn_background_task(_run_stock_ledger_backfill(job, request, current_user.get("id")), "stock-ledger-backfill")
+    return job_progress(job)
+
+
+@app.get("/api/admin/stock-ledger/backfill/status")
+async def admin_stock_ledger_backfill_status(
+    job_id: Optional[str] = None,
+    current_user: dict = Depends(get_current_user),
+):
+    """Progress of a backfill job (latest when job_id is omitted): status, checkpoint, counters and throughput."""
+    if current_user.get("role") != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required",
+        )
+    if not hasattr(db, "get_stock_ledger_backfill_job"):
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Stock ledger is not available for this database backend",
+        )
+    job = await adb.get_stock_ledger_backfill_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Stock ledger backfill job not found")
+    return job_progress(job)
+
+
+@app.post("/api/admin/stock-ledger/balances/rebuild")
+async def admin_rebuild_stock_ledger_balances(current_user: dict = Depends(get_current_user)):
+    """
+    Recompute stock_ledger_balances (the per product / warehouse / batch ledger
+    totals kept by the stock_ledger trigger) from the full ledger. Run after
+    bulk ledger fixes; returns the balance and ledger row counts.
+    """
+    if current_user.get("role") != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required",
+        )
+    if not hasattr(db, "rebuild_stock_ledger_balances"):
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Stock ledger is not available for this database backend",
+        )
+    try:
+        return await adb.rebuild_stock_ledger_balances()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.get("/api/expiry-alerts", response_model=List[ExpiryAlert])
 async def get_expiry_alerts(current_user: dict = Depends(get_current_user)):
-    return db.get_expiry_alerts()
+    return await adb.get_expiry_alerts()
 
 @app.get("/api/dashboard/stats", response_model=DashboardStats)
 async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
-    return db.get_dashboard_stats()
+    return await adb.get_dashboard_stats()
+
+
+@app.post("/api/admin/dashboard/rollups/refresh", response_model=DashboardStats)
+async def admin_refresh_dashboard_rollups(current_user: dict = Depends(get_current_user)):
+    """Recompute the dashboard rollups now instead of waiting for the periodic repair job."""
+    if current_user.get("role") != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required",
+        )
+    if hasattr(db, "refresh_dashboard_rollups"):
+        try:
+            await adb.refresh_dashboard_rollups()
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return await adb.get_dashboard_stats()
 
 @app.get("/api/receivables")
 async def get_receivables(current_user: dict = Depends(get_current_user)):
-    return db.get_receivables()
+    return await adb.get_receivables()
 
 @app.get("/api/reports/sales")
 async def get_sales_report(
@@ -2824,13 +2742,14 @@ async def get_sales_report(
     - summary: Aggregate totals (total_gross, total_returns, total_net, return_rate)
     """
     try:
-        sales_report, summary = db.get_sales_report(from_date, to_date)
+        sales_report, summary = await adb.get_sales_report(from_date, to_date)
         if not _is_admin(current_user):
             uid = current_user.get("id")
             if _is_sr(current_user):
                 sales_report = [s for s in sales_report if s.get("created_by") == uid]
             elif _is_dsr(current_user):
-                sales_report = [s for s in sales_report if _sale_belongs_to_dsr(s, current_user)]
+                route_assignees = await _route_assignees(sales_report, current_user)
+                sales_report = [s for s in sales_report if _sale_belongs_to_dsr(s, current_user, route_assignees)]
             else:
                 sales_report = []
             summary = _recompute_sales_report_summary(sales_report)
@@ -2864,18 +2783,17 @@ async def get_sales_returns_report(
     - List of return records with retailer, reason, refund_type, total_return_amount
     """
     try:
-        returns_report = db.get_sales_returns_report(from_date, to_date)
+        returns_report = await adb.get_sales_returns_report(from_date, to_date)
         if not _is_admin(current_user):
             uid = current_user.get("id")
-            filtered: List[dict] = []
-            for ret in returns_report:
-                sid = ret.get("sale_id")
-                if not sid:
-                    continue
-                sale = db.get_sale(str(sid))
-                if sale and _sale_visible_to_user(sale, current_user):
-                    filtered.append(ret)
-            returns_report = filtered
+            sale_ids = list(dict.fromkeys(str(ret["sale_id"]) for ret in returns_report if ret.get("sale_id")))
+            await adb.prime("sales", sale_ids)
+            sales = {sid: await adb.get_sale(sid) for sid in sale_ids}
+            route_assignees = await _route_assignees(list(sales.values()), current_user)
+            returns_report = [
+                ret for ret in returns_report
+                if ret.get("sale_id") and _sale_visible_to_user(sales.get(str(ret["sale_id"])), current_user, route_assignees)
+            ]
         return [SaleReturnReport(**ret) for ret in returns_report]
     except Exception as e:
         error_msg = str(e)
@@ -2886,11 +2804,27 @@ async def get_sales_returns_report(
             detail=f"Failed to get sales returns report: {error_type}: {error_msg}"
         )
 
+def _collection_report_scope(current_user: dict, user_id: Optional[str]) -> Optional[str]:
+    """SRs have no collection report; DSRs only see their own."""
+    if _is_sr(current_user):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Collection report is not available for SR",
+        )
+    if not _is_admin(current_user):
+        current_user_id = current_user.get("id")
+        if user_id and user_id != current_user_id:
+            raise HTTPException(status_code=403, detail="You can only view your own collection report")
+        return current_user_id
+    return user_id
+
 @app.get("/api/reports/collections")
 async def get_collection_report(
     from_date: Optional[str] = None,
     to_date: Optional[str] = None,
     user_id: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -2900,9 +2834,12 @@ async def get_collection_report(
     - from_date: Start date (YYYY-MM-DD)
     - to_date: End date (YYYY-MM-DD)
     - user_id: Filter by SR/delivery man (optional)
+    - limit / cursor: Page size and the next_cursor of the previous page (optional;
+      without limit every payment is returned)
     
     Returns:
     - List of payment records with sale invoice, retailer, route, collected_by details
+    - summary totals over every matching payment (not just the page)
     
     Filtering Logic:
     - If user_id is provided, includes payments where:
@@ -2910,94 +2847,35 @@ async def get_collection_report(
       2. payment's sale.assigned_to = user_id, OR
       3. payment's route.assigned_to = user_id
     - This ensures payments are shown even if collected_by is NULL
+    - Only approved payments are included
     """
     try:
-        if _is_sr(current_user):
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Collection report is not available for SR",
-            )
-        if not _is_admin(current_user):
-            current_user_id = current_user.get("id")
-            if user_id and user_id != current_user_id:
-                raise HTTPException(status_code=403, detail="You can only view your own collection report")
-            user_id = current_user_id
-        # Get all payments (without user_id filter first, we'll filter manually)
-        all_payments = db.get_payments(from_date=from_date, to_date=to_date)
-        
-        # Enrich payments with sale and route information, and apply SR filter
-        enriched_payments = []
-        for payment in all_payments:
-            if (payment.get("approval_status") or "approved") != "approved":
-                continue
-            enriched = payment.copy()
-            sale = None
-            route = None
-
-            # Get sale information
-            if payment.get("sale_id"):
-                sale = db.get_sale(payment["sale_id"])
-                if sale:
-                    enriched["invoice_number"] = sale.get("invoice_number")
-                    enriched["retailer_name"] = sale.get("retailer_name") or payment.get("retailer_name")
-            
-            # Get route information
-            if payment.get("route_id"):
-                route = db.get_route(payment["route_id"])
-                if route:
-                    enriched["route_number"] = route.get("route_number")
-            
-            # Apply SR filter with fallback logic
-            if user_id:
-                # Check if payment matches SR filter:
-                # 1. Direct match: payments.collected_by = user_id
-                # 2. Sale match: sale.assigned_to = user_id
-                # 3. Route match: route.assigned_to = user_id
-                payment_matches = False
-                
-                if payment.get("collected_by") == user_id:
-                    payment_matches = True
-                elif sale and sale.get("assigned_to") == user_id:
-                    payment_matches = True
-                elif route and route.get("assigned_to") == user_id:
-                    payment_matches = True
-                
-                if not payment_matches:
-                    continue  # Skip this payment
-            
-            # Enrich collected_by_name with fallback logic
-            if not enriched.get("collected_by_name"):
-                # Priority: collected_by > route.assigned_to > sale.assigned_to
-                collector_id = payment.get("collected_by")
-                if not collector_id and route:
-                    collector_id = route.get("assigned_to")
-                if not collector_id and sale:
-                    collector_id = sale.get("assigned_to")
-                
-                if collector_id:
-                    collector_user = db.get_user_by_id(collector_id)
-                    if collector_user:
-                        enriched["collected_by_name"] = collector_user.get("name")
-                        # Also set collected_by if it was NULL (for consistency)
-                        if not payment.get("collected_by"):
-                            enriched["collected_by"] = collector_id
-            
-            enriched_payments.append(enriched)
-        
-        # Calculate summary
-        total_amount = sum(float(p.get("amount", 0)) for p in enriched_payments)
-        total_count = len(enriched_payments)
-        
+        user_id = _collection_report_scope(current_user, user_id)
+        if limit is not None:
+            limit = max(1, min(limit, 1000))
+        result = await adb.get_collection_payments(
+            user_id=user_id,
+            from_date=from_date,
+            to_date=to_date,
+            approval_status="approved",
+            cursor=cursor,
+            limit=limit,
+        )
         return {
-            "payments": enriched_payments,
+            "payments": result["payments"],
+            "next_cursor": result["next_cursor"],
             "summary": {
-                "total_payments": total_count,
-                "total_amount": total_amount,
+                "total_payments": result["total_payments"],
+                "total_amount": result["total_amount"],
                 "from_date": from_date,
                 "to_date": to_date,
                 "user_id": user_id
             }
         }
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
         error_msg = str(e)
         error_type = type(e).__name__
@@ -3009,6 +2887,52 @@ async def get_collection_report(
             detail=f"Failed to get collection report: {error_type}: {error_msg}"
         )
 
+@app.get("/api/reports/collections/by-sr")
+async def get_collection_report_by_sr(
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    user_id: Optional[str] = None,
+    history_limit: int = 0,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Per-SR collection totals (orders, sales, returns, collected, pending).
+
+    payment_history carries at most history_limit newest payments per SR
+    (default none); page the rest from /api/reports/collections/by-sr/{user_id}/payments.
+    """
+    user_id = _collection_report_scope(current_user, user_id)
+    history_limit = max(0, min(history_limit, 500))
+    if not hasattr(adb, "get_collection_report"):
+        return {"total_srs": 0, "total_pending": 0.0, "reports": []}
+    reports = await adb.get_collection_report(
+        user_id=user_id, from_date=from_date, to_date=to_date, payment_history_limit=history_limit
+    )
+    return {
+        "total_srs": len(reports),
+        "total_pending": sum(r["current_pending_amount"] for r in reports),
+        "reports": reports,
+    }
+
+@app.get("/api/reports/collections/by-sr/{user_id}/payments")
+async def get_collection_report_payments(
+    user_id: str,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    limit: int = 50,
+    offset: int = 0,
+    current_user: dict = Depends(get_current_user)
+):
+    """One page of an SR's payment history for the collection report."""
+    user_id = _collection_report_scope(current_user, user_id)
+    limit, offset = max(1, min(limit, 500)), max(0, offset)
+    if not hasattr(adb, "get_collector_payments"):
+        return {"payments": [], "limit": limit, "offset": offset}
+    payments = await adb.get_collector_payments(
+        user_id, from_date=from_date, to_date=to_date, limit=limit, offset=offset
+    )
+    return {"payments": payments, "limit": limit, "offset": offset}
+
 @app.post("/api/products/import")
 async def import_products(products: List[ProductCreate], current_user: dict = Depends(get_current_user)):
     imported = []
@@ -3018,19 +2942,19 @@ async def import_products(products: List[ProductCreate], current_user: dict = De
         expiry_date = data.pop("expiry_date", None)
         if batch_number and not expiry_date:
             raise HTTPException(status_code=400, detail="Expiry date is required when batch number is provided")
-        product = db.create_product(data)
+        product = await adb.create_product(data)
         if expiry_date:
             if not batch_number:
                 batch_number = _generate_batch_number()
-            db.create_batch({
+            await adb.create_batch({
                 "product_id": product["id"],
                 "batch_number": batch_number,
                 "expiry_date": expiry_date,
                 "quantity": max(0, int(data.get("stock_quantity", 0))),
                 "purchase_price": data.get("purchase_price", 0),
             })
-        product = _attach_latest_batch(product)
-        _record_opening_stock_ledger_for_product(product, current_user.get("id"))
+        product = await _attach_latest_batch(product)
+        await adb.run_sync(_record_opening_stock_ledger_for_product, product, current_user.get("id"))
         imported.append(Product(**product))
     return {"imported": len(imported), "products": imported}
 
@@ -3039,7 +2963,7 @@ async def import_products(products: List[ProductCreate], current_user: dict = De
 async def get_categories(current_user: dict = Depends(get_current_user)):
     try:
         print(f"[DEBUG] Getting categories, database type: {type(db).__name__}")
-        categories = db.get_categories()
+        categories = await adb.get_categories()
         print(f"[DEBUG] Retrieved {len(categories)} categories")
         return [Category(**c) for c in categories]
     except Exception as e:
@@ -3055,7 +2979,7 @@ async def get_categories(current_user: dict = Depends(get_current_user)):
 
 @app.get("/api/categories/{category_id}", response_model=Category)
 async def get_category(category_id: str, current_user: dict = Depends(get_current_user)):
-    category = db.get_category(category_id)
+    category = await adb.get_category(category_id)
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
     return Category(**category)
@@ -3167,14 +3091,14 @@ async def create_category(category_data: CategoryCreate, current_user: dict = De
 
 @app.put("/api/categories/{category_id}", response_model=Category)
 async def update_category(category_id: str, category_data: CategoryCreate, current_user: dict = Depends(get_current_user)):
-    category = db.update_category(category_id, category_data.model_dump())
+    category = await adb.update_category(category_id, category_data.model_dump())
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
     return Category(**category)
 
 @app.delete("/api/categories/{category_id}")
 async def delete_category(category_id: str, current_user: dict = Depends(get_current_user)):
-    if not db.delete_category(category_id):
+    if not await adb.delete_category(category_id):
         raise HTTPException(status_code=404, detail="Category not found")
     return {"message": "Category deleted"}
 
@@ -3182,7 +3106,7 @@ async def delete_category(category_id: str, current_user: dict = Depends(get_cur
 @app.get("/api/suppliers", response_model=List[Supplier])
 async def get_suppliers(current_user: dict = Depends(get_current_user)):
     print(f"[API] get_suppliers: User: {current_user.get('email', 'unknown')}")
-    suppliers = db.get_suppliers()
+    suppliers = await adb.get_suppliers()
     print(f"[API] get_suppliers: Retrieved {len(suppliers)} suppliers")
     if suppliers:
         print(f"[API] get_suppliers: First supplier: id={suppliers[0].get('id', 'no-id')}, name={suppliers[0].get('name', 'no-name')}")
@@ -3190,7 +3114,7 @@ async def get_suppliers(current_user: dict = Depends(get_current_user)):
 
 @app.get("/api/suppliers/{supplier_id}", response_model=Supplier)
 async def get_supplier(supplier_id: str, current_user: dict = Depends(get_current_user)):
-    supplier = db.get_supplier(supplier_id)
+    supplier = await adb.get_supplier(supplier_id)
     if not supplier:
         raise HTTPException(status_code=404, detail="Supplier not found")
     return Supplier(**supplier)
@@ -3213,7 +3137,7 @@ async def create_supplier(supplier_data: SupplierCreate, current_user: dict = De
         print(f"[API] create_supplier: User: {current_user.get('email', 'unknown')}")
         print(f"[API] create_supplier: Payload: {supplier_data.model_dump()}")
         
-        supplier = db.create_supplier(supplier_data.model_dump())
+        supplier = await adb.create_supplier(supplier_data.model_dump())
         print(f"[API] create_supplier: Supplier created in DB: id={supplier.get('id', 'no-id')}, name={supplier.get('name', 'no-name')}")
         
         # Validate the response matches Supplier model
@@ -3249,59 +3173,59 @@ async def create_supplier(supplier_data: SupplierCreate, current_user: dict = De
 
 @app.put("/api/suppliers/{supplier_id}", response_model=Supplier)
 async def update_supplier(supplier_id: str, supplier_data: SupplierCreate, current_user: dict = Depends(get_current_user)):
-    supplier = db.update_supplier(supplier_id, supplier_data.model_dump())
+    supplier = await adb.update_supplier(supplier_id, supplier_data.model_dump())
     if not supplier:
         raise HTTPException(status_code=404, detail="Supplier not found")
     return Supplier(**supplier)
 
 @app.delete("/api/suppliers/{supplier_id}")
 async def delete_supplier(supplier_id: str, current_user: dict = Depends(get_current_user)):
-    if not db.delete_supplier(supplier_id):
+    if not await adb.delete_supplier(supplier_id):
         raise HTTPException(status_code=404, detail="Supplier not found")
     return {"message": "Supplier deleted"}
 
 # Unit endpoints
 @app.get("/api/units", response_model=List[Unit])
 async def get_units(current_user: dict = Depends(get_current_user)):
-    units = db.get_units()
+    units = await adb.get_units()
     return [Unit(**u) for u in units]
 
 @app.get("/api/units/{unit_id}", response_model=Unit)
 async def get_unit(unit_id: str, current_user: dict = Depends(get_current_user)):
-    unit = db.get_unit(unit_id)
+    unit = await adb.get_unit(unit_id)
     if not unit:
         raise HTTPException(status_code=404, detail="Unit not found")
     return Unit(**unit)
 
 @app.post("/api/units", response_model=Unit)
 async def create_unit(unit_data: UnitCreate, current_user: dict = Depends(get_current_user)):
-    unit = db.create_unit(unit_data.model_dump())
+    unit = await adb.create_unit(unit_data.model_dump())
     return Unit(**unit)
 
 @app.put("/api/units/{unit_id}", response_model=Unit)
 async def update_unit(unit_id: str, unit_data: UnitCreate, current_user: dict = Depends(get_current_user)):
-    unit = db.update_unit(unit_id, unit_data.model_dump())
+    unit = await adb.update_unit(unit_id, unit_data.model_dump())
     if not unit:
         raise HTTPException(status_code=404, detail="Unit not found")
     return Unit(**unit)
 
 @app.delete("/api/units/{unit_id}")
 async def delete_unit(unit_id: str, current_user: dict = Depends(get_current_user)):
-    if not db.delete_unit(unit_id):
+    if not await adb.delete_unit(unit_id):
         raise HTTPException(status_code=404, detail="Unit not found")
     return {"message": "Unit deleted"}
 
 # ERP upgrade endpoints: variants + UOM
 @app.get("/api/product-templates", response_model=List[ProductTemplate])
 async def get_product_templates(current_user: dict = Depends(get_current_user)):
-    templates = db.get_product_templates() if hasattr(db, "get_product_templates") else []
+    templates = await adb.get_product_templates() if hasattr(db, "get_product_templates") else []
     return [ProductTemplate(**t) for t in templates]
 
 @app.post("/api/product-templates", response_model=ProductTemplate)
 async def create_product_template(template_data: ProductTemplateCreate, current_user: dict = Depends(get_current_user)):
     if not hasattr(db, "create_product_template"):
         raise HTTPException(status_code=400, detail="Product template feature not available")
-    template = db.create_product_template(template_data.model_dump())
+    template = await adb.create_product_template(template_data.model_dump())
     return ProductTemplate(**template)
 
 @app.get("/api/product-variants", response_model=List[ProductVariant])
@@ -3310,58 +3234,58 @@ async def get_product_variants(
     product_id: Optional[str] = None,
     current_user: dict = Depends(get_current_user),
 ):
-    variants = db.get_product_variants(template_id=template_id, product_id=product_id) if hasattr(db, "get_product_variants") else []
+    variants = await adb.get_product_variants(template_id=template_id, product_id=product_id) if hasattr(db, "get_product_variants") else []
     return [ProductVariant(**v) for v in variants]
 
 @app.post("/api/product-variants", response_model=ProductVariant)
 async def create_product_variant(variant_data: ProductVariantCreate, current_user: dict = Depends(get_current_user)):
     if not hasattr(db, "create_product_variant"):
         raise HTTPException(status_code=400, detail="Product variant feature not available")
-    variant = db.create_product_variant(variant_data.model_dump())
+    variant = await adb.create_product_variant(variant_data.model_dump())
     return ProductVariant(**variant)
 
 @app.get("/api/uom-conversions", response_model=List[UomConversion])
 async def get_uom_conversions(product_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
-    rows = db.get_uom_conversions(product_id=product_id) if hasattr(db, "get_uom_conversions") else []
+    rows = await adb.get_uom_conversions(product_id=product_id) if hasattr(db, "get_uom_conversions") else []
     return [UomConversion(**row) for row in rows]
 
 @app.post("/api/uom-conversions", response_model=UomConversion)
 async def upsert_uom_conversion(conversion_data: UomConversionCreate, current_user: dict = Depends(get_current_user)):
     if not hasattr(db, "upsert_uom_conversion"):
         raise HTTPException(status_code=400, detail="UOM conversion feature not available")
-    row = db.upsert_uom_conversion(conversion_data.model_dump())
+    row = await adb.upsert_uom_conversion(conversion_data.model_dump())
     return UomConversion(**row)
 
 # ERP upgrade endpoints: price lists
 @app.get("/api/price-lists", response_model=List[PriceList])
 async def get_price_lists(current_user: dict = Depends(get_current_user)):
-    rows = db.get_price_lists() if hasattr(db, "get_price_lists") else []
+    rows = await adb.get_price_lists() if hasattr(db, "get_price_lists") else []
     return [PriceList(**row) for row in rows]
 
 @app.post("/api/price-lists", response_model=PriceList)
 async def create_price_list(price_list_data: PriceListCreate, current_user: dict = Depends(get_current_user)):
     if not hasattr(db, "create_price_list"):
         raise HTTPException(status_code=400, detail="Price list feature not available")
-    row = db.create_price_list(price_list_data.model_dump())
+    row = await adb.create_price_list(price_list_data.model_dump())
     return PriceList(**row)
 
 @app.get("/api/price-list-items", response_model=List[PriceListItem])
 async def get_price_list_items(price_list_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
-    rows = db.get_price_list_items(price_list_id=price_list_id) if hasattr(db, "get_price_list_items") else []
+    rows = await adb.get_price_list_items(price_list_id=price_list_id) if hasattr(db, "get_price_list_items") else []
     return [PriceListItem(**row) for row in rows]
 
 @app.post("/api/price-list-items", response_model=PriceListItem)
 async def upsert_price_list_item(item_data: PriceListItemCreate, current_user: dict = Depends(get_current_user)):
     if not hasattr(db, "upsert_price_list_item"):
         raise HTTPException(status_code=400, detail="Price list item feature not available")
-    row = db.upsert_price_list_item(item_data.model_dump())
+    row = await adb.upsert_price_list_item(item_data.model_dump())
     return PriceListItem(**row)
 
 @app.post("/api/price-lists/assign")
 async def assign_price_list(assignment_data: RetailerPriceListAssignmentCreate, current_user: dict = Depends(get_current_user)):
     if not hasattr(db, "assign_price_list_to_retailer"):
         raise HTTPException(status_code=400, detail="Price list assignment feature not available")
-    assignment = db.assign_price_list_to_retailer(
+    assignment = await adb.assign_price_list_to_retailer(
         assignment_data.retailer_id,
         assignment_data.price_list_id,
     )
@@ -3376,40 +3300,75 @@ async def resolve_price_for_sale(
     uom: Optional[str] = None,
     current_user: dict = Depends(get_current_user),
 ):
-    if not hasattr(db, "resolve_price"):
+    if not hasattr(db, "resolve_prices"):
+        raise HTTPException(status_code=400, detail="Price resolution feature not available")
+    line = {"product_id": product_id, "variant_id": variant_id, "quantity": quantity, "uom": uom}
+    return (await adb.resolve_prices(retailer_id, [line]))[0]
+
+@app.post("/api/price-lists/resolve")
+async def resolve_prices_for_order(
+    request_data: PriceResolveRequest,
+    current_user: dict = Depends(get_current_user),
+):
+    """Resolve prices for every line of an order in one call (same rules as GET /api/price-lists/resolve)"""
+    if not hasattr(db, "resolve_prices"):
         raise HTTPException(status_code=400, detail="Price resolution feature not available")
-    return db.resolve_price(retailer_id, product_id, variant_id, quantity, uom)
+    lines = [line.model_dump() for line in request_data.lines]
+    return {"retailer_id": request_data.retailer_id, "lines": await adb.resolve_prices(request_data.retailer_id, lines)}
 
 # ERP upgrade endpoints: reorder
 @app.get("/api/reorder-policies", response_model=List[ReorderPolicy])
 async def get_reorder_policies(current_user: dict = Depends(get_current_user)):
-    rows = db.get_reorder_policies() if hasattr(db, "get_reorder_policies") else []
+    rows = await adb.get_reorder_policies() if hasattr(db, "get_reorder_policies") else []
     return [ReorderPolicy(**row) for row in rows]
 
 @app.post("/api/reorder-policies", response_model=ReorderPolicy)
 async def upsert_reorder_policy(policy_data: ReorderPolicyCreate, current_user: dict = Depends(get_current_user)):
     if not hasattr(db, "upsert_reorder_policy"):
         raise HTTPException(status_code=400, detail="Reorder policy feature not available")
-    row = db.upsert_reorder_policy(policy_data.model_dump())
+    row = await adb.upsert_reorder_policy(policy_data.model_dump())
     return ReorderPolicy(**row)
 
 @app.post("/api/reorder-suggestions/generate", response_model=List[ReorderSuggestion])
 async def generate_reorder_suggestions(current_user: dict = Depends(get_current_user)):
     if not hasattr(db, "generate_reorder_suggestions"):
         raise HTTPException(status_code=400, detail="Reorder suggestion feature not available")
-    rows = db.generate_reorder_suggestions()
+    rows = await adb.generate_reorder_suggestions()
     return [ReorderSuggestion(**row) for row in rows]
 
 @app.get("/api/reorder-suggestions", response_model=List[ReorderSuggestion])
 async def get_reorder_suggestions(current_user: dict = Depends(get_current_user)):
-    rows = db.get_reorder_suggestions() if hasattr(db, "get_reorder_suggestions") else []
+    rows = await adb.get_reorder_suggestions() if hasattr(db, "get_reorder_suggestions") else []
     return [ReorderSuggestion(**row) for row in rows]
 
 # ERP upgrade endpoints: AR aging + credit
+def _aging_params(as_of: Optional[str], edges: Optional[str]):
+    try:
+        as_of_date = date.fromisoformat(as_of) if as_of else None
+        aging_edges = parse_aging_edges(edges) if edges else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return as_of_date, aging_edges
+
 @app.get("/api/receivables/aging", response_model=List[ReceivableAgingRow])
-async def get_receivables_aging(current_user: dict = Depends(get_current_user)):
-    rows = db.get_receivable_aging() if hasattr(db, "get_receivable_aging") else []
-    return [ReceivableAgingRow(**row) for row in rows]
+async def get_receivables_aging(as_of: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    if not hasattr(db, "get_receivable_aging_report"):
+        return []
+    as_of_date, _ = _aging_params(as_of, None)
+    report = await adb.get_receivable_aging_report(as_of=as_of_date)
+    return [ReceivableAgingRow(**row) for row in report["rows"]]
+
+@app.get("/api/receivables/aging/summary")
+async def get_receivables_aging_summary(
+    as_of: Optional[str] = None,
+    edges: Optional[str] = None,
+    current_user: dict = Depends(get_current_user),
+):
+    """Aging per retailer plus per-SR and per-market-route totals; edges like '7,15,30,60' (days)"""
+    if not hasattr(db, "get_receivable_aging_report"):
+        raise HTTPException(status_code=400, detail="Receivable aging not available")
+    as_of_date, aging_edges = _aging_params(as_of, edges)
+    return await adb.get_receivable_aging_report(as_of=as_of_date, edges=aging_edges)
 
 @app.get("/api/credit/check", response_model=CreditCheckResponse)
 async def check_credit(
@@ -3419,7 +3378,7 @@ async def check_credit(
 ):
     if not hasattr(db, "check_credit_limit"):
         raise HTTPException(status_code=400, detail="Credit check feature not available")
-    result = db.check_credit_limit(retailer_id, new_order_amount)
+    result = await adb.check_credit_limit(retailer_id, new_order_amount)
     return CreditCheckResponse(**result)
 
 # ERP upgrade endpoints: margin report
@@ -3427,11 +3386,35 @@ async def check_credit(
 async def get_margin_report(
     from_date: Optional[str] = None,
     to_date: Optional[str] = None,
+    group_by: Optional[str] = None,
+    include_rows: bool = True,
     current_user: dict = Depends(get_current_user),
 ):
+    """Margin totals and line rows; group_by = product | category | retailer | sr | day"""
     if not hasattr(db, "get_margin_report"):
         raise HTTPException(status_code=400, detail="Margin report feature not available")
-    return MarginReportSummary(**db.get_margin_report(from_date=from_date, to_date=to_date))
+    if group_by and group_by not in MARGIN_GROUP_BY:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of: {', '.join(MARGIN_GROUP_BY)}")
+    report = await adb.get_margin_report(
+        from_date=from_date, to_date=to_date, group_by=group_by, include_rows=include_rows
+    )
+    return MarginReportSummary(**report)
+
+@app.get("/api/reports/margins/stream")
+async def stream_margin_report(
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    current_user: dict = Depends(get_current_user),
+):
+    """Margin rows as NDJSON, read page by page (for long ranges / exports)"""
+    if not hasattr(db, "iter_margin_rows"):
+        raise HTTPException(status_code=400, detail="Margin report feature not available")
+
+    def lines():
+        for row in db.iter_margin_rows(from_date, to_date):
+            yield MarginReportRow(**row).model_dump_json() + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 # SMS Notification endpoints
 sms_service = SmsService()
@@ -3458,13 +3441,13 @@ async def trigger_sms_notification(
             return
         
         # Get template for this event type
-        template = db.get_sms_template_by_event_type(event_type.value)
+        template = await adb.get_sms_template_by_event_type(event_type.value)
         if not template:
             logger.warning(f"No SMS template found for event type: {event_type.value}")
             return
         
         # Get SMS settings for this event type (check role-based settings)
-        settings = db.get_sms_settings(role="admin")  # Default to admin role
+        settings = await adb.get_sms_settings(role="admin")  # Default to admin role
         event_settings = [s for s in settings if s.get("event_type") == event_type.value]
         
         if not event_settings or not any(s.get("enabled", False) for s in event_settings):
@@ -3491,7 +3474,7 @@ async def trigger_sms_notification(
                 # Note: We'll need to implement get_users method or query users table directly
                 # For now, skip admin phone collection if method doesn't exist
                 if hasattr(db, 'get_users'):
-                    users = db.get_users()
+                    users = await adb.get_users()
                     admin_phones = [u.get("phone") for u in users if u.get("role") == "admin" and u.get("phone")]
                     recipient_phones.extend(admin_phones)
             
@@ -3502,7 +3485,7 @@ async def trigger_sms_notification(
             
             if "suppliers" in recipient_types:
                 # Get supplier phone numbers
-                suppliers = db.get_suppliers()
+                suppliers = await adb.get_suppliers()
                 supplier_phones = [s.get("phone") for s in suppliers if s.get("phone")]
                 recipient_phones.extend(supplier_phones)
         
@@ -3529,7 +3512,7 @@ async def trigger_sms_notification(
                     "trxn_id": result.get("trxnId"),
                     "error_message": result.get("responseResult") if result.get("status") != "Success" else None
                 }
-                db.create_sms_log(log_data)
+                await adb.create_sms_log(log_data)
         else:
             # Add to queue
             for phone in recipient_phones:
@@ -3558,7 +3541,7 @@ async def get_sms_settings(
         user_id_param = current_user.get("id") if not user_id else user_id
         role_param = user_role if not role else role
         
-        settings = db.get_sms_settings(user_id=user_id_param, role=role_param)
+        settings = await adb.get_sms_settings(user_id=user_id_param, role=role_param)
         result = [SmsSettings(**s) for s in settings]
         return result
     except Exception as e:
@@ -3582,11 +3565,11 @@ async def update_sms_settings(
         delivery_mode_str = settings_data.delivery_mode.value if settings_data.delivery_mode else SmsDeliveryMode.IMMEDIATE.value
         
         # Check if settings already exist (check both user_id and role)
-        existing = db.get_sms_settings_by_user_and_event(user_id, event_type_str)
+        existing = await adb.get_sms_settings_by_user_and_event(user_id, event_type_str)
         existing_by_role = None
         if not existing:
             # Also check by role (due to UNIQUE(role, event_type) constraint)
-            existing_by_role = db.get_sms_settings_by_role_and_event(user_role, event_type_str)
+            existing_by_role = await adb.get_sms_settings_by_role_and_event(user_role, event_type_str)
         
         # Use existing_by_role if found (due to UNIQUE constraint)
         if existing_by_role and not existing:
@@ -3603,14 +3586,14 @@ async def update_sms_settings(
         }
         
         if existing:
-            updated = db.update_sms_settings(existing["id"], settings_dict)
+            updated = await adb.update_sms_settings(existing["id"], settings_dict)
             if not updated:
                 raise HTTPException(status_code=404, detail="SMS settings not found")
             result = SmsSettings(**updated)
             return result
         else:
             try:
-                created = db.create_sms_settings(settings_dict)
+                created = await adb.create_sms_settings(settings_dict)
                 result = SmsSettings(**created)
                 return result
             except Exception as db_error:
@@ -3618,9 +3601,9 @@ async def update_sms_settings(
                 error_str = str(db_error).lower()
                 if "unique" in error_str or "duplicate" in error_str:
                     # Try to update instead if unique constraint violation
-                    existing_by_role = db.get_sms_settings_by_role_and_event(user_role, event_type_str)
+                    existing_by_role = await adb.get_sms_settings_by_role_and_event(user_role, event_type_str)
                     if existing_by_role:
-                        updated = db.update_sms_settings(existing_by_role["id"], settings_dict)
+                        updated = await adb.update_sms_settings(existing_by_role["id"], settings_dict)
                         if updated:
                             result = SmsSettings(**updated)
                             return result
@@ -3639,7 +3622,7 @@ async def update_sms_settings(
 @app.get("/api/sms/templates", response_model=List[SmsTemplate])
 async def get_sms_templates(current_user: dict = Depends(get_current_user)):
     """Get all SMS templates"""
-    templates = db.get_sms_templates()
+    templates = await adb.get_sms_templates()
     return [SmsTemplate(**t) for t in templates]
 
 @app.get("/api/sms/templates/{event_type}", response_model=SmsTemplate)
@@ -3648,7 +3631,7 @@ async def get_sms_template_by_event(
     current_user: dict = Depends(get_current_user)
 ):
     """Get SMS template by event type"""
-    template = db.get_sms_template_by_event_type(event_type)
+    template = await adb.get_sms_template_by_event_type(event_type)
     if not template:
         raise HTTPException(status_code=404, detail="Template not found")
     return SmsTemplate(**template)
@@ -3664,7 +3647,7 @@ async def create_sms_template(
     
     template_dict = template_data.model_dump()
     template_dict["event_type"] = template_data.event_type.value
-    template = db.create_sms_template(template_dict)
+    template = await adb.create_sms_template(template_dict)
     return SmsTemplate(**template)
 
 @app.put("/api/sms/templates/{template_id}", response_model=SmsTemplate)
@@ -3678,7 +3661,7 @@ async def update_sms_template(
         raise HTTPException(status_code=403, detail="Only admins can update templates")
     
     update_dict = template_data.model_dump(exclude_unset=True)
-    updated = db.update_sms_template(template_id, update_dict)
+    updated = await adb.update_sms_template(template_id, update_dict)
     if not updated:
         raise HTTPException(status_code=404, detail="Template not found")
     return SmsTemplate(**updated)
@@ -3691,7 +3674,7 @@ async def get_sms_logs(
     current_user: dict = Depends(get_current_user)
 ):
     """Get SMS logs"""
-    logs = db.get_sms_logs(limit=limit, event_type=event_type, recipient_phone=recipient_phone)
+    logs = await adb.get_sms_logs(limit=limit, event_type=event_type, recipient_phone=recipient_phone)
     return [SmsLog(**log) for log in logs]
 
 @app.get("/api/sms/balance")
@@ -3720,7 +3703,7 @@ async def send_test_sms(
         "trxn_id": result.get("trxnId"),
         "error_message": result.get("responseResult") if result.get("status") != "Success" else None
     }
-    db.create_sms_log(log_data)
+    await adb.create_sms_log(log_data)
     
     return result
 
@@ -3744,7 +3727,7 @@ async def send_sms(
         "trxn_id": result.get("trxnId"),
         "error_message": result.get("responseResult") if result.get("status") != "Success" else None
     }
-    db.create_sms_log(log_data)
+    await adb.create_sms_log(log_data)
     
     return result
 
@@ -3757,7 +3740,7 @@ async def create_route(route_data: RouteCreate, current_user: dict = Depends(get
     """Create a new route/batch with sales orders"""
     try:
         _require_admin(current_user, detail="Only admin can create routes")
-        route = db.create_route(route_data.model_dump(), route_data.sale_ids)
+        route = await adb.create_route(route_data.model_dump(), route_data.sale_ids)
         return RouteWithSales(**route)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -3779,13 +3762,28 @@ async def get_routes(
         return []
     if not _is_admin(current_user):
         assigned_to = current_user.get("id")
-    routes = db.get_routes(assigned_to=assigned_to, status=status, route_date=route_date)
+    routes = await adb.get_routes(assigned_to=assigned_to, status=status, route_date=route_date)
     return [Route(**r) for r in routes]
 
+@app.get("/api/routes/details", response_model=List[RouteWithSales])
+async def get_routes_details(ids: str, current_user: dict = Depends(get_current_user)):
+    """Get several routes with their sales in one call (comma-separated ids, for list screens)"""
+    route_ids = [route_id.strip() for route_id in ids.split(",") if route_id.strip()]
+    if len(route_ids) > 200:
+        raise HTTPException(status_code=400, detail="At most 200 route ids per request")
+    if _is_sr(current_user) or not route_ids:
+        return []
+    routes = await adb.get_routes_with_sales(route_ids)
+    return [
+        RouteWithSales(**routes[route_id])
+        for route_id in dict.fromkeys(route_ids)
+        if route_id in routes and (_is_admin(current_user) or _route_belongs_to_dsr(routes[route_id], current_user))
+    ]
+
 @app.get("/api/routes/{route_id}", response_model=RouteWithSales)
 async def get_route(route_id: str, current_user: dict = Depends(get_current_user)):
     """Get route details with all sales and previous due information"""
-    route = db.get_route(route_id)
+    route = await adb.get_route(route_id)
     if not route:
         raise HTTPException(status_code=404, detail="Route not found")
     if not _is_admin(current_user) and not _route_belongs_to_dsr(route, current_user):
@@ -3802,7 +3800,7 @@ async def update_route(
     try:
         _require_admin(current_user, detail="Only admin can update routes")
         
-        route = db.update_route(route_id, route_update.model_dump(exclude_unset=True))
+        route = await adb.update_route(route_id, route_update.model_dump(exclude_unset=True))
         
         
         if not route:
@@ -3824,7 +3822,7 @@ async def add_sales_to_route(
     """Add sales orders to an existing route"""
     try:
         _require_admin(current_user, detail="Only admin can update route sales")
-        route = db.add_sales_to_route(route_id, sale_ids)
+        route = await adb.add_sales_to_route(route_id, sale_ids)
         return RouteWithSales(**route)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -3840,7 +3838,7 @@ async def remove_sale_from_route(
     """Remove a sale from route"""
     try:
         _require_admin(current_user, detail="Only admin can update route sales")
-        route = db.remove_sale_from_route(route_id, sale_id)
+        route = await adb.remove_sale_from_route(route_id, sale_id)
         if not route:
             raise HTTPException(status_code=404, detail="Route not found")
         return RouteWithSales(**route)
@@ -3852,7 +3850,7 @@ async def delete_route(route_id: str, current_user: dict = Depends(get_current_u
     """Delete a route"""
     try:
         _require_admin(current_user, detail="Only admin can delete routes")
-        success = db.delete_route(route_id)
+        success = await adb.delete_route(route_id)
         if not success:
             raise HTTPException(status_code=404, detail="Route not found")
         return {"message": "Route deleted successfully"}
@@ -3866,7 +3864,7 @@ async def get_retailer_previous_due(
     current_user: dict = Depends(get_current_user)
 ):
     """Get current previous due for a retailer (for new routes)"""
-    previous_due = db.calculate_previous_due(retailer_id, exclude_route_id=exclude_route_id)
+    previous_due = await adb.calculate_previous_due(retailer_id, exclude_route_id=exclude_route_id)
     return {"retailer_id": retailer_id, "previous_due": previous_due}
 
 @app.get("/api/routes/{route_id}/previous-due")
@@ -3875,7 +3873,7 @@ async def get_route_previous_due(
     current_user: dict = Depends(get_current_user)
 ):
     """Get previous due calculation for all retailers in route"""
-    route = db.get_route(route_id)
+    route = await adb.get_route(route_id)
     if not route:
         raise HTTPException(status_code=404, detail="Route not found")
     if not _is_admin(current_user) and not _route_belongs_to_dsr(route, current_user):
@@ -3905,12 +3903,12 @@ async def create_route_reconciliation(
 ):
     """Create reconciliation record for a route"""
     try:
-        route = db.get_route(route_id)
+        route = await adb.get_route(route_id)
         if not route:
             raise HTTPException(status_code=404, detail="Route not found")
         if not _is_admin(current_user) and not _route_belongs_to_dsr(route, current_user):
             raise HTTPException(status_code=403, detail="You can only reconcile your assigned routes")
-        reconciliation = db.create_route_reconciliation(
+        reconciliation = await adb.create_route_reconciliation(
             route_id,
             reconciliation_data.model_dump(),
             user_id=current_user.get("id")
@@ -3930,12 +3928,12 @@ async def get_reconciliations(
     current_user: dict = Depends(get_current_user)
 ):
     """Get all reconciliations"""
-    reconciliations = db.get_route_reconciliations(route_id=route_id)
+    reconciliations = await adb.get_route_reconciliations(route_id=route_id)
     if not _is_admin(current_user):
         current_user_id = current_user.get("id")
         visible_route_ids = {
             route.get("id")
-            for route in db.get_routes(assigned_to=current_user_id)
+            for route in await adb.get_routes(assigned_to=current_user_id)
         }
         reconciliations = [r for r in reconciliations if r.get("route_id") in visible_route_ids]
     return [RouteReconciliation(**r) for r in reconciliations]
@@ -3946,11 +3944,11 @@ async def get_reconciliation(
     current_user: dict = Depends(get_current_user)
 ):
     """Get reconciliation details"""
-    reconciliation = db.get_route_reconciliation(reconciliation_id)
+    reconciliation = await adb.get_route_reconciliation(reconciliation_id)
     if not reconciliation:
         raise HTTPException(status_code=404, detail="Reconciliation not found")
     if not _is_admin(current_user):
-        route = db.get_route(reconciliation.get("route_id"))
+        route = await adb.get_route(reconciliation.get("route_id"))
         if not _route_belongs_to_dsr(route, current_user):
             raise HTTPException(status_code=403, detail="You can only view your route reconciliations")
     return RouteReconciliation(**reconciliation)
@@ -3963,7 +3961,7 @@ async def get_sr_cash_holding(
     """Get current cash holding for an SR"""
     if not _is_admin(current_user) and user_id != current_user.get("id"):
         raise HTTPException(status_code=403, detail="You can only view your own cash holding")
-    user = db.get_user_by_id(user_id)
+    user = await adb.get_user_by_id(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -3981,7 +3979,7 @@ async def get_sr_accountability(
     """Get full accountability report for an SR"""
     if not _is_admin(current_user) and user_id != current_user.get("id"):
         raise HTTPException(status_code=403, detail="You can only view your own accountability")
-    accountability = db.get_sr_accountability(user_id)
+    accountability = await adb.get_sr_accountability(user_id)
     if not accountability:
         raise HTTPException(status_code=404, detail="User not found or has no accountability data")
     return SrAccountability(**accountability)
@@ -4011,7 +4009,7 @@ async def backfill_payment_route_id(
         )
     
     try:
-        result = db.backfill_payment_route_id(dry_run=dry_run)
+        result = await adb.backfill_payment_route_id(dry_run=dry_run)
         return result
     except Exception as e:
         error_msg = str(e)
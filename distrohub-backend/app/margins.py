@@ -0,0 +1,113 @@
+"""
+Margin report aggregation shared by the database backends.
+
+Backends produce margin rows (one per sale line with a cost snapshot) via
+iter_margin_rows(); summarize_margin_rows() folds them into totals and,
+optionally, one group-by dimension in a single pass, so the report never
+holds more than the requested rows in memory.
+"""
+
+from datetime import date, datetime
+from typing import Dict, Iterable, Optional
+
+MARGIN_GROUP_BY = ("product", "category", "retailer", "sr", "day")
+
+# group_by -> (key field, label field) on a margin row
+_GROUP_FIELDS = {
+    "product": ("product_id", "product_name"),
+    "category": ("category", "category"),
+    "retailer": ("retailer_id", "retailer_name"),
+    "sr": ("assigned_to", "assigned_to_name"),
+}
+
+
+def margin_row(snapshot: dict, sale_item: dict, sale: dict, category: Optional[str] = None) -> dict:
+    """One report row from a cost snapshot and its sale line / sale."""
+    net_sales = float(sale_item.get("total", 0) or 0)
+    cogs_total = float(snapshot.get("cogs_total", 0) or 0)
+    margin_amount = net_sales - cogs_total
+    return {
+        "sale_id": sale.get("id") or sale_item.get("sale_id"),
+        "invoice_number": sale.get("invoice_number"),
+        "product_id": sale_item.get("product_id") or snapshot.get("product_id"),
+        "product_name": sale_item.get("product_name"),
+        "category": category,
+        "retailer_id": sale.get("retailer_id"),
+        "retailer_name": sale.get("retailer_name"),
+        "assigned_to": sale.get("assigned_to"),
+        "assigned_to_name": sale.get("assigned_to_name"),
+        "quantity": int(sale_item.get("quantity", 0) or 0),
+        "net_sales": net_sales,
+        "cogs_total": cogs_total,
+        "margin_amount": margin_amount,
+        "margin_percent": (margin_amount / net_sales * 100) if net_sales > 0 else 0,
+        "created_at": sale.get("created_at") or snapshot.get("created_at"),
+    }
+
+
+def _day(value) -> Optional[str]:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()[:10]
+    return str(value)[:10] if value else None
+
+
+def _group_key(row: dict, group_by: str):
+    if group_by == "day":
+        day = _day(row.get("created_at"))
+        return day, day
+    key_field, label_field = _GROUP_FIELDS[group_by]
+    return row.get(key_field), row.get(label_field)
+
+
+def _percent(margin: float, net_sales: float) -> float:
+    return (margin / net_sales * 100) if net_sales > 0 else 0
+
+
+def summarize_margin_rows(rows: Iterable[dict], group_by: Optional[str] = None, include_rows: bool = True) -> dict:
+    """
+    Totals (and groups when group_by is set) over margin rows in one pass.
+
+    Raises ValueError for an unknown group_by. Groups are sorted by margin,
+    largest first; rows are omitted when include_rows is False.
+    """
+    if group_by and group_by not in MARGIN_GROUP_BY:
+        raise ValueError(f"group_by must be one of: {', '.join(MARGIN_GROUP_BY)}")
+    kept = []
+    groups: Dict[object, dict] = {}
+    total_net_sales = 0.0
+    total_cogs = 0.0
+    for row in rows:
+        total_net_sales += row["net_sales"]
+        total_cogs += row["cogs_total"]
+        if include_rows:
+            kept.append(row)
+        if group_by:
+            key, label = _group_key(row, group_by)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = {
+                    "key": None if key is None else str(key),
+                    "label": label or ("Unassigned" if key is None else str(key)),
+                    "line_count": 0,
+                    "quantity": 0,
+                    "net_sales": 0.0,
+                    "cogs_total": 0.0,
+                }
+            group["line_count"] += 1
+            group["quantity"] += row["quantity"]
+            group["net_sales"] += row["net_sales"]
+            group["cogs_total"] += row["cogs_total"]
+
+    for group in groups.values():
+        group["margin_amount"] = group["net_sales"] - group["cogs_total"]
+        group["margin_percent"] = _percent(group["margin_amount"], group["net_sales"])
+    total_margin = total_net_sales - total_cogs
+    return {
+        "total_net_sales": total_net_sales,
+        "total_cogs": total_cogs,
+        "total_margin": total_margin,
+        "margin_percent": _percent(total_margin, total_net_sales),
+        "group_by": group_by,
+        "groups": sorted(groups.values(), key=lambda g: -g["margin_amount"]),
+        "rows": kept,
+    }
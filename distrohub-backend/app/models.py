@@ -30,6 +30,8 @@ def normalize_user_role(raw) -> UserRole:
     """Map DB / JWT values to UserRole. Legacy `sales_rep` is treated as DSR."""
     if raw is None:
         return UserRole.DSR
+    if isinstance(raw, UserRole):
+        return raw
     s = str(raw).strip().lower()
     if s == UserRole.ADMIN.value:
         return UserRole.ADMIN
@@ -94,8 +96,12 @@ class UserLogin(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str = "bearer"
+    refresh_token: Optional[str] = None
     user: User
 
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
 class ProductBase(BaseModel):
     name: str
     sku: str
@@ -472,6 +478,12 @@ class StockLedgerEntry(BaseModel):
     created_by: Optional[str] = None
     created_at: datetime
 
+class StockLedgerPage(BaseModel):
+    """One keyset page of the stock ledger (newest first)"""
+    entries: List[StockLedgerEntry]
+    next_cursor: Optional[str] = None
+    opening_balance: Optional[int] = None
+
 class WarehouseCreate(BaseModel):
     """Create warehouse request"""
     name: str
@@ -728,6 +740,18 @@ class RetailerPriceListAssignmentCreate(BaseModel):
     price_list_id: str
 
 
+class PriceResolveLine(BaseModel):
+    product_id: str
+    quantity: float = 1
+    variant_id: Optional[str] = None
+    uom: Optional[str] = None
+
+
+class PriceResolveRequest(BaseModel):
+    retailer_id: str
+    lines: List[PriceResolveLine]
+
+
 class ReorderPolicyBase(BaseModel):
     product_id: str
     lead_time_days: int = 7
@@ -771,6 +795,7 @@ class ReceivableAgingRow(BaseModel):
     bucket_16_30: float = 0
     bucket_31_60: float = 0
     bucket_60_plus: float = 0
+    sale_count: int = 0
 
 
 class CreditCheckResponse(BaseModel):
@@ -791,6 +816,11 @@ class MarginReportRow(BaseModel):
     invoice_number: Optional[str] = None
     product_id: str
     product_name: Optional[str] = None
+    category: Optional[str] = None
+    retailer_id: Optional[str] = None
+    retailer_name: Optional[str] = None
+    assigned_to: Optional[str] = None
+    assigned_to_name: Optional[str] = None
     quantity: int
     net_sales: float
     cogs_total: float
@@ -799,11 +829,24 @@ class MarginReportRow(BaseModel):
     created_at: datetime
 
 
+class MarginReportGroup(BaseModel):
+    key: Optional[str] = None
+    label: str
+    line_count: int
+    quantity: int
+    net_sales: float
+    cogs_total: float
+    margin_amount: float
+    margin_percent: float
+
+
 class MarginReportSummary(BaseModel):
     total_net_sales: float
     total_cogs: float
     total_margin: float
     margin_percent: float
+    group_by: Optional[str] = None
+    groups: List[MarginReportGroup] = []
     rows: List[MarginReportRow]
 
 # SMS Notification Models
@@ -0,0 +1,50 @@
+"""
+Opaque keyset cursors for list endpoints ordered by (created_at DESC, id DESC).
+
+A cursor encodes the sort key of the last row of a page; the next page is
+every row strictly after it in that order. Unlike offsets, pages stay stable
+while new rows are inserted at the head.
+"""
+
+import base64
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+
+def _key_text(value) -> str:
+    return value.isoformat() if isinstance(value, datetime) else str(value or "")
+
+
+def sort_key(row: dict) -> Tuple[str, str]:
+    """(created_at, id) key matching cursor comparison; sort with reverse=True for newest first."""
+    return _key_text(row.get("created_at")), str(row.get("id"))
+
+
+def encode_cursor(created_at, row_id) -> str:
+    raw = f"{_key_text(created_at)}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[str, str]]:
+    """(created_at, id) of the cursor row, or None for the first page. Raises ValueError if malformed."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8").rsplit("|", 1)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not created_at or not row_id:
+        raise ValueError("Invalid cursor")
+    return created_at, row_id
+
+
+def keyset_page(rows: List[dict], cursor: Optional[str], limit: Optional[int]) -> Tuple[List[dict], Optional[str]]:
+    """Page rows already sorted by (created_at DESC, id DESC) in memory; returns (page, next_cursor)."""
+    after = decode_cursor(cursor)
+    if after:
+        rows = [r for r in rows if sort_key(r) < after]
+    if not limit or len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    return page, encode_cursor(page[-1].get("created_at"), page[-1].get("id"))
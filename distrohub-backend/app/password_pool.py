@@ -0,0 +1,171 @@
+"""
+Bounded worker pool for bcrypt hashing and verification.
+
+bcrypt at cost 12 costs ~250 ms of CPU per call. Running it on the event loop
+(or on the shared db thread pool) stalls every other request during a login
+burst, so login, register and user create/update hand password work to this
+dedicated pool and await the result.
+
+Settings:
+  BCRYPT_ROUNDS                 work factor for new hashes (default 12)
+  PASSWORD_POOL_WORKERS         concurrent hashes (default min(4, cpu count))
+  PASSWORD_POOL_KIND            "thread" (default; bcrypt releases the GIL) or "process"
+  PASSWORD_REHASH_BATCH_SIZE    legacy SHA-256 upgrades written per flush (default 50)
+  PASSWORD_REHASH_FLUSH_SECONDS delay before a partial batch is flushed (default 2)
+
+Legacy SHA-256 hashes verified at login are queued with schedule_rehash();
+the queue is hashed in the pool and written with one
+apply_password_rehashes() call per batch, off the login response path.
+"""
+
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+import bcrypt as _bcrypt_lib
+
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+PASSWORD_POOL_WORKERS = int(os.environ.get("PASSWORD_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_POOL_KIND = os.environ.get("PASSWORD_POOL_KIND", "thread").lower()
+PASSWORD_REHASH_BATCH_SIZE = int(os.environ.get("PASSWORD_REHASH_BATCH_SIZE", "50"))
+PASSWORD_REHASH_FLUSH_SECONDS = float(os.environ.get("PASSWORD_REHASH_FLUSH_SECONDS", "2"))
+
+
+def is_bcrypt_hash(hashed_password: Optional[str]) -> bool:
+    return bool(hashed_password) and (hashed_password.startswith("$2b$") or hashed_password.startswith("$2a$"))
+
+
+def hash_password(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    """Hash password using bcrypt."""
+    pwd_bytes = password.encode("utf-8")[:72]
+    salt = _bcrypt_lib.gensalt(rounds=rounds)
+    return _bcrypt_lib.hashpw(pwd_bytes, salt).decode("utf-8")
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify password. Supports both bcrypt (new) and SHA-256 (legacy) hashes."""
+    if not hashed_password:
+        return False
+    if is_bcrypt_hash(hashed_password):
+        try:
+            return _bcrypt_lib.checkpw(
+                plain_password.encode("utf-8")[:72],
+                hashed_password.encode("utf-8")
+            )
+        except Exception:
+            return False
+    # Legacy SHA-256 fallback (backward compatibility)
+    return hashlib.sha256(plain_password.encode()).hexdigest() == hashed_password
+
+
+class PasswordPool:
+    """Dedicated executor for password work with queue-depth counters and a batched rehash queue."""
+
+    def __init__(self, max_workers: int = PASSWORD_POOL_WORKERS, kind: str = PASSWORD_POOL_KIND):
+        self.max_workers = max(1, max_workers)
+        self.kind = "process" if kind == "process" else "thread"
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.completed = 0
+        self.total_ms = 0.0
+        self._rehash_queue: Dict[str, dict] = {}
+        self._rehash_task: Optional[asyncio.Task] = None
+        self.rehashed = 0
+
+    def _get_executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                if self.kind == "process":
+                    self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="pwd")
+            return self._executor
+
+    async def _submit(self, fn: Callable, *args):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+                self.total_ms += (time.perf_counter() - started) * 1000
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(hash_password, password, BCRYPT_ROUNDS)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._submit(verify_password, plain_password, hashed_password)
+
+    def schedule_rehash(self, backend, user_id: str, legacy_hash: str, password: str) -> None:
+        """Queue a legacy hash upgrade; flushed in batches by a background task."""
+        with self._lock:
+            self._rehash_queue[user_id] = {"id": user_id, "old_hash": legacy_hash, "password": password}
+            full = len(self._rehash_queue) >= PASSWORD_REHASH_BATCH_SIZE
+        if self._rehash_task is None or self._rehash_task.done():
+            self._rehash_task = asyncio.get_running_loop().create_task(
+                self._flush_later(backend, 0 if full else PASSWORD_REHASH_FLUSH_SECONDS)
+            )
+
+    async def _flush_later(self, backend, delay: float) -> None:
+        if delay:
+            await asyncio.sleep(delay)
+        while self._rehash_queue:
+            await self.flush_rehashes(backend)
+
+    async def flush_rehashes(self, backend) -> int:
+        """Hash up to one batch of queued passwords in the pool and write them in one call."""
+        with self._lock:
+            batch = list(self._rehash_queue.values())[:PASSWORD_REHASH_BATCH_SIZE]
+            for item in batch:
+                self._rehash_queue.pop(item["id"], None)
+        if not batch:
+            return 0
+        hashes = await asyncio.gather(*(self.hash(item["password"]) for item in batch))
+        updates = [
+            {"id": item["id"], "old_hash": item["old_hash"], "password_hash": new_hash}
+            for item, new_hash in zip(batch, hashes)
+        ]
+        try:
+            written = await backend.apply_password_rehashes(updates)
+        except Exception as e:
+            # Non-fatal: the legacy hash keeps working and is re-queued on the next login
+            print(f"[AUTH] Legacy password rehash batch failed: {e}")
+            return 0
+        with self._lock:
+            self.rehashed += written
+        print(f"[AUTH] Upgraded {written} legacy password hash(es) to bcrypt")
+        return written
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "kind": self.kind,
+                "workers": self.max_workers,
+                "bcrypt_rounds": BCRYPT_ROUNDS,
+                "in_flight": self.in_flight,
+                "queue_depth": max(0, self.in_flight - self.max_workers),
+                "max_in_flight": self.max_in_flight,
+                "completed": self.completed,
+                "avg_ms": round(self.total_ms / self.completed, 1) if self.completed else 0.0,
+                "rehash_pending": len(self._rehash_queue),
+                "rehashed": self.rehashed,
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+password_pool = PasswordPool()
@@ -0,0 +1,556 @@
+import asyncio
+import json
+import os
+import threading
+import uuid
+from datetime import date, datetime, time as dt_time, timedelta
+from decimal import Decimal
+from enum import Enum
+from typing import Any, Dict, List, Optional, Tuple
+
+import asyncpg
+
+from app.dataloader import loader_cached
+from app.models import PaymentStatus, OrderStatus
+from app.supabase_db import SupabaseDatabase
+
+DATABASE_URL = os.environ.get("DATABASE_URL")
+POSTGRES_POOL_MIN_SIZE = int(os.environ.get("POSTGRES_POOL_MIN_SIZE", "2"))
+POSTGRES_POOL_MAX_SIZE = int(os.environ.get("POSTGRES_POOL_MAX_SIZE", "20"))
+# asyncpg prepares every statement and caches it per connection. Set to 0 when
+# running behind pgbouncer in transaction mode.
+POSTGRES_STATEMENT_CACHE_SIZE = int(os.environ.get("POSTGRES_STATEMENT_CACHE_SIZE", "256"))
+POSTGRES_COMMAND_TIMEOUT = float(os.environ.get("POSTGRES_COMMAND_TIMEOUT", "30"))
+
+
+def _ident(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _to_text(value: Any) -> Optional[str]:
+    """Encode a Python value as the text form Postgres casts from."""
+    if value is None:
+        return None
+    if isinstance(value, Enum):
+        value = value.value
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (datetime, date, dt_time)):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return str(value)
+
+
+def _to_json_value(value: Any) -> Any:
+    """Shape asyncpg values like PostgREST JSON (str ids, float numerics, ISO dates)."""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, (datetime, date, dt_time)):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return str(value)
+    if isinstance(value, list):
+        return [_to_json_value(v) for v in value]
+    return value
+
+
+def _record_to_dict(record) -> dict:
+    return {k: _to_json_value(v) for k, v in record.items()}
+
+
+class PostgresResult:
+    def __init__(self, data: Any, count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+
+class PostgresQuery:
+    """
+    Subset of the supabase-py/PostgREST query builder compiled to SQL.
+
+    Supports what SupabaseDatabase uses: select (with one level of child
+    embedding like "*, sale_items(*)" and count="exact"), insert, upsert,
+    update, delete, eq/neq/gt/gte/lt/lte/like/ilike/in_/is_ filters,
+    not_, order, limit and range. Every value is bound as a parameter and
+    cast to the column's declared type.
+    """
+
+    _OPERATORS = {"eq": "=", "neq": "<>", "gt": ">", "gte": ">=", "lt": "<", "lte": "<=", "like": "LIKE", "ilike": "ILIKE"}
+
+    def __init__(self, client: "PostgresClient", table: str):
+        self._client = client
+        self.table = table
+        self.op = "select"
+        self.columns = "*"
+        self.count: Optional[str] = None
+        self.payload: Any = None
+        self.on_conflict: Optional[str] = None
+        self.filters: List[Tuple[str, str, Any, bool]] = []
+        self.orders: List[Tuple[str, bool, Optional[bool]]] = []
+        self.limit_value: Optional[int] = None
+        self.offset_value: Optional[int] = None
+        self._negate_next = False
+
+    def select(self, columns: str = "*", count: Optional[str] = None):
+        self.columns = columns or "*"
+        self.count = count
+        return self
+
+    def insert(self, data):
+        self.op, self.payload = "insert", data
+        return self
+
+    def upsert(self, data, on_conflict: Optional[str] = None):
+        self.op, self.payload, self.on_conflict = "upsert", data, on_conflict
+        return self
+
+    def update(self, data: dict):
+        self.op, self.payload = "update", data
+        return self
+
+    def delete(self):
+        self.op = "delete"
+        return self
+
+    @property
+    def not_(self):
+        self._negate_next = True
+        return self
+
+    def _filter(self, column: str, op: str, value: Any):
+        self.filters.append((column, op, value, self._negate_next))
+        self._negate_next = False
+        return self
+
+    def eq(self, column, value): return self._filter(column, "eq", value)
+    def neq(self, column, value): return self._filter(column, "neq", value)
+    def gt(self, column, value): return self._filter(column, "gt", value)
+    def gte(self, column, value): return self._filter(column, "gte", value)
+    def lt(self, column, value): return self._filter(column, "lt", value)
+    def lte(self, column, value): return self._filter(column, "lte", value)
+    def like(self, column, value): return self._filter(column, "like", value)
+    def ilike(self, column, value): return self._filter(column, "ilike", value)
+    def in_(self, column, values): return self._filter(column, "in", list(values or []))
+    def is_(self, column, value): return self._filter(column, "is", value)
+
+    def order(self, column: str, desc: bool = False, nullsfirst: Optional[bool] = None):
+        self.orders.append((column, desc, nullsfirst))
+        return self
+
+    def limit(self, size: int):
+        self.limit_value = int(size)
+        return self
+
+    def range(self, start: int, end: int):
+        self.offset_value = int(start)
+        self.limit_value = int(end) - int(start) + 1
+        return self
+
+    def execute(self) -> PostgresResult:
+        return self._client.execute_query(self)
+
+
+class SqlCompiler:
+    """Turns a PostgresQuery into (sql, args) given the table's column types."""
+
+    def __init__(self, column_types: Dict[str, str], primary_key: Optional[List[str]] = None):
+        self.column_types = column_types
+        self.primary_key = primary_key or ["id"]
+        self.args: List[Any] = []
+
+    def bind(self, column: str, value: Any) -> str:
+        udt = self.column_types.get(column)
+        if udt is None:
+            self.args.append(value.value if isinstance(value, Enum) else value)
+            return f"${len(self.args)}"
+        if udt.startswith("_"):
+            self.args.append(None if value is None else [_to_text(v) for v in value])
+            return f"${len(self.args)}::text[]::{_ident(udt[1:])}[]"
+        self.args.append(_to_text(value))
+        return f"${len(self.args)}::text::{_ident(udt)}"
+
+    def bind_list(self, column: str, values: List[Any]) -> str:
+        udt = self.column_types.get(column) or "text"
+        self.args.append([_to_text(v) for v in values])
+        return f"${len(self.args)}::text[]::{_ident(udt)}[]"
+
+    def where(self, query: PostgresQuery, alias: str = "t") -> str:
+        clauses = []
+        for column, op, value, negate in query.filters:
+            col = f"{alias}.{_ident(column)}"
+            if op == "in":
+                clause = f"{col} = ANY({self.bind_list(column, value)})"
+            elif op == "is":
+                literal = str(value).lower()
+                if literal not in ("null", "true", "false"):
+                    raise ValueError(f"Unsupported is_ value: {value}")
+                clause = f"{col} IS {literal.upper()}"
+            else:
+                clause = f"{col} {PostgresQuery._OPERATORS[op]} {self.bind(column, value)}"
+            clauses.append(f"NOT ({clause})" if negate else clause)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else ""
+
+    @staticmethod
+    def split_columns(columns: str) -> List[str]:
+        parts, depth, current = [], 0, ""
+        for ch in columns:
+            if ch == "(":
+                depth += 1
+            elif ch == ")":
+                depth -= 1
+            if ch == "," and depth == 0:
+                parts.append(current.strip())
+                current = ""
+            else:
+                current += ch
+        if current.strip():
+            parts.append(current.strip())
+        return parts
+
+    def projection(self, query: PostgresQuery, alias: str = "t") -> str:
+        out = []
+        for part in self.split_columns(query.columns):
+            if "(" in part:
+                child, inner = part.split("(", 1)
+                child = child.strip()
+                inner_cols = inner.rstrip(")").strip() or "*"
+                fk = query.table[:-1] + "_id" if query.table.endswith("s") else query.table + "_id"
+                if inner_cols == "*":
+                    row_expr = "c"
+                else:
+                    pairs = ", ".join(
+                        f"'{c}', c.{_ident(c)}" for c in self.split_columns(inner_cols)
+                    )
+                    row_expr = f"json_build_object({pairs})"
+                out.append(
+                    f"(SELECT coalesce(json_agg({row_expr}), '[]'::json) FROM {_ident(child)} c "
+                    f"WHERE c.{_ident(fk)} = {alias}.\"id\") AS {_ident(child)}"
+                )
+            elif part == "*":
+                out.append(f"{alias}.*")
+            else:
+                out.append(f"{alias}.{_ident(part)}")
+        return ", ".join(out)
+
+    def compile_select(self, query: PostgresQuery) -> str:
+        sql = f"SELECT {self.projection(query)} FROM {_ident(query.table)} t{self.where(query)}"
+        if query.orders:
+            terms = []
+            for column, desc, nullsfirst in query.orders:
+                term = f"t.{_ident(column)} {'DESC' if desc else 'ASC'}"
+                if nullsfirst is not None:
+                    term += " NULLS FIRST" if nullsfirst else " NULLS LAST"
+                terms.append(term)
+            sql += " ORDER BY " + ", ".join(terms)
+        if query.limit_value is not None:
+            sql += f" LIMIT {int(query.limit_value)}"
+        if query.offset_value:
+            sql += f" OFFSET {int(query.offset_value)}"
+        return sql
+
+    def compile_count(self, query: PostgresQuery) -> str:
+        return f"SELECT count(*) FROM {_ident(query.table)} t{self.where(query)}"
+
+    def compile_insert(self, query: PostgresQuery) -> str:
+        rows = query.payload if isinstance(query.payload, list) else [query.payload]
+        columns: List[str] = []
+        for row in rows:
+            for key in row.keys():
+                if key not in columns:
+                    columns.append(key)
+        values_sql = []
+        for row in rows:
+            values_sql.append(
+                "(" + ", ".join(self.bind(c, row[c]) if c in row else "DEFAULT" for c in columns) + ")"
+            )
+        sql = (
+            f"INSERT INTO {_ident(query.table)} AS t ({', '.join(_ident(c) for c in columns)}) "
+            f"VALUES {', '.join(values_sql)}"
+        )
+        if query.op == "upsert":
+            conflict = [c.strip() for c in query.on_conflict.split(",")] if query.on_conflict else self.primary_key
+            updates = [c for c in columns if c not in conflict]
+            sql += f" ON CONFLICT ({', '.join(_ident(c) for c in conflict)})"
+            if updates:
+                sql += " DO UPDATE SET " + ", ".join(f"{_ident(c)} = EXCLUDED.{_ident(c)}" for c in updates)
+            else:
+                sql += " DO NOTHING"
+        return sql + " RETURNING t.*"
+
+    def compile_update(self, query: PostgresQuery) -> str:
+        sets = ", ".join(f"{_ident(c)} = {self.bind(c, v)}" for c, v in query.payload.items())
+        return f"UPDATE {_ident(query.table)} t SET {sets}{self.where(query)} RETURNING t.*"
+
+    def compile_delete(self, query: PostgresQuery) -> str:
+        return f"DELETE FROM {_ident(query.table)} t{self.where(query)} RETURNING t.*"
+
+
+class PostgresRpc:
+    def __init__(self, client: "PostgresClient", fn: str, params: Optional[dict] = None):
+        self._client = client
+        self.fn = fn
+        self.params = params or {}
+
+    def execute(self) -> PostgresResult:
+        return self._client.execute_rpc(self.fn, self.params)
+
+
+async def _init_connection(conn) -> None:
+    for typename in ("json", "jsonb"):
+        await conn.set_type_codec(
+            typename,
+            encoder=lambda v: v if isinstance(v, str) else json.dumps(v, default=str),
+            decoder=json.loads,
+            schema="pg_catalog",
+        )
+
+
+class PostgresClient:
+    """
+    asyncpg pool driven from a dedicated event-loop thread.
+
+    SupabaseDatabase methods are synchronous and are called both from the
+    request loop (through AsyncDatabase's thread offload) and from sync
+    helpers, so the pool lives on its own loop and callers block on
+    run_coroutine_threadsafe. Concurrency is bounded by the pool size.
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        min_size: int = POSTGRES_POOL_MIN_SIZE,
+        max_size: int = POSTGRES_POOL_MAX_SIZE,
+        statement_cache_size: int = POSTGRES_STATEMENT_CACHE_SIZE,
+        command_timeout: float = POSTGRES_COMMAND_TIMEOUT,
+    ):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="postgres-pool", daemon=True)
+        self._thread.start()
+        self._column_types: Dict[str, Dict[str, str]] = {}
+        self._primary_keys: Dict[str, List[str]] = {}
+        self.pool = self.run(
+            asyncpg.create_pool(
+                dsn=dsn,
+                min_size=min_size,
+                max_size=max_size,
+                statement_cache_size=statement_cache_size,
+                command_timeout=command_timeout,
+                init=_init_connection,
+            )
+        )
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def close(self) -> None:
+        try:
+            self.run(self.pool.close())
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    # supabase-py compatible entry points
+    def table(self, name: str) -> PostgresQuery:
+        return PostgresQuery(self, name)
+
+    def rpc(self, fn: str, params: Optional[dict] = None) -> PostgresRpc:
+        return PostgresRpc(self, fn, params)
+
+    # Raw SQL helpers for methods that use server-side joins
+    def fetch(self, sql: str, *args) -> List[dict]:
+        async def _fetch():
+            async with self.pool.acquire() as conn:
+                return await conn.fetch(sql, *args)
+        return [_record_to_dict(r) for r in self.run(_fetch())]
+
+    def fetchrow(self, sql: str, *args) -> Optional[dict]:
+        rows = self.fetch(sql, *args)
+        return rows[0] if rows else None
+
+    def fetchval(self, sql: str, *args) -> Any:
+        async def _fetchval():
+            async with self.pool.acquire() as conn:
+                return await conn.fetchval(sql, *args)
+        return _to_json_value(self.run(_fetchval()))
+
+    async def _table_meta(self, conn, table: str) -> Tuple[Dict[str, str], List[str]]:
+        if table not in self._column_types:
+            rows = await conn.fetch(
+                "SELECT column_name, udt_name FROM information_schema.columns "
+                "WHERE table_schema = 'public' AND table_name = $1",
+                table,
+            )
+            pk_rows = await conn.fetch(
+                "SELECT a.attname FROM pg_index i "
+                "JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey) "
+                "WHERE i.indrelid = ('public.' || quote_ident($1))::regclass AND i.indisprimary",
+                table,
+            )
+            self._column_types[table] = {r["column_name"]: r["udt_name"] for r in rows}
+            self._primary_keys[table] = [r["attname"] for r in pk_rows] or ["id"]
+        return self._column_types[table], self._primary_keys[table]
+
+    def execute_query(self, query: PostgresQuery) -> PostgresResult:
+        async def _execute():
+            async with self.pool.acquire() as conn:
+                column_types, primary_key = await self._table_meta(conn, query.table)
+                compiler = SqlCompiler(column_types, primary_key)
+                if query.op == "select":
+                    sql = compiler.compile_select(query)
+                    rows = await conn.fetch(sql, *compiler.args)
+                    count = None
+                    if query.count:
+                        counter = SqlCompiler(column_types, primary_key)
+                        count = await conn.fetchval(counter.compile_count(query), *counter.args)
+                    return rows, count
+                if query.op in ("insert", "upsert"):
+                    if isinstance(query.payload, list) and not query.payload:
+                        return [], None
+                    sql = compiler.compile_insert(query)
+                elif query.op == "update":
+                    sql = compiler.compile_update(query)
+                else:
+                    sql = compiler.compile_delete(query)
+                return await conn.fetch(sql, *compiler.args), None
+
+        rows, count = self.run(_execute())
+        return PostgresResult([_record_to_dict(r) for r in rows], count)
+
+    def execute_rpc(self, fn: str, params: dict) -> PostgresResult:
+        names = list(params.keys())
+        arg_sql = ", ".join(f"{_ident(n)} => ${i + 1}" for i, n in enumerate(names))
+        sql = f"SELECT * FROM {_ident(fn)}({arg_sql})"
+        rows = self.fetch(sql, *[params[n] for n in names])
+        # Scalar functions come back as a single column named after the function;
+        # PostgREST returns the bare value in that case.
+        if len(rows) == 1 and list(rows[0].keys()) == [fn]:
+            return PostgresResult(rows[0][fn])
+        return PostgresResult(rows)
+
+
+class PostgresDatabase(SupabaseDatabase):
+    """
+    SupabaseDatabase talking to Postgres directly over an asyncpg pool.
+
+    All SupabaseDatabase methods work unchanged through the PostgREST-compatible
+    PostgresClient; the hottest reads are overridden below with server-side joins.
+    Selected with USE_POSTGRES=true and DATABASE_URL (any Postgres with the
+    supabase/migrations schema applied; no Supabase project needed).
+    """
+
+    def __init__(self, dsn: Optional[str] = None):
+        dsn = dsn or DATABASE_URL
+        if not dsn:
+            raise ValueError("DATABASE_URL is not configured")
+        self.client = PostgresClient(dsn)
+        try:
+            users = self.client.fetchval("SELECT count(*) FROM users")
+            print(f"[DB] Postgres connection verified ({users} user(s), pool max={POSTGRES_POOL_MAX_SIZE})")
+        except Exception as e:
+            self.client.close()
+            raise ValueError(f"Postgres cannot query users table: {e}")
+
+    def close(self) -> None:
+        self.client.close()
+
+    @loader_cached("sales")
+    def get_sale(self, sale_id: str) -> Optional[dict]:
+        sale = self.client.fetchrow(
+            "SELECT s.*, coalesce((SELECT json_agg(i) FROM sale_items i WHERE i.sale_id = s.id), '[]'::json) AS items "
+            "FROM sales s WHERE s.id = $1::text::uuid",
+            str(sale_id),
+        )
+        if not sale:
+            return None
+        sale["payment_status"] = PaymentStatus(sale["payment_status"]) if sale.get("payment_status") else PaymentStatus.DUE
+        sale["status"] = OrderStatus(sale["status"]) if sale.get("status") else OrderStatus.PENDING
+        return sale
+
+    def _get_sale_return_totals(self, sale_ids: List[str], from_date: Optional[str] = None) -> Dict[str, dict]:
+        """Per-sale return totals aggregated server-side in one statement."""
+        if not sale_ids:
+            return {}
+        rows = self.client.fetch(
+            "SELECT r.sale_id, count(*) AS return_count, "
+            "coalesce(sum(r.total_return_amount), 0) AS returned_total, "
+            "coalesce(sum(q.qty), 0) AS returned_qty "
+            "FROM sales_returns r "
+            "LEFT JOIN LATERAL (SELECT sum(i.quantity_returned) AS qty FROM sales_return_items i "
+            "WHERE i.return_id = r.id) q ON true "
+            "WHERE r.sale_id = ANY($1::text[]::uuid[]) GROUP BY r.sale_id",
+            [str(sale_id) for sale_id in sale_ids],
+        )
+        return {
+            str(row["sale_id"]): {
+                "returned_total": float(row["returned_total"] or 0),
+                "return_count": int(row["return_count"] or 0),
+                "returned_qty": int(row["returned_qty"] or 0),
+            }
+            for row in rows
+        }
+
+    def _sum_previous_dues(self, retailer_ids: List[str], exclude_route_id: Optional[str] = None) -> Dict[str, float]:
+        """Previous due from unpaid sales, grouped server-side in one statement."""
+        route_clause = "s.route_id IS NULL"
+        args: List[Any] = [retailer_ids]
+        if exclude_route_id:
+            args.append(str(exclude_route_id))
+            route_clause = "s.route_id IS DISTINCT FROM $2::text::uuid"
+        rows = self.client.fetch(
+            "SELECT s.retailer_id, coalesce(sum(s.due_amount), 0) AS due FROM sales s "
+            "WHERE s.retailer_id = ANY($1::text[]::uuid[]) AND s.payment_status <> 'paid' "
+            f"AND {route_clause} GROUP BY s.retailer_id",
+            *args,
+        )
+        dues = {retailer_id: 0.0 for retailer_id in retailer_ids}
+        dues.update({str(row["retailer_id"]): float(row["due"] or 0) for row in rows})
+        return dues
+
+    def get_payments(
+        self,
+        sale_id: Optional[str] = None,
+        user_id: Optional[str] = None,
+        route_id: Optional[str] = None,
+        from_date: Optional[str] = None,
+        to_date: Optional[str] = None,
+        enrich_routes: bool = True,
+        approval_status: Optional[str] = None,
+    ) -> List[dict]:
+        clauses, args = [], []
+        for column, value in (
+            ("sale_id", sale_id),
+            ("collected_by", user_id),
+            ("route_id", route_id),
+        ):
+            if value:
+                args.append(str(value))
+                clauses.append(f"p.{column} = ${len(args)}::text::uuid")
+        if approval_status:
+            args.append(approval_status)
+            clauses.append(f"p.approval_status = ${len(args)}")
+        if from_date:
+            args.append(from_date)
+            clauses.append(f"p.created_at >= ${len(args)}::text::timestamptz")
+        if to_date:
+            try:
+                end_datetime = datetime.fromisoformat(to_date.replace("Z", "+00:00")) + timedelta(days=1)
+                args.append(end_datetime.isoformat())
+                clauses.append(f"p.created_at < ${len(args)}::text::timestamptz")
+            except ValueError:
+                pass
+        where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+        if enrich_routes:
+            sql = (
+                "SELECT p.*, r.route_number AS joined_route_number FROM payments p "
+                f"LEFT JOIN routes r ON r.id = p.route_id{where} ORDER BY p.created_at DESC"
+            )
+        else:
+            sql = f"SELECT p.* FROM payments p{where} ORDER BY p.created_at DESC"
+        payments = self.client.fetch(sql, *args)
+        for payment in payments:
+            route_number = payment.pop("joined_route_number", None)
+            if route_number:
+                payment["route_number"] = route_number
+        return payments
@@ -0,0 +1,165 @@
+"""
+Compiled price-list index for resolving whole orders in memory.
+
+PriceIndex is built once from price_lists, price_list_items and
+retailer_price_list_assignments:
+
+    retailer -> active price lists (by priority)
+    price list -> product -> (variant_id, uom) -> min_qty tiers (sorted)
+
+so resolving a line is a few dict lookups plus a bisect over the tiers,
+with no queries. Item variant_id / uom of None match any requested value,
+exactly like the old per-line resolve_price.
+
+The Supabase backend keeps one compiled index per process in
+`price_indexes`, keyed by the reference_cache versions of the three tables:
+create_price_list, upsert_price_list_item and assign_price_list_to_retailer
+invalidate those tables, so the next lookup recompiles. The TTL
+(REFERENCE_CACHE_TTL_SECONDS) bounds staleness across API workers.
+"""
+
+import threading
+import time
+from bisect import bisect_right
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.reference_cache import REFERENCE_CACHE_ENABLED, REFERENCE_CACHE_TTL_SECONDS, reference_cache
+
+PRICE_INDEX_TABLES = ("price_lists", "price_list_items", "retailer_price_list_assignments")
+
+
+def default_price(product: Optional[dict]) -> dict:
+    fallback = float((product or {}).get("selling_price", 0) or 0)
+    return {
+        "price_list_id": None,
+        "price_source": "product_default",
+        "base_price": fallback,
+        "resolved_price": fallback,
+        "discount_percent": 0,
+    }
+
+
+def _priority(price_list: dict) -> float:
+    """Sort key for a price list; NULL priority sorts with the default (100)."""
+    priority = price_list.get("priority")
+    return 100 if priority is None else float(priority)
+
+
+class PriceIndex:
+    """Immutable lookup structure compiled from price-list rows."""
+
+    def __init__(self, price_lists: Iterable[dict], items: Iterable[dict], assignments: Iterable[dict]):
+        active = {str(pl["id"]): pl for pl in price_lists if pl.get("id") and pl.get("is_active", True)}
+        lists_by_retailer: Dict[str, Dict[str, dict]] = {}
+        for assignment in assignments:
+            price_list = active.get(str(assignment.get("price_list_id")))
+            if price_list is not None:
+                lists_by_retailer.setdefault(str(assignment.get("retailer_id")), {})[str(price_list["id"])] = price_list
+        self._lists_by_retailer: Dict[str, List[str]] = {
+            retailer_id: sorted(lists, key=lambda pl_id: _priority(lists[pl_id]))
+            for retailer_id, lists in lists_by_retailer.items()
+        }
+
+        # (price list, product) -> (variant_id, uom) -> (min_qtys ascending, [(position, item)])
+        tiers: Dict[Tuple[str, str], Dict[Tuple[Optional[str], Optional[str]], List[Tuple[float, int, dict]]]] = {}
+        for position, item in enumerate(items):
+            if str(item.get("price_list_id")) not in active:
+                continue
+            variants = tiers.setdefault((str(item["price_list_id"]), str(item.get("product_id"))), {})
+            variants.setdefault((item.get("variant_id") or None, item.get("uom") or None), []).append(
+                (float(item.get("min_qty", 0) or 0), -position, item)
+            )
+        self._tiers = {}
+        for key, variants in tiers.items():
+            compiled = {}
+            for variant_key, rows in variants.items():
+                # Equal min_qty sorts the earliest row last, so bisect_right lands on it
+                rows.sort(key=lambda t: (t[0], t[1]))
+                compiled[variant_key] = ([t[0] for t in rows], [(-t[1], t[2]) for t in rows])
+            self._tiers[key] = compiled
+
+    def price_lists_for(self, retailer_id: str) -> List[str]:
+        return self._lists_by_retailer.get(str(retailer_id), [])
+
+    def resolve(
+        self,
+        retailer_id: str,
+        product_id: str,
+        variant_id: Optional[str] = None,
+        quantity: float = 1,
+        uom: Optional[str] = None,
+    ) -> Optional[dict]:
+        """Price from the first matching price list, or None when no list prices this line."""
+        quantity = float(quantity or 0)
+        keys = {(v, u) for v in (None, variant_id or None) for u in (None, uom or None)}
+        for price_list_id in self.price_lists_for(retailer_id):
+            variants = self._tiers.get((price_list_id, str(product_id)))
+            if not variants:
+                continue
+            best = None  # (min_qty, -position, item): highest tier wins, earliest row on ties
+            for key in keys:
+                tier = variants.get(key)
+                if not tier:
+                    continue
+                min_qtys, rows = tier
+                at = bisect_right(min_qtys, quantity) - 1
+                if at >= 0:
+                    candidate = (min_qtys[at], -rows[at][0], rows[at][1])
+                    if best is None or candidate[:2] > best[:2]:
+                        best = candidate
+            if best:
+                item = best[2]
+                base_price = float(item.get("unit_price", 0) or 0)
+                discount_percent = float(item.get("discount_percent", 0) or 0)
+                return {
+                    "price_list_id": price_list_id,
+                    "price_source": "price_list",
+                    "base_price": base_price,
+                    "resolved_price": round(base_price * (1 - discount_percent / 100), 2),
+                    "discount_percent": discount_percent,
+                }
+        return None
+
+
+class PriceIndexCache:
+    """One compiled PriceIndex per process, rebuilt when its source tables are invalidated or the TTL lapses."""
+
+    def __init__(self, ttl_seconds: float = REFERENCE_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.compiles = 0
+        self.hits = 0
+        self._entry: Optional[tuple] = None  # (versions, compiled_at, index)
+        self._lock = threading.Lock()
+
+    def _versions(self) -> tuple:
+        return tuple(reference_cache.version(table) for table in PRICE_INDEX_TABLES)
+
+    def get(self, compile_index: Callable[[], PriceIndex]) -> PriceIndex:
+        versions = self._versions()
+        with self._lock:
+            entry = self._entry
+            if (
+                REFERENCE_CACHE_ENABLED
+                and entry
+                and entry[0] == versions
+                and time.monotonic() - entry[1] < self.ttl_seconds
+            ):
+                self.hits += 1
+                return entry[2]
+        index = compile_index()
+        with self._lock:
+            self.compiles += 1
+            if versions == self._versions():  # not invalidated while compiling
+                self._entry = (versions, time.monotonic(), index)
+        return index
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entry = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "compiles": self.compiles, "cached": self._entry is not None}
+
+
+price_indexes = PriceIndexCache()
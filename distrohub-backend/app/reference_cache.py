@@ -0,0 +1,140 @@
+"""
+Process-wide cache for reference data (catalog, warehouses, price lists, SMS config).
+
+Each table is cached as a full row list with a TTL. Write methods on the
+backend invalidate their table (see dataloader.invalidates), which bumps the
+table's version; a load that started before an invalidation is discarded
+instead of stored, so a slow read can never re-populate the cache with
+pre-write rows.
+
+TTL bounds staleness across processes (several API workers each hold their
+own copy). Defaults: REFERENCE_CACHE_TTL_SECONDS=300, and a shorter
+REFERENCE_CACHE_PRODUCTS_TTL_SECONDS=30 for products because stock_quantity
+moves with every sale.
+"""
+
+import os
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+REFERENCE_CACHE_ENABLED = os.environ.get("REFERENCE_CACHE_ENABLED", "true").lower() == "true"
+REFERENCE_CACHE_TTL_SECONDS = float(os.environ.get("REFERENCE_CACHE_TTL_SECONDS", "300"))
+REFERENCE_CACHE_PRODUCTS_TTL_SECONDS = float(os.environ.get("REFERENCE_CACHE_PRODUCTS_TTL_SECONDS", "30"))
+
+REFERENCE_TABLES = (
+    "products",
+    "latest_product_batches",
+    "categories",
+    "units",
+    "warehouses",
+    "suppliers",
+    "price_lists",
+    "price_list_items",
+    "retailer_price_list_assignments",
+    "uom_conversions",
+    "sms_templates",
+    "sms_settings",
+)
+
+
+class ReferenceCache:
+    """Versioned, TTL-bound row lists per table with hit/miss counters."""
+
+    def __init__(self, ttl_seconds: float = REFERENCE_CACHE_TTL_SECONDS, ttl_overrides: Optional[Dict[str, float]] = None):
+        self.ttl_seconds = ttl_seconds
+        self.ttl_overrides = ttl_overrides or {}
+        self._entries: Dict[str, tuple] = {}  # table -> (version, loaded_at, rows)
+        self._versions: Dict[str, int] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _count(self, table: str, key: str) -> None:
+        stats = self._stats.setdefault(table, {"hits": 0, "misses": 0, "invalidations": 0})
+        stats[key] += 1
+
+    def _ttl(self, table: str) -> float:
+        return self.ttl_overrides.get(table, self.ttl_seconds)
+
+    def peek(self, table: str) -> Optional[List[dict]]:
+        """Cached rows (copied per row) or None on miss/expiry."""
+        with self._lock:
+            entry = self._entries.get(table)
+            if entry and entry[0] == self._versions.get(table, 0) and time.monotonic() - entry[1] < self._ttl(table):
+                self._count(table, "hits")
+                rows = entry[2]
+            else:
+                self._count(table, "misses")
+                return None
+        return [dict(row) for row in rows]
+
+    def version(self, table: str) -> int:
+        with self._lock:
+            return self._versions.get(table, 0)
+
+    def store(self, table: str, rows: List[dict], version: int) -> None:
+        with self._lock:
+            if version != self._versions.get(table, 0):
+                return  # invalidated while loading
+            self._entries[table] = (version, time.monotonic(), [dict(row) for row in rows])
+
+    def get_or_load(self, table: str, load: Callable[[], List[dict]]) -> List[dict]:
+        if not REFERENCE_CACHE_ENABLED:
+            return load()
+        rows = self.peek(table)
+        if rows is not None:
+            return rows
+        version = self.version(table)
+        rows = load() or []
+        self.store(table, rows, version)
+        return [dict(row) for row in rows]
+
+    async def get_or_load_async(self, table: str, load: Callable[[], Awaitable[List[dict]]]) -> List[dict]:
+        if not REFERENCE_CACHE_ENABLED:
+            return await load()
+        rows = self.peek(table)
+        if rows is not None:
+            return rows
+        version = self.version(table)
+        rows = await load() or []
+        self.store(table, rows, version)
+        return [dict(row) for row in rows]
+
+    def invalidate(self, *tables: str) -> None:
+        with self._lock:
+            for table in tables:
+                if table not in REFERENCE_TABLES:
+                    continue
+                self._versions[table] = self._versions.get(table, 0) + 1
+                self._entries.pop(table, None)
+                self._count(table, "invalidations")
+
+    def clear(self) -> None:
+        self.invalidate(*REFERENCE_TABLES)
+
+    def stats(self) -> dict:
+        with self._lock:
+            tables = {}
+            hits = misses = 0
+            for table, counts in self._stats.items():
+                lookups = counts["hits"] + counts["misses"]
+                tables[table] = {
+                    **counts,
+                    "version": self._versions.get(table, 0),
+                    "cached_rows": len(self._entries[table][2]) if table in self._entries else 0,
+                    "hit_ratio": round(counts["hits"] / lookups, 3) if lookups else 0.0,
+                }
+                hits += counts["hits"]
+                misses += counts["misses"]
+        total = hits + misses
+        return {
+            "enabled": REFERENCE_CACHE_ENABLED,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / total, 3) if total else 0.0,
+            "tables": tables,
+        }
+
+
+reference_cache = ReferenceCache(ttl_overrides={"products": REFERENCE_CACHE_PRODUCTS_TTL_SECONDS})
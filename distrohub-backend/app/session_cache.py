@@ -0,0 +1,66 @@
+"""
+Process-wide cache of users.token_version for JWT revocation checks.
+
+Access tokens carry the user's claims (role, name, ...) and the token_version
+(`tv`) they were issued under. get_current_user trusts the claims as long as
+the cached version for that user matches; on a miss or expiry it reloads the
+user row once and re-caches the version.
+
+update_user / delete_user drop the local entry (the DB trigger bumps
+token_version on role/email/password/name/phone changes), so this process
+sees revocations immediately and other workers within
+TOKEN_VERSION_CACHE_TTL_SECONDS (default 60).
+"""
+
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+TOKEN_VERSION_CACHE_TTL_SECONDS = float(os.environ.get("TOKEN_VERSION_CACHE_TTL_SECONDS", "60"))
+
+
+class TokenVersionCache:
+    """user_id -> (token_version, cached_at) with a TTL and hit/miss counters."""
+
+    def __init__(self, ttl_seconds: float = TOKEN_VERSION_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str) -> Optional[int]:
+        with self._lock:
+            entry = self._entries.get(str(user_id))
+            if entry and time.monotonic() - entry[1] < self.ttl_seconds:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def put(self, user_id: str, version: int) -> None:
+        with self._lock:
+            self._entries[str(user_id)] = (int(version or 0), time.monotonic())
+
+    def revoke(self, user_id: str) -> None:
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "ttl_seconds": self.ttl_seconds,
+                "cached_users": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+token_versions = TokenVersionCache()
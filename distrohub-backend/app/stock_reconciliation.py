@@ -0,0 +1,216 @@
+"""
+Stock reconciliation: products.stock_quantity vs batch quantities vs the stock ledger.
+
+Backends return per (product, warehouse) aggregates from
+get_stock_reconciliation_aggregates() — one GROUP BY on the server, or
+batches folded with the stock_ledger_balances rows by
+fold_reconciliation_aggregates() — and build_reconciliation_report() merges
+them with the product list in one pass. The ledger side never rescans
+stock_ledger: stock_ledger_balances is kept current by a trigger as entries
+are appended, and rebuild_stock_ledger_balances() recomputes it from
+scratch. Warehouse rows compare batch quantity with the ledger net for that
+warehouse; ledger lines without a warehouse are grouped under None.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+def _to_int(value: Any) -> int:
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _key(value) -> Optional[str]:
+    return str(value) if value else None
+
+
+def ledger_balance_rows(ledger_rows: Iterable[dict]) -> List[dict]:
+    """
+    Fold stock_ledger rows into balances per (product_id, warehouse_id, batch_id):
+    {product_id, warehouse_id, batch_id, quantity, entries}, the shape of the
+    stock_ledger_balances table. Lines without a product keep a None product_id so
+    they still count towards the ledger total. Accepts any iterable, so a paged
+    scan streams through.
+    """
+    balances: Dict[Tuple[Optional[str], Optional[str], Optional[str]], dict] = {}
+    for entry in ledger_rows:
+        key = (_key(entry.get("product_id")), _key(entry.get("warehouse_id")), _key(entry.get("batch_id")))
+        row = balances.get(key)
+        if row is None:
+            row = balances[key] = {"product_id": key[0], "warehouse_id": key[1], "batch_id": key[2], "quantity": 0, "entries": 0}
+        row["quantity"] += _to_int(entry.get("quantity_change"))
+        row["entries"] += 1
+    return list(balances.values())
+
+
+def product_ledger_totals(ledger_balances: Iterable[dict]) -> Tuple[Dict[str, int], Dict[str, int], int]:
+    """Ledger net and entry count per product_id, plus total entries, from balance rows."""
+    net: Dict[str, int] = {}
+    count: Dict[str, int] = {}
+    total = 0
+    for balance in ledger_balances:
+        entries = _to_int(balance.get("entries"))
+        total += entries
+        if balance.get("product_id"):
+            product_id = str(balance["product_id"])
+            net[product_id] = net.get(product_id, 0) + _to_int(balance.get("quantity"))
+            count[product_id] = count.get(product_id, 0) + entries
+    return net, count, total
+
+
+def fold_reconciliation_aggregates(batches: Iterable[dict], ledger_balances: Iterable[dict]) -> dict:
+    """
+    Sum batch quantity and ledger balance / entry count per (product_id, warehouse_id).
+
+    ledger_balances are stock_ledger_balances rows (or ledger_balance_rows()).
+    Returns {"rows": [{product_id, warehouse_id, batch_quantity, ledger_quantity,
+    ledger_entries}], "ledger_rows": n}, the shape of the
+    get_stock_reconciliation_aggregates RPC.
+    """
+    groups: Dict[Tuple[str, Optional[str]], dict] = {}
+
+    def group(product_id, warehouse_id) -> dict:
+        key = (str(product_id), _key(warehouse_id))
+        row = groups.get(key)
+        if row is None:
+            row = groups[key] = {
+                "product_id": key[0],
+                "warehouse_id": key[1],
+                "batch_quantity": 0,
+                "ledger_quantity": 0,
+                "ledger_entries": 0,
+            }
+        return row
+
+    for batch in batches:
+        if batch.get("product_id"):
+            group(batch["product_id"], batch.get("warehouse_id"))["batch_quantity"] += _to_int(batch.get("quantity"))
+    ledger_count = 0
+    for balance in ledger_balances:
+        entries = _to_int(balance.get("entries"))
+        ledger_count += entries
+        if balance.get("product_id") and entries:
+            row = group(balance["product_id"], balance.get("warehouse_id"))
+            row["ledger_quantity"] += _to_int(balance.get("quantity"))
+            row["ledger_entries"] += entries
+    return {"rows": list(groups.values()), "ledger_rows": ledger_count}
+
+
+def _status(stock_batch_mismatch: bool, batch_ledger_mismatch: bool) -> str:
+    if stock_batch_mismatch and batch_ledger_mismatch:
+        return "mismatch_both"
+    if stock_batch_mismatch:
+        return "mismatch_stock_vs_batch"
+    if batch_ledger_mismatch:
+        return "mismatch_batch_vs_ledger"
+    return "ok"
+
+
+def build_reconciliation_report(
+    products: List[dict],
+    aggregates: dict,
+    include_only_mismatch: bool = True,
+    by_warehouse: bool = False,
+    warehouse_names: Optional[Dict[str, str]] = None,
+) -> dict:
+    """
+    Reconciliation report rows (one per product) from get_stock_reconciliation_aggregates().
+
+    With by_warehouse each row carries "warehouses": batch vs ledger per
+    warehouse, and include_only_mismatch also keeps products whose totals
+    agree but whose warehouses do not.
+    """
+    warehouse_names = warehouse_names or {}
+    per_product: Dict[str, List[dict]] = {}
+    for row in aggregates.get("rows") or []:
+        per_product.setdefault(str(row["product_id"]), []).append(row)
+
+    items = []
+    totals = {
+        "mismatch_stock_vs_batch": 0,
+        "mismatch_batch_vs_ledger": 0,
+        "sum_stock_quantity": 0,
+        "sum_batch_quantity": 0,
+        "sum_ledger_quantity": 0,
+    }
+    mismatch_warehouses = 0
+    for product in products:
+        product_id = product.get("id")
+        if not product_id:
+            continue
+        groups = per_product.get(str(product_id), [])
+        stock_quantity = _to_int(product.get("stock_quantity"))
+        batch_quantity = sum(_to_int(g.get("batch_quantity")) for g in groups)
+        ledger_quantity = sum(_to_int(g.get("ledger_quantity")) for g in groups)
+        ledger_entries = sum(_to_int(g.get("ledger_entries")) for g in groups)
+
+        stock_vs_batch_diff = stock_quantity - batch_quantity
+        batch_vs_ledger_diff = batch_quantity - ledger_quantity if ledger_entries > 0 else None
+        has_stock_batch_mismatch = stock_vs_batch_diff != 0
+        has_batch_ledger_mismatch = batch_vs_ledger_diff is not None and batch_vs_ledger_diff != 0
+
+        warehouses = []
+        if by_warehouse:
+            for g in sorted(groups, key=lambda g: (g.get("warehouse_id") is None, str(g.get("warehouse_id")))):
+                entries = _to_int(g.get("ledger_entries"))
+                diff = _to_int(g.get("batch_quantity")) - _to_int(g.get("ledger_quantity")) if entries > 0 else None
+                warehouse_id = _key(g.get("warehouse_id"))
+                warehouses.append(
+                    {
+                        "warehouse_id": warehouse_id,
+                        "warehouse_name": warehouse_names.get(warehouse_id) if warehouse_id else "Unassigned",
+                        "batch_quantity": _to_int(g.get("batch_quantity")),
+                        "ledger_quantity": _to_int(g.get("ledger_quantity")),
+                        "ledger_entries": entries,
+                        "batch_vs_ledger_diff": diff,
+                        "status": "ok" if not diff else "mismatch_batch_vs_ledger",
+                    }
+                )
+        warehouse_mismatches = sum(1 for w in warehouses if w["status"] != "ok")
+
+        if include_only_mismatch and not (has_stock_batch_mismatch or has_batch_ledger_mismatch or warehouse_mismatches):
+            continue
+
+        totals["mismatch_stock_vs_batch"] += int(has_stock_batch_mismatch)
+        totals["mismatch_batch_vs_ledger"] += int(has_batch_ledger_mismatch)
+        totals["sum_stock_quantity"] += stock_quantity
+        totals["sum_batch_quantity"] += batch_quantity
+        totals["sum_ledger_quantity"] += ledger_quantity
+        mismatch_warehouses += warehouse_mismatches
+
+        item = {
+            "product_id": product_id,
+            "product_name": product.get("name"),
+            "sku": product.get("sku"),
+            "stock_quantity": stock_quantity,
+            "batch_quantity": batch_quantity,
+            "ledger_quantity": ledger_quantity,
+            "ledger_entries": ledger_entries,
+            "stock_vs_batch_diff": stock_vs_batch_diff,
+            "batch_vs_ledger_diff": batch_vs_ledger_diff,
+            "status": _status(has_stock_batch_mismatch, has_batch_ledger_mismatch),
+        }
+        if by_warehouse:
+            item["warehouses"] = warehouses
+        items.append(item)
+
+    report_totals = {
+        "products_checked": len(products),
+        "rows_returned": len(items),
+        "mismatch_stock_vs_batch": totals["mismatch_stock_vs_batch"],
+        "mismatch_batch_vs_ledger": totals["mismatch_batch_vs_ledger"],
+        "sum_stock_quantity": totals["sum_stock_quantity"],
+        "sum_batch_quantity": totals["sum_batch_quantity"],
+        "sum_ledger_quantity": totals["sum_ledger_quantity"],
+        "ledger_rows_scanned": _to_int(aggregates.get("ledger_rows")),
+    }
+    if by_warehouse:
+        report_totals["mismatch_warehouse_batch_vs_ledger"] = mismatch_warehouses
+    return {
+        "generated_at": datetime.now().isoformat(),
+        "totals": report_totals,
+        "items": items,
+    }
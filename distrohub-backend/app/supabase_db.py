@@ -1,9 +1,18 @@
 import os
-import hashlib
-import bcrypt as _bcrypt_lib
-from datetime import datetime, date, timedelta
-from typing import Dict, List, Optional, Tuple
+from datetime import datetime, date, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
 from supabase import create_client, Client
+from app.dataloader import invalidates, loader_cached
+from app.reference_cache import reference_cache
+from app.batches import LATEST_BATCH_FIELDS, latest_batch_rows
+from app.stock_reconciliation import fold_reconciliation_aggregates, ledger_balance_rows, product_ledger_totals
+from app.dashboard_rollups import stats_from_rollup
+from app.session_cache import token_versions
+from app.password_pool import hash_password as _hash_password, verify_password as _verify_password
+from app.aging import DEFAULT_AGING_EDGES, age_receivables
+from app.margins import margin_row, summarize_margin_rows
+from app.pricing import PriceIndex, default_price, price_indexes
+from app.pagination import decode_cursor, encode_cursor, keyset_page, sort_key
 from app.models import (
     UserRole, PaymentStatus, OrderStatus, ExpiryStatus,
     ProductBatch, InventoryItem, ExpiryAlert, DashboardStats,
@@ -15,12 +24,72 @@ def _normalize_role(raw) -> UserRole:
 
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+# PostgREST caps responses at max-rows (1000 on Supabase); report reads page below it.
+# in_() lists are chunked to keep the request URL short.
+REPORT_PAGE_SIZE = int(os.environ.get("REPORT_PAGE_SIZE", "1000"))
+IN_FILTER_CHUNK_SIZE = int(os.environ.get("IN_FILTER_CHUNK_SIZE", "200"))
 
 def get_supabase_client() -> Optional[Client]:
     if SUPABASE_URL and SUPABASE_KEY:
         return create_client(SUPABASE_URL, SUPABASE_KEY)
     return None
 
+def _chunked(values: List, size: Optional[int] = None):
+    size = size or IN_FILTER_CHUNK_SIZE
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _iter_pages(build, page_size: Optional[int] = None) -> Iterator[List[dict]]:
+    """Yield the pages of build() (a fresh, ordered query) until a short page."""
+    page_size = page_size or REPORT_PAGE_SIZE
+    offset = 0
+    while True:
+        page = build().range(offset, offset + page_size - 1).execute().data or []
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        offset += page_size
+
+
+def _fetch_pages(build, page_size: Optional[int] = None) -> List[dict]:
+    """Run build() (a fresh, ordered query) page by page until a short page."""
+    rows: List[dict] = []
+    for page in _iter_pages(build, page_size):
+        rows.extend(page)
+    return rows
+
+
+def _is_missing_rpc_error(error: Exception) -> bool:
+    """True when PostgREST/Postgres reports the function does not exist (migration not applied)."""
+    code = getattr(error, "code", None) or getattr(error, "sqlstate", None)
+    if code in ("PGRST202", "42883"):
+        return True
+    text = str(error)
+    return "PGRST202" in text or "Could not find the function" in text
+
+
+def _is_missing_table_error(error: Exception) -> bool:
+    """True when PostgREST/Postgres reports the table does not exist (migration not applied)."""
+    code = getattr(error, "code", None) or getattr(error, "sqlstate", None)
+    if code in ("PGRST205", "42P01"):
+        return True
+    text = str(error)
+    return "PGRST205" in text or "Could not find the table" in text
+
+
+def _rpc_error_message(error: Exception) -> str:
+    """Pull the RAISE EXCEPTION text out of a PostgREST/asyncpg error."""
+    message = getattr(error, "message", None)
+    if message:
+        return str(message)
+    if error.args and isinstance(error.args[0], dict):
+        return str(error.args[0].get("message") or error.args[0])
+    return str(error)
+
+
 class SupabaseDatabase:
     def __init__(self):
         self.client = get_supabase_client()
@@ -37,27 +106,12 @@ class SupabaseDatabase:
 
     
     def hash_password(self, password: str) -> str:
-        """Hash password using bcrypt."""
-        pwd_bytes = password.encode("utf-8")[:72]
-        salt = _bcrypt_lib.gensalt(rounds=12)
-        return _bcrypt_lib.hashpw(pwd_bytes, salt).decode("utf-8")
+        """Hash password using bcrypt (cost from BCRYPT_ROUNDS)."""
+        return _hash_password(password)
 
     def verify_password(self, plain_password: str, hashed_password: str) -> bool:
         """Verify password. Supports both bcrypt (new) and SHA-256 (legacy) hashes."""
-        if not hashed_password:
-            return False
-        if hashed_password.startswith("$2b$") or hashed_password.startswith("$2a$"):
-            try:
-                return _bcrypt_lib.checkpw(
-                    plain_password.encode("utf-8")[:72],
-                    hashed_password.encode("utf-8")
-                )
-            except Exception:
-                return False
-        else:
-            # Legacy SHA-256 fallback (backward compatibility)
-            sha256_hash = hashlib.sha256(plain_password.encode()).hexdigest()
-            return sha256_hash == hashed_password
+        return _verify_password(plain_password, hashed_password)
 
     def log_audit_event(
         self,
@@ -92,6 +146,7 @@ class SupabaseDatabase:
             return user
         return None
     
+    @loader_cached("users")
     def get_user_by_id(self, user_id: str) -> Optional[dict]:
         """Get user by ID"""
         result = self.client.table("users").select("*").eq("id", user_id).execute()
@@ -109,13 +164,15 @@ class SupabaseDatabase:
             user["role"] = _normalize_role(user.get("role"))
         return users
     
-    def create_user(self, email: str, name: str, password: str, role: UserRole, phone: str = None) -> dict:
+    def create_user(
+        self, email: str, name: str, password: str, role: UserRole, phone: str = None, password_hash: str = None
+    ) -> dict:
         user_data = {
             "email": email,
             "name": name,
             "role": role.value if isinstance(role, UserRole) else role,
             "phone": phone,
-            "password_hash": self.hash_password(password)
+            "password_hash": password_hash or self.hash_password(password)
         }
         result = self.client.table("users").insert(user_data).execute()
         u = result.data[0] if result.data else user_data
@@ -123,6 +180,7 @@ class SupabaseDatabase:
             u["role"] = _normalize_role(u.get("role"))
         return u
     
+    @invalidates("users")
     def update_user(self, user_id: str, data: dict) -> Optional[dict]:
         """Update user information"""
         try:
@@ -137,7 +195,9 @@ class SupabaseDatabase:
             if "phone" in data:
                 update_data["phone"] = data["phone"] if data["phone"] else None
             
-            if "password" in data and data["password"]:
+            if data.get("password_hash"):
+                update_data["password_hash"] = data["password_hash"]
+            elif "password" in data and data["password"]:
                 update_data["password_hash"] = self.hash_password(data["password"])
 
             if "role" in data and data["role"] is not None:
@@ -154,6 +214,8 @@ class SupabaseDatabase:
                 return None
             
             result = self.client.table("users").update(update_data).eq("id", user_id).execute()
+            # users_bump_token_version trigger revokes outstanding tokens; drop our cached version
+            token_versions.revoke(user_id)
             u = result.data[0] if result.data else None
             if u:
                 u["role"] = _normalize_role(u.get("role"))
@@ -162,6 +224,7 @@ class SupabaseDatabase:
             print(f"[DB] Error updating user {user_id}: {e}")
             raise
     
+    @invalidates("users")
     def delete_user(self, user_id: str) -> bool:
         """Delete a user and clear assigned_to references in sales"""
         try:
@@ -179,19 +242,74 @@ class SupabaseDatabase:
             
             # Step 3: Delete the user
             result = self.client.table("users").delete().eq("id", user_id).execute()
+            token_versions.revoke(user_id)
             return len(result.data) > 0
         except Exception as e:
             print(f"[DB] Error deleting user {user_id}: {e}")
             raise
+
+    @invalidates("users")
+    def apply_password_rehashes(self, updates: List[dict]) -> int:
+        """
+        Write bcrypt upgrades of legacy password hashes.
+
+        Each update is {id, old_hash, password_hash}; a row is only written
+        while it still holds old_hash, so a password change that lands in
+        between is never overwritten. One RPC call per batch, per-row updates
+        when the function is not deployed. Returns the number of rows upgraded.
+        A rehash never bumps token_version: the RPC flags its update for the
+        trigger, the per-row path puts the bumped version back.
+        """
+        updates = [u for u in updates or [] if u.get("id") and u.get("password_hash")]
+        if not updates:
+            return 0
+
+        if getattr(self, "_password_rehash_rpc_available", True):
+            try:
+                result = self.client.rpc("apply_password_rehashes", {"p_updates": updates}).execute()
+                return int(result.data or 0)
+            except Exception as e:
+                if not _is_missing_rpc_error(e):
+                    raise ValueError(_rpc_error_message(e))
+                print("[Supabase] apply_password_rehashes RPC not found, using per-row updates")
+                self._password_rehash_rpc_available = False
+
+        written = 0
+        for item in updates:
+            result = (
+                self.client.table("users")
+                .update({"password_hash": item["password_hash"]})
+                .eq("id", item["id"])
+                .eq("password_hash", item["old_hash"])
+                .execute()
+            )
+            rows = result.data or []
+            for row in rows:
+                bumped = row.get("token_version")
+                if bumped:
+                    # The trigger can't tell this update from a password change
+                    (
+                        self.client.table("users")
+                        .update({"token_version": int(bumped) - 1})
+                        .eq("id", item["id"])
+                        .eq("password_hash", item["password_hash"])
+                        .eq("token_version", bumped)
+                        .execute()
+                    )
+            written += len(rows)
+        return written
     
     def get_products(self) -> List[dict]:
-        result = self.client.table("products").select("*").execute()
-        return result.data or []
+        return reference_cache.get_or_load(
+            "products", lambda: _fetch_pages(lambda: self.client.table("products").select("*").order("id"))
+        )
     
+    @loader_cached("products")
     def get_product(self, product_id: str) -> Optional[dict]:
         result = self.client.table("products").select("*").eq("id", product_id).execute()
         return result.data[0] if result.data else None
     
+    @invalidates("products")
     def create_product(self, data: dict) -> dict:
         """
         Create a product in Supabase.
@@ -242,10 +360,12 @@ class SupabaseDatabase:
             traceback.print_exc()
             raise Exception(f"Unexpected error creating product: {error_msg}")
     
+    @invalidates("products")
     def update_product(self, product_id: str, data: dict) -> Optional[dict]:
         result = self.client.table("products").update(data).eq("id", product_id).execute()
         return result.data[0] if result.data else None
 
+    @invalidates("products")
     def update_product_stock(self, product_id: str, quantity_change: int) -> Optional[dict]:
         product = self.get_product(product_id)
         if not product:
@@ -256,6 +376,7 @@ class SupabaseDatabase:
             new_qty = 0
         return self.update_product(product_id, {"stock_quantity": new_qty})
     
+    @invalidates("products", "product_batches", "latest_product_batches")
     def delete_product(self, product_id: str) -> bool:
         """Delete a product and its associated batches"""
         try:
@@ -279,11 +400,30 @@ class SupabaseDatabase:
             query = query.eq("warehouse_id", warehouse_id)
         result = query.execute()
         return result.data or []
+
+    def get_latest_batches(self) -> Dict[str, dict]:
+        """product_id -> latest batch summary (app.batches), cached with the reference data."""
+        rows = reference_cache.get_or_load("latest_product_batches", self._load_latest_batches)
+        return {str(row["product_id"]): row for row in rows}
+
+    def _load_latest_batches(self) -> List[dict]:
+        fields = ", ".join(LATEST_BATCH_FIELDS)
+        if getattr(self, "_latest_batches_view_available", True):
+            try:
+                return _fetch_pages(lambda: self.client.table("latest_product_batches").select(fields).order("product_id"))
+            except Exception as e:
+                if not _is_missing_table_error(e):
+                    raise
+                print("[Supabase] latest_product_batches view not found, reducing product_batches")
+                self._latest_batches_view_available = False
+        return latest_batch_rows(_fetch_pages(lambda: self.client.table("product_batches").select(fields).order("id")))
     
+    @loader_cached("product_batches")
     def get_batch(self, batch_id: str) -> Optional[dict]:
         result = self.client.table("product_batches").select("*").eq("id", batch_id).execute()
         return result.data[0] if result.data else None
     
+    @invalidates("latest_product_batches")
     def create_batch(self, data: dict) -> dict:
         if "expiry_date" in data and isinstance(data["expiry_date"], date):
             data["expiry_date"] = data["expiry_date"].isoformat()
@@ -295,6 +435,7 @@ class SupabaseDatabase:
         result = self.client.table("product_batches").insert(data).execute()
         return result.data[0] if result.data else data
     
+    @invalidates("product_batches")
     def update_batch_quantity(self, batch_id: str, quantity_change: int) -> Optional[dict]:
         batch = self.get_batch(batch_id)
         if batch:
@@ -302,7 +443,93 @@ class SupabaseDatabase:
             result = self.client.table("product_batches").update({"quantity": new_quantity}).eq("id", batch_id).execute()
             return result.data[0] if result.data else None
         return None
-    
+
+    @invalidates("products", "product_batches")
+    def apply_stock_movements(self, movements: List[dict], guard_non_negative: bool = False) -> dict:
+        """
+        Apply stock deltas atomically in one round-trip.
+
+        Each movement is {"batch_id", "product_id", "warehouse_id", "delta"}; any of the
+        ids may be omitted. batch_id moves product_batches.quantity, product_id moves
+        products.stock_quantity (clamped at 0) and warehouse_id + product_id moves the
+        warehouse_stock summary. With guard_non_negative, a batch or product that would
+        drop below zero rejects the whole call with ValueError.
+
+        Returns {"batches": {id: qty}, "products": {id: qty}, "warehouse_stock": {"wid:pid": qty}}.
+        """
+        payload = []
+        for movement in movements or []:
+            delta = int(movement.get("delta") or 0)
+            if delta == 0:
+                continue
+            payload.append({
+                "batch_id": movement.get("batch_id"),
+                "product_id": movement.get("product_id"),
+                "warehouse_id": movement.get("warehouse_id"),
+                "delta": delta,
+            })
+        if not payload:
+            return {"batches": {}, "products": {}, "warehouse_stock": {}}
+
+        if getattr(self, "_stock_movements_rpc_available", True):
+            try:
+                result = self.client.rpc(
+                    "apply_stock_movements",
+                    {"p_movements": payload, "p_guard_non_negative": guard_non_negative},
+                ).execute()
+                data = result.data or {}
+                return {
+                    "batches": data.get("batches") or {},
+                    "products": data.get("products") or {},
+                    "warehouse_stock": data.get("warehouse_stock") or {},
+                }
+            except Exception as e:
+                if not _is_missing_rpc_error(e):
+                    raise ValueError(_rpc_error_message(e))
+                print("[Supabase] apply_stock_movements RPC not found, using per-row stock updates")
+                self._stock_movements_rpc_available = False
+
+        return self._apply_stock_movements_per_row(payload, guard_non_negative)
+
+    def _apply_stock_movements_per_row(self, movements: List[dict], guard_non_negative: bool) -> dict:
+        """Fallback for databases without the apply_stock_movements function (not atomic)."""
+        batch_deltas: Dict[str, int] = {}
+        product_deltas: Dict[str, int] = {}
+        warehouse_deltas: Dict[tuple, int] = {}
+        for movement in movements:
+            delta = movement["delta"]
+            if movement.get("batch_id"):
+                batch_deltas[movement["batch_id"]] = batch_deltas.get(movement["batch_id"], 0) + delta
+            if movement.get("product_id"):
+                product_deltas[movement["product_id"]] = product_deltas.get(movement["product_id"], 0) + delta
+                if movement.get("warehouse_id"):
+                    key = (movement["warehouse_id"], movement["product_id"])
+                    warehouse_deltas[key] = warehouse_deltas.get(key, 0) + delta
+
+        if guard_non_negative:
+            for batch_id, delta in batch_deltas.items():
+                batch = self.get_batch(batch_id)
+                if batch and int(batch.get("quantity") or 0) + delta < 0:
+                    raise ValueError(f"Insufficient stock in batch {batch.get('batch_number')}")
+            for product_id, delta in product_deltas.items():
+                product = self.get_product(product_id)
+                if product and int(product.get("stock_quantity") or 0) + delta < 0:
+                    raise ValueError(f"Insufficient stock for product {product.get('name')}")
+
+        result = {"batches": {}, "products": {}, "warehouse_stock": {}}
+        for batch_id, delta in batch_deltas.items():
+            batch = self.update_batch_quantity(batch_id, delta)
+            if batch:
+                result["batches"][str(batch_id)] = batch.get("quantity")
+        for product_id, delta in product_deltas.items():
+            product = self.update_product_stock(product_id, delta)
+            if product:
+                result["products"][str(product_id)] = product.get("stock_quantity")
+        for (warehouse_id, product_id), delta in warehouse_deltas.items():
+            row = self.update_warehouse_stock(warehouse_id, product_id, delta)
+            result["warehouse_stock"][f"{warehouse_id}:{product_id}"] = (row or {}).get("total_quantity", 0)
+        return result
+
     def get_retailers(self) -> List[dict]:
         result = self.client.table("retailers").select("*").execute()
         return result.data or []
@@ -321,12 +548,108 @@ class SupabaseDatabase:
         return result.data[0] if result.data else None
     
     def update_retailer_due(self, retailer_id: str, amount_change: float) -> Optional[dict]:
-        retailer = self.get_retailer(retailer_id)
-        if retailer:
-            new_due = retailer["total_due"] + amount_change
-            result = self.client.table("retailers").update({"total_due": new_due}).eq("id", retailer_id).execute()
-            return result.data[0] if result.data else None
-        return None
+        result = self.apply_balance_deltas([
+            {"kind": "retailer_due", "id": retailer_id, "amount": amount_change}
+        ])
+        return result["retailers"].get(str(retailer_id))
+
+    @invalidates("sales", "routes", "users")
+    def apply_balance_deltas(self, deltas: List[dict], ledger_entries: Optional[List[dict]] = None) -> dict:
+        """
+        Apply signed balance deltas atomically in one round-trip.
+
+        Each delta is {"kind", "id", "amount"} with kind one of:
+        - "retailer_due": retailers.total_due += amount
+        - "sale_payment": sales.paid_amount += amount, due_amount -= amount (clamped at 0),
+          payment_status recomputed
+        - "sr_cash": users.current_cash_holding += amount plus an sr_cash_holdings audit row
+          (optional "source", "reference_id", "notes")
+
+        ledger_entries are receivable_ledger rows written in the same transaction.
+        Returns {"retailers": {id: row}, "sales": {id: row}, "sr_cash": {user_id: holding}, "ledger": [rows]}.
+        """
+        deltas = [
+            d for d in deltas or []
+            if d.get("id") and (d.get("kind") == "sr_cash" or float(d.get("amount") or 0) != 0)
+        ]
+        ledger_entries = [
+            {key: value for key, value in entry.items() if key != "created_at"}
+            for entry in ledger_entries or []
+        ]
+        if not deltas and not ledger_entries:
+            return {"retailers": {}, "sales": {}, "sr_cash": {}, "ledger": []}
+
+        if getattr(self, "_balance_deltas_rpc_available", True):
+            try:
+                result = self.client.rpc(
+                    "apply_balance_deltas",
+                    {"p_deltas": deltas, "p_ledger_entries": ledger_entries},
+                ).execute()
+                data = result.data or {}
+                return {
+                    "retailers": data.get("retailers") or {},
+                    "sales": data.get("sales") or {},
+                    "sr_cash": data.get("sr_cash") or {},
+                    "ledger": data.get("ledger") or [],
+                }
+            except Exception as e:
+                if not _is_missing_rpc_error(e):
+                    raise ValueError(_rpc_error_message(e))
+                print("[Supabase] apply_balance_deltas RPC not found, using per-row balance updates")
+                self._balance_deltas_rpc_available = False
+
+        return self._apply_balance_deltas_per_row(deltas, ledger_entries)
+
+    def _apply_balance_deltas_per_row(self, deltas: List[dict], ledger_entries: List[dict]) -> dict:
+        """Fallback for databases without the apply_balance_deltas function (not atomic)."""
+        result = {"retailers": {}, "sales": {}, "sr_cash": {}, "ledger": []}
+        for delta in deltas:
+            kind = delta.get("kind")
+            row_id = str(delta["id"])
+            amount = float(delta.get("amount") or 0)
+            if kind == "retailer_due":
+                retailer = self.get_retailer(row_id)
+                if retailer:
+                    new_due = float(retailer.get("total_due") or 0) + amount
+                    updated = self.client.table("retailers").update({"total_due": new_due}).eq("id", row_id).execute()
+                    if updated.data:
+                        result["retailers"][row_id] = updated.data[0]
+            elif kind == "sale_payment":
+                sale = self.client.table("sales").select("paid_amount,due_amount").eq("id", row_id).execute()
+                if sale.data:
+                    new_paid = float(sale.data[0].get("paid_amount") or 0) + amount
+                    new_due = max(0, float(sale.data[0].get("due_amount") or 0) - amount)
+                    updated = self.client.table("sales").update({
+                        "paid_amount": new_paid,
+                        "due_amount": new_due,
+                        "payment_status": "paid" if new_due <= 0.01 else "partial",
+                    }).eq("id", row_id).execute()
+                    if updated.data:
+                        result["sales"][row_id] = updated.data[0]
+            elif kind == "sr_cash":
+                user = self.get_user_by_id(row_id)
+                if not user:
+                    raise ValueError("User not found")
+                before_balance = float(user.get("current_cash_holding", 0) or 0)
+                after_balance = before_balance + amount
+                self.client.table("users").update({"current_cash_holding": after_balance}).eq("id", row_id).execute()
+                source = delta.get("source") or "manual_adjustment"
+                holding_record = {
+                    "user_id": row_id,
+                    "amount": amount,
+                    "before_balance": before_balance,
+                    "after_balance": after_balance,
+                    "source": source,
+                    "reference_id": delta.get("reference_id"),
+                    "notes": delta.get("notes") or f"Cash holding updated from {source}",
+                }
+                inserted = self.client.table("sr_cash_holdings").insert(holding_record).execute()
+                result["sr_cash"][row_id] = inserted.data[0] if inserted.data else holding_record
+            else:
+                raise ValueError(f"Unknown balance delta kind: {kind}")
+        for entry in ledger_entries:
+            result["ledger"].append(self.add_receivable_ledger_entry(entry))
+        return result
     
     def delete_retailer(self, retailer_id: str) -> bool:
         self.client.table("retailers").delete().eq("id", retailer_id).execute()
@@ -355,19 +678,23 @@ class SupabaseDatabase:
     # Warehouse methods
     def get_warehouses(self) -> List[dict]:
         """Get all warehouses"""
-        result = self.client.table("warehouses").select("*").order("name").execute()
-        return result.data or []
+        return reference_cache.get_or_load(
+            "warehouses", lambda: self.client.table("warehouses").select("*").order("name").execute().data
+        )
     
+    @loader_cached("warehouses")
     def get_warehouse(self, warehouse_id: str) -> Optional[dict]:
         """Get single warehouse by ID"""
         result = self.client.table("warehouses").select("*").eq("id", warehouse_id).execute()
         return result.data[0] if result.data else None
     
+    @invalidates("warehouses")
     def create_warehouse(self, data: dict) -> dict:
         """Create new warehouse"""
         result = self.client.table("warehouses").insert(data).execute()
         return result.data[0] if result.data else data
     
+    @invalidates("warehouses")
     def update_warehouse(self, warehouse_id: str, data: dict) -> Optional[dict]:
         """Update warehouse"""
         result = self.client.table("warehouses").update(data).eq("id", warehouse_id).execute()
@@ -443,6 +770,7 @@ class SupabaseDatabase:
                 return insert_result.data[0] if insert_result.data else None
         return None
     
+    @invalidates("warehouses")
     def delete_warehouse(self, warehouse_id: str) -> bool:
         """Delete warehouse with stock check"""
         stock_count = self.get_warehouse_stock_count(warehouse_id)
@@ -461,6 +789,7 @@ class SupabaseDatabase:
                 purchase.pop("purchase_items")
         return purchases
     
+    @invalidates("products", "product_batches")
     def create_purchase(self, data: dict, items: List[dict]) -> dict:
         from datetime import datetime
         import uuid
@@ -513,6 +842,7 @@ class SupabaseDatabase:
         
         # Create batches and purchase items
         purchase_items = []
+        stock_movements = []
         for item in items:
             product = self.get_product(item["product_id"])
             if not product:
@@ -522,14 +852,16 @@ class SupabaseDatabase:
             if batch_id:
                 existing_batch = self.get_batch(batch_id)
                 if existing_batch:
-                    # Update existing batch quantity
-                    self.update_batch_quantity(batch_id, item["quantity"])
-                    self.update_product_stock(item["product_id"], item["quantity"])
+                    # Top up existing batch (applied with the rest of the stock movements below)
+                    stock_movements.append({
+                        "batch_id": batch_id,
+                        "product_id": item["product_id"],
+                        "warehouse_id": warehouse_id,
+                        "delta": item["quantity"],
+                    })
                     batch_number = existing_batch.get("batch_number", item["batch_number"])
                     expiry_date = existing_batch.get("expiry_date", item["expiry_date"])
                     purchase_price = existing_batch.get("purchase_price", item["unit_price"])
-                    if warehouse_id:
-                        self.update_warehouse_stock(warehouse_id, item["product_id"], item["quantity"])
                     item_total = item["quantity"] * item["unit_price"]
                     purchase_item_data = {
                         "id": str(uuid.uuid4()),
@@ -558,11 +890,13 @@ class SupabaseDatabase:
                 "warehouse_id": warehouse_id  # Link batch to warehouse
             }
             batch = self.create_batch(batch_data)
-            self.update_product_stock(item["product_id"], item["quantity"])
 
-            # Update warehouse_stock summary
-            if warehouse_id and batch:
-                self.update_warehouse_stock(warehouse_id, item["product_id"], item["quantity"])
+            # Product stock + warehouse_stock summary (batch is created with its quantity)
+            stock_movements.append({
+                "product_id": item["product_id"],
+                "warehouse_id": warehouse_id if batch else None,
+                "delta": item["quantity"],
+            })
 
             # Create purchase item
             item_total = item["quantity"] * item["unit_price"]
@@ -582,6 +916,7 @@ class SupabaseDatabase:
             purchase_item["batch_id"] = batch.get("id") if batch else None
             purchase_items.append(purchase_item)
         
+        self.apply_stock_movements(stock_movements)
         purchase["items"] = purchase_items
         total_elapsed = time.time() - start_time
         print(f"[Supabase] create_purchase completed in {total_elapsed:.2f}s: purchase_id={purchase.get('id')}, items={len(purchase_items)}")
@@ -598,7 +933,43 @@ class SupabaseDatabase:
                 sale.pop("sale_items")
         return sales
     
+    @invalidates("products", "product_batches")
     def create_sale(self, data: dict, items: List[dict]) -> dict:
+        """
+        Create a sale in one round-trip via the create_sale_atomic RPC.
+
+        The RPC writes the sale, items, stock decrements, cost snapshots, retailer
+        due, receivable ledger and stock ledger rows in a single transaction.
+        Falls back to the multi-call path when the function is not deployed yet.
+        """
+        if getattr(self, "_create_sale_rpc_available", True):
+            payload = {
+                key: data.get(key)
+                for key in (
+                    "retailer_id", "paid_amount", "notes", "assigned_to", "created_by",
+                    "terms_days", "due_date", "credit_risk_bearer", "sr_liable_user_id",
+                )
+            }
+            try:
+                result = self.client.rpc(
+                    "create_sale_atomic",
+                    {"p_sale": payload, "p_items": items},
+                ).execute()
+            except Exception as e:
+                if not _is_missing_rpc_error(e):
+                    print(f"[Supabase] create_sale_atomic failed: {e}")
+                    raise ValueError(_rpc_error_message(e))
+                print("[Supabase] create_sale_atomic not deployed; using multi-call create_sale")
+                self._create_sale_rpc_available = False
+            else:
+                sale = result.data[0] if isinstance(result.data, list) else result.data
+                if not sale or not sale.get("id"):
+                    raise ValueError("Failed to create sale: create_sale_atomic returned no data")
+                print(f"[Supabase] Sale created atomically: sale_id={sale.get('id')}, invoice={sale.get('invoice_number')}")
+                return sale
+        return self._create_sale_multi_call(data, items)
+
+    def _create_sale_multi_call(self, data: dict, items: List[dict]) -> dict:
         from datetime import datetime
         import uuid
         
@@ -740,6 +1111,16 @@ class SupabaseDatabase:
         if not actual_sale_id or not sale:
             raise ValueError(f"Sale creation failed: sale_id or sale object not set. actual_sale_id={actual_sale_id}")
         
+        # Decrement batch + product stock for every line in one atomic call
+        self.apply_stock_movements([
+            {
+                "batch_id": validated["item"]["batch_id"],
+                "product_id": validated["item"]["product_id"],
+                "delta": -validated["item"]["quantity"],
+            }
+            for validated in validated_items
+        ])
+
         # Now insert sale_items using the verified actual_sale_id from database
         sale_items = []
         for validated in validated_items:
@@ -747,10 +1128,6 @@ class SupabaseDatabase:
             product = validated["product"]
             batch = validated["batch"]
             
-            # Update batch quantity
-            self.update_batch_quantity(item["batch_id"], -item["quantity"])
-            self.update_product_stock(item["product_id"], -item["quantity"])
-            
             # Create sale item
             sale_item_data = {
                 "id": str(uuid.uuid4()),
@@ -822,6 +1199,33 @@ class SupabaseDatabase:
             })
         return sale
     
+    def get_rows_by_ids(self, table: str, ids: List[str]) -> Dict[str, dict]:
+        """
+        Fetch rows of a point-lookup table with one `in_("id", ...)` query.
+
+        Used by RequestLoader.prime; rows are shaped exactly like the matching
+        single getter (get_product, get_batch, get_warehouse, get_user_by_id, get_sale).
+        """
+        if not ids:
+            return {}
+        if table == "sales":
+            result = self.client.table("sales").select("*, sale_items(*)").in_("id", ids).execute()
+            rows = result.data or []
+            for sale in rows:
+                sale["payment_status"] = PaymentStatus(sale["payment_status"]) if sale.get("payment_status") else PaymentStatus.DUE
+                sale["status"] = OrderStatus(sale["status"]) if sale.get("status") else OrderStatus.PENDING
+                sale["items"] = sale.pop("sale_items", None) or []
+        elif table in ("products", "product_batches", "warehouses", "users"):
+            result = self.client.table(table).select("*").in_("id", ids).execute()
+            rows = result.data or []
+            if table == "users":
+                for user in rows:
+                    user["role"] = _normalize_role(user.get("role"))
+        else:
+            raise ValueError(f"get_rows_by_ids does not support table '{table}'")
+        return {str(row["id"]): row for row in rows}
+
+    @loader_cached("sales")
     def get_sale(self, sale_id: str) -> Optional[dict]:
         result = self.client.table("sales").select("*").eq("id", sale_id).execute()
         if result.data:
@@ -833,6 +1237,7 @@ class SupabaseDatabase:
             return sale
         return None
     
+    @invalidates("sales", "routes", "products", "product_batches")
     def delete_sale(self, sale_id: str) -> bool:
         """Delete a sale and its related data (returns, return items, sale items, sale)"""
         try:
@@ -862,6 +1267,7 @@ class SupabaseDatabase:
             print(f"[DB] Error deleting sale {sale_id}: {e}")
             raise
 
+    @invalidates("sales", "routes")
     def update_sale(self, sale_id: str, data: dict) -> Optional[dict]:
         """
         Update sale invoice manually (admin only).
@@ -1001,162 +1407,128 @@ class SupabaseDatabase:
         """
         Get sales report with return aggregation.
         Returns (sales_with_returns, summary_totals)
+
+        Built from a fixed set of queries whatever the range: sales with
+        embedded items (paged), return totals per sale, and the routes the
+        sales belong to; everything else is one pass in memory.
         """
-        # Build date filter for sales
-        sales_query = self.client.table("sales").select("*")
-        if from_date:
-            sales_query = sales_query.gte("created_at", from_date)
+        end_datetime = None
         if to_date:
             # Add one day to include the end date
             end_datetime = datetime.fromisoformat(to_date.replace('Z', '+00:00')) + timedelta(days=1)
-            sales_query = sales_query.lt("created_at", end_datetime.isoformat())
-        
-        sales_query = sales_query.order("created_at", desc=True)
-        sales_result = sales_query.execute()
-        sales = sales_result.data or []
-        
-        # Get all sale IDs for return aggregation
-        sale_ids = [sale["id"] for sale in sales] if sales else []
-        
-        # Get all returns for these sales in one query
-        returns_by_sale = {}
-        total_returns = 0.0
-        sales_with_returns_count = 0
-        all_returns = []  # Define outside if block for later use
-        
-        if sale_ids:
-            # Supabase doesn't support IN with list, so we'll need to query returns differently
-            # Get all returns where sale_id is in our list
-            # Since Supabase Python client doesn't support array filters easily, we'll fetch all returns
-            # and filter in Python (for small datasets this is fine)
-            returns_result = self.client.table("sales_returns").select("*").execute()
-            all_returns = returns_result.data or []
-            
-            # Filter returns for our sales and aggregate
-            for ret in all_returns:
-                ret_sale_id = ret.get("sale_id")
-                if ret_sale_id in sale_ids:
-                    if ret_sale_id not in returns_by_sale:
-                        returns_by_sale[ret_sale_id] = []
-                    returns_by_sale[ret_sale_id].append(ret)
-                    total_returns += float(ret.get("total_return_amount", 0))
-            
-            sales_with_returns_count = len(returns_by_sale)
-        
-        # Get all return items for these sales to calculate returned quantities
-        return_items_by_sale = {}
-        if sale_ids and all_returns:
-            # Get all return items
-            return_items_result = self.client.table("sales_return_items").select("*").execute()
-            all_return_items = return_items_result.data or []
-            
-            # Create a mapping of return_id -> sale_id for quick lookup
-            return_to_sale_map = {ret["id"]: ret.get("sale_id") for ret in all_returns if ret.get("sale_id") in sale_ids}
-            
-            # Group return items by sale_id
-            for ret_item in all_return_items:
-                return_id = ret_item.get("return_id")
-                sale_id = return_to_sale_map.get(return_id)
-                if sale_id:
-                    if sale_id not in return_items_by_sale:
-                        return_items_by_sale[sale_id] = []
-                    return_items_by_sale[sale_id].append(ret_item)
-        
-        # Build sales report with return data
+
+        def sales_query():
+            query = self.client.table("sales").select("*, sale_items(*)")
+            if from_date:
+                query = query.gte("created_at", from_date)
+            if end_datetime:
+                query = query.lt("created_at", end_datetime.isoformat())
+            return query.order("created_at", desc=True).order("id", desc=True)
+
+        sales = _fetch_pages(sales_query)
+        return_totals = self._get_sale_return_totals([sale["id"] for sale in sales], from_date)
+
         # For sales in routes, use route's SR (Route SR overrides Sales SR)
-        # Get route info for sales that have route_id (PERFORMANCE: Fetch all routes in ONE query)
-        route_ids = set(sale.get("route_id") for sale in sales if sale.get("route_id"))
         routes_map = {}
-        if route_ids:
-            # Fetch all routes in a single query instead of N queries (N+1 problem fix)
-            route_ids_list = list(route_ids)
-            routes_result = self.client.table("routes").select("id,assigned_to,assigned_to_name").in_("id", route_ids_list).execute()
+        route_ids = list({sale["route_id"] for sale in sales if sale.get("route_id")})
+        for chunk in _chunked(route_ids):
+            routes_result = self.client.table("routes").select("id,assigned_to,assigned_to_name").in_("id", chunk).execute()
             for route in (routes_result.data or []):
-                routes_map[route["id"]] = {
-                    "assigned_to": route.get("assigned_to"),
-                    "assigned_to_name": route.get("assigned_to_name")
-                }
-        
+                routes_map[route["id"]] = route
+
         sales_report = []
         total_gross = 0.0
+        total_returns = 0.0
+        total_items = 0
         total_returned_items = 0
-        
+        sales_with_returns_count = 0
+        no_returns = {"returned_total": 0.0, "return_count": 0, "returned_qty": 0}
+
         for sale in sales:
-            sale_id = sale["id"]
             sale["payment_status"] = PaymentStatus(sale["payment_status"]) if sale.get("payment_status") else PaymentStatus.DUE
             sale["status"] = OrderStatus(sale["status"]) if sale.get("status") else OrderStatus.PENDING
-            
-            # If sale is in a route, use route's SR for reporting (Route SR overrides Sales SR)
-            route_id = sale.get("route_id")
-            if route_id and route_id in routes_map:
-                route_info = routes_map[route_id]
-                sale["effective_assigned_to"] = route_info["assigned_to"]  # Route's SR
-                sale["effective_assigned_to_name"] = route_info["assigned_to_name"]
+            sale["items"] = sale.pop("sale_items", None) or []
+
+            route_info = routes_map.get(sale.get("route_id"))
+            if route_info:
+                sale["effective_assigned_to"] = route_info.get("assigned_to")  # Route's SR
+                sale["effective_assigned_to_name"] = route_info.get("assigned_to_name")
             else:
                 # Sale not in route, use sale's SR
                 sale["effective_assigned_to"] = sale.get("assigned_to")
                 sale["effective_assigned_to_name"] = sale.get("assigned_to_name")
-            
-            # Get sale items
-            items_result = self.client.table("sale_items").select("*").eq("sale_id", sale_id).execute()
-            sale["items"] = items_result.data or []
-            
-            # Calculate total items quantity
+
+            totals = return_totals.get(str(sale["id"]), no_returns)
             total_items_qty = sum(int(item.get("quantity", 0)) for item in sale["items"])
-            
-            # Calculate return totals for this sale
-            sale_returns = returns_by_sale.get(sale_id, [])
-            returned_total = sum(float(r.get("total_return_amount", 0)) for r in sale_returns)
-            
-            # Calculate returned items quantity
-            sale_return_items = return_items_by_sale.get(sale_id, [])
-            returned_qty = sum(int(item.get("quantity_returned", 0)) for item in sale_return_items)
-            
-            # Calculate net items (total - returned)
-            net_items_qty = max(0, total_items_qty - returned_qty)
-            
+            returned_total = float(totals["returned_total"])
+            returned_qty = int(totals["returned_qty"])
             gross_total = float(sale.get("total_amount", 0))
             net_total = gross_total - returned_total
-            
-            # Calculate adjusted due amount (net_total - paid_amount)
             # Original due_amount is gross_total - paid_amount, but after returns it should be net_total - paid_amount
             paid_amount = float(sale.get("paid_amount", 0))
-            adjusted_due_amount = max(0, net_total - paid_amount)
-            
-            # Add report fields
+
             sale["gross_total"] = gross_total
             sale["returned_total"] = returned_total
             sale["net_total"] = net_total
-            sale["has_returns"] = len(sale_returns) > 0
-            sale["return_count"] = len(sale_returns)
+            sale["has_returns"] = totals["return_count"] > 0
+            sale["return_count"] = int(totals["return_count"])
             sale["total_items"] = total_items_qty
             sale["returned_qty"] = returned_qty
-            sale["net_items"] = net_items_qty
-            # Update due_amount to reflect returns
-            sale["due_amount"] = adjusted_due_amount
-            
+            sale["net_items"] = max(0, total_items_qty - returned_qty)
+            sale["due_amount"] = max(0, net_total - paid_amount)
+
             total_gross += gross_total
+            total_returns += returned_total
+            total_items += total_items_qty
             total_returned_items += returned_qty
+            if sale["has_returns"]:
+                sales_with_returns_count += 1
             sales_report.append(sale)
-        
-        # Calculate summary totals
-        total_net = total_gross - total_returns
-        return_rate = (total_returns / total_gross * 100) if total_gross > 0 else 0.0
-        total_items = sum(s.get("total_items", 0) for s in sales_report)
-        
+
         summary = {
             "total_gross": total_gross,
             "total_returns": total_returns,
-            "total_net": total_net,
-            "return_rate": return_rate,
+            "total_net": total_gross - total_returns,
+            "return_rate": (total_returns / total_gross * 100) if total_gross > 0 else 0.0,
             "total_sales": len(sales_report),
             "sales_with_returns": sales_with_returns_count,
             "total_items": total_items,
             "total_returned_items": total_returned_items,
             "total_net_items": total_items - total_returned_items
         }
-        
+
         return sales_report, summary
+
+    def _get_sale_return_totals(self, sale_ids: List[str], from_date: Optional[str] = None) -> Dict[str, dict]:
+        """
+        {sale_id: {returned_total, return_count, returned_qty}} for the given sales.
+
+        Returns are read by sale id in IN_FILTER_CHUNK_SIZE chunks (paged, with
+        embedded item quantities). A return is never older than its sale, so a
+        report start date also bounds created_at.
+        """
+        wanted = list(dict.fromkeys(str(sale_id) for sale_id in sale_ids))
+        if not wanted:
+            return {}
+
+        def returns_query(chunk):
+            query = self.client.table("sales_returns").select(
+                "id,sale_id,total_return_amount,sales_return_items(quantity_returned)"
+            ).in_("sale_id", chunk)
+            if from_date:
+                query = query.gte("created_at", from_date)
+            return query.order("id")
+
+        totals: Dict[str, dict] = {}
+        for chunk in _chunked(wanted):
+            for ret in _fetch_pages(lambda: returns_query(chunk)):
+                entry = totals.setdefault(str(ret.get("sale_id")), {"returned_total": 0.0, "return_count": 0, "returned_qty": 0})
+                entry["returned_total"] += float(ret.get("total_return_amount") or 0)
+                entry["return_count"] += 1
+                entry["returned_qty"] += sum(
+                    int(item.get("quantity_returned") or 0) for item in ret.get("sales_return_items") or []
+                )
+        return totals
     
     def get_sales_returns_report(self, from_date: Optional[str] = None, to_date: Optional[str] = None) -> List[dict]:
         """Get sales returns report with sale invoice info"""
@@ -1195,7 +1567,13 @@ class SupabaseDatabase:
         
         return returns_report
     
-    def get_collection_report(self, user_id: Optional[str] = None, from_date: Optional[str] = None, to_date: Optional[str] = None) -> List[dict]:
+    def get_collection_report(
+        self,
+        user_id: Optional[str] = None,
+        from_date: Optional[str] = None,
+        to_date: Optional[str] = None,
+        payment_history_limit: Optional[int] = None,
+    ) -> List[dict]:
         """
         Get collection report for SRs/delivery men.
         
@@ -1203,139 +1581,155 @@ class SupabaseDatabase:
             user_id: Optional user ID to filter by specific SR. If None, returns report for all SRs.
             from_date: Optional start date filter
             to_date: Optional end date filter
+            payment_history_limit: Newest payments to include per SR (None = all, 0 = none;
+                page the rest with get_collector_payments)
         
         Returns:
             List of collection reports, one per SR
+
+        All SRs are covered by the same handful of queries (users, sales,
+        routes, route_sales, route sales by id, payments, return totals),
+        grouped by SR in memory, so cost follows data volume, not users x sales.
         """
-        from datetime import datetime, timedelta
-        
-        # Get all users with role 'sales_rep' if user_id not specified
+        users_query = self.client.table("users").select("id,name").in_("role", ["dsr", "sales_rep"])
         if user_id:
-            users_query = self.client.table("users").select("*").eq("id", user_id).in_("role", ["dsr", "sales_rep"])
-        else:
-            users_query = self.client.table("users").select("*").in_("role", ["dsr", "sales_rep"])
-        
-        users_result = users_query.execute()
-        users = users_result.data or []
-        
+            users_query = users_query.eq("id", user_id)
+        users = users_query.execute().data or []
         if not users:
             return []
-        
+
+        sr_ids = [str(user["id"]) for user in users]
+        end_iso = None
+        if to_date:
+            end_iso = (datetime.fromisoformat(to_date.replace('Z', '+00:00')) + timedelta(days=1)).isoformat()
+
+        def in_range(query):
+            if from_date:
+                query = query.gte("created_at", from_date)
+            if end_iso:
+                query = query.lt("created_at", end_iso)
+            return query
+
+        sale_columns = "id,assigned_to,total_amount,due_amount,created_at"
+        sales_by_id: Dict[str, dict] = {}
+        sale_ids_by_sr: Dict[str, set] = {sr_id: set() for sr_id in sr_ids}
+
+        # Sales assigned to any SR
+        for chunk in _chunked(sr_ids):
+            rows = _fetch_pages(
+                lambda: in_range(self.client.table("sales").select(sale_columns).in_("assigned_to", chunk)).order("id")
+            )
+            for sale in rows:
+                sales_by_id[str(sale["id"])] = sale
+                sale_ids_by_sr[str(sale["assigned_to"])].add(str(sale["id"]))
+
+        # Also include sales from routes assigned to the SR (Route SR is source of truth)
+        route_owner: Dict[str, str] = {}
+        for chunk in _chunked(sr_ids):
+            routes = _fetch_pages(
+                lambda chunk=chunk: self.client.table("routes").select("id,assigned_to").in_("assigned_to", chunk).order("id")
+            )
+            for route in routes:
+                route_owner[str(route["id"])] = str(route["assigned_to"])
+
+        route_sale_owners: Dict[str, set] = {}
+        for chunk in _chunked(list(route_owner)):
+            links = _fetch_pages(
+                lambda: self.client.table("route_sales").select("route_id,sale_id").in_("route_id", chunk).order("sale_id")
+            )
+            for link in links:
+                route_sale_owners.setdefault(str(link["sale_id"]), set()).add(route_owner[str(link["route_id"])])
+
+        missing = [sale_id for sale_id in route_sale_owners if sale_id not in sales_by_id]
+        for chunk in _chunked(missing):
+            rows = in_range(self.client.table("sales").select(sale_columns).in_("id", chunk)).execute().data or []
+            for sale in rows:
+                sales_by_id[str(sale["id"])] = sale
+        for sale_id, owners in route_sale_owners.items():
+            if sale_id in sales_by_id:
+                for sr_id in owners:
+                    sale_ids_by_sr[sr_id].add(sale_id)
+
+        # Payments collected by any SR, newest first
+        payments_by_sr: Dict[str, List[dict]] = {sr_id: [] for sr_id in sr_ids}
+        payment_columns = "collected_by,amount" if payment_history_limit == 0 else "*"
+        for chunk in _chunked(sr_ids):
+            rows = _fetch_pages(
+                lambda: in_range(
+                    self.client.table("payments").select(payment_columns).in_("collected_by", chunk)
+                ).order("created_at", desc=True).order("id", desc=True)
+            )
+            for payment in rows:
+                payments_by_sr[str(payment["collected_by"])].append(payment)
+
+        return_totals = self._get_sale_return_totals(list(sales_by_id), from_date)
+
         reports = []
-        
         for user in users:
-            sr_id = user["id"]
-            sr_name = user["name"]
-            
-            # Get all sales assigned to this SR
-            # After Route SR override implementation, sales.assigned_to should already match route SR
-            # But we also check routes to ensure completeness (handles edge cases)
-            sales_query = self.client.table("sales").select("*").eq("assigned_to", sr_id)
-            if from_date:
-                sales_query = sales_query.gte("created_at", from_date)
-            if to_date:
-                end_datetime = datetime.fromisoformat(to_date.replace('Z', '+00:00')) + timedelta(days=1)
-                sales_query = sales_query.lt("created_at", end_datetime.isoformat())
-            
-            sales_result = sales_query.execute()
-            assigned_sales = sales_result.data or []
-            
-            # Also include sales from routes assigned to this SR (Route SR is source of truth)
-            # This ensures we catch all sales that belong to this SR's routes, even if sales.assigned_to wasn't updated
-            # PERFORMANCE: Batch fetch routes, route_sales, and sales instead of nested loops
-            routes_result = self.client.table("routes").select("id").eq("assigned_to", sr_id).execute()
-            route_ids = [r["id"] for r in (routes_result.data or [])]
-            
-            if route_ids:
-                # Fetch all route_sales for these routes in ONE query (instead of N queries)
-                route_sales_result = self.client.table("route_sales").select("sale_id").in_("route_id", route_ids).execute()
-                route_sale_ids = [rs["sale_id"] for rs in (route_sales_result.data or [])]
-                
-                if route_sale_ids:
-                    # Fetch all sales in ONE query (instead of M queries)
-                    # Note: Supabase doesn't support IN with large lists directly, so we fetch all and filter
-                    # For better performance with large datasets, consider pagination or chunking
-                    all_sales_result = self.client.table("sales").select("*").in_("id", route_sale_ids).execute()
-                    route_sales = all_sales_result.data or []
-                    
-                    # Filter by date and add to assigned_sales if not already included
-                    for sale in route_sales:
-                        sale_id = sale.get("id")
-                        if not any(s.get("id") == sale_id for s in assigned_sales):
-                            # Apply date filters
-                            sale_date = sale.get("created_at", "")
-                            if from_date and sale_date < from_date:
-                                continue
-                            if to_date:
-                                end_datetime = datetime.fromisoformat(to_date.replace('Z', '+00:00')) + timedelta(days=1)
-                                if sale_date >= end_datetime.isoformat():
-                                    continue
-                            assigned_sales.append(sale)
-            
-            # Calculate totals
-            total_orders_assigned = len(assigned_sales)
-            total_sales_amount = sum(float(sale.get("total_amount", 0)) for sale in assigned_sales)
-            
-            # Get all payments collected by this SR
-            payments_query = self.client.table("payments").select("*").eq("collected_by", sr_id)
-            if from_date:
-                payments_query = payments_query.gte("created_at", from_date)
-            if to_date:
-                end_datetime = datetime.fromisoformat(to_date.replace('Z', '+00:00')) + timedelta(days=1)
-                payments_query = payments_query.lt("created_at", end_datetime.isoformat())
-            
-            payments_result = payments_query.execute()
-            payments = payments_result.data or []
-            total_collected_amount = sum(float(payment.get("amount", 0)) for payment in payments)
-            
-            # Get returns for sales assigned to this SR
-            sale_ids = [sale["id"] for sale in assigned_sales]
-            total_returns = 0.0
-            if sale_ids:
-                # Get all returns for these sales
-                for sale_id in sale_ids:
-                    returns_result = self.client.table("sales_returns").select("*").eq("sale_id", sale_id).execute()
-                    returns = returns_result.data or []
-                    for ret in returns:
-                        total_returns += float(ret.get("total_return_amount", 0))
-            
-            # Calculate current pending amount (sum of due_amount for assigned sales)
-            current_pending_amount = sum(float(sale.get("due_amount", 0)) for sale in assigned_sales)
-            
-            # Calculate collection rate
+            sr_id = str(user["id"])
+            assigned_sales = [sales_by_id[sale_id] for sale_id in sale_ids_by_sr[sr_id]]
+            payments = payments_by_sr[sr_id]
+
+            total_sales_amount = sum(float(sale.get("total_amount") or 0) for sale in assigned_sales)
+            total_returns = sum(
+                return_totals[sale_id]["returned_total"] for sale_id in sale_ids_by_sr[sr_id] if sale_id in return_totals
+            )
+            total_collected_amount = sum(float(payment.get("amount") or 0) for payment in payments)
             net_sales = total_sales_amount - total_returns
-            if net_sales > 0:
-                collection_rate = (total_collected_amount / net_sales) * 100
-            else:
-                collection_rate = 0.0
-            
-            # Format payment history
-            payment_history = []
-            for payment in payments:
-                payment_history.append({
-                    "id": payment.get("id"),
-                    "sale_id": payment.get("sale_id"),
-                    "amount": float(payment.get("amount", 0)),
-                    "payment_method": payment.get("payment_method"),
-                    "collected_by_name": payment.get("collected_by_name"),
-                    "created_at": payment.get("created_at"),
-                    "notes": payment.get("notes")
-                })
-            
+            collection_rate = (total_collected_amount / net_sales) * 100 if net_sales > 0 else 0.0
+
+            history = payments if payment_history_limit is None else payments[:payment_history_limit]
             reports.append({
                 "user_id": sr_id,
-                "user_name": sr_name,
-                "total_orders_assigned": total_orders_assigned,
+                "user_name": user["name"],
+                "total_orders_assigned": len(assigned_sales),
                 "total_sales_amount": total_sales_amount,
                 "total_collected_amount": total_collected_amount,
                 "total_returns": total_returns,
-                "current_pending_amount": current_pending_amount,
+                "current_pending_amount": sum(float(sale.get("due_amount") or 0) for sale in assigned_sales),
                 "collection_rate": round(collection_rate, 2),
-                "payment_history": payment_history
+                "payment_count": len(payments),
+                "payment_history": [self._collection_history_row(payment) for payment in history],
             })
-        
+
         return reports
+
+    @staticmethod
+    def _collection_history_row(payment: dict) -> dict:
+        return {
+            "id": payment.get("id"),
+            "sale_id": payment.get("sale_id"),
+            "amount": float(payment.get("amount", 0)),
+            "payment_method": payment.get("payment_method"),
+            "collected_by_name": payment.get("collected_by_name"),
+            "created_at": payment.get("created_at"),
+            "notes": payment.get("notes")
+        }
+
+    def get_collector_payments(
+        self,
+        user_id: str,
+        from_date: Optional[str] = None,
+        to_date: Optional[str] = None,
+        limit: int = 50,
+        offset: int = 0,
+    ) -> List[dict]:
+        """One page of an SR's collected payments, newest first (collection report history)."""
+        query = self.client.table("payments").select("*").eq("collected_by", user_id)
+        if from_date:
+            query = query.gte("created_at", from_date)
+        if to_date:
+            end_datetime = datetime.fromisoformat(to_date.replace('Z', '+00:00')) + timedelta(days=1)
+            query = query.lt("created_at", end_datetime.isoformat())
+        result = (
+            query.order("created_at", desc=True)
+            .order("id", desc=True)
+            .range(offset, offset + max(1, limit) - 1)
+            .execute()
+        )
+        return [self._collection_history_row(payment) for payment in result.data or []]
     
+    @invalidates("sales", "routes", "product_batches")
     def create_sale_return(self, sale_id: str, data: dict, items: List[dict], user_id: Optional[str] = None) -> dict:
         """
         Create a sales return transaction.
@@ -1489,12 +1883,15 @@ class SupabaseDatabase:
             return_record = return_result.data[0]
             return_id = return_record.get("id")
             
-            # Insert return items and update inventory
+            # Restore inventory for all returned lines in one atomic call
+            self.apply_stock_movements([
+                {"batch_id": validated["batch_id"], "delta": validated["quantity_returned"]}
+                for validated in validated_items
+            ])
+
+            # Insert return items
             return_items = []
             for validated in validated_items:
-                # Increment batch quantity (restore inventory)
-                self.update_batch_quantity(validated["batch_id"], validated["quantity_returned"])
-                
                 # Create return item record
                 return_item_data = {
                     "id": str(uuid.uuid4()),
@@ -1520,17 +1917,18 @@ class SupabaseDatabase:
             # Reduce retailer due (if adjust_due)
             if refund_type == "adjust_due":
                 retailer_id = sale.get("retailer_id")
-                self.update_retailer_due(retailer_id, -total_return_amount)
-                self.add_receivable_ledger_entry({
-                    "retailer_id": retailer_id,
-                    "sale_id": sale_id,
-                    "entry_type": "sale_return",
-                    "amount": -float(total_return_amount or 0),
-                    "reference_type": "sales_return",
-                    "reference_id": return_id,
-                    "remarks": "sale_return_adjust_due",
-                    "created_at": datetime.now().isoformat(),
-                })
+                self.apply_balance_deltas(
+                    [{"kind": "retailer_due", "id": retailer_id, "amount": -total_return_amount}],
+                    [{
+                        "retailer_id": retailer_id,
+                        "sale_id": sale_id,
+                        "entry_type": "sale_return",
+                        "amount": -float(total_return_amount or 0),
+                        "reference_type": "sales_return",
+                        "reference_id": return_id,
+                        "remarks": "sale_return_adjust_due",
+                    }],
+                )
             
             # CRITICAL: Recalculate original sale payment status after return
             # This ensures invoice reflects actual delivered amount and payment status
@@ -1626,6 +2024,143 @@ class SupabaseDatabase:
         
         return payments
     
+    def get_collection_payments(
+        self,
+        user_id: Optional[str] = None,
+        from_date: Optional[str] = None,
+        to_date: Optional[str] = None,
+        approval_status: Optional[str] = "approved",
+        cursor: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> dict:
+        """
+        Payments for the collection report with invoice, retailer, route and collector joined.
+
+        user_id matches payments the SR collected, or whose sale or route is
+        assigned to them. Totals cover every match; payments is one page
+        ordered newest first (limit=None returns all), continued with next_cursor.
+        Returns {"payments", "total_payments", "total_amount", "next_cursor"}.
+        """
+        end_iso = None
+        if to_date:
+            end_iso = (datetime.fromisoformat(to_date.replace('Z', '+00:00')) + timedelta(days=1)).isoformat()
+        after = decode_cursor(cursor)
+
+        if getattr(self, "_collection_payments_rpc_available", True):
+            try:
+                result = self.client.rpc("get_collection_payments", {
+                    "p_user_id": user_id,
+                    "p_from": from_date,
+                    "p_to": end_iso,
+                    "p_approval_status": approval_status,
+                    "p_cursor_created_at": after[0] if after else None,
+                    "p_cursor_id": after[1] if after else None,
+                    "p_limit": limit,
+                }).execute()
+                data = result.data or {}
+                totals = data.get("totals") or {}
+                payments = [self._shape_collection_payment(row) for row in data.get("payments") or []]
+                next_cursor = None
+                if limit and len(payments) == limit:
+                    next_cursor = encode_cursor(payments[-1].get("created_at"), payments[-1].get("id"))
+                return {
+                    "payments": payments,
+                    "total_payments": int(totals.get("total_payments") or 0),
+                    "total_amount": float(totals.get("total_amount") or 0),
+                    "next_cursor": next_cursor,
+                }
+            except Exception as e:
+                if not _is_missing_rpc_error(e):
+                    raise ValueError(_rpc_error_message(e))
+                print("[Supabase] get_collection_payments RPC not found, using bulk lookups")
+                self._collection_payments_rpc_available = False
+
+        return self._get_collection_payments_bulk(user_id, from_date, end_iso, approval_status, cursor, limit)
+
+    @staticmethod
+    def _shape_collection_payment(row: dict) -> dict:
+        """Fold the joined_* columns into the report fields (sale/route values win, payment values are fallbacks)."""
+        payment = {k: v for k, v in row.items() if not k.startswith("joined_")}
+        if row.get("joined_invoice_number") is not None:
+            payment["invoice_number"] = row["joined_invoice_number"]
+        if row.get("joined_retailer_name"):
+            payment["retailer_name"] = row["joined_retailer_name"]
+        if row.get("joined_route_number"):
+            payment["route_number"] = row["joined_route_number"]
+        if not payment.get("collected_by_name") and row.get("joined_collector_name"):
+            payment["collected_by_name"] = row["joined_collector_name"]
+            if not payment.get("collected_by"):
+                payment["collected_by"] = row.get("joined_collector_id")
+        return payment
+
+    def _get_collection_payments_bulk(
+        self,
+        user_id: Optional[str],
+        from_date: Optional[str],
+        end_iso: Optional[str],
+        approval_status: Optional[str],
+        cursor: Optional[str],
+        limit: Optional[int],
+    ) -> dict:
+        """Fallback without the RPC: paged payments, then one projected in_() fetch per related table."""
+        def payments_query():
+            query = self.client.table("payments").select("*")
+            if approval_status:
+                query = query.eq("approval_status", approval_status)
+            if from_date:
+                query = query.gte("created_at", from_date)
+            if end_iso:
+                query = query.lt("created_at", end_iso)
+            return query.order("created_at", desc=True).order("id", desc=True)
+
+        payments = _fetch_pages(payments_query)
+
+        def rows_by_id(table: str, columns: str, ids) -> Dict[str, dict]:
+            found = {}
+            for chunk in _chunked(list({str(i) for i in ids if i})):
+                for row in self.client.table(table).select(columns).in_("id", chunk).execute().data or []:
+                    found[str(row["id"])] = row
+            return found
+
+        sales = rows_by_id("sales", "id,invoice_number,retailer_name,assigned_to", (p.get("sale_id") for p in payments))
+        routes = rows_by_id("routes", "id,route_number,assigned_to", (p.get("route_id") for p in payments))
+
+        joined = []
+        for payment in payments:
+            sale = sales.get(str(payment.get("sale_id")))
+            route = routes.get(str(payment.get("route_id")))
+            if user_id and user_id not in (
+                payment.get("collected_by"),
+                sale and sale.get("assigned_to"),
+                route and route.get("assigned_to"),
+            ):
+                continue
+            joined.append({
+                **payment,
+                "joined_invoice_number": sale.get("invoice_number") if sale else None,
+                "joined_retailer_name": sale.get("retailer_name") if sale else None,
+                "joined_route_number": route.get("route_number") if route else None,
+                "joined_collector_id": payment.get("collected_by")
+                or (route and route.get("assigned_to"))
+                or (sale and sale.get("assigned_to")),
+            })
+
+        page, next_cursor = keyset_page(joined, cursor, limit)
+        collectors = rows_by_id(
+            "users", "id,name",
+            (row["joined_collector_id"] for row in page if not row.get("collected_by_name")),
+        )
+        for row in page:
+            collector = collectors.get(str(row.get("joined_collector_id")))
+            row["joined_collector_name"] = collector.get("name") if collector else None
+        return {
+            "payments": [self._shape_collection_payment(row) for row in page],
+            "total_payments": len(joined),
+            "total_amount": sum(float(p.get("amount") or 0) for p in joined),
+            "next_cursor": next_cursor,
+        }
+
+    @invalidates("sales", "routes")
     def create_payment(self, data: dict) -> dict:
         retailer = self.get_retailer(data["retailer_id"])
         if not retailer:
@@ -1668,12 +2203,12 @@ class SupabaseDatabase:
                 raise ValueError("Failed to insert pending payment")
             return res.data[0]
 
-        self.update_retailer_due(data["retailer_id"], -data["amount"])
-        
         # DATA ATTACHMENT FIX: Get route_id from sale if sale is in a route
         # Note: Payments created before 2026-01-13 may have route_id = NULL and need backfill
         # See: 20260113000001_backfill_payment_route_id.sql
+        import uuid
         route_id = None
+        sale = None
         if data.get("sale_id"):
             # #region agent log
             log_data = {
@@ -1716,32 +2251,8 @@ class SupabaseDatabase:
                 except: pass
                 # #endregion
                 
-                # Get current values as floats to ensure proper calculation
-                current_paid = float(sale.get("paid_amount", 0))
-                current_due = float(sale.get("due_amount", 0))
-                payment_amount = float(data["amount"])
-                
-                new_paid = current_paid + payment_amount
-                new_due = max(0, current_due - payment_amount)  # Ensure non-negative
-                payment_status = "paid" if new_due <= 0.01 else "partial"  # Use small threshold for float comparison
-                
-                # Update payment amounts only (delivery_status will be updated manually by admin)
-                update_data = {
-                    "paid_amount": new_paid,
-                    "due_amount": new_due,
-                    "payment_status": payment_status
-                }
-                
-                print(f"[DB] Updating sale {data['sale_id']}: paid={current_paid} -> {new_paid}, due={current_due} -> {new_due}, status={payment_status}")
                 if route_id:
                     print(f"[DB] Payment is for sale in route: {route_id}")
-                
-                # DO NOT update delivery_status automatically - admin will update manually
-                result = self.client.table("sales").update(update_data).eq("id", data["sale_id"]).execute()
-                if not result.data:
-                    print(f"[DB] Warning: Sale update returned no data for sale_id={data['sale_id']}")
-                else:
-                    print(f"[DB] Sale updated successfully: {result.data[0].get('invoice_number')}")
         
         # Get collected_by user name if collected_by is provided
         collected_by_name = None
@@ -1776,6 +2287,7 @@ class SupabaseDatabase:
         # #endregion
         
         payment_data = {
+            "id": str(uuid.uuid4()),
             "retailer_id": data["retailer_id"],
             "retailer_name": retailer["name"],
             "sale_id": data.get("sale_id"),
@@ -1791,17 +2303,30 @@ class SupabaseDatabase:
         
         # #region agent log
         inserted_payment = result.data[0] if result.data else payment_data
-        self.add_receivable_ledger_entry({
-            "retailer_id": data["retailer_id"],
-            "sale_id": data.get("sale_id"),
-            "payment_id": inserted_payment.get("id"),
-            "entry_type": "payment",
-            "amount": -float(data.get("amount", 0) or 0),
-            "reference_type": "payment",
-            "reference_id": inserted_payment.get("id"),
-            "remarks": "payment_collected",
-            "created_at": datetime.now().isoformat(),
-        })
+        # Retailer due, sale paid/due (delivery_status is left for admin) and receivable
+        # ledger in one atomic call
+        payment_amount = float(data.get("amount", 0) or 0)
+        balance_deltas = [{"kind": "retailer_due", "id": data["retailer_id"], "amount": -payment_amount}]
+        if sale:
+            balance_deltas.append({"kind": "sale_payment", "id": data["sale_id"], "amount": payment_amount})
+        try:
+            balances = self.apply_balance_deltas(balance_deltas, [{
+                "retailer_id": data["retailer_id"],
+                "sale_id": data.get("sale_id"),
+                "payment_id": inserted_payment.get("id"),
+                "entry_type": "payment",
+                "amount": -payment_amount,
+                "reference_type": "payment",
+                "reference_id": inserted_payment.get("id"),
+                "remarks": "payment_collected",
+            }])
+        except Exception:
+            # The balances were not posted: drop the payment row so it is not counted as collected
+            self.client.table("payments").delete().eq("id", inserted_payment.get("id") or payment_data["id"]).execute()
+            raise
+        updated_sale = balances["sales"].get(str(data.get("sale_id")))
+        if updated_sale:
+            print(f"[DB] Sale updated: {updated_sale.get('invoice_number')} paid={updated_sale.get('paid_amount')}, due={updated_sale.get('due_amount')}, status={updated_sale.get('payment_status')}")
         log_data = {
             "location": "supabase_db.py:create_payment:after_insert",
             "message": "Payment created",
@@ -1873,36 +2398,27 @@ class SupabaseDatabase:
         r = self.client.table("payments").select("*").eq("id", payment_id).limit(1).execute()
         return r.data[0] if r.data else None
 
+    @invalidates("sales", "routes")
     def approve_pending_payment(self, payment_id: str, approver_id: str) -> Optional[dict]:
         p = self.get_payment_by_id(payment_id)
         if not p or p.get("approval_status") != "pending_approval":
             return None
-        self.update_retailer_due(p["retailer_id"], -float(p.get("amount", 0) or 0))
+        amt = float(p.get("amount", 0) or 0)
+        balance_deltas = [{"kind": "retailer_due", "id": p["retailer_id"], "amount": -amt}]
         if p.get("sale_id"):
-            sale = self.get_sale(p["sale_id"])
-            if sale:
-                current_paid = float(sale.get("paid_amount", 0))
-                current_due = float(sale.get("due_amount", 0))
-                amt = float(p.get("amount", 0) or 0)
-                new_paid = current_paid + amt
-                new_due = max(0, current_due - amt)
-                pay_status = "paid" if new_due <= 0.01 else "partial"
-                self.client.table("sales").update(
-                    {"paid_amount": new_paid, "due_amount": new_due, "payment_status": pay_status}
-                ).eq("id", p["sale_id"]).execute()
-        from datetime import datetime
-        ap_at = datetime.now().isoformat()
-        self.add_receivable_ledger_entry({
+            balance_deltas.append({"kind": "sale_payment", "id": p["sale_id"], "amount": amt})
+        self.apply_balance_deltas(balance_deltas, [{
             "retailer_id": p["retailer_id"],
             "sale_id": p.get("sale_id"),
             "payment_id": p["id"],
             "entry_type": "payment",
-            "amount": -float(p.get("amount", 0) or 0),
+            "amount": -amt,
             "reference_type": "payment",
             "reference_id": p["id"],
             "remarks": "payment_collected_approved",
-            "created_at": ap_at,
-        })
+        }])
+        from datetime import datetime
+        ap_at = datetime.now().isoformat()
         upd = {
             "approval_status": "approved",
             "approved_by": approver_id,
@@ -1955,12 +2471,111 @@ class SupabaseDatabase:
         result = self.client.table("stock_ledger").insert(payload).execute()
         return result.data[0] if result.data else payload
 
-    def get_stock_ledger(self, product_id: Optional[str] = None, limit: int = 200) -> List[dict]:
-        query = self.client.table("stock_ledger").select("*").order("created_at", desc=True).limit(limit)
-        if product_id:
-            query = query.eq("product_id", product_id)
-        result = query.execute()
-        return result.data or []
+    def get_stock_ledger(self, product_id: Optional[str] = None, limit: int = 200, **filters) -> List[dict]:
+        """Newest ledger entries first; filters / cursor as in get_stock_ledger_page."""
+        return self.get_stock_ledger_page(product_id=product_id, limit=limit, **filters)["entries"]
+
+    def get_stock_ledger_page(
+        self,
+        product_id: Optional[str] = None,
+        warehouse_id: Optional[str] = None,
+        batch_id: Optional[str] = None,
+        voucher_type: Optional[str] = None,
+        voucher_id: Optional[str] = None,
+        from_date: Optional[str] = None,
+        to_date: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: int = 200,
+        opening_balance: bool = False,
+    ) -> dict:
+        """
+        One keyset page of stock_ledger ordered by (created_at DESC, id DESC).
+
+        to_date is inclusive (whole day). With opening_balance (first page only)
+        the net quantity_change of matching entries before from_date is returned.
+        Uses the get_stock_ledger_page RPC, else the same filters through the
+        query builder. Returns {"entries", "next_cursor", "opening_balance"}.
+        """
+        end_iso = None
+        if to_date:
+            end_iso = (datetime.fromisoformat(to_date.replace('Z', '+00:00')) + timedelta(days=1)).isoformat()
+        after = decode_cursor(cursor)
+        want_opening = opening_balance and after is None
+
+        entries = None
+        opening = None
+        if getattr(self, "_stock_ledger_page_rpc_available", True):
+            try:
+                result = self.client.rpc("get_stock_ledger_page", {
+                    "p_product_id": product_id,
+                    "p_warehouse_id": warehouse_id,
+                    "p_batch_id": batch_id,
+                    "p_voucher_type": voucher_type,
+                    "p_voucher_id": voucher_id,
+                    "p_from": from_date,
+                    "p_to": end_iso,
+                    "p_cursor_created_at": after[0] if after else None,
+                    "p_cursor_id": after[1] if after else None,
+                    "p_limit": limit,
+                    "p_opening_balance": want_opening,
+                }).execute()
+                data = result.data or {}
+                entries = data.get("entries") or []
+                opening = data.get("opening_balance")
+            except Exception as e:
+                if not _is_missing_rpc_error(e):
+                    raise ValueError(_rpc_error_message(e))
+                print("[Supabase] get_stock_ledger_page RPC not found, using filtered ledger queries")
+                self._stock_ledger_page_rpc_available = False
+
+        if entries is None:
+            def ledger_query(columns: str = "*"):
+                query = self.client.table("stock_ledger").select(columns)
+                for column, value in (
+                    ("product_id", product_id),
+                    ("warehouse_id", warehouse_id),
+                    ("batch_id", batch_id),
+                    ("voucher_type", voucher_type),
+                    ("voucher_id", voucher_id),
+                ):
+                    if value:
+                        query = query.eq(column, value)
+                return query
+
+            def page_query():
+                query = ledger_query()
+                if from_date:
+                    query = query.gte("created_at", from_date)
+                if end_iso:
+                    query = query.lt("created_at", end_iso)
+                if after:
+                    # No row-value comparison in the query builder: take created_at <= cursor
+                    # and drop the cursor's already-served ties below.
+                    query = query.lte("created_at", after[0])
+                return query.order("created_at", desc=True).order("id", desc=True)
+
+            entries = []
+            for page in _iter_pages(page_query, limit + 1):
+                entries.extend(row for row in page if not after or sort_key(row) < after)
+                if len(entries) >= limit:
+                    break
+            entries = entries[:limit]
+            if want_opening:
+                opening = 0
+                if from_date:
+                    before = _iter_pages(
+                        lambda: ledger_query("id, quantity_change").lt("created_at", from_date).order("id")
+                    )
+                    opening = sum(int(row.get("quantity_change") or 0) for page in before for row in page)
+
+        next_cursor = None
+        if limit and len(entries) == limit:
+            next_cursor = encode_cursor(entries[-1].get("created_at"), entries[-1].get("id"))
+        return {
+            "entries": entries,
+            "next_cursor": next_cursor,
+            "opening_balance": int(opening) if want_opening and opening is not None else None,
+        }
 
     def get_stock_ledger_backfill_keys(self) -> set[str]:
         keys: set[str] = set()
@@ -1991,13 +2606,15 @@ class SupabaseDatabase:
         while True:
             result = (
                 self.client.table("stock_ledger")
-                .select("voucher_type,voucher_id")
+                .select("voucher_type,voucher_id,remarks")
                 .not_.is_("voucher_id", "null")
                 .range(offset, offset + page_size - 1)
                 .execute()
             )
             rows = result.data or []
             for row in rows:
+                if str(row.get("remarks") or "").startswith("backfill:"):
+                    continue
                 vt = row.get("voucher_type")
                 vid = row.get("voucher_id")
                 if vt is not None and vid is not None:
@@ -2007,72 +2624,319 @@ class SupabaseDatabase:
             offset += page_size
         return keys
 
-    def add_stock_ledger_entries_bulk(self, rows: List[dict]) -> int:
-        if not rows:
-            return 0
-        inserted = 0
-        chunk_size = 250
-        for i in range(0, len(rows), chunk_size):
-            chunk = rows[i : i + chunk_size]
-            payloads = []
-            for data in chunk:
-                created_at = data.get("created_at")
-                if created_at is None:
-                    created_ts = datetime.now().isoformat()
-                elif isinstance(created_at, datetime):
-                    created_ts = created_at.isoformat()
-                else:
-                    created_ts = str(created_at)
-                payloads.append(
-                    {
-                        "product_id": data["product_id"],
-                        "product_name": data.get("product_name"),
-                        "batch_id": data.get("batch_id"),
-                        "batch_number": data.get("batch_number"),
-                        "warehouse_id": data.get("warehouse_id"),
-                        "warehouse_name": data.get("warehouse_name"),
-                        "voucher_type": data["voucher_type"],
-                        "voucher_id": data.get("voucher_id"),
-                        "quantity_change": int(data.get("quantity_change", 0)),
-                        "quantity_after": data.get("quantity_after"),
-                        "unit_cost": data.get("unit_cost"),
-                        "remarks": data.get("remarks"),
-                        "created_by": data.get("created_by"),
-                        "created_at": created_ts,
-                    }
+    def add_stock_ledger_entries_bulk(self, rows: List[dict]) -> int:
+        if not rows:
+            return 0
+        inserted = 0
+        chunk_size = 250
+        for i in range(0, len(rows), chunk_size):
+            chunk = rows[i : i + chunk_size]
+            payloads = []
+            for data in chunk:
+                created_at = data.get("created_at")
+                if created_at is None:
+                    created_ts = datetime.now().isoformat()
+                elif isinstance(created_at, datetime):
+                    created_ts = created_at.isoformat()
+                else:
+                    created_ts = str(created_at)
+                payloads.append(
+                    {
+                        "product_id": data["product_id"],
+                        "product_name": data.get("product_name"),
+                        "batch_id": data.get("batch_id"),
+                        "batch_number": data.get("batch_number"),
+                        "warehouse_id": data.get("warehouse_id"),
+                        "warehouse_name": data.get("warehouse_name"),
+                        "voucher_type": data["voucher_type"],
+                        "voucher_id": data.get("voucher_id"),
+                        "quantity_change": int(data.get("quantity_change", 0)),
+                        "quantity_after": data.get("quantity_after"),
+                        "unit_cost": data.get("unit_cost"),
+                        "remarks": data.get("remarks"),
+                        "created_by": data.get("created_by"),
+                        "created_at": created_ts,
+                    }
+                )
+            self.client.table("stock_ledger").insert(payloads).execute()
+            inserted += len(payloads)
+        return inserted
+
+    def get_stock_ledger_aggregates_by_product(self) -> Tuple[Dict[str, int], Dict[str, int], int]:
+        """Ledger net qty + entry counts per product, from the stock_ledger_balances rows."""
+        return product_ledger_totals(self.get_stock_ledger_balances())
+
+    def _scan_stock_ledger_balances(self) -> List[dict]:
+        pages = _iter_pages(
+            lambda: self.client.table("stock_ledger")
+            .select("id, product_id, warehouse_id, batch_id, quantity_change")
+            .order("id")
+        )
+        return ledger_balance_rows(row for page in pages for row in page)
+
+    def get_stock_ledger_balances(self) -> List[dict]:
+        """
+        Ledger balance / entry count per (product_id, warehouse_id, batch_id) from
+        stock_ledger_balances, which the stock_ledger trigger keeps current. Without
+        the table (migration not applied) the ledger is folded in one projected scan.
+        """
+        if getattr(self, "_ledger_balances_table_available", True):
+            try:
+                return _fetch_pages(
+                    lambda: self.client.table("stock_ledger_balances")
+                    .select("product_id, warehouse_id, batch_id, quantity, entries")
+                    .order("id")
+                )
+            except Exception as e:
+                if not _is_missing_table_error(e):
+                    raise
+                print("[Supabase] stock_ledger_balances table not found, scanning stock_ledger")
+                self._ledger_balances_table_available = False
+        return self._scan_stock_ledger_balances()
+
+    def rebuild_stock_ledger_balances(self) -> dict:
+        """
+        Recompute stock_ledger_balances from the full ledger (after bulk fixes or
+        if drift is suspected). Uses the rebuild_stock_ledger_balances RPC, else
+        folds the ledger here and rewrites the table. Returns {balances, ledger_rows}.
+        """
+        if getattr(self, "_rebuild_balances_rpc_available", True):
+            try:
+                result = self.client.rpc("rebuild_stock_ledger_balances", {}).execute()
+                data = result.data or {}
+                return {"balances": int(data.get("balances") or 0), "ledger_rows": int(data.get("ledger_rows") or 0)}
+            except Exception as e:
+                if not _is_missing_rpc_error(e):
+                    raise ValueError(_rpc_error_message(e))
+                print("[Supabase] rebuild_stock_ledger_balances RPC not found, rebuilding from a ledger scan")
+                self._rebuild_balances_rpc_available = False
+
+        balances = self._scan_stock_ledger_balances()
+        ledger_rows = sum(row["entries"] for row in balances)
+        if getattr(self, "_ledger_balances_table_available", True):
+            try:
+                self.client.table("stock_ledger_balances").delete().gte("entries", 0).execute()
+                for chunk in _chunked(balances):
+                    self.client.table("stock_ledger_balances").insert(chunk).execute()
+            except Exception as e:
+                if not _is_missing_table_error(e):
+                    raise
+                print("[Supabase] stock_ledger_balances table not found, nothing to rebuild")
+                self._ledger_balances_table_available = False
+        return {"balances": len(balances), "ledger_rows": ledger_rows}
+
+    def get_stock_reconciliation_aggregates(self) -> dict:
+        """
+        Batch quantity and ledger net / entries per (product_id, warehouse_id) for the
+        reconciliation report (app.stock_reconciliation). Uses the
+        get_stock_reconciliation_aggregates RPC (server-side GROUP BY), else one
+        projected paged scan of product_batches folded with stock_ledger_balances.
+        """
+        if getattr(self, "_reconciliation_rpc_available", True):
+            try:
+                result = self.client.rpc("get_stock_reconciliation_aggregates", {}).execute()
+                data = result.data or {}
+                return {"rows": data.get("rows") or [], "ledger_rows": int(data.get("ledger_rows") or 0)}
+            except Exception as e:
+                if not _is_missing_rpc_error(e):
+                    raise ValueError(_rpc_error_message(e))
+                print("[Supabase] get_stock_reconciliation_aggregates RPC not found, reading batches and ledger balances")
+                self._reconciliation_rpc_available = False
+
+        batches = _iter_pages(
+            lambda: self.client.table("product_batches").select("id, product_id, warehouse_id, quantity").order("id")
+        )
+        return fold_reconciliation_aggregates((row for page in batches for row in page), self.get_stock_ledger_balances())
+
+    def get_all_batches(self) -> List[dict]:
+        """Every batch (id, product, number, warehouse) for lookups preloaded once, e.g. the ledger backfill."""
+        return _fetch_pages(
+            lambda: self.client.table("product_batches").select("id, product_id, batch_number, warehouse_id").order("id")
+        )
+
+    def iter_stock_ledger_backfill_vouchers(
+        self, phase: str, after_id: Optional[str] = None, page_size: Optional[int] = None
+    ) -> Iterator[List[dict]]:
+        """
+        Pages of vouchers for the stock-ledger backfill (app.ledger_backfill), keyset-ordered by id
+        after after_id: purchases / sales with "items", or flat sales-return lines with
+        _return_created_at (the get_all_sales_return_items_flat shape).
+        """
+        page_size = page_size or REPORT_PAGE_SIZE
+        table, columns, embedded = {
+            "purchase": ("purchases", "id, created_at, warehouse_id, warehouse_name, purchase_items(*)", "purchase_items"),
+            "sale": ("sales", "id, created_at, sale_items(*)", "sale_items"),
+            "sale_return": ("sales_return_items", "*", None),
+        }[phase]
+        while True:
+            query = self.client.table(table).select(columns).order("id").limit(page_size)
+            if after_id:
+                query = query.gt("id", after_id)
+            try:
+                page = query.execute().data or []
+            except Exception as e:
+                if phase != "sale_return" or not _is_missing_table_error(e):
+                    raise
+                print("[Supabase] sales_return_items table not found, skipping returns in the ledger backfill")
+                return
+            if embedded:
+                for voucher in page:
+                    voucher["items"] = voucher.pop(embedded, None) or []
+            else:
+                return_ids = list({str(i["return_id"]) for i in page if i.get("return_id")})
+                returns: Dict[str, dict] = {}
+                for chunk in _chunked(return_ids):
+                    result = self.client.table("sales_returns").select("id, created_at, return_number").in_("id", chunk).execute()
+                    returns.update({str(r["id"]): r for r in result.data or []})
+                for item in page:
+                    header = returns.get(str(item.get("return_id")), {})
+                    item["_return_created_at"] = header.get("created_at")
+                    item["_return_number"] = header.get("return_number")
+            if page:
+                yield page
+            if len(page) < page_size:
+                return
+            after_id = str(page[-1]["id"])
+
+    def _local_backfill_jobs(self) -> Dict[str, dict]:
+        return self.__dict__.setdefault("_backfill_jobs", {})
+
+    def _backfill_jobs_table_missing(self, error: Exception) -> bool:
+        if not _is_missing_table_error(error):
+            return False
+        print("[Supabase] stock_ledger_backfill_jobs table not found, keeping backfill checkpoints in memory")
+        self._backfill_jobs_table_available = False
+        return True
+
+    def save_stock_ledger_backfill_job(self, job: dict) -> dict:
+        """Insert or update a backfill job record (status, checkpoint, counters)."""
+        if getattr(self, "_backfill_jobs_table_available", True):
+            try:
+                result = self.client.table("stock_ledger_backfill_jobs").upsert(job).execute()
+                return result.data[0] if result.data else job
+            except Exception as e:
+                if not self._backfill_jobs_table_missing(e):
+                    raise
+        self._local_backfill_jobs()[str(job["id"])] = dict(job)
+        return job
+
+    def get_stock_ledger_backfill_job(self, job_id: Optional[str] = None) -> Optional[dict]:
+        """A backfill job by id, or the most recently started one."""
+        if getattr(self, "_backfill_jobs_table_available", True):
+            try:
+                query = self.client.table("stock_ledger_backfill_jobs").select("*")
+                query = query.eq("id", job_id) if job_id else query.order("started_at", desc=True)
+                result = query.limit(1).execute()
+                return result.data[0] if result.data else None
+            except Exception as e:
+                if not self._backfill_jobs_table_missing(e):
+                    raise
+        jobs = self._local_backfill_jobs()
+        if job_id:
+            return jobs.get(str(job_id))
+        return max(jobs.values(), key=lambda j: str(j.get("started_at") or ""), default=None)
+
+    def claim_stock_ledger_backfill_job(self, job_id: str, heartbeat_at: Optional[str]) -> bool:
+        """
+        Take over an interrupted job: bump its heartbeat only if it is still heartbeat_at,
+        so one API worker wins when several start at once.
+        """
+        now = datetime.now(timezone.utc).isoformat()
+        if getattr(self, "_backfill_jobs_table_available", True):
+            try:
+                query = self.client.table("stock_ledger_backfill_jobs").update({"heartbeat_at": now}).eq("id", job_id)
+                query = query.eq("heartbeat_at", heartbeat_at) if heartbeat_at else query.is_("heartbeat_at", "null")
+                return bool(query.execute().data)
+            except Exception as e:
+                if not self._backfill_jobs_table_missing(e):
+                    raise
+        job = self._local_backfill_jobs().get(str(job_id))
+        if not job or job.get("heartbeat_at") != heartbeat_at:
+            return False
+        job["heartbeat_at"] = now
+        return True
+
+    def _local_ledger_write_queue(self) -> Dict[str, dict]:
+        return self.__dict__.setdefault("_ledger_write_queue", {})
+
+    def _ledger_write_queue_missing(self, error: Exception) -> bool:
+        if not _is_missing_table_error(error):
+            return False
+        print("[Supabase] stock_ledger_write_queue table not found, keeping failed ledger writes in memory")
+        self._ledger_write_queue_table_available = False
+        return True
+
+    def enqueue_stock_ledger_write(self, entry: dict) -> dict:
+        """Save a failed voucher ledger write (app.ledger_writer) for background retry."""
+        if getattr(self, "_ledger_write_queue_table_available", True):
+            try:
+                result = self.client.table("stock_ledger_write_queue").insert(entry).execute()
+                return result.data[0] if result.data else entry
+            except Exception as e:
+                if not self._ledger_write_queue_missing(e):
+                    raise
+        self._local_ledger_write_queue()[str(entry["id"])] = dict(entry)
+        return entry
+
+    def get_due_stock_ledger_writes(self, now: str, limit: int = 20) -> List[dict]:
+        """Pending queue entries whose next_attempt_at has passed, oldest first."""
+        if getattr(self, "_ledger_write_queue_table_available", True):
+            try:
+                result = (
+                    self.client.table("stock_ledger_write_queue")
+                    .select("*")
+                    .eq("status", "pending")
+                    .lte("next_attempt_at", now)
+                    .order("next_attempt_at")
+                    .limit(limit)
+                    .execute()
                 )
-            self.client.table("stock_ledger").insert(payloads).execute()
-            inserted += len(payloads)
-        return inserted
+                return result.data or []
+            except Exception as e:
+                if not self._ledger_write_queue_missing(e):
+                    raise
+        due = [
+            e for e in self._local_ledger_write_queue().values()
+            if e.get("status") == "pending" and str(e.get("next_attempt_at") or "") <= now
+        ]
+        return [dict(e) for e in sorted(due, key=lambda e: str(e.get("next_attempt_at")))[:limit]]
 
-    def get_stock_ledger_aggregates_by_product(self) -> Tuple[Dict[str, int], Dict[str, int], int]:
-        """Paginate entire stock_ledger and aggregate net qty + entry counts per product."""
-        net: Dict[str, int] = {}
-        cnt: Dict[str, int] = {}
-        total_rows = 0
-        page_size = 5000
-        offset = 0
-        while True:
-            result = (
-                self.client.table("stock_ledger")
-                .select("product_id,quantity_change")
-                .range(offset, offset + page_size - 1)
-                .execute()
-            )
-            rows = result.data or []
-            for row in rows:
-                pid = row.get("product_id")
-                if not pid:
-                    continue
-                pid = str(pid)
-                q = int(row.get("quantity_change") or 0)
-                net[pid] = net.get(pid, 0) + q
-                cnt[pid] = cnt.get(pid, 0) + 1
-            total_rows += len(rows)
-            if len(rows) < page_size:
-                break
-            offset += page_size
-        return net, cnt, total_rows
+    def claim_stock_ledger_write(self, entry_id: str, next_attempt_at: Optional[str], lease_until: str) -> bool:
+        """
+        Lease a queue entry: move next_attempt_at to lease_until only if it is still
+        next_attempt_at, so one API worker retries it at a time.
+        """
+        if getattr(self, "_ledger_write_queue_table_available", True):
+            try:
+                result = (
+                    self.client.table("stock_ledger_write_queue")
+                    .update({"next_attempt_at": lease_until})
+                    .eq("id", entry_id)
+                    .eq("status", "pending")
+                    .eq("next_attempt_at", next_attempt_at)
+                    .execute()
+                )
+                return bool(result.data)
+            except Exception as e:
+                if not self._ledger_write_queue_missing(e):
+                    raise
+        entry = self._local_ledger_write_queue().get(str(entry_id))
+        if not entry or entry.get("status") != "pending" or entry.get("next_attempt_at") != next_attempt_at:
+            return False
+        entry["next_attempt_at"] = lease_until
+        return True
+
+    def update_stock_ledger_write(self, entry_id: str, data: dict) -> None:
+        if getattr(self, "_ledger_write_queue_table_available", True):
+            try:
+                self.client.table("stock_ledger_write_queue").update(data).eq("id", entry_id).execute()
+                return
+            except Exception as e:
+                if not self._ledger_write_queue_missing(e):
+                    raise
+        entry = self._local_ledger_write_queue().get(str(entry_id))
+        if entry:
+            entry.update(data)
 
     def get_all_sales_return_items_flat(self) -> List[dict]:
         items_res = self.client.table("sales_return_items").select("*").execute()
@@ -2192,6 +3056,37 @@ class SupabaseDatabase:
         return sorted(alerts, key=lambda x: x.days_until_expiry)
     
     def get_dashboard_stats(self) -> DashboardStats:
+        """
+        Dashboard statistics as one row of the dashboard_stats view (app.dashboard_rollups).
+        Without the rollup tables (migration not applied) the source tables are aggregated.
+        """
+        if getattr(self, "_dashboard_rollups_available", True):
+            try:
+                rows = self.client.table("dashboard_stats").select("*").limit(1).execute().data
+                row = rows[0] if rows else self.refresh_dashboard_rollups()
+                if row:
+                    return stats_from_rollup(row)
+            except Exception as e:
+                if not _is_missing_table_error(e):
+                    raise
+                print("[Supabase] dashboard_stats view not found, aggregating source tables")
+                self._dashboard_rollups_available = False
+        return self._aggregate_dashboard_stats()
+
+    def refresh_dashboard_rollups(self) -> dict:
+        """Recompute the dashboard rollups (repair job); returns the refreshed dashboard_stats row."""
+        if getattr(self, "_refresh_dashboard_rollups_rpc_available", True):
+            try:
+                result = self.client.rpc("refresh_dashboard_rollups", {}).execute()
+                return result.data or {}
+            except Exception as e:
+                if not _is_missing_rpc_error(e):
+                    raise ValueError(_rpc_error_message(e))
+                print("[Supabase] refresh_dashboard_rollups RPC not found, dashboard stats are aggregated per request")
+                self._refresh_dashboard_rollups_rpc_available = False
+        return {}
+
+    def _aggregate_dashboard_stats(self) -> DashboardStats:
         """
         Calculate dashboard statistics with high performance by minimizing round-trips.
         """
@@ -2343,12 +3238,15 @@ class SupabaseDatabase:
     # Category methods
     def get_categories(self) -> List[dict]:
         try:
-            result = self.client.table("categories").select("*").execute()
-            categories = result.data or []
-            # Calculate product_count for each category
-            products = self.get_products()
+            categories = reference_cache.get_or_load(
+                "categories", lambda: self.client.table("categories").select("*").execute().data
+            )
+            # Calculate product_count for each category (one pass over the cached catalog)
+            product_counts: Dict[str, int] = {}
+            for p in self.get_products():
+                product_counts[p.get("category")] = product_counts.get(p.get("category"), 0) + 1
             for category in categories:
-                category["product_count"] = sum(1 for p in products if p.get("category") == category.get("name"))
+                category["product_count"] = product_counts.get(category.get("name"), 0)
                 # Convert created_at string to datetime if needed
                 created_at = category.get("created_at")
                 if created_at is None:
@@ -2376,9 +3274,11 @@ class SupabaseDatabase:
             raise
     
     def get_category(self, category_id: str) -> Optional[dict]:
-        result = self.client.table("categories").select("*").eq("id", category_id).execute()
-        if result.data:
-            category = result.data[0]
+        categories = reference_cache.get_or_load(
+            "categories", lambda: self.client.table("categories").select("*").execute().data
+        )
+        category = next((c for c in categories if str(c.get("id")) == str(category_id)), None)
+        if category:
             # Calculate product_count
             products = self.get_products()
             category["product_count"] = sum(1 for p in products if p.get("category") == category.get("name"))
@@ -2391,6 +3291,7 @@ class SupabaseDatabase:
             return category
         return None
     
+    @invalidates("categories")
     def create_category(self, data: dict) -> dict:
         """
         Create a category in Supabase.
@@ -2539,6 +3440,7 @@ class SupabaseDatabase:
             # Always raise - never return None or exit silently
             raise Exception(f"Unexpected error creating category: {error_type}: {error_msg}")
     
+    @invalidates("categories")
     def update_category(self, category_id: str, data: dict) -> Optional[dict]:
         result = self.client.table("categories").update(data).eq("id", category_id).execute()
         if result.data:
@@ -2555,6 +3457,7 @@ class SupabaseDatabase:
             return category
         return None
     
+    @invalidates("categories")
     def delete_category(self, category_id: str) -> bool:
         self.client.table("categories").delete().eq("id", category_id).execute()
         return True
@@ -2562,9 +3465,9 @@ class SupabaseDatabase:
     # Supplier methods
     def get_suppliers(self) -> List[dict]:
         try:
-            print(f"[Supabase] get_suppliers: Fetching all suppliers...")
-            result = self.client.table("suppliers").select("*").execute()
-            suppliers = result.data or []
+            suppliers = reference_cache.get_or_load(
+                "suppliers", lambda: self.client.table("suppliers").select("*").execute().data
+            )
             print(f"[Supabase] get_suppliers: Retrieved {len(suppliers)} suppliers")
             if suppliers:
                 print(f"[Supabase] get_suppliers: First supplier: id={suppliers[0].get('id', 'no-id')}, name={suppliers[0].get('name', 'no-name')}")
@@ -2578,9 +3481,9 @@ class SupabaseDatabase:
             raise
     
     def get_supplier(self, supplier_id: str) -> Optional[dict]:
-        result = self.client.table("suppliers").select("*").eq("id", supplier_id).execute()
-        return result.data[0] if result.data else None
+        return next((s for s in self.get_suppliers() if str(s.get("id")) == str(supplier_id)), None)
     
+    @invalidates("suppliers")
     def create_supplier(self, data: dict) -> dict:
         """
         Create a supplier in Supabase.
@@ -2669,31 +3572,36 @@ class SupabaseDatabase:
             traceback.print_exc()
             raise
     
+    @invalidates("suppliers")
     def update_supplier(self, supplier_id: str, data: dict) -> Optional[dict]:
         result = self.client.table("suppliers").update(data).eq("id", supplier_id).execute()
         return result.data[0] if result.data else None
     
+    @invalidates("suppliers")
     def delete_supplier(self, supplier_id: str) -> bool:
         self.client.table("suppliers").delete().eq("id", supplier_id).execute()
         return True
     
     # Unit methods
     def get_units(self) -> List[dict]:
-        result = self.client.table("units").select("*").execute()
-        return result.data or []
+        return reference_cache.get_or_load(
+            "units", lambda: self.client.table("units").select("*").execute().data
+        )
     
     def get_unit(self, unit_id: str) -> Optional[dict]:
-        result = self.client.table("units").select("*").eq("id", unit_id).execute()
-        return result.data[0] if result.data else None
+        return next((u for u in self.get_units() if str(u.get("id")) == str(unit_id)), None)
     
+    @invalidates("units")
     def create_unit(self, data: dict) -> dict:
         result = self.client.table("units").insert(data).execute()
         return result.data[0] if result.data else data
     
+    @invalidates("units")
     def update_unit(self, unit_id: str, data: dict) -> Optional[dict]:
         result = self.client.table("units").update(data).eq("id", unit_id).execute()
         return result.data[0] if result.data else None
     
+    @invalidates("units")
     def delete_unit(self, unit_id: str) -> bool:
         self.client.table("units").delete().eq("id", unit_id).execute()
         return True
@@ -2721,12 +3629,15 @@ class SupabaseDatabase:
         return result.data[0] if result.data else data
 
     def get_uom_conversions(self, product_id: Optional[str] = None) -> List[dict]:
-        query = self.client.table("uom_conversions").select("*")
+        rows = reference_cache.get_or_load(
+            "uom_conversions",
+            lambda: self.client.table("uom_conversions").select("*").order("created_at", desc=True).execute().data,
+        )
         if product_id:
-            query = query.eq("product_id", product_id)
-        result = query.order("created_at", desc=True).execute()
-        return result.data or []
+            rows = [r for r in rows if str(r.get("product_id")) == str(product_id)]
+        return rows
 
+    @invalidates("uom_conversions")
     def upsert_uom_conversion(self, data: dict) -> dict:
         existing = self.client.table("uom_conversions").select("*").eq("product_id", data["product_id"]).eq("from_uom", data["from_uom"]).eq("to_uom", data["to_uom"]).limit(1).execute()
         if existing.data:
@@ -2737,20 +3648,24 @@ class SupabaseDatabase:
 
     # ERP upgrade: price list
     def get_price_lists(self) -> List[dict]:
-        result = self.client.table("price_lists").select("*").order("priority").execute()
-        return result.data or []
+        return reference_cache.get_or_load(
+            "price_lists", lambda: self.client.table("price_lists").select("*").order("priority").execute().data
+        )
 
+    @invalidates("price_lists")
     def create_price_list(self, data: dict) -> dict:
         result = self.client.table("price_lists").insert(data).execute()
         return result.data[0] if result.data else data
 
     def get_price_list_items(self, price_list_id: Optional[str] = None) -> List[dict]:
-        query = self.client.table("price_list_items").select("*")
+        rows = reference_cache.get_or_load(
+            "price_list_items", lambda: _fetch_pages(lambda: self.client.table("price_list_items").select("*").order("id"))
+        )
         if price_list_id:
-            query = query.eq("price_list_id", price_list_id)
-        result = query.execute()
-        return result.data or []
+            rows = [r for r in rows if str(r.get("price_list_id")) == str(price_list_id)]
+        return rows
 
+    @invalidates("price_list_items")
     def upsert_price_list_item(self, data: dict) -> dict:
         query = self.client.table("price_list_items").select("*").eq("price_list_id", data["price_list_id"]).eq("product_id", data["product_id"])
         if data.get("variant_id"):
@@ -2764,6 +3679,7 @@ class SupabaseDatabase:
             result = self.client.table("price_list_items").insert(data).execute()
         return result.data[0] if result.data else data
 
+    @invalidates("retailer_price_list_assignments")
     def assign_price_list_to_retailer(self, retailer_id: str, price_list_id: str) -> dict:
         existing = self.client.table("retailer_price_list_assignments").select("*").eq("retailer_id", retailer_id).eq("price_list_id", price_list_id).limit(1).execute()
         if existing.data:
@@ -2771,40 +3687,43 @@ class SupabaseDatabase:
         result = self.client.table("retailer_price_list_assignments").insert({"retailer_id": retailer_id, "price_list_id": price_list_id}).execute()
         return result.data[0] if result.data else {"retailer_id": retailer_id, "price_list_id": price_list_id}
 
+    def get_price_list_assignments(self) -> List[dict]:
+        return reference_cache.get_or_load(
+            "retailer_price_list_assignments",
+            lambda: _fetch_pages(
+                lambda: self.client.table("retailer_price_list_assignments").select("retailer_id, price_list_id").order("id")
+            ),
+        )
+
+    def _compile_price_index(self) -> PriceIndex:
+        return PriceIndex(self.get_price_lists(), self.get_price_list_items(), self.get_price_list_assignments())
+
+    def resolve_prices(self, retailer_id: str, lines: List[dict]) -> List[dict]:
+        """
+        Resolve every order line (product_id, variant_id, quantity, uom) against the
+        compiled price-list index (app.pricing); unpriced lines fall back to the
+        product's selling_price. Results are in line order.
+        """
+        index = price_indexes.get(self._compile_price_index)
+        resolved = [
+            index.resolve(retailer_id, line["product_id"], line.get("variant_id"), line.get("quantity", 0), line.get("uom"))
+            for line in lines
+        ]
+        missing = list(dict.fromkeys(str(line["product_id"]) for r, line in zip(resolved, lines) if r is None))
+        if missing:
+            products: Dict[str, dict] = {}
+            for chunk in _chunked(missing):
+                products.update(self.get_rows_by_ids("products", chunk))
+            resolved = [
+                r if r is not None else default_price(products.get(str(line["product_id"])))
+                for r, line in zip(resolved, lines)
+            ]
+        return resolved
+
     def resolve_price(self, retailer_id: str, product_id: str, variant_id: Optional[str], quantity: float, uom: Optional[str]) -> dict:
-        assignments = self.client.table("retailer_price_list_assignments").select("price_list_id").eq("retailer_id", retailer_id).execute().data or []
-        price_list_ids = [a.get("price_list_id") for a in assignments if a.get("price_list_id")]
-        if price_list_ids:
-            lists = self.client.table("price_lists").select("*").in_("id", price_list_ids).eq("is_active", True).order("priority").execute().data or []
-            for pl in lists:
-                items = self.client.table("price_list_items").select("*").eq("price_list_id", pl["id"]).eq("product_id", product_id).execute().data or []
-                items = [
-                    i for i in items
-                    if (not i.get("variant_id") or i.get("variant_id") == variant_id)
-                    and (not i.get("uom") or i.get("uom") == uom)
-                    and float(quantity) >= float(i.get("min_qty", 0) or 0)
-                ]
-                if items:
-                    item = sorted(items, key=lambda x: float(x.get("min_qty", 0) or 0), reverse=True)[0]
-                    base_price = float(item.get("unit_price", 0) or 0)
-                    discount_percent = float(item.get("discount_percent", 0) or 0)
-                    resolved_price = round(base_price * (1 - discount_percent / 100), 2)
-                    return {
-                        "price_list_id": pl["id"],
-                        "price_source": "price_list",
-                        "base_price": base_price,
-                        "resolved_price": resolved_price,
-                        "discount_percent": discount_percent,
-                    }
-        product = self.get_product(product_id) or {}
-        fallback = float(product.get("selling_price", 0) or 0)
-        return {
-            "price_list_id": None,
-            "price_source": "product_default",
-            "base_price": fallback,
-            "resolved_price": fallback,
-            "discount_percent": 0,
-        }
+        return self.resolve_prices(
+            retailer_id, [{"product_id": product_id, "variant_id": variant_id, "quantity": quantity, "uom": uom}]
+        )[0]
 
     # ERP upgrade: reorder
     def upsert_reorder_policy(self, data: dict) -> dict:
@@ -2864,40 +3783,29 @@ class SupabaseDatabase:
         return result.data[0] if result.data else data
 
     def get_receivable_aging(self) -> List[dict]:
-        rows = []
-        retailers = self.get_retailers()
-        now = datetime.now().date()
-        for retailer in retailers:
-            sales = self.client.table("sales").select("id,due_amount,due_date,created_at").eq("retailer_id", retailer["id"]).execute().data or []
-            bucket = {"current": 0.0, "bucket_8_15": 0.0, "bucket_16_30": 0.0, "bucket_31_60": 0.0, "bucket_60_plus": 0.0}
-            for sale in sales:
-                due = float(sale.get("due_amount", 0) or 0)
-                if due <= 0:
-                    continue
-                due_date = sale.get("due_date")
-                days = 0
-                if due_date:
-                    try:
-                        days = (now - datetime.fromisoformat(str(due_date)).date()).days
-                    except Exception:
-                        days = 0
-                if days <= 7:
-                    bucket["current"] += due
-                elif days <= 15:
-                    bucket["bucket_8_15"] += due
-                elif days <= 30:
-                    bucket["bucket_16_30"] += due
-                elif days <= 60:
-                    bucket["bucket_31_60"] += due
-                else:
-                    bucket["bucket_60_plus"] += due
-            rows.append({
-                "retailer_id": retailer["id"],
-                "retailer_name": retailer.get("shop_name") or retailer.get("name"),
-                "total_due": sum(bucket.values()),
-                **bucket,
-            })
-        return rows
+        return self.get_receivable_aging_report()["rows"]
+
+    def get_receivable_aging_report(self, as_of: Optional[date] = None, edges: Optional[Tuple[int, ...]] = None) -> dict:
+        """
+        Aging for every retailer plus SR / market-route totals (see app.aging).
+
+        One projected, paged read of open-due sales created up to as_of, one of
+        retailers and one of market routes, independent of retailer count.
+        """
+        as_of = as_of or datetime.now().date()
+        created_before = (as_of + timedelta(days=1)).isoformat()
+        sales = _fetch_pages(
+            lambda: self.client.table("sales")
+            .select("id, retailer_id, due_amount, due_date, created_at, assigned_to, assigned_to_name")
+            .gt("due_amount", 0)
+            .lt("created_at", created_before)
+            .order("id")
+        )
+        retailers = _fetch_pages(
+            lambda: self.client.table("retailers").select("id, name, shop_name, market_route_id").order("id")
+        )
+        market_routes = {str(r["id"]): r.get("name") for r in self.get_market_routes()}
+        return age_receivables(sales, retailers, edges or DEFAULT_AGING_EDGES, as_of, market_routes)
 
     def check_credit_limit(self, retailer_id: str, new_order_amount: float) -> dict:
         retailer = self.get_retailer(retailer_id)
@@ -2926,73 +3834,74 @@ class SupabaseDatabase:
         result = self.client.table("sale_item_cost_snapshot").insert(data).execute()
         return result.data[0] if result.data else data
 
-    def get_margin_report(self, from_date: Optional[str] = None, to_date: Optional[str] = None) -> dict:
-        query = self.client.table("sale_item_cost_snapshot").select("*")
-        if from_date:
-            query = query.gte("created_at", from_date)
-        if to_date:
-            query = query.lte("created_at", to_date)
-        snapshots = query.execute().data or []
-        rows = []
-        total_net_sales = 0.0
-        total_cogs = 0.0
-        for snap in snapshots:
-            sale_item = {}
-            sale = {}
-            sale_item_id = snap.get("sale_item_id")
-            if sale_item_id:
-                si_res = self.client.table("sale_items").select("*").eq("id", sale_item_id).limit(1).execute()
-                if si_res.data:
-                    sale_item = si_res.data[0]
-            sale_id = sale_item.get("sale_id")
-            if sale_id:
-                s_res = self.client.table("sales").select("id,invoice_number,created_at").eq("id", sale_id).limit(1).execute()
-                if s_res.data:
-                    sale = s_res.data[0]
-            quantity = int(sale_item.get("quantity", 0) or 0)
-            net_sales = float(sale_item.get("total", 0) or 0)
-            cogs_total = float(snap.get("cogs_total", 0) or 0)
-            margin_amount = net_sales - cogs_total
-            margin_percent = (margin_amount / net_sales * 100) if net_sales > 0 else 0
-            total_net_sales += net_sales
-            total_cogs += cogs_total
-            rows.append({
-                "sale_id": sale.get("id") or sale_item.get("sale_id"),
-                "invoice_number": sale.get("invoice_number"),
-                "product_id": sale_item.get("product_id"),
-                "product_name": sale_item.get("product_name"),
-                "quantity": quantity,
-                "net_sales": net_sales,
-                "cogs_total": cogs_total,
-                "margin_amount": margin_amount,
-                "margin_percent": margin_percent,
-                "created_at": sale.get("created_at") or snap.get("created_at"),
-            })
-        total_margin = total_net_sales - total_cogs
-        return {
-            "total_net_sales": total_net_sales,
-            "total_cogs": total_cogs,
-            "total_margin": total_margin,
-            "margin_percent": (total_margin / total_net_sales * 100) if total_net_sales > 0 else 0,
-            "rows": rows,
-        }
+    def get_margin_report(
+        self,
+        from_date: Optional[str] = None,
+        to_date: Optional[str] = None,
+        group_by: Optional[str] = None,
+        include_rows: bool = True,
+    ) -> dict:
+        """Margin totals, rows and optional group-by (see app.margins) from iter_margin_rows."""
+        return summarize_margin_rows(self.iter_margin_rows(from_date, to_date), group_by, include_rows)
+
+    def iter_margin_rows(self, from_date: Optional[str] = None, to_date: Optional[str] = None) -> Iterator[dict]:
+        """
+        Margin rows for cost snapshots in the date range, one snapshot page at a time.
+
+        Each page costs one snapshot query plus one chunked in_() query each for
+        its sale_items and sales, so memory stays bounded for long ranges.
+        """
+        def build():
+            query = self.client.table("sale_item_cost_snapshot").select("id, sale_item_id, product_id, cogs_total, created_at")
+            if from_date:
+                query = query.gte("created_at", from_date)
+            if to_date:
+                query = query.lte("created_at", to_date)
+            return query.order("created_at").order("id")
+
+        categories = {str(p["id"]): p.get("category") for p in self.get_products()}
+        for snapshots in _iter_pages(build):
+            sale_items: Dict[str, dict] = {}
+            for chunk in _chunked(list({str(s["sale_item_id"]) for s in snapshots if s.get("sale_item_id")})):
+                result = (
+                    self.client.table("sale_items")
+                    .select("id, sale_id, product_id, product_name, quantity, total")
+                    .in_("id", chunk)
+                    .execute()
+                )
+                sale_items.update({str(item["id"]): item for item in result.data or []})
+            sales: Dict[str, dict] = {}
+            for chunk in _chunked(list({str(i["sale_id"]) for i in sale_items.values() if i.get("sale_id")})):
+                result = (
+                    self.client.table("sales")
+                    .select("id, invoice_number, created_at, retailer_id, retailer_name, assigned_to, assigned_to_name")
+                    .in_("id", chunk)
+                    .execute()
+                )
+                sales.update({str(sale["id"]): sale for sale in result.data or []})
+            for snap in snapshots:
+                sale_item = sale_items.get(str(snap.get("sale_item_id")), {})
+                sale = sales.get(str(sale_item.get("sale_id")), {})
+                product_id = sale_item.get("product_id") or snap.get("product_id")
+                yield margin_row(snap, sale_item, sale, categories.get(str(product_id)))
     
     # SMS Settings methods
     def get_sms_settings(self, user_id: Optional[str] = None, role: Optional[str] = None) -> List[dict]:
         """Get SMS settings for a user or role"""
-        try:
-            query = self.client.table("sms_settings").select("*")
-            if user_id:
-                query = query.eq("user_id", user_id)
-            if role:
-                query = query.eq("role", role)
-            result = query.execute()
-            if hasattr(result, 'error') and result.error:
-                raise Exception(f"Supabase error: {result.error}")
-            return result.data or []
-        except Exception as e:
-            raise
+        rows = reference_cache.get_or_load("sms_settings", self._load_sms_settings)
+        if user_id:
+            rows = [r for r in rows if str(r.get("user_id")) == str(user_id)]
+        if role:
+            rows = [r for r in rows if r.get("role") == role]
+        return rows
+
+    def _load_sms_settings(self) -> List[dict]:
+        result = self.client.table("sms_settings").select("*").execute()
+        if hasattr(result, 'error') and result.error:
+            raise Exception(f"Supabase error: {result.error}")
+        return result.data or []
     
+    @invalidates("sms_settings")
     def create_sms_settings(self, data: dict) -> dict:
         """Create SMS settings"""
         try:
@@ -3003,6 +3912,7 @@ class SupabaseDatabase:
         except Exception as e:
             raise
     
+    @invalidates("sms_settings")
     def update_sms_settings(self, settings_id: str, data: dict) -> Optional[dict]:
         """Update SMS settings"""
         data["updated_at"] = datetime.now().isoformat()
@@ -3016,35 +3926,34 @@ class SupabaseDatabase:
     
     def get_sms_settings_by_user_and_event(self, user_id: str, event_type: str) -> Optional[dict]:
         """Get SMS settings for a specific user and event type"""
-        result = self.client.table("sms_settings").select("*").eq("user_id", user_id).eq("event_type", event_type).execute()
-        return result.data[0] if result.data else None
+        return next((r for r in self.get_sms_settings(user_id=user_id) if r.get("event_type") == event_type), None)
     
     def get_sms_settings_by_role_and_event(self, role: str, event_type: str) -> Optional[dict]:
         """Get SMS settings for a specific role and event type"""
-        result = self.client.table("sms_settings").select("*").eq("role", role).eq("event_type", event_type).execute()
-        return result.data[0] if result.data else None
+        return next((r for r in self.get_sms_settings(role=role) if r.get("event_type") == event_type), None)
     
     # SMS Templates methods
     def get_sms_templates(self) -> List[dict]:
         """Get all SMS templates"""
-        result = self.client.table("sms_templates").select("*").execute()
-        return result.data or []
+        return reference_cache.get_or_load(
+            "sms_templates", lambda: self.client.table("sms_templates").select("*").execute().data
+        )
     
     def get_sms_template(self, template_id: str) -> Optional[dict]:
         """Get SMS template by ID"""
-        result = self.client.table("sms_templates").select("*").eq("id", template_id).execute()
-        return result.data[0] if result.data else None
+        return next((t for t in self.get_sms_templates() if str(t.get("id")) == str(template_id)), None)
     
     def get_sms_template_by_event_type(self, event_type: str) -> Optional[dict]:
         """Get SMS template by event type"""
-        result = self.client.table("sms_templates").select("*").eq("event_type", event_type).execute()
-        return result.data[0] if result.data else None
+        return next((t for t in self.get_sms_templates() if t.get("event_type") == event_type), None)
     
+    @invalidates("sms_templates")
     def create_sms_template(self, data: dict) -> dict:
         """Create SMS template"""
         result = self.client.table("sms_templates").insert(data).execute()
         return result.data[0] if result.data else data
     
+    @invalidates("sms_templates")
     def update_sms_template(self, template_id: str, data: dict) -> Optional[dict]:
         """Update SMS template"""
         data["updated_at"] = datetime.now().isoformat()
@@ -3120,27 +4029,71 @@ class SupabaseDatabase:
         Calculate previous due for a retailer (sum of unpaid/partial orders not in any route).
         Excludes orders already in routes (unless exclude_route_id is specified, then excludes only that route).
         """
-        # Get all sales for this retailer
-        query = self.client.table("sales").select("due_amount, route_id, payment_status")
-        query = query.eq("retailer_id", retailer_id)
-        query = query.neq("payment_status", "paid")  # Only unpaid/partial orders
-        
-        result = query.execute()
-        sales = result.data or []
-        
-        # Filter in Python (Supabase Python client doesn't support complex OR queries easily)
-        if exclude_route_id:
-            # Exclude orders in the specified route (for editing routes)
-            filtered_sales = [s for s in sales if not s.get("route_id") or s.get("route_id") != exclude_route_id]
-        else:
-            # Exclude orders already in any route
-            filtered_sales = [s for s in sales if not s.get("route_id")]
-        
-        previous_due = sum(float(s.get("due_amount", 0)) for s in filtered_sales)
-        return previous_due
+        return self.calculate_previous_dues([retailer_id], exclude_route_id).get(str(retailer_id), 0.0)
+
+    def calculate_previous_dues(self, retailer_ids: List[str], exclude_route_id: Optional[str] = None) -> Dict[str, float]:
+        """
+        calculate_previous_due for many retailers; every requested id is present.
+
+        The common case (no exclude_route_id) reads the trigger-maintained
+        retailer_previous_due balances with one chunked in_() query. Editing a
+        route (exclude_route_id) or a database without the migration falls back
+        to summing the retailers' unpaid sales.
+        """
+        ids = list(dict.fromkeys(str(r) for r in retailer_ids if r))
+        if not ids:
+            return {}
+        if not exclude_route_id:
+            balances = self._get_previous_due_balances(ids)
+            if balances is not None:
+                return balances
+        return self._sum_previous_dues(ids, exclude_route_id)
+
+    def _get_previous_due_balances(self, retailer_ids: List[str]) -> Optional[Dict[str, float]]:
+        """Maintained unrouted due per retailer, or None when retailer_previous_due does not exist."""
+        if not getattr(self, "_previous_due_table_available", True):
+            return None
+        dues: Dict[str, float] = {retailer_id: 0.0 for retailer_id in retailer_ids}
+        try:
+            for chunk in _chunked(retailer_ids):
+                result = self.client.table("retailer_previous_due").select("retailer_id, amount").in_("retailer_id", chunk).execute()
+                for row in result.data or []:
+                    dues[str(row["retailer_id"])] = max(0.0, float(row.get("amount") or 0))
+        except Exception as e:
+            if not _is_missing_table_error(e):
+                raise
+            print("[Supabase] retailer_previous_due table not found, summing unpaid sales")
+            self._previous_due_table_available = False
+            return None
+        return dues
+
+    def _sum_previous_dues(self, retailer_ids: List[str], exclude_route_id: Optional[str] = None) -> Dict[str, float]:
+        """Previous due from the retailers' unpaid sales: one paged read per in_() chunk."""
+        dues: Dict[str, float] = {retailer_id: 0.0 for retailer_id in retailer_ids}
+        for chunk in _chunked(retailer_ids):
+            sales = _fetch_pages(
+                lambda chunk=chunk: self.client.table("sales")
+                .select("id, retailer_id, due_amount, route_id")
+                .in_("retailer_id", chunk)
+                .neq("payment_status", "paid")  # Only unpaid/partial orders
+                .order("id")
+            )
+            for sale in sales:
+                route_id = sale.get("route_id")
+                # Without exclude_route_id only unrouted orders count; with it, every order outside that route
+                if route_id and (not exclude_route_id or str(route_id) == str(exclude_route_id)):
+                    continue
+                dues[str(sale["retailer_id"])] += float(sale.get("due_amount") or 0)
+        return dues
     
+    @invalidates("sales", "routes")
     def create_route(self, data: dict, sale_ids: List[str]) -> dict:
-        """Create a new route/batch with sales orders and calculate previous due snapshots"""
+        """
+        Create a new route/batch with sales orders and calculate previous due snapshots.
+
+        Candidate sales are read once, previous due is computed for all their
+        retailers together, and route_sales / sales writes are issued in bulk.
+        """
         from datetime import datetime
         import uuid
         
@@ -3149,74 +4102,38 @@ class SupabaseDatabase:
         if not assigned_user:
             raise ValueError("Assigned user not found")
         
-        # Generate route number
-        route_number = f"RT-{datetime.now().strftime('%Y%m%d')}-{str(uuid.uuid4())[:4].upper()}"
-        
-        # Calculate previous due for each retailer and create route_sales records
-        route_sales_data = []
-        retailer_previous_due = {}  # Cache previous due per retailer
-        
-        # First pass: collect all retailer IDs and calculate their previous due
-        retailer_ids = set()
-        for sale_id in sale_ids:
-            sale = self.get_sale(sale_id)
-            if sale and sale.get("retailer_id"):
-                retailer_ids.add(sale.get("retailer_id"))
-        
-        # Calculate previous due for each retailer (excluding sales being added to route)
-        for retailer_id in retailer_ids:
-            # Get all sales for this retailer that are being added to route
-            route_sale_ids_for_retailer = [
-                sale_id for sale_id in sale_ids
-                if (sale := self.get_sale(sale_id)) and sale.get("retailer_id") == retailer_id
-            ]
-            
-            # Calculate total due for these sales
-            route_sales_due = 0.0
-            for sid in route_sale_ids_for_retailer:
-                sale = self.get_sale(sid)
-                if sale:
-                    route_sales_due += float(sale.get("due_amount", 0))
-            
-            # Calculate all previous due for retailer
-            all_previous_due = self.calculate_previous_due(retailer_id)
-            
-            # Previous due snapshot = all previous due - due from sales being added to route
-            retailer_previous_due[retailer_id] = max(0, all_previous_due - route_sales_due)
-        
-        # Second pass: create route_sales records with previous due snapshots
-        for sale_id in sale_ids:
-            sale = self.get_sale(sale_id)
-            if not sale:
-                continue
-            
-            retailer_id = sale.get("retailer_id")
-            if not retailer_id:
-                continue
-            
-            previous_due_snapshot = retailer_previous_due.get(retailer_id, 0)
-            
-            route_sales_data.append({
-                "sale_id": sale_id,
-                "previous_due": previous_due_snapshot
-            })
-        
-        if not route_sales_data:
+        # Load every candidate sale once; sales without a retailer are skipped
+        wanted = list(dict.fromkeys(str(sale_id) for sale_id in sale_ids if sale_id))
+        sales_by_id: Dict[str, dict] = {}
+        for chunk in _chunked(wanted):
+            result = self.client.table("sales").select("id, retailer_id, due_amount, total_amount").in_("id", chunk).execute()
+            for sale in result.data or []:
+                sales_by_id[str(sale["id"])] = sale
+        route_sales = [sales_by_id[sale_id] for sale_id in wanted if sales_by_id.get(sale_id, {}).get("retailer_id")]
+        if not route_sales:
             raise ValueError("No valid sales found to add to route")
         
-        # Calculate route totals
-        total_orders = len(route_sales_data)
-        total_amount = sum(float(self.get_sale(rs["sale_id"]).get("total_amount", 0)) for rs in route_sales_data)
+        # Previous due snapshot = retailer's unrouted due - due of the sales being added to this route
+        route_due_by_retailer: Dict[str, float] = {}
+        for sale in route_sales:
+            retailer_id = str(sale["retailer_id"])
+            route_due_by_retailer[retailer_id] = route_due_by_retailer.get(retailer_id, 0.0) + float(sale.get("due_amount") or 0)
+        all_previous_due = self.calculate_previous_dues(list(route_due_by_retailer))
+        retailer_previous_due = {
+            retailer_id: max(0, all_previous_due.get(retailer_id, 0.0) - route_due)
+            for retailer_id, route_due in route_due_by_retailer.items()
+        }
         
         # Create route record
+        route_number = f"RT-{datetime.now().strftime('%Y%m%d')}-{str(uuid.uuid4())[:4].upper()}"
         route_data = {
             "route_number": route_number,
             "assigned_to": data["assigned_to"],
             "assigned_to_name": assigned_user.get("name"),
             "route_date": data["route_date"].isoformat() if isinstance(data["route_date"], date) else data["route_date"],
             "status": "pending",
-            "total_orders": total_orders,
-            "total_amount": total_amount,
+            "total_orders": len(route_sales),
+            "total_amount": sum(float(sale.get("total_amount") or 0) for sale in route_sales),
             "notes": data.get("notes")
         }
         
@@ -3224,24 +4141,27 @@ class SupabaseDatabase:
         if not route_result.data:
             raise ValueError("Failed to create route")
         
-        route = route_result.data[0]
-        route_id = route["id"]
+        route_id = route_result.data[0]["id"]
         
         # Create route_sales records with previous_due snapshots
-        for rs_data in route_sales_data:
-            route_sale_data = {
+        route_sale_rows = [
+            {
                 "route_id": route_id,
-                "sale_id": rs_data["sale_id"],
-                "previous_due": rs_data["previous_due"]
+                "sale_id": sale["id"],
+                "previous_due": retailer_previous_due[str(sale["retailer_id"])],
             }
-            self.client.table("route_sales").insert(route_sale_data).execute()
-            
-            # Update sale.route_id AND override sales.assigned_to to match route (Route SR overrides Sales SR)
+            for sale in route_sales
+        ]
+        for chunk in _chunked(route_sale_rows):
+            self.client.table("route_sales").insert(chunk).execute()
+        
+        # Attach sales to the route AND override sales.assigned_to to match route (Route SR overrides Sales SR)
+        for chunk in _chunked([sale["id"] for sale in route_sales]):
             self.client.table("sales").update({
                 "route_id": route_id,
                 "assigned_to": data["assigned_to"],  # Route's SR
                 "assigned_to_name": assigned_user.get("name")  # Route's SR name
-            }).eq("id", rs_data["sale_id"]).execute()
+            }).in_("id", chunk).execute()
         
         # Fetch complete route with sales
         return self.get_route(route_id)
@@ -3260,34 +4180,62 @@ class SupabaseDatabase:
         result = query.execute()
         return result.data or []
     
+    @loader_cached("routes")
     def get_route(self, route_id: str) -> Optional[dict]:
         """Get route with all associated sales and previous due snapshots"""
-        route_result = self.client.table("routes").select("*").eq("id", route_id).execute()
-        if not route_result.data:
-            return None
-        
-        route = route_result.data[0]
-        
-        # Get route_sales (previous due snapshots)
-        route_sales_result = self.client.table("route_sales").select("*").eq("route_id", route_id).execute()
-        route_sales = route_sales_result.data or []
-        
-        # Get sales for this route
-        sale_ids = [rs["sale_id"] for rs in route_sales]
-        sales = []
-        for sale_id in sale_ids:
-            sale = self.get_sale(sale_id)
+        return self.get_routes_with_sales([route_id]).get(str(route_id))
+
+    def get_route_assignees(self, route_ids: List[str]) -> Dict[str, Optional[str]]:
+        """{route_id: assigned_to} with one chunked query (sale visibility checks need only the owner)."""
+        assignees: Dict[str, Optional[str]] = {}
+        for chunk in _chunked(list(dict.fromkeys(str(i) for i in route_ids if i))):
+            for route in self.client.table("routes").select("id,assigned_to").in_("id", chunk).execute().data or []:
+                assignees[str(route["id"])] = route.get("assigned_to")
+        return assignees
+
+    def get_routes_with_sales(self, route_ids: List[str]) -> Dict[str, dict]:
+        """
+        Load routes with their route_sales and sales (items embedded), keyed by route id.
+
+        Three queries (chunked in_() lists) regardless of how many routes or sales;
+        previous_due snapshots are joined from route_sales by sale id.
+        """
+        ids = list(dict.fromkeys(str(i) for i in route_ids if i))
+        if not ids:
+            return {}
+
+        routes: Dict[str, dict] = {}
+        for chunk in _chunked(ids):
+            for route in self.client.table("routes").select("*").in_("id", chunk).execute().data or []:
+                route["sales"] = []
+                route["route_sales"] = []
+                routes[str(route["id"])] = route
+        if not routes:
+            return {}
+
+        route_sales: List[dict] = []
+        for chunk in _chunked(list(routes)):
+            route_sales.extend(
+                _fetch_pages(
+                    lambda chunk=chunk: self.client.table("route_sales").select("*").in_("route_id", chunk).order("id")
+                )
+            )
+
+        sales: Dict[str, dict] = {}
+        for chunk in _chunked(list(dict.fromkeys(str(rs["sale_id"]) for rs in route_sales))):
+            sales.update(self.get_rows_by_ids("sales", chunk))
+
+        for rs in route_sales:
+            route = routes.get(str(rs["route_id"]))
+            if route is None:
+                continue
+            route["route_sales"].append(rs)
+            sale = sales.get(str(rs["sale_id"]))
             if sale:
-                # Find corresponding previous_due from route_sales
-                route_sale = next((rs for rs in route_sales if rs["sale_id"] == sale_id), None)
-                if route_sale:
-                    sale["previous_due"] = float(route_sale.get("previous_due", 0))
-                sales.append(sale)
-        
-        route["sales"] = sales
-        route["route_sales"] = route_sales
-        
-        return route
+                sale = dict(sale)
+                sale["previous_due"] = float(rs.get("previous_due") or 0)
+                route["sales"].append(sale)
+        return routes
     
     def _check_route_not_reconciled(self, route: dict) -> None:
         """Raise ValueError if route is reconciled (immutable)"""
@@ -3412,6 +4360,7 @@ class SupabaseDatabase:
         except: pass
         # #endregion
     
+    @invalidates("sales", "routes")
     def update_route(self, route_id: str, data: dict) -> Optional[dict]:
         """Update route (status, notes, etc.)"""
         # #region agent log
@@ -3553,6 +4502,7 @@ class SupabaseDatabase:
         
         return result.data[0] if result.data else None
     
+    @invalidates("sales", "routes")
     def add_sales_to_route(self, route_id: str, sale_ids: List[str]) -> dict:
         """Add sales orders to an existing route"""
         route = self.get_route(route_id)
@@ -3633,6 +4583,7 @@ class SupabaseDatabase:
         
         return self.get_route(route_id)
     
+    @invalidates("sales", "routes")
     def remove_sale_from_route(self, route_id: str, sale_id: str) -> dict:
         """Remove a sale from route"""
         route = self.get_route(route_id)
@@ -3673,6 +4624,7 @@ class SupabaseDatabase:
         
         return self.get_route(route_id)
     
+    @invalidates("sales", "routes")
     def delete_route(self, route_id: str) -> bool:
         """Delete a route (cascades to route_sales, clears sales.route_id)"""
         try:
@@ -3695,6 +4647,7 @@ class SupabaseDatabase:
             print(f"[DB] Error deleting route {route_id}: {e}")
             raise
     
+    @invalidates("sales", "routes", "users")
     def create_route_reconciliation(self, route_id: str, data: dict, user_id: Optional[str] = None) -> dict:
         """Create reconciliation record for a route"""
         route = self.get_route(route_id)
@@ -3805,30 +4758,16 @@ class SupabaseDatabase:
         This function should ONLY be called during reconciliation.
         Individual payments during delivery do NOT update cash holdings.
         """
-        # Get current holding (before update)
-        user = self.get_user_by_id(user_id)
-        if not user:
-            raise ValueError("User not found")
-        
-        before_balance = float(user.get("current_cash_holding", 0))
-        after_balance = before_balance + amount
-        
-        # Update users.current_cash_holding
-        self.client.table("users").update({"current_cash_holding": after_balance}).eq("id", user_id).execute()
-        
-        # Create historical audit trail record with before/after balance
-        holding_record = {
-            "user_id": user_id,
+        # Increment + audit row (with before/after balance) in one atomic call
+        result = self.apply_balance_deltas([{
+            "kind": "sr_cash",
+            "id": user_id,
             "amount": amount,  # Change amount (positive = added, negative = deducted)
-            "before_balance": before_balance,  # Balance before this transaction
-            "after_balance": after_balance,  # Balance after this transaction
             "source": source,  # 'reconciliation', 'manual_adjustment', 'initial'
             "reference_id": reference_id,  # route_reconciliation_id or NULL
-            "notes": notes or f"Cash holding updated from {source}"
-        }
-        
-        result = self.client.table("sr_cash_holdings").insert(holding_record).execute()
-        return result.data[0] if result.data else holding_record
+            "notes": notes or f"Cash holding updated from {source}",
+        }])
+        return result["sr_cash"].get(str(user_id)) or {"user_id": user_id, "amount": amount, "source": source}
     
     def get_sr_accountability(self, user_id: str) -> Optional[dict]:
         """Get SR accountability report"""
@@ -0,0 +1,165 @@
+-- Single round-trip, transactional sale creation
+-- Replaces the per-line HTTP sequence in SupabaseDatabase.create_sale
+-- (batch/product read+write, item insert, cost snapshot) plus the retailer
+-- due update, receivable ledger and stock ledger writes.
+-- Either everything is written or nothing is.
+-- Created: 2026-10-16
+
+CREATE OR REPLACE FUNCTION create_sale_atomic(p_sale JSONB, p_items JSONB)
+RETURNS JSONB
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    v_sale_id UUID := uuid_generate_v4();
+    v_retailer retailers%ROWTYPE;
+    v_subtotal NUMERIC := 0;
+    v_discount NUMERIC := 0;
+    v_total NUMERIC;
+    v_paid NUMERIC := COALESCE(NULLIF(p_sale->>'paid_amount', '')::NUMERIC, 0);
+    v_due NUMERIC;
+    v_assigned_to UUID := NULLIF(p_sale->>'assigned_to', '')::UUID;
+    v_created_by UUID := NULLIF(p_sale->>'created_by', '')::UUID;
+    v_invoice TEXT;
+    v_sale sales%ROWTYPE;
+    v_has_ledger BOOLEAN := to_regclass('public.stock_ledger') IS NOT NULL;
+BEGIN
+    -- Row lock serialises concurrent sales for the same retailer (due balance)
+    SELECT * INTO v_retailer FROM retailers WHERE id = (p_sale->>'retailer_id')::UUID FOR UPDATE;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Retailer not found' USING ERRCODE = 'P0002';
+    END IF;
+
+    -- Valid lines only: product and batch must exist (same rule as the Python path)
+    DROP TABLE IF EXISTS _sale_lines;
+    CREATE TEMP TABLE _sale_lines ON COMMIT DROP AS
+    SELECT
+        li.ord,
+        uuid_generate_v4() AS sale_item_id,
+        p.id AS product_id,
+        p.name AS product_name,
+        b.id AS batch_id,
+        b.batch_number,
+        b.warehouse_id,
+        (li.item->>'quantity')::INTEGER AS quantity,
+        (li.item->>'unit_price')::NUMERIC AS unit_price,
+        COALESCE(NULLIF(li.item->>'discount', '')::NUMERIC, 0) AS discount,
+        COALESCE(b.purchase_price, p.purchase_price, 0) AS cost_unit,
+        li.item
+    FROM jsonb_array_elements(p_items) WITH ORDINALITY AS li(item, ord)
+    JOIN products p ON p.id = NULLIF(li.item->>'product_id', '')::UUID
+    JOIN product_batches b ON b.id = NULLIF(li.item->>'batch_id', '')::UUID;
+
+    IF NOT EXISTS (SELECT 1 FROM _sale_lines) THEN
+        RAISE EXCEPTION 'No valid items found. All items must have valid product_id and batch_id.' USING ERRCODE = 'P0001';
+    END IF;
+
+    SELECT COALESCE(SUM(quantity * unit_price), 0), COALESCE(SUM(discount), 0)
+      INTO v_subtotal, v_discount
+      FROM _sale_lines;
+    v_total := v_subtotal - v_discount;
+    v_due := v_total - v_paid;
+
+    -- Stock: relative updates, batches locked in id order to avoid deadlocks
+    PERFORM 1 FROM product_batches WHERE id IN (SELECT batch_id FROM _sale_lines) ORDER BY id FOR UPDATE;
+    UPDATE product_batches b
+       SET quantity = b.quantity - l.qty
+      FROM (SELECT batch_id, SUM(quantity) AS qty FROM _sale_lines GROUP BY batch_id) l
+     WHERE b.id = l.batch_id;
+
+    UPDATE products p
+       SET stock_quantity = GREATEST(0, COALESCE(p.stock_quantity, 0) - l.qty)
+      FROM (SELECT product_id, SUM(quantity) AS qty FROM _sale_lines GROUP BY product_id) l
+     WHERE p.id = l.product_id;
+
+    IF v_due > 0 THEN
+        UPDATE retailers SET total_due = COALESCE(total_due, 0) + v_due WHERE id = v_retailer.id;
+    END IF;
+
+    v_invoice := 'INV-' || to_char(NOW(), 'YYYYMMDD') || '-'
+        || upper(substr(replace(uuid_generate_v4()::TEXT, '-', ''), 1, 4));
+
+    INSERT INTO sales (
+        id, invoice_number, retailer_id, retailer_name, subtotal, discount, total_amount,
+        paid_amount, due_amount, payment_status, status, notes,
+        assigned_to, assigned_to_name, created_by, created_by_name,
+        terms_days, due_date, credit_status, credit_risk_bearer, sr_liable_user_id, created_at
+    ) VALUES (
+        v_sale_id, v_invoice, v_retailer.id, v_retailer.name, v_subtotal, v_discount, v_total,
+        v_paid, v_due,
+        CASE WHEN v_due <= 0 THEN 'paid' WHEN v_paid > 0 THEN 'partial' ELSE 'due' END,
+        'confirmed', p_sale->>'notes',
+        v_assigned_to, (SELECT name FROM users WHERE id = v_assigned_to),
+        v_created_by, (SELECT name FROM users WHERE id = v_created_by),
+        COALESCE(NULLIF(p_sale->>'terms_days', '')::INTEGER, 0),
+        NULLIF(p_sale->>'due_date', '')::DATE,
+        CASE WHEN v_due > 0 THEN 'open' ELSE 'settled' END,
+        COALESCE(NULLIF(p_sale->>'credit_risk_bearer', ''), 'company'),
+        NULLIF(p_sale->>'sr_liable_user_id', '')::UUID,
+        NOW()
+    )
+    RETURNING * INTO v_sale;
+
+    INSERT INTO sale_items (
+        id, sale_id, product_id, product_name, batch_number, batch_id, quantity, unit_price,
+        discount, total, variant_id, uom, uom_quantity, price_list_id, base_price,
+        resolved_price, discount_applied, price_source
+    )
+    SELECT
+        sale_item_id, v_sale_id, product_id, product_name, batch_number, batch_id, quantity, unit_price,
+        discount, quantity * unit_price - discount,
+        NULLIF(item->>'variant_id', '')::UUID,
+        item->>'uom',
+        NULLIF(item->>'uom_quantity', '')::NUMERIC,
+        NULLIF(item->>'price_list_id', '')::UUID,
+        COALESCE(NULLIF(item->>'base_price', '')::NUMERIC, unit_price),
+        COALESCE(NULLIF(item->>'resolved_price', '')::NUMERIC, unit_price),
+        discount,
+        COALESCE(item->>'price_source', 'manual')
+    FROM _sale_lines
+    ORDER BY ord;
+
+    INSERT INTO sale_item_cost_snapshot (
+        sale_item_id, product_id, batch_id, cost_method, cogs_unit, cogs_total, margin_amount, margin_percent
+    )
+    SELECT
+        sale_item_id, product_id, batch_id, 'moving_avg', cost_unit, cost_unit * quantity,
+        (quantity * unit_price - discount) - cost_unit * quantity,
+        CASE WHEN quantity * unit_price - discount > 0
+             THEN GREATEST(-999999, LEAST(999999,
+                  ((quantity * unit_price - discount) - cost_unit * quantity)
+                  / (quantity * unit_price - discount) * 100))
+             ELSE 0 END
+    FROM _sale_lines;
+
+    IF v_due > 0 THEN
+        INSERT INTO receivable_ledger (retailer_id, sale_id, entry_type, amount, reference_type, reference_id, remarks)
+        VALUES (v_retailer.id, v_sale_id, 'sale', v_due, 'sale', v_sale_id, 'sale_due_created');
+    END IF;
+
+    IF v_has_ledger THEN
+        INSERT INTO stock_ledger (
+            product_id, product_name, batch_id, batch_number, warehouse_id, warehouse_name,
+            voucher_type, voucher_id, quantity_change, quantity_after, unit_cost, remarks, created_by
+        )
+        SELECT
+            l.product_id, l.product_name, l.batch_id, l.batch_number, l.warehouse_id, w.name,
+            'sale', v_sale_id, -l.quantity, p.stock_quantity, l.unit_price, 'Sale ' || v_invoice, v_created_by
+        FROM _sale_lines l
+        JOIN products p ON p.id = l.product_id
+        LEFT JOIN warehouses w ON w.id = l.warehouse_id
+        ORDER BY l.ord;
+    END IF;
+
+    RETURN to_jsonb(v_sale) || jsonb_build_object(
+        'items', COALESCE((
+            SELECT jsonb_agg(to_jsonb(si) ORDER BY l.ord)
+            FROM sale_items si
+            JOIN _sale_lines l ON l.sale_item_id = si.id
+        ), '[]'::JSONB),
+        'stock_ledger_recorded', v_has_ledger
+    );
+END;
+$$;
+
+COMMENT ON FUNCTION create_sale_atomic(JSONB, JSONB) IS 'Creates a sale with items, stock decrements, cost snapshots, retailer due, receivable and stock ledger rows in one transaction. Called by SupabaseDatabase.create_sale.';
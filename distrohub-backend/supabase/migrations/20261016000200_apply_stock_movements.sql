@@ -0,0 +1,135 @@
+-- Atomic, relative stock movements
+-- One call applies a list of {batch_id, product_id, warehouse_id, delta}
+-- as server-side increments (quantity = quantity + delta) instead of the
+-- read-modify-write sequence in update_batch_quantity / update_product_stock /
+-- update_warehouse_stock. Rows are locked in id order to avoid deadlocks.
+-- Created: 2026-10-16
+
+CREATE OR REPLACE FUNCTION apply_stock_movements(
+    p_movements JSONB,
+    p_guard_non_negative BOOLEAN DEFAULT FALSE
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    v_batches JSONB := '{}'::JSONB;
+    v_products JSONB := '{}'::JSONB;
+    v_warehouse JSONB := '{}'::JSONB;
+    v_violation TEXT;
+BEGIN
+    DROP TABLE IF EXISTS _stock_movements;
+    CREATE TEMP TABLE _stock_movements ON COMMIT DROP AS
+    SELECT
+        NULLIF(m->>'batch_id', '')::UUID AS batch_id,
+        NULLIF(m->>'product_id', '')::UUID AS product_id,
+        NULLIF(m->>'warehouse_id', '')::UUID AS warehouse_id,
+        COALESCE(NULLIF(m->>'delta', '')::INTEGER, 0) AS delta
+    FROM jsonb_array_elements(COALESCE(p_movements, '[]'::JSONB)) AS m
+    WHERE COALESCE(NULLIF(m->>'delta', '')::INTEGER, 0) <> 0;
+
+    -- Batches: plain increment (may go negative unless guarded)
+    PERFORM 1 FROM product_batches
+     WHERE id IN (SELECT batch_id FROM _stock_movements WHERE batch_id IS NOT NULL)
+     ORDER BY id FOR UPDATE;
+
+    IF p_guard_non_negative THEN
+        SELECT b.batch_number INTO v_violation
+          FROM product_batches b
+          JOIN (SELECT batch_id, SUM(delta) AS delta FROM _stock_movements
+                 WHERE batch_id IS NOT NULL GROUP BY batch_id) d ON d.batch_id = b.id
+         WHERE b.quantity + d.delta < 0
+         LIMIT 1;
+        IF FOUND THEN
+            RAISE EXCEPTION 'Insufficient stock in batch %', v_violation USING ERRCODE = 'P0001';
+        END IF;
+    END IF;
+
+    WITH d AS (
+        SELECT batch_id, SUM(delta) AS delta FROM _stock_movements
+         WHERE batch_id IS NOT NULL GROUP BY batch_id
+    ), u AS (
+        UPDATE product_batches b SET quantity = b.quantity + d.delta
+          FROM d WHERE b.id = d.batch_id
+        RETURNING b.id, b.quantity
+    )
+    SELECT COALESCE(jsonb_object_agg(id::TEXT, quantity), '{}'::JSONB) INTO v_batches FROM u;
+
+    -- Products: summary stock never drops below zero
+    PERFORM 1 FROM products
+     WHERE id IN (SELECT product_id FROM _stock_movements WHERE product_id IS NOT NULL)
+     ORDER BY id FOR UPDATE;
+
+    IF p_guard_non_negative THEN
+        SELECT p.name INTO v_violation
+          FROM products p
+          JOIN (SELECT product_id, SUM(delta) AS delta FROM _stock_movements
+                 WHERE product_id IS NOT NULL GROUP BY product_id) d ON d.product_id = p.id
+         WHERE COALESCE(p.stock_quantity, 0) + d.delta < 0
+         LIMIT 1;
+        IF FOUND THEN
+            RAISE EXCEPTION 'Insufficient stock for product %', v_violation USING ERRCODE = 'P0001';
+        END IF;
+    END IF;
+
+    WITH d AS (
+        SELECT product_id, SUM(delta) AS delta FROM _stock_movements
+         WHERE product_id IS NOT NULL GROUP BY product_id
+    ), u AS (
+        UPDATE products p SET stock_quantity = GREATEST(0, COALESCE(p.stock_quantity, 0) + d.delta)
+          FROM d WHERE p.id = d.product_id
+        RETURNING p.id, p.stock_quantity
+    )
+    SELECT COALESCE(jsonb_object_agg(id::TEXT, stock_quantity), '{}'::JSONB) INTO v_products FROM u;
+
+    -- Warehouse summary: same rules as update_warehouse_stock
+    -- (insert only for positive deltas, clamp at zero, drop empty rows)
+    DROP TABLE IF EXISTS _warehouse_deltas;
+    CREATE TEMP TABLE _warehouse_deltas ON COMMIT DROP AS
+    SELECT warehouse_id, product_id, SUM(delta) AS delta
+      FROM _stock_movements
+     WHERE warehouse_id IS NOT NULL AND product_id IS NOT NULL
+     GROUP BY warehouse_id, product_id;
+
+    UPDATE warehouse_stock ws
+       SET total_quantity = GREATEST(0, COALESCE(ws.total_quantity, 0) + d.delta),
+           last_updated = NOW()
+      FROM _warehouse_deltas d
+     WHERE ws.warehouse_id = d.warehouse_id AND ws.product_id = d.product_id;
+
+    INSERT INTO warehouse_stock (warehouse_id, product_id, total_quantity, last_updated)
+    SELECT d.warehouse_id, d.product_id, d.delta, NOW()
+      FROM _warehouse_deltas d
+     WHERE d.delta > 0
+       AND NOT EXISTS (
+           SELECT 1 FROM warehouse_stock ws
+            WHERE ws.warehouse_id = d.warehouse_id AND ws.product_id = d.product_id
+       )
+     ORDER BY d.warehouse_id, d.product_id
+    ON CONFLICT (warehouse_id, product_id) DO UPDATE
+       SET total_quantity = warehouse_stock.total_quantity + EXCLUDED.total_quantity,
+           last_updated = NOW();
+
+    DELETE FROM warehouse_stock ws
+     USING _warehouse_deltas d
+     WHERE ws.warehouse_id = d.warehouse_id
+       AND ws.product_id = d.product_id
+       AND ws.total_quantity <= 0;
+
+    SELECT COALESCE(jsonb_object_agg(d.warehouse_id::TEXT || ':' || d.product_id::TEXT,
+                                     COALESCE(ws.total_quantity, 0)), '{}'::JSONB)
+      INTO v_warehouse
+      FROM _warehouse_deltas d
+      LEFT JOIN warehouse_stock ws
+        ON ws.warehouse_id = d.warehouse_id AND ws.product_id = d.product_id;
+
+    RETURN jsonb_build_object(
+        'batches', v_batches,
+        'products', v_products,
+        'warehouse_stock', v_warehouse
+    );
+END;
+$$;
+
+COMMENT ON FUNCTION apply_stock_movements(JSONB, BOOLEAN) IS 'Applies batch/product/warehouse stock deltas as relative updates in one transaction and returns the new quantities. Called by SupabaseDatabase.apply_stock_movements.';
@@ -0,0 +1,121 @@
+-- Atomic monetary balance updates
+-- Applies signed deltas to retailer dues, sale paid/due and SR cash holdings
+-- as server-side increments (no read-modify-write from the API), optionally
+-- together with receivable_ledger rows, in one transaction.
+-- Delta kinds:
+--   retailer_due  {id, amount}                      retailers.total_due += amount
+--   sale_payment  {id, amount}                      sales.paid_amount += amount, due_amount -= amount (>= 0)
+--   sr_cash       {id, amount, source, reference_id, notes}
+--                                                   users.current_cash_holding += amount + sr_cash_holdings audit row
+-- Created: 2026-10-16
+
+CREATE OR REPLACE FUNCTION apply_balance_deltas(
+    p_deltas JSONB,
+    p_ledger_entries JSONB DEFAULT '[]'::JSONB
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    v_delta JSONB;
+    v_amount NUMERIC;
+    v_id UUID;
+    v_row JSONB;
+    v_before NUMERIC;
+    v_after NUMERIC;
+    v_retailers JSONB := '{}'::JSONB;
+    v_sales JSONB := '{}'::JSONB;
+    v_sr_cash JSONB := '{}'::JSONB;
+    v_ledger JSONB := '[]'::JSONB;
+BEGIN
+    -- Lock every touched row up front in a stable order to avoid deadlocks
+    PERFORM 1 FROM retailers
+     WHERE id IN (SELECT (d->>'id')::UUID FROM jsonb_array_elements(p_deltas) d WHERE d->>'kind' = 'retailer_due')
+     ORDER BY id FOR UPDATE;
+    PERFORM 1 FROM sales
+     WHERE id IN (SELECT (d->>'id')::UUID FROM jsonb_array_elements(p_deltas) d WHERE d->>'kind' = 'sale_payment')
+     ORDER BY id FOR UPDATE;
+    PERFORM 1 FROM users
+     WHERE id IN (SELECT (d->>'id')::UUID FROM jsonb_array_elements(p_deltas) d WHERE d->>'kind' = 'sr_cash')
+     ORDER BY id FOR UPDATE;
+
+    FOR v_delta IN SELECT * FROM jsonb_array_elements(COALESCE(p_deltas, '[]'::JSONB))
+    LOOP
+        v_id := NULLIF(v_delta->>'id', '')::UUID;
+        v_amount := COALESCE(NULLIF(v_delta->>'amount', '')::NUMERIC, 0);
+        CONTINUE WHEN v_id IS NULL;
+
+        IF v_delta->>'kind' = 'retailer_due' THEN
+            UPDATE retailers SET total_due = COALESCE(total_due, 0) + v_amount
+             WHERE id = v_id
+            RETURNING to_jsonb(retailers.*) INTO v_row;
+            IF v_row IS NOT NULL THEN
+                v_retailers := v_retailers || jsonb_build_object(v_id::TEXT, v_row);
+            END IF;
+
+        ELSIF v_delta->>'kind' = 'sale_payment' THEN
+            UPDATE sales
+               SET paid_amount = COALESCE(paid_amount, 0) + v_amount,
+                   due_amount = GREATEST(0, COALESCE(due_amount, 0) - v_amount),
+                   payment_status = CASE WHEN GREATEST(0, COALESCE(due_amount, 0) - v_amount) <= 0.01
+                                         THEN 'paid' ELSE 'partial' END
+             WHERE id = v_id
+            RETURNING to_jsonb(sales.*) INTO v_row;
+            IF v_row IS NOT NULL THEN
+                v_sales := v_sales || jsonb_build_object(v_id::TEXT, v_row);
+            END IF;
+
+        ELSIF v_delta->>'kind' = 'sr_cash' THEN
+            SELECT COALESCE(current_cash_holding, 0) INTO v_before FROM users WHERE id = v_id;
+            IF NOT FOUND THEN
+                RAISE EXCEPTION 'User not found' USING ERRCODE = 'P0002';
+            END IF;
+            UPDATE users SET current_cash_holding = COALESCE(current_cash_holding, 0) + v_amount
+             WHERE id = v_id
+            RETURNING current_cash_holding INTO v_after;
+
+            INSERT INTO sr_cash_holdings (user_id, amount, before_balance, after_balance, source, reference_id, notes)
+            VALUES (
+                v_id, v_amount, v_before, v_after,
+                COALESCE(NULLIF(v_delta->>'source', ''), 'manual_adjustment'),
+                NULLIF(v_delta->>'reference_id', '')::UUID,
+                COALESCE(v_delta->>'notes', 'Cash holding updated from ' || COALESCE(v_delta->>'source', 'manual_adjustment'))
+            )
+            RETURNING to_jsonb(sr_cash_holdings.*) INTO v_row;
+            v_sr_cash := v_sr_cash || jsonb_build_object(v_id::TEXT, v_row);
+
+        ELSE
+            RAISE EXCEPTION 'Unknown balance delta kind: %', v_delta->>'kind' USING ERRCODE = 'P0001';
+        END IF;
+        v_row := NULL;
+    END LOOP;
+
+    WITH ins AS (
+        INSERT INTO receivable_ledger (
+            retailer_id, sale_id, payment_id, entry_type, amount, reference_type, reference_id, remarks
+        )
+        SELECT
+            NULLIF(e->>'retailer_id', '')::UUID,
+            NULLIF(e->>'sale_id', '')::UUID,
+            NULLIF(e->>'payment_id', '')::UUID,
+            e->>'entry_type',
+            (e->>'amount')::NUMERIC,
+            e->>'reference_type',
+            NULLIF(e->>'reference_id', '')::UUID,
+            e->>'remarks'
+        FROM jsonb_array_elements(COALESCE(p_ledger_entries, '[]'::JSONB)) AS e
+        RETURNING *
+    )
+    SELECT COALESCE(jsonb_agg(to_jsonb(ins.*)), '[]'::JSONB) INTO v_ledger FROM ins;
+
+    RETURN jsonb_build_object(
+        'retailers', v_retailers,
+        'sales', v_sales,
+        'sr_cash', v_sr_cash,
+        'ledger', v_ledger
+    );
+END;
+$$;
+
+COMMENT ON FUNCTION apply_balance_deltas(JSONB, JSONB) IS 'Applies retailer due, sale paid/due and SR cash holding deltas plus receivable ledger rows in one transaction and returns the updated rows. Called by SupabaseDatabase.apply_balance_deltas.';
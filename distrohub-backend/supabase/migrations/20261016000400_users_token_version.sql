@@ -0,0 +1,33 @@
+-- JWT revocation support
+-- Access tokens carry the user's claims plus the token_version they were
+-- issued under; bumping users.token_version revokes every outstanding
+-- access/refresh token for that user. The trigger bumps it whenever a
+-- claim-bearing field or the password changes, so every writer (API, SQL
+-- console, other services) revokes consistently.
+-- Created: 2026-10-16
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS token_version INTEGER NOT NULL DEFAULT 0;
+
+CREATE OR REPLACE FUNCTION users_bump_token_version()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF NEW.name IS DISTINCT FROM OLD.name
+        OR NEW.email IS DISTINCT FROM OLD.email
+        OR NEW.phone IS DISTINCT FROM OLD.phone
+        OR NEW.role IS DISTINCT FROM OLD.role
+        OR NEW.password_hash IS DISTINCT FROM OLD.password_hash THEN
+        NEW.token_version := COALESCE(OLD.token_version, 0) + 1;
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_users_bump_token_version ON users;
+CREATE TRIGGER trg_users_bump_token_version
+    BEFORE UPDATE ON users
+    FOR EACH ROW
+    EXECUTE FUNCTION users_bump_token_version();
+
+COMMENT ON COLUMN users.token_version IS 'Bumped on role/email/name/phone/password change; JWTs with an older tv claim are rejected';
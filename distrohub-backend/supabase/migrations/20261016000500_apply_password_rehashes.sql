@@ -0,0 +1,52 @@
+-- Batched legacy password upgrades
+-- The API verifies legacy SHA-256 hashes at login, bcrypts them in its
+-- password pool and writes a whole batch with one call. A row is only
+-- updated while it still holds the legacy hash it was verified against, so
+-- a password change that lands in between is never overwritten.
+-- Upgrading a legacy hash is not a credential change: the function flags its
+-- own update with the transaction-local app.password_rehash setting and the
+-- token_version trigger skips flagged updates (sessions issued at that login
+-- stay valid). Every other password change still bumps token_version.
+-- p_updates: [{"id", "old_hash", "password_hash"}]; returns rows upgraded.
+-- Created: 2026-10-16
+
+CREATE OR REPLACE FUNCTION apply_password_rehashes(p_updates JSONB)
+RETURNS INTEGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    PERFORM set_config('app.password_rehash', 'on', true);
+    UPDATE users u
+    SET password_hash = x.password_hash
+    FROM jsonb_to_recordset(COALESCE(p_updates, '[]'::JSONB))
+        AS x(id UUID, old_hash TEXT, password_hash TEXT)
+    WHERE u.id = x.id
+      AND u.password_hash = x.old_hash
+      AND x.password_hash LIKE '$2%';
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    PERFORM set_config('app.password_rehash', 'off', true);
+    RETURN v_count;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION users_bump_token_version()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF NEW.name IS DISTINCT FROM OLD.name
+        OR NEW.email IS DISTINCT FROM OLD.email
+        OR NEW.phone IS DISTINCT FROM OLD.phone
+        OR NEW.role IS DISTINCT FROM OLD.role
+        OR (NEW.password_hash IS DISTINCT FROM OLD.password_hash
+            AND COALESCE(current_setting('app.password_rehash', true), '') <> 'on') THEN
+        NEW.token_version := COALESCE(OLD.token_version, 0) + 1;
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+COMMENT ON FUNCTION apply_password_rehashes(JSONB) IS 'Bulk bcrypt upgrade of legacy SHA-256 password hashes, guarded by the old hash';
@@ -0,0 +1,81 @@
+-- Collection report query
+-- Payments joined to their sale, route and collector in one statement, with
+-- the approval and SR filters pushed down. An SR matches a payment when it
+-- collected it, owns the sale (sales.assigned_to) or owns the route
+-- (routes.assigned_to). Totals cover every matching row; payments is one
+-- keyset page ordered by (created_at DESC, id DESC).
+-- Returns {"payments": [...], "totals": {"total_payments", "total_amount"}}
+-- Created: 2026-10-16
+
+CREATE INDEX IF NOT EXISTS idx_payments_created_at_id ON payments(created_at DESC, id DESC);
+
+CREATE OR REPLACE FUNCTION get_collection_payments(
+    p_user_id TEXT DEFAULT NULL,
+    p_from TEXT DEFAULT NULL,
+    p_to TEXT DEFAULT NULL,
+    p_approval_status TEXT DEFAULT 'approved',
+    p_cursor_created_at TEXT DEFAULT NULL,
+    p_cursor_id TEXT DEFAULT NULL,
+    p_limit INTEGER DEFAULT NULL
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+AS $$
+DECLARE
+    v_result JSONB;
+BEGIN
+    WITH matched AS (
+        SELECT
+            p.*,
+            s.invoice_number AS joined_invoice_number,
+            s.retailer_name AS joined_retailer_name,
+            r.route_number AS joined_route_number,
+            COALESCE(p.collected_by, r.assigned_to, s.assigned_to) AS joined_collector_id,
+            u.name AS joined_collector_name
+        FROM payments p
+        LEFT JOIN sales s ON s.id = p.sale_id
+        LEFT JOIN routes r ON r.id = p.route_id
+        LEFT JOIN users u ON u.id = COALESCE(p.collected_by, r.assigned_to, s.assigned_to)
+        WHERE (p_approval_status IS NULL OR COALESCE(p.approval_status, 'approved') = p_approval_status)
+          AND (p_from IS NULL OR p.created_at >= p_from::TIMESTAMPTZ)
+          AND (p_to IS NULL OR p.created_at < p_to::TIMESTAMPTZ)
+          AND (
+              p_user_id IS NULL
+              OR p.collected_by = p_user_id::UUID
+              OR s.assigned_to = p_user_id::UUID
+              OR r.assigned_to = p_user_id::UUID
+          )
+    ),
+    page AS (
+        SELECT *
+        FROM matched m
+        WHERE p_cursor_created_at IS NULL
+           OR (m.created_at, m.id) < (p_cursor_created_at::TIMESTAMPTZ, p_cursor_id::UUID)
+        ORDER BY m.created_at DESC, m.id DESC
+        LIMIT p_limit
+    )
+    SELECT jsonb_build_object(
+        'totals', (
+            SELECT jsonb_build_object(
+                'total_payments', count(*),
+                'total_amount', COALESCE(sum(amount), 0)
+            )
+            FROM matched
+        ),
+        'payments', COALESCE(
+            (SELECT jsonb_agg(to_jsonb(page) ORDER BY page.created_at DESC, page.id DESC) FROM page),
+            '[]'::JSONB
+        )
+    )
+    INTO v_result;
+
+    RETURN v_result;
+END;
+$$;
+
+-- Ids and timestamps are TEXT parameters cast in the body, so PostgREST and
+-- the asyncpg backend can both pass plain strings.
+COMMENT ON FUNCTION get_collection_payments(TEXT, TEXT, TEXT, TEXT, TEXT, TEXT, INTEGER)
+    IS 'Collection report: payments with sale/route/collector joined, SR + approval filters, keyset page and totals';
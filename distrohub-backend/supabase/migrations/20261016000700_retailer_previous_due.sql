@@ -0,0 +1,67 @@
+-- Maintained "unrouted previous due" per retailer
+-- retailer_previous_due.amount is the sum of due_amount over the retailer's
+-- unpaid/partial sales that are not attached to a route (the same set
+-- calculate_previous_due scans). A trigger on sales keeps it current for
+-- every writer: sale creation, payments, returns, route attach/detach and
+-- deletes all end up as INSERT/UPDATE/DELETE on sales.
+-- Created: 2026-10-16
+
+CREATE TABLE IF NOT EXISTS retailer_previous_due (
+    retailer_id UUID PRIMARY KEY REFERENCES retailers(id) ON DELETE CASCADE,
+    amount DECIMAL(12,2) NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE OR REPLACE FUNCTION sales_maintain_retailer_previous_due()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    v_old NUMERIC := 0;
+    v_new NUMERIC := 0;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE')
+        AND OLD.retailer_id IS NOT NULL AND OLD.route_id IS NULL AND OLD.payment_status <> 'paid' THEN
+        v_old := COALESCE(OLD.due_amount, 0);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE')
+        AND NEW.retailer_id IS NOT NULL AND NEW.route_id IS NULL AND NEW.payment_status <> 'paid' THEN
+        v_new := COALESCE(NEW.due_amount, 0);
+    END IF;
+
+    IF TG_OP = 'UPDATE' AND OLD.retailer_id IS NOT DISTINCT FROM NEW.retailer_id THEN
+        v_new := v_new - v_old;
+        v_old := 0;
+    END IF;
+
+    IF v_old <> 0 THEN
+        UPDATE retailer_previous_due
+        SET amount = amount - v_old, updated_at = NOW()
+        WHERE retailer_id = OLD.retailer_id;
+    END IF;
+    IF v_new <> 0 THEN
+        INSERT INTO retailer_previous_due (retailer_id, amount)
+        VALUES (NEW.retailer_id, v_new)
+        ON CONFLICT (retailer_id) DO UPDATE
+        SET amount = retailer_previous_due.amount + EXCLUDED.amount, updated_at = NOW();
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_sales_retailer_previous_due ON sales;
+CREATE TRIGGER trg_sales_retailer_previous_due
+    AFTER INSERT OR UPDATE OF retailer_id, route_id, payment_status, due_amount OR DELETE ON sales
+    FOR EACH ROW
+    EXECUTE FUNCTION sales_maintain_retailer_previous_due();
+
+-- Backfill from current sales
+INSERT INTO retailer_previous_due (retailer_id, amount)
+SELECT s.retailer_id, COALESCE(SUM(s.due_amount), 0)
+FROM sales s
+WHERE s.retailer_id IS NOT NULL AND s.route_id IS NULL AND s.payment_status <> 'paid'
+GROUP BY s.retailer_id
+ON CONFLICT (retailer_id) DO UPDATE SET amount = EXCLUDED.amount, updated_at = NOW();
+
+COMMENT ON TABLE retailer_previous_due IS 'Per-retailer sum of due_amount on unpaid sales not in any route; maintained by trg_sales_retailer_previous_due';
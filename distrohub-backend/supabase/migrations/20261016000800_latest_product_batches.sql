@@ -0,0 +1,21 @@
+-- Latest batch per product for the product list
+-- GET /api/products shows each product's newest batch (batch_number,
+-- expiry_date). This view returns exactly one row per product so the API
+-- reads all summaries in one query instead of one batch query per product.
+-- Ordering matches app/batches.py: created_at, then expiry_date.
+-- Created: 2026-10-16
+
+CREATE INDEX IF NOT EXISTS idx_product_batches_product_created
+    ON product_batches (product_id, created_at DESC);
+
+CREATE OR REPLACE VIEW latest_product_batches AS
+SELECT DISTINCT ON (product_id)
+    product_id,
+    batch_number,
+    expiry_date,
+    created_at
+FROM product_batches
+WHERE product_id IS NOT NULL
+ORDER BY product_id, created_at DESC NULLS LAST, expiry_date DESC NULLS LAST;
+
+COMMENT ON VIEW latest_product_batches IS 'Newest batch (by created_at) per product; read in bulk by the product list.';
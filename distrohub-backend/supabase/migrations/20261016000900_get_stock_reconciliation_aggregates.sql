@@ -0,0 +1,51 @@
+-- Stock reconciliation aggregates
+-- Batch quantity and stock-ledger net / entry count per (product, warehouse)
+-- in one statement, so the reconciliation report does not read batches per
+-- product or page through the whole ledger. Ledger lines without a
+-- warehouse are grouped under a NULL warehouse_id.
+-- Returns {"rows": [{product_id, warehouse_id, batch_quantity, ledger_quantity, ledger_entries}], "ledger_rows": n}
+-- Created: 2026-10-16
+
+CREATE OR REPLACE FUNCTION get_stock_reconciliation_aggregates()
+RETURNS JSONB
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+AS $$
+DECLARE
+    v_result JSONB;
+BEGIN
+    WITH grouped AS (
+        SELECT product_id, warehouse_id,
+               SUM(batch_quantity)::BIGINT AS batch_quantity,
+               SUM(ledger_quantity)::BIGINT AS ledger_quantity,
+               SUM(ledger_entries)::BIGINT AS ledger_entries
+        FROM (
+            SELECT product_id, warehouse_id, quantity AS batch_quantity, 0 AS ledger_quantity, 0 AS ledger_entries
+            FROM product_batches
+            WHERE product_id IS NOT NULL
+            UNION ALL
+            SELECT product_id, warehouse_id, 0, quantity_change, 1
+            FROM stock_ledger
+            WHERE product_id IS NOT NULL
+        ) movements
+        GROUP BY product_id, warehouse_id
+    )
+    SELECT jsonb_build_object(
+        'rows', COALESCE((
+            SELECT jsonb_agg(jsonb_build_object(
+                'product_id', product_id,
+                'warehouse_id', warehouse_id,
+                'batch_quantity', batch_quantity,
+                'ledger_quantity', ledger_quantity,
+                'ledger_entries', ledger_entries
+            ))
+            FROM grouped
+        ), '[]'::JSONB),
+        'ledger_rows', (SELECT COUNT(*) FROM stock_ledger)
+    ) INTO v_result;
+    RETURN v_result;
+END;
+$$;
+
+COMMENT ON FUNCTION get_stock_reconciliation_aggregates() IS 'Batch quantity and ledger net per (product, warehouse) for the stock reconciliation report.';
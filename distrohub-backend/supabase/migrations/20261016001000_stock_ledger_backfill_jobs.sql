@@ -0,0 +1,26 @@
+-- Stock-ledger backfill jobs
+-- One row per backfill run started from /api/admin/stock-ledger/backfill.
+-- The API saves the checkpoint ({"phase", "after_id"}: last voucher id fully
+-- written) and counters after every page, and bumps heartbeat_at as it goes;
+-- a "running" job with an old heartbeat was interrupted and is resumed from
+-- its checkpoint (see app/ledger_backfill.py).
+-- Created: 2026-10-16
+
+CREATE TABLE IF NOT EXISTS stock_ledger_backfill_jobs (
+    id UUID PRIMARY KEY,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    dry_run BOOLEAN NOT NULL DEFAULT TRUE,
+    options JSONB NOT NULL DEFAULT '{}'::JSONB,
+    checkpoint JSONB NOT NULL DEFAULT '{}'::JSONB,
+    stats JSONB NOT NULL DEFAULT '{}'::JSONB,
+    sample JSONB NOT NULL DEFAULT '[]'::JSONB,
+    error TEXT,
+    created_by UUID,
+    started_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    heartbeat_at TIMESTAMP WITH TIME ZONE,
+    finished_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS idx_stock_ledger_backfill_jobs_started_at ON stock_ledger_backfill_jobs(started_at DESC);
+
+COMMENT ON TABLE stock_ledger_backfill_jobs IS 'Checkpointed stock-ledger backfill runs (status, resume point, progress counters).';
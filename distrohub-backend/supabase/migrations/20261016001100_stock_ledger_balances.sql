@@ -0,0 +1,141 @@
+-- Maintained stock-ledger balances
+-- stock_ledger_balances holds the ledger net and entry count per
+-- (product, warehouse, batch). Statement-level triggers on stock_ledger fold
+-- each insert / update / delete into it from the transition tables, so reading
+-- ledger totals costs one row per balance instead of a full ledger scan and
+-- the reconciliation report stays flat as the ledger grows.
+-- rebuild_stock_ledger_balances() recomputes the table from scratch (used once
+-- below and after bulk fixes). get_stock_reconciliation_aggregates() now reads
+-- its ledger side from the balances.
+-- Created: 2026-10-16
+
+CREATE TABLE IF NOT EXISTS stock_ledger_balances (
+    id BIGSERIAL PRIMARY KEY,
+    product_id UUID,
+    warehouse_id UUID,
+    batch_id UUID,
+    quantity BIGINT NOT NULL DEFAULT 0,
+    entries BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    CONSTRAINT stock_ledger_balances_key UNIQUE NULLS NOT DISTINCT (product_id, warehouse_id, batch_id)
+);
+
+CREATE OR REPLACE FUNCTION stock_ledger_maintain_balances()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO stock_ledger_balances (product_id, warehouse_id, batch_id, quantity, entries)
+        SELECT product_id, warehouse_id, batch_id, SUM(quantity_change), COUNT(*)
+        FROM new_rows
+        GROUP BY product_id, warehouse_id, batch_id
+        ORDER BY product_id, warehouse_id, batch_id
+        ON CONFLICT ON CONSTRAINT stock_ledger_balances_key DO UPDATE
+        SET quantity = stock_ledger_balances.quantity + EXCLUDED.quantity,
+            entries = stock_ledger_balances.entries + EXCLUDED.entries,
+            updated_at = NOW();
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        INSERT INTO stock_ledger_balances (product_id, warehouse_id, batch_id, quantity, entries)
+        SELECT product_id, warehouse_id, batch_id, -SUM(quantity_change), -COUNT(*)
+        FROM old_rows
+        GROUP BY product_id, warehouse_id, batch_id
+        ORDER BY product_id, warehouse_id, batch_id
+        ON CONFLICT ON CONSTRAINT stock_ledger_balances_key DO UPDATE
+        SET quantity = stock_ledger_balances.quantity + EXCLUDED.quantity,
+            entries = stock_ledger_balances.entries + EXCLUDED.entries,
+            updated_at = NOW();
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS stock_ledger_balances_insert ON stock_ledger;
+CREATE TRIGGER stock_ledger_balances_insert
+    AFTER INSERT ON stock_ledger
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION stock_ledger_maintain_balances();
+
+DROP TRIGGER IF EXISTS stock_ledger_balances_update ON stock_ledger;
+CREATE TRIGGER stock_ledger_balances_update
+    AFTER UPDATE ON stock_ledger
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION stock_ledger_maintain_balances();
+
+DROP TRIGGER IF EXISTS stock_ledger_balances_delete ON stock_ledger;
+CREATE TRIGGER stock_ledger_balances_delete
+    AFTER DELETE ON stock_ledger
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION stock_ledger_maintain_balances();
+
+CREATE OR REPLACE FUNCTION rebuild_stock_ledger_balances()
+RETURNS JSONB
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    v_balances BIGINT;
+    v_ledger_rows BIGINT;
+BEGIN
+    -- Block ledger writes for the rebuild so no trigger delta is lost.
+    LOCK TABLE stock_ledger IN SHARE MODE;
+    DELETE FROM stock_ledger_balances;
+    INSERT INTO stock_ledger_balances (product_id, warehouse_id, batch_id, quantity, entries)
+    SELECT product_id, warehouse_id, batch_id, SUM(quantity_change), COUNT(*)
+    FROM stock_ledger
+    GROUP BY product_id, warehouse_id, batch_id;
+    GET DIAGNOSTICS v_balances = ROW_COUNT;
+    SELECT COALESCE(SUM(entries), 0) INTO v_ledger_rows FROM stock_ledger_balances;
+    RETURN jsonb_build_object('balances', v_balances, 'ledger_rows', v_ledger_rows);
+END;
+$$;
+
+COMMENT ON FUNCTION rebuild_stock_ledger_balances() IS 'Recompute stock_ledger_balances from the full stock ledger.';
+
+CREATE OR REPLACE FUNCTION get_stock_reconciliation_aggregates()
+RETURNS JSONB
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+AS $$
+DECLARE
+    v_result JSONB;
+BEGIN
+    WITH grouped AS (
+        SELECT product_id, warehouse_id,
+               SUM(batch_quantity)::BIGINT AS batch_quantity,
+               SUM(ledger_quantity)::BIGINT AS ledger_quantity,
+               SUM(ledger_entries)::BIGINT AS ledger_entries
+        FROM (
+            SELECT product_id, warehouse_id, quantity AS batch_quantity, 0 AS ledger_quantity, 0 AS ledger_entries
+            FROM product_batches
+            WHERE product_id IS NOT NULL
+            UNION ALL
+            SELECT product_id, warehouse_id, 0, quantity, entries
+            FROM stock_ledger_balances
+            WHERE product_id IS NOT NULL AND entries <> 0
+        ) movements
+        GROUP BY product_id, warehouse_id
+    )
+    SELECT jsonb_build_object(
+        'rows', COALESCE((
+            SELECT jsonb_agg(jsonb_build_object(
+                'product_id', product_id,
+                'warehouse_id', warehouse_id,
+                'batch_quantity', batch_quantity,
+                'ledger_quantity', ledger_quantity,
+                'ledger_entries', ledger_entries
+            ))
+            FROM grouped
+        ), '[]'::JSONB),
+        'ledger_rows', (SELECT COALESCE(SUM(entries), 0) FROM stock_ledger_balances)
+    ) INTO v_result;
+    RETURN v_result;
+END;
+$$;
+
+COMMENT ON FUNCTION get_stock_reconciliation_aggregates() IS 'Batch quantity and ledger net per (product, warehouse) for the stock reconciliation report.';
+
+SELECT rebuild_stock_ledger_balances();
@@ -0,0 +1,85 @@
+-- Stock ledger query API
+-- Keyset pages of stock_ledger ordered by (created_at DESC, id DESC) with the
+-- product / warehouse / batch / voucher / date filters pushed down, so stock
+-- cards and batch traceability read one index range per page at any ledger
+-- size. On the first page (p_opening_balance) the net quantity of matching
+-- entries before p_from is returned as the opening balance.
+-- Returns {"entries": [...], "opening_balance": n | null}
+-- Created: 2026-10-16
+
+CREATE INDEX IF NOT EXISTS idx_stock_ledger_created_id ON stock_ledger(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_stock_ledger_product_created_id ON stock_ledger(product_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_stock_ledger_warehouse_created_id ON stock_ledger(warehouse_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_stock_ledger_batch_created_id ON stock_ledger(batch_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_stock_ledger_voucher_type_created_id ON stock_ledger(voucher_type, created_at DESC, id DESC);
+
+-- Superseded by the (…, created_at DESC, id DESC) indexes above.
+DROP INDEX IF EXISTS idx_stock_ledger_created_at;
+DROP INDEX IF EXISTS idx_stock_ledger_product_created;
+
+CREATE OR REPLACE FUNCTION get_stock_ledger_page(
+    p_product_id TEXT DEFAULT NULL,
+    p_warehouse_id TEXT DEFAULT NULL,
+    p_batch_id TEXT DEFAULT NULL,
+    p_voucher_type TEXT DEFAULT NULL,
+    p_voucher_id TEXT DEFAULT NULL,
+    p_from TEXT DEFAULT NULL,
+    p_to TEXT DEFAULT NULL,
+    p_cursor_created_at TEXT DEFAULT NULL,
+    p_cursor_id TEXT DEFAULT NULL,
+    p_limit INTEGER DEFAULT 200,
+    p_opening_balance BOOLEAN DEFAULT FALSE
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+AS $$
+DECLARE
+    v_entries JSONB;
+    v_opening BIGINT;
+BEGIN
+    SELECT COALESCE(jsonb_agg(to_jsonb(page) ORDER BY page.created_at DESC, page.id DESC), '[]'::JSONB)
+    INTO v_entries
+    FROM (
+        SELECT l.*
+        FROM stock_ledger l
+        WHERE (p_product_id IS NULL OR l.product_id = p_product_id::UUID)
+          AND (p_warehouse_id IS NULL OR l.warehouse_id = p_warehouse_id::UUID)
+          AND (p_batch_id IS NULL OR l.batch_id = p_batch_id::UUID)
+          AND (p_voucher_type IS NULL OR l.voucher_type = p_voucher_type)
+          AND (p_voucher_id IS NULL OR l.voucher_id = p_voucher_id::UUID)
+          AND (p_from IS NULL OR l.created_at >= p_from::TIMESTAMPTZ)
+          AND (p_to IS NULL OR l.created_at < p_to::TIMESTAMPTZ)
+          AND (
+              p_cursor_created_at IS NULL
+              OR (l.created_at, l.id) < (p_cursor_created_at::TIMESTAMPTZ, p_cursor_id::UUID)
+          )
+        ORDER BY l.created_at DESC, l.id DESC
+        LIMIT p_limit
+    ) page;
+
+    IF p_opening_balance THEN
+        IF p_from IS NULL THEN
+            v_opening := 0;
+        ELSE
+            SELECT COALESCE(SUM(l.quantity_change), 0)
+            INTO v_opening
+            FROM stock_ledger l
+            WHERE (p_product_id IS NULL OR l.product_id = p_product_id::UUID)
+              AND (p_warehouse_id IS NULL OR l.warehouse_id = p_warehouse_id::UUID)
+              AND (p_batch_id IS NULL OR l.batch_id = p_batch_id::UUID)
+              AND (p_voucher_type IS NULL OR l.voucher_type = p_voucher_type)
+              AND (p_voucher_id IS NULL OR l.voucher_id = p_voucher_id::UUID)
+              AND l.created_at < p_from::TIMESTAMPTZ;
+        END IF;
+    END IF;
+
+    RETURN jsonb_build_object('entries', v_entries, 'opening_balance', v_opening);
+END;
+$$;
+
+-- Ids and timestamps are TEXT parameters cast in the body, so PostgREST and
+-- the asyncpg backend can both pass plain strings.
+COMMENT ON FUNCTION get_stock_ledger_page(TEXT, TEXT, TEXT, TEXT, TEXT, TEXT, TEXT, TEXT, TEXT, INTEGER, BOOLEAN)
+    IS 'Stock ledger: filtered keyset page ordered by (created_at DESC, id DESC) with the opening balance before p_from';
@@ -0,0 +1,31 @@
+-- Stock-ledger write retry queue
+-- When the bulk ledger insert for a purchase, sale or sales return fails, the
+-- planned rows are saved here and retried in the background with backoff
+-- (see app/ledger_writer.py). expected_rows is the voucher's full row count,
+-- so a retry only inserts the rows still missing from stock_ledger. When the
+-- rows could not be planned, voucher holds the voucher's lines and arguments
+-- and the retry plans them first.
+-- next_attempt_at doubles as the claim lease; "failed" entries ran out of
+-- attempts and need a look.
+-- Created: 2026-10-16
+
+CREATE TABLE IF NOT EXISTS stock_ledger_write_queue (
+    id UUID PRIMARY KEY,
+    voucher_type VARCHAR(20) NOT NULL,
+    voucher_id UUID,
+    rows JSONB NOT NULL DEFAULT '[]'::JSONB,
+    expected_rows INTEGER NOT NULL DEFAULT 0,
+    voucher JSONB,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_stock_ledger_write_queue_due
+ON stock_ledger_write_queue(next_attempt_at)
+WHERE status = 'pending';
+
+COMMENT ON TABLE stock_ledger_write_queue IS 'Failed per-voucher stock ledger writes awaiting background retry.';
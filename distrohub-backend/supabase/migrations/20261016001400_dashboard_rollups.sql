@@ -0,0 +1,285 @@
+-- Dashboard rollups
+-- /api/dashboard/stats used to download every sale, retailer, product,
+-- purchase, supplier, payment and batch per call. The figures now live in
+-- dashboard_rollups (one base row, id = 1) plus dashboard_monthly_rollups
+-- (sales and collections per calendar month), and the dashboard_stats view
+-- adds the pending deltas and joins the current month so the API reads a
+-- single row.
+--
+-- Statement triggers on sales, payments, purchases, retailers, suppliers,
+-- products and categories append each statement's delta (old rows out, new
+-- rows in) to dashboard_rollup_deltas. Writers only insert there, so they
+-- never queue on a shared counter row; the view sums the pending deltas on
+-- read. refresh_dashboard_rollups() recounts the base figures and folds the
+-- deltas away in one statement (one snapshot), without locking the source
+-- tables. low_stock_count and expiring_soon_count depend on batch sums and on
+-- today's date, so they are only recomputed by the refresh; the API runs it
+-- periodically (DASHBOARD_ROLLUP_REFRESH_SECONDS) and once below to seed the
+-- tables. Retailers carry no active flag, so total_retailers counts them all.
+-- Created: 2026-10-16
+
+CREATE TABLE IF NOT EXISTS dashboard_rollups (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    total_sales NUMERIC(14,2) NOT NULL DEFAULT 0,
+    total_products INTEGER NOT NULL DEFAULT 0,
+    total_categories INTEGER NOT NULL DEFAULT 0,
+    total_purchases INTEGER NOT NULL DEFAULT 0,
+    total_retailers INTEGER NOT NULL DEFAULT 0,
+    receivable_from_customers NUMERIC(14,2) NOT NULL DEFAULT 0,
+    supplier_due NUMERIC(14,2) NOT NULL DEFAULT 0,
+    purchases_unpaid NUMERIC(14,2) NOT NULL DEFAULT 0,
+    low_stock_count INTEGER NOT NULL DEFAULT 0,
+    expiring_soon_count INTEGER NOT NULL DEFAULT 0,
+    refreshed_at TIMESTAMPTZ
+);
+
+CREATE TABLE IF NOT EXISTS dashboard_monthly_rollups (
+    month DATE PRIMARY KEY,
+    sales_amount NUMERIC(14,2) NOT NULL DEFAULT 0,
+    collections_amount NUMERIC(14,2) NOT NULL DEFAULT 0
+);
+
+-- Append-only: one row per write statement (per month for sales / payments)
+CREATE TABLE IF NOT EXISTS dashboard_rollup_deltas (
+    id BIGSERIAL PRIMARY KEY,
+    month DATE,
+    total_sales NUMERIC(14,2) NOT NULL DEFAULT 0,
+    total_products INTEGER NOT NULL DEFAULT 0,
+    total_categories INTEGER NOT NULL DEFAULT 0,
+    total_purchases INTEGER NOT NULL DEFAULT 0,
+    total_retailers INTEGER NOT NULL DEFAULT 0,
+    receivable_from_customers NUMERIC(14,2) NOT NULL DEFAULT 0,
+    supplier_due NUMERIC(14,2) NOT NULL DEFAULT 0,
+    purchases_unpaid NUMERIC(14,2) NOT NULL DEFAULT 0,
+    sales_amount NUMERIC(14,2) NOT NULL DEFAULT 0,
+    collections_amount NUMERIC(14,2) NOT NULL DEFAULT 0,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Supplier dues are read through JSONB so the optional due columns may be absent.
+CREATE OR REPLACE FUNCTION dashboard_supplier_due(p_row JSONB)
+RETURNS NUMERIC
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT COALESCE(
+        NULLIF((p_row->>'total_due')::NUMERIC, 0),
+        NULLIF((p_row->>'payable')::NUMERIC, 0),
+        (p_row->>'due_amount')::NUMERIC,
+        0
+    );
+$$;
+
+-- A statement's new rows (sign 1) and old rows (sign -1)
+CREATE OR REPLACE FUNCTION dashboard_rollup_changes(p_new JSONB[], p_old JSONB[])
+RETURNS TABLE (sign INTEGER, data JSONB)
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT 1, r FROM unnest(p_new) AS r
+    UNION ALL
+    SELECT -1, r FROM unnest(p_old) AS r;
+$$;
+
+-- Appends one delta row (per month for sales / payments) for a write statement.
+CREATE OR REPLACE FUNCTION dashboard_rollups_append(p_table TEXT, p_new JSONB[], p_old JSONB[])
+RETURNS VOID
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+BEGIN
+    IF cardinality(p_new) + cardinality(p_old) = 0 THEN
+        RETURN;
+    END IF;
+
+    IF p_table = 'sales' THEN
+        INSERT INTO dashboard_rollup_deltas (month, total_sales, sales_amount)
+        SELECT
+            date_trunc('month', COALESCE((data->>'created_at')::TIMESTAMPTZ, NOW()))::DATE,
+            SUM(sign * COALESCE((data->>'total_amount')::NUMERIC, 0)),
+            SUM(sign * COALESCE((data->>'total_amount')::NUMERIC, 0))
+        FROM dashboard_rollup_changes(p_new, p_old)
+        GROUP BY 1;
+    ELSIF p_table = 'payments' THEN
+        INSERT INTO dashboard_rollup_deltas (month, collections_amount)
+        SELECT
+            date_trunc('month', COALESCE((data->>'created_at')::TIMESTAMPTZ, NOW()))::DATE,
+            SUM(sign * COALESCE((data->>'amount')::NUMERIC, 0))
+        FROM dashboard_rollup_changes(p_new, p_old)
+        GROUP BY 1;
+    ELSIF p_table = 'purchases' THEN
+        INSERT INTO dashboard_rollup_deltas (total_purchases, purchases_unpaid)
+        SELECT
+            SUM(sign),
+            SUM(sign * (COALESCE((data->>'total_amount')::NUMERIC, 0) - COALESCE((data->>'paid_amount')::NUMERIC, 0)))
+        FROM dashboard_rollup_changes(p_new, p_old);
+    ELSIF p_table = 'retailers' THEN
+        INSERT INTO dashboard_rollup_deltas (total_retailers, receivable_from_customers)
+        SELECT SUM(sign), SUM(sign * COALESCE((data->>'total_due')::NUMERIC, 0))
+        FROM dashboard_rollup_changes(p_new, p_old);
+    ELSIF p_table = 'suppliers' THEN
+        INSERT INTO dashboard_rollup_deltas (supplier_due)
+        SELECT SUM(sign * dashboard_supplier_due(data)) FROM dashboard_rollup_changes(p_new, p_old);
+    ELSIF p_table = 'products' THEN
+        INSERT INTO dashboard_rollup_deltas (total_products)
+        SELECT SUM(sign) FROM dashboard_rollup_changes(p_new, p_old);
+    ELSIF p_table = 'categories' THEN
+        INSERT INTO dashboard_rollup_deltas (total_categories)
+        SELECT SUM(sign) FROM dashboard_rollup_changes(p_new, p_old);
+    END IF;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION dashboard_rollups_track()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    v_new JSONB[] := '{}';
+    v_old JSONB[] := '{}';
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        v_new := ARRAY(SELECT to_jsonb(n) FROM new_rows n);
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        v_old := ARRAY(SELECT to_jsonb(o) FROM old_rows o);
+    END IF;
+    PERFORM dashboard_rollups_append(TG_TABLE_NAME, v_new, v_old);
+    RETURN NULL;
+END;
+$$;
+
+DO $$
+DECLARE
+    v_table TEXT;
+BEGIN
+    FOREACH v_table IN ARRAY ARRAY['sales', 'payments', 'purchases', 'retailers', 'suppliers', 'products', 'categories'] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', v_table || '_dashboard_rollups_insert', v_table);
+        EXECUTE format(
+            'CREATE TRIGGER %I AFTER INSERT ON %I REFERENCING NEW TABLE AS new_rows '
+            'FOR EACH STATEMENT EXECUTE FUNCTION dashboard_rollups_track()',
+            v_table || '_dashboard_rollups_insert', v_table
+        );
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', v_table || '_dashboard_rollups_update', v_table);
+        EXECUTE format(
+            'CREATE TRIGGER %I AFTER UPDATE ON %I REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows '
+            'FOR EACH STATEMENT EXECUTE FUNCTION dashboard_rollups_track()',
+            v_table || '_dashboard_rollups_update', v_table
+        );
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', v_table || '_dashboard_rollups_delete', v_table);
+        EXECUTE format(
+            'CREATE TRIGGER %I AFTER DELETE ON %I REFERENCING OLD TABLE AS old_rows '
+            'FOR EACH STATEMENT EXECUTE FUNCTION dashboard_rollups_track()',
+            v_table || '_dashboard_rollups_delete', v_table
+        );
+    END LOOP;
+END $$;
+
+CREATE OR REPLACE VIEW dashboard_stats AS
+WITH pending AS (
+    SELECT
+        COALESCE(SUM(total_sales), 0) AS total_sales,
+        COALESCE(SUM(total_products), 0) AS total_products,
+        COALESCE(SUM(total_categories), 0) AS total_categories,
+        COALESCE(SUM(total_purchases), 0) AS total_purchases,
+        COALESCE(SUM(total_retailers), 0) AS total_retailers,
+        COALESCE(SUM(receivable_from_customers), 0) AS receivable_from_customers,
+        COALESCE(SUM(supplier_due), 0) AS supplier_due,
+        COALESCE(SUM(purchases_unpaid), 0) AS purchases_unpaid,
+        COALESCE(SUM(sales_amount) FILTER (WHERE month = date_trunc('month', NOW())::DATE), 0) AS sales_amount,
+        COALESCE(SUM(collections_amount) FILTER (WHERE month = date_trunc('month', NOW())::DATE), 0) AS collections_amount
+    FROM dashboard_rollup_deltas
+)
+SELECT
+    r.total_sales + d.total_sales AS total_sales,
+    r.total_products + d.total_products AS total_products,
+    r.total_categories + d.total_categories AS total_categories,
+    r.total_purchases + d.total_purchases AS total_purchases,
+    r.total_retailers + d.total_retailers AS total_retailers,
+    r.receivable_from_customers + d.receivable_from_customers AS receivable_from_customers,
+    r.supplier_due + d.supplier_due AS supplier_due,
+    r.purchases_unpaid + d.purchases_unpaid AS purchases_unpaid,
+    r.low_stock_count,
+    r.expiring_soon_count,
+    COALESCE(m.sales_amount, 0) + d.sales_amount AS sales_this_month,
+    COALESCE(m.collections_amount, 0) + d.collections_amount AS collections_this_month,
+    r.refreshed_at
+FROM dashboard_rollups r
+CROSS JOIN pending d
+LEFT JOIN dashboard_monthly_rollups m ON m.month = date_trunc('month', NOW())::DATE
+WHERE r.id = 1;
+
+CREATE OR REPLACE FUNCTION refresh_dashboard_rollups()
+RETURNS JSONB
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+BEGIN
+    INSERT INTO dashboard_rollups (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
+    -- One refresh at a time; writers only append deltas and never take this lock.
+    PERFORM 1 FROM dashboard_rollups WHERE id = 1 FOR UPDATE;
+
+    -- A single statement runs on one snapshot: the recount includes exactly the
+    -- committed writes whose deltas it deletes. Deltas committed later stay
+    -- pending on top of the new base.
+    WITH folded AS (
+        DELETE FROM dashboard_rollup_deltas RETURNING id
+    ),
+    months AS (
+        SELECT month, SUM(sales_amount) AS sales_amount, SUM(collections_amount) AS collections_amount
+        FROM (
+            SELECT date_trunc('month', created_at)::DATE AS month, total_amount AS sales_amount, 0 AS collections_amount
+            FROM sales WHERE created_at IS NOT NULL
+            UNION ALL
+            SELECT date_trunc('month', created_at)::DATE, 0, amount
+            FROM payments WHERE created_at IS NOT NULL
+        ) movements
+        GROUP BY month
+    ),
+    monthly AS (
+        INSERT INTO dashboard_monthly_rollups (month, sales_amount, collections_amount)
+        SELECT month, sales_amount, collections_amount FROM months
+        ON CONFLICT (month) DO UPDATE
+        SET sales_amount = EXCLUDED.sales_amount, collections_amount = EXCLUDED.collections_amount
+        RETURNING month
+    ),
+    emptied AS (
+        UPDATE dashboard_monthly_rollups SET sales_amount = 0, collections_amount = 0
+        WHERE month NOT IN (SELECT month FROM months)
+        RETURNING month
+    )
+    UPDATE dashboard_rollups SET
+        total_sales = (SELECT COALESCE(SUM(total_amount), 0) FROM sales),
+        total_products = (SELECT COUNT(*) FROM products),
+        total_categories = (SELECT COUNT(*) FROM categories),
+        total_purchases = (SELECT COUNT(*) FROM purchases),
+        total_retailers = (SELECT COUNT(*) FROM retailers),
+        receivable_from_customers = (SELECT COALESCE(SUM(total_due), 0) FROM retailers),
+        supplier_due = (SELECT COALESCE(SUM(dashboard_supplier_due(to_jsonb(s))), 0) FROM suppliers s),
+        purchases_unpaid = (SELECT COALESCE(SUM(total_amount - COALESCE(paid_amount, 0)), 0) FROM purchases),
+        low_stock_count = (
+            SELECT COUNT(*)
+            FROM products p
+            LEFT JOIN (
+                SELECT product_id, SUM(quantity) AS quantity FROM product_batches GROUP BY product_id
+            ) b ON b.product_id = p.id
+            WHERE COALESCE(b.quantity, 0) < 50
+        ),
+        expiring_soon_count = (
+            SELECT COUNT(*)
+            FROM product_batches
+            WHERE quantity > 0 AND expiry_date BETWEEN CURRENT_DATE AND CURRENT_DATE + 30
+        ),
+        refreshed_at = NOW()
+    WHERE id = 1;
+
+    RETURN (SELECT to_jsonb(d) FROM dashboard_stats d);
+END;
+$$;
+
+COMMENT ON TABLE dashboard_rollups IS 'Admin dashboard base totals, recounted by refresh_dashboard_rollups().';
+COMMENT ON TABLE dashboard_rollup_deltas IS 'Append-only dashboard deltas from write triggers, folded into dashboard_rollups on refresh.';
+COMMENT ON FUNCTION refresh_dashboard_rollups() IS 'Recompute the dashboard rollups and fold the pending deltas (repair job; also refreshes low-stock and expiry counts).';
+
+SELECT refresh_dashboard_rollups();
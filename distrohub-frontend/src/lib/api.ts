@@ -29,6 +29,7 @@ function isPublicAuthPath(url: string | undefined): boolean {
   return (
     url.includes('/api/auth/login') ||
     url.includes('/api/auth/register') ||
+    url.includes('/api/auth/refresh') ||
     url.includes('/api/auth/google')
   );
 }
@@ -59,9 +60,44 @@ api.interceptors.request.use((config) => {
   return Promise.reject(error);
 });
 
+/** One in-flight refresh shared by every request that hit 401 at the same time */
+let refreshInFlight: Promise<string | null> | null = null;
+
+function refreshAccessToken(): Promise<string | null> {
+  const refreshToken = localStorage.getItem('refresh_token')?.trim();
+  if (!refreshToken) return Promise.resolve(null);
+  if (!refreshInFlight) {
+    refreshInFlight = axios
+      .post(`${API_URL}/api/auth/refresh`, { refresh_token: refreshToken }, { timeout: 30000 })
+      .then((res) => {
+        const { access_token, refresh_token, user } = res.data;
+        localStorage.setItem('token', String(access_token).trim());
+        if (refresh_token) localStorage.setItem('refresh_token', String(refresh_token).trim());
+        if (user) localStorage.setItem('user', JSON.stringify(user));
+        return String(access_token).trim();
+      })
+      .catch(() => null)
+      .finally(() => {
+        refreshInFlight = null;
+      });
+  }
+  return refreshInFlight;
+}
+
 api.interceptors.response.use(
   (response) => response,
-  (error) => {
+  async (error) => {
+    // 401 on a protected call: access tokens are short-lived, try one refresh and replay
+    const original = error?.config;
+    if (error.response?.status === 401 && original && !original._retried && !isPublicAuthPath(original.url)) {
+      original._retried = true;
+      const token = await refreshAccessToken();
+      if (token) {
+        original.headers.Authorization = `Bearer ${token}`;
+        return api(original);
+      }
+    }
+
     if (import.meta.env.DEV) {
       console.error('[API] Response error:', {
         message: error?.message,
@@ -106,6 +142,7 @@ api.interceptors.response.use(
           sessionStorage.setItem(lock, '1');
           console.warn('[API] 401 Unauthorized - clearing token and redirecting to login');
           localStorage.removeItem('token');
+          localStorage.removeItem('refresh_token');
           localStorage.removeItem('user');
           window.location.href = '/login';
           setTimeout(() => sessionStorage.removeItem(lock), 2000);
@@ -302,6 +302,7 @@ export function Dashboard() {
       // 401 → session expired/invalid — clear token and redirect to login
       if (e.response?.status === 401) {
         localStorage.removeItem('token');
+        localStorage.removeItem('refresh_token');
         localStorage.removeItem('user');
         window.location.href = '/login';
         return;
@@ -21,8 +21,9 @@ export function Login() {
 
     try {
       const response = await api.post('/api/auth/login', { email, password });
-      const { access_token, user } = response.data;
+      const { access_token, refresh_token, user } = response.data;
       localStorage.setItem('token', String(access_token).trim());
+      if (refresh_token) localStorage.setItem('refresh_token', String(refresh_token).trim());
       localStorage.setItem('user', JSON.stringify(user));
       navigate('/');
     } catch (err: unknown) {
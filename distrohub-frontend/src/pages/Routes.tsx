@@ -240,13 +240,13 @@ function CreateRouteModal({ onClose, onSave }: { onClose: () => void; onSave: ()
     const fetchPreviousDue = async () => {
       const retailerIds = new Set(formData.sale_ids.map(saleId => availableSales.find(s => s.id === saleId)?.retailer_id).filter(Boolean) as string[]);
       const dueMap: Record<string, number> = {};
-      for (const retailerId of retailerIds) {
-        try {
-          const response = await api.get(`/api/retailers/${retailerId}/previous-due`);
-          dueMap[retailerId] = response.data.previous_due || 0;
-        } catch {
-          dueMap[retailerId] = 0;
+      try {
+        const response = await api.get('/api/retailers/previous-due', { params: { ids: Array.from(retailerIds).join(',') } });
+        for (const retailerId of retailerIds) {
+          dueMap[retailerId] = response.data.previous_due?.[retailerId] || 0;
         }
+      } catch {
+        for (const retailerId of retailerIds) dueMap[retailerId] = 0;
       }
       setPreviousDueMap(dueMap);
     };
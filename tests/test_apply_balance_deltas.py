@@ -0,0 +1,100 @@
+"""
+Test suite for atomic balance updates (apply_balance_deltas).
+
+Tests:
+1. A payment posts retailer due, sale paid/due and ledger row in one RPC call
+2. A failed balance post removes the inserted payment row
+3. update_retailer_due / update_sr_cash_holding go through the RPC
+4. Missing function falls back to per-row updates
+"""
+
+from unittest.mock import Mock
+
+import pytest
+
+
+def _make_db(client):
+    from app.supabase_db import SupabaseDatabase
+    db = SupabaseDatabase.__new__(SupabaseDatabase)
+    db.client = client
+    return db
+
+
+class TestApplyBalanceDeltas:
+    """SupabaseDatabase.apply_balance_deltas"""
+
+    def test_payment_posts_in_one_call(self):
+        client = Mock()
+        client.rpc.return_value.execute.return_value.data = {
+            "retailers": {"r-1": {"id": "r-1", "total_due": 50}},
+            "sales": {"s-1": {"id": "s-1", "paid_amount": 100, "due_amount": 0, "payment_status": "paid"}},
+            "sr_cash": {},
+            "ledger": [{"id": "l-1"}],
+        }
+        client.table.return_value.insert.return_value.execute.return_value.data = [{"id": "pay-1"}]
+        db = _make_db(client)
+        db.get_retailer = Mock(return_value={"id": "r-1", "name": "Karim Store"})
+        db.get_sale = Mock(return_value={"id": "s-1", "route_id": None})
+
+        db.create_payment({
+            "retailer_id": "r-1",
+            "sale_id": "s-1",
+            "amount": 100,
+            "payment_method": "cash",
+        })
+
+        assert client.rpc.call_count == 1
+        name, params = client.rpc.call_args[0]
+        assert name == "apply_balance_deltas"
+        assert params["p_deltas"] == [
+            {"kind": "retailer_due", "id": "r-1", "amount": -100.0},
+            {"kind": "sale_payment", "id": "s-1", "amount": 100.0},
+        ]
+        assert params["p_ledger_entries"][0]["payment_id"] == "pay-1"
+        assert params["p_ledger_entries"][0]["amount"] == -100.0
+        client.table.return_value.delete.assert_not_called()
+
+    def test_payment_removed_when_balances_fail(self):
+        client = Mock()
+        client.rpc.return_value.execute.side_effect = Exception("deadlock detected")
+        client.table.return_value.insert.return_value.execute.return_value.data = [{"id": "pay-1"}]
+        db = _make_db(client)
+        db.get_retailer = Mock(return_value={"id": "r-1", "name": "Karim Store"})
+
+        with pytest.raises(ValueError):
+            db.create_payment({"retailer_id": "r-1", "amount": 100, "payment_method": "cash"})
+
+        client.table.return_value.delete.return_value.eq.assert_called_once_with("id", "pay-1")
+
+    def test_single_balance_helpers_use_rpc(self):
+        client = Mock()
+        client.rpc.return_value.execute.return_value.data = {
+            "retailers": {"r-1": {"id": "r-1", "total_due": 25}},
+            "sr_cash": {"u-1": {"user_id": "u-1", "after_balance": 300}},
+        }
+        db = _make_db(client)
+
+        assert db.update_retailer_due("r-1", 25)["total_due"] == 25
+        holding = db.update_sr_cash_holding("u-1", 300, "reconciliation", "rec-1")
+        assert holding["after_balance"] == 300
+        kinds = [call[0][1]["p_deltas"][0]["kind"] for call in client.rpc.call_args_list]
+        assert kinds == ["retailer_due", "sr_cash"]
+        client.table.assert_not_called()
+
+    def test_missing_function_falls_back_per_row(self):
+        client = Mock()
+        error = Exception("Could not find the function public.apply_balance_deltas")
+        error.code = "PGRST202"
+        client.rpc.return_value.execute.side_effect = error
+        client.table.return_value.update.return_value.eq.return_value.execute.return_value.data = [
+            {"id": "r-1", "total_due": 70}
+        ]
+        db = _make_db(client)
+        db.get_retailer = Mock(return_value={"id": "r-1", "total_due": 100})
+
+        result = db.apply_balance_deltas([{"kind": "retailer_due", "id": "r-1", "amount": -30}])
+
+        client.table.return_value.update.assert_called_with({"total_due": 70.0})
+        assert result["retailers"]["r-1"]["total_due"] == 70
+        db.apply_balance_deltas([{"kind": "retailer_due", "id": "r-1", "amount": -30}])
+        assert client.rpc.call_count == 1
@@ -0,0 +1,97 @@
+"""
+Test suite for atomic stock movements (apply_stock_movements).
+
+Tests:
+1. Movements are sent to the RPC in one call, zero deltas dropped
+2. Guard violations from the RPC surface as ValueError
+3. Missing function falls back to per-row updates with aggregated deltas
+4. In-memory backend rejects the whole batch when a guard fails
+"""
+
+import pytest
+from unittest.mock import Mock
+
+
+def _make_db(client):
+    from app.supabase_db import SupabaseDatabase
+    db = SupabaseDatabase.__new__(SupabaseDatabase)
+    db.client = client
+    return db
+
+
+class TestApplyStockMovements:
+    """SupabaseDatabase.apply_stock_movements"""
+
+    def test_single_rpc_call(self):
+        client = Mock()
+        client.rpc.return_value.execute.return_value.data = {
+            "batches": {"b-1": 8},
+            "products": {"p-1": 40},
+            "warehouse_stock": {},
+        }
+        db = _make_db(client)
+
+        result = db.apply_stock_movements([
+            {"batch_id": "b-1", "product_id": "p-1", "delta": -2},
+            {"product_id": "p-2", "delta": 0},
+        ], guard_non_negative=True)
+
+        assert result["batches"] == {"b-1": 8}
+        assert result["products"] == {"p-1": 40}
+        assert client.rpc.call_count == 1
+        name, params = client.rpc.call_args[0]
+        assert name == "apply_stock_movements"
+        assert params["p_guard_non_negative"] is True
+        assert params["p_movements"] == [
+            {"batch_id": "b-1", "product_id": "p-1", "warehouse_id": None, "delta": -2}
+        ]
+        client.table.assert_not_called()
+
+    def test_guard_error_becomes_value_error(self):
+        client = Mock()
+        error = Exception("Insufficient stock in batch B-1")
+        error.message = "Insufficient stock in batch B-1"
+        client.rpc.return_value.execute.side_effect = error
+        db = _make_db(client)
+
+        with pytest.raises(ValueError, match="Insufficient stock"):
+            db.apply_stock_movements([{"batch_id": "b-1", "delta": -99}], guard_non_negative=True)
+
+    def test_missing_function_falls_back_per_row(self):
+        client = Mock()
+        error = Exception("Could not find the function public.apply_stock_movements")
+        error.code = "PGRST202"
+        client.rpc.return_value.execute.side_effect = error
+        db = _make_db(client)
+        db.update_batch_quantity = Mock(return_value={"quantity": 5})
+        db.update_product_stock = Mock(return_value={"stock_quantity": 12})
+        db.update_warehouse_stock = Mock(return_value={"total_quantity": 7})
+
+        result = db.apply_stock_movements([
+            {"batch_id": "b-1", "product_id": "p-1", "warehouse_id": "w-1", "delta": 3},
+            {"batch_id": "b-1", "product_id": "p-1", "warehouse_id": "w-1", "delta": 2},
+        ])
+
+        db.update_batch_quantity.assert_called_once_with("b-1", 5)
+        db.update_product_stock.assert_called_once_with("p-1", 5)
+        db.update_warehouse_stock.assert_called_once_with("w-1", "p-1", 5)
+        assert result["warehouse_stock"] == {"w-1:p-1": 7}
+
+        db.apply_stock_movements([{"product_id": "p-1", "delta": 1}])
+        assert client.rpc.call_count == 1
+
+    def test_in_memory_guard_is_all_or_nothing(self):
+        from app.database import InMemoryDatabase
+        db = InMemoryDatabase()
+        product = next(iter(db.products.values()))
+        batch = db.create_batch({"product_id": product["id"], "batch_number": "B-T", "quantity": 1})
+        stock_before = product.get("stock_quantity")
+
+        with pytest.raises(ValueError):
+            db.apply_stock_movements([
+                {"product_id": product["id"], "delta": 1},
+                {"batch_id": batch["id"], "delta": -5},
+            ], guard_non_negative=True)
+
+        assert db.batches[batch["id"]]["quantity"] == 1
+        assert product.get("stock_quantity") == stock_before
@@ -0,0 +1,103 @@
+"""
+Test suite for claim-based access tokens and token_version revocation (app.auth).
+
+Tests:
+1. A token with claims and a cached version is resolved without a users lookup
+2. A cache miss loads the row once and re-caches the version
+3. A bumped token_version revokes outstanding access and refresh tokens
+4. Refresh tokens cannot be used as access tokens; refresh issues a new pair
+5. update_user / delete_user drop the cached version
+"""
+
+import asyncio
+from unittest.mock import Mock
+
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+
+from app import auth
+from app.models import UserRole
+from app.session_cache import token_versions
+
+
+USER = {
+    "id": "u-1",
+    "email": "sr@distrohub.com",
+    "name": "Rahim",
+    "role": "sr",
+    "phone": None,
+    "created_at": "2026-01-01T00:00:00",
+    "token_version": 3,
+}
+
+
+def _current_user(token):
+    return asyncio.run(auth.get_current_user(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)))
+
+
+class TestAuthClaims:
+    """get_current_user / refresh_session with the token version cache"""
+
+    def setup_method(self):
+        token_versions.clear()
+
+    def test_claims_skip_user_lookup(self, monkeypatch):
+        load = Mock(side_effect=AssertionError("users lookup not expected"))
+        monkeypatch.setattr(auth, "_load_user", load)
+        tokens = auth.issue_tokens(dict(USER))
+
+        user = _current_user(tokens["access_token"])
+
+        assert user["id"] == "u-1"
+        assert user["role"] == UserRole.SR
+        assert user["name"] == "Rahim"
+        load.assert_not_called()
+
+    def test_cache_miss_loads_once(self, monkeypatch):
+        load = Mock(return_value=dict(USER))
+        monkeypatch.setattr(auth, "_load_user", load)
+        token = auth.create_access_token(data=auth.user_claims(USER))
+
+        _current_user(token)
+        _current_user(token)
+
+        assert load.call_count == 1
+        assert token_versions.get("u-1") == 3
+
+    def test_bumped_version_revokes(self, monkeypatch):
+        tokens = auth.issue_tokens(dict(USER))
+        monkeypatch.setattr(auth, "_load_user", Mock(return_value={**USER, "token_version": 4}))
+        token_versions.revoke("u-1")
+
+        with pytest.raises(HTTPException) as exc:
+            _current_user(tokens["access_token"])
+        assert exc.value.status_code == 401
+        with pytest.raises(HTTPException):
+            auth.refresh_session(tokens["refresh_token"])
+
+    def test_refresh_token_roles(self, monkeypatch):
+        monkeypatch.setattr(auth, "_load_user", Mock(return_value=dict(USER)))
+        tokens = auth.issue_tokens(dict(USER))
+
+        with pytest.raises(HTTPException):
+            _current_user(tokens["refresh_token"])
+        session = auth.refresh_session(tokens["refresh_token"])
+        assert _current_user(session["access_token"])["email"] == "sr@distrohub.com"
+        with pytest.raises(HTTPException):
+            auth.refresh_session(session["access_token"])
+
+    def test_user_writes_drop_cached_version(self):
+        from app.supabase_db import SupabaseDatabase
+        db = SupabaseDatabase.__new__(SupabaseDatabase)
+        db.client = Mock()
+        db.client.table.return_value.update.return_value.eq.return_value.execute.return_value.data = [dict(USER)]
+        db.client.table.return_value.delete.return_value.eq.return_value.execute.return_value.data = [dict(USER)]
+
+        token_versions.put("u-1", 3)
+        db.update_user("u-1", {"role": "dsr"})
+        assert token_versions.get("u-1") is None
+
+        token_versions.put("u-1", 3)
+        assert db.delete_user("u-1") is True
+        assert token_versions.get("u-1") is None
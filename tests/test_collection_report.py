@@ -0,0 +1,211 @@
+"""
+Test suite for the batched SR collection report (SupabaseDatabase.get_collection_report).
+
+Tests:
+1. All SRs are served by a fixed number of queries, grouped by SR
+2. Route sales count for the route's SR once, even when also assigned directly
+3. payment_history_limit trims history without changing totals
+4. get_collector_payments pages newest-first
+5. get_collection_payments pushes SR/approval filters and paging into one RPC call
+6. Without the RPC, related rows are fetched in bulk and cursor pages cover every match
+"""
+
+from unittest.mock import Mock
+
+
+def _make_db(client):
+    from app.supabase_db import SupabaseDatabase
+    db = SupabaseDatabase.__new__(SupabaseDatabase)
+    db.client = client
+    return db
+
+
+class _Query:
+    """In-memory stand-in for the PostgREST builder (filters, order, range)."""
+
+    def __init__(self, rows, log, table):
+        self.rows, self.log, self.table = rows, log, table
+        self.filters, self.orders, self.window = [], [], None
+
+    def select(self, *args, **kwargs):
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda r: str(r.get(column)) == str(value))
+        return self
+
+    def in_(self, column, values):
+        wanted = {str(v) for v in values}
+        self.filters.append(lambda r: str(r.get(column)) in wanted)
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(lambda r: str(r.get(column)) >= value)
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(lambda r: str(r.get(column)) < value)
+        return self
+
+    def order(self, column, desc=False):
+        self.orders.append((column, desc))
+        return self
+
+    def range(self, start, end):
+        self.window = (start, end)
+        return self
+
+    def execute(self):
+        self.log.append(self.table)
+        rows = [dict(r) for r in self.rows if all(f(r) for f in self.filters)]
+        for column, desc in reversed(self.orders):
+            rows.sort(key=lambda r: str(r.get(column)), reverse=desc)
+        if self.window:
+            rows = rows[self.window[0]:self.window[1] + 1]
+        return Mock(data=rows)
+
+
+def _client(tables):
+    log = []
+    client = Mock()
+    client.table.side_effect = lambda name: _Query(tables.get(name, []), log, name)
+    return client, log
+
+
+TABLES = {
+    "users": [
+        {"id": "u-1", "name": "Karim", "role": "dsr"},
+        {"id": "u-2", "name": "Rahim", "role": "dsr"},
+        {"id": "u-3", "name": "Admin", "role": "admin"},
+    ],
+    "sales": [
+        {"id": "s-1", "assigned_to": "u-1", "total_amount": 1000, "due_amount": 400, "created_at": "2026-10-02"},
+        {"id": "s-2", "assigned_to": "u-2", "total_amount": 500, "due_amount": 0, "created_at": "2026-10-03"},
+        {"id": "s-3", "assigned_to": None, "total_amount": 300, "due_amount": 300, "created_at": "2026-10-04"},
+        {"id": "s-old", "assigned_to": None, "total_amount": 900, "due_amount": 900, "created_at": "2026-09-01"},
+    ],
+    "routes": [{"id": "r-1", "assigned_to": "u-1"}],
+    "route_sales": [
+        {"route_id": "r-1", "sale_id": "s-1"},
+        {"route_id": "r-1", "sale_id": "s-3"},
+        {"route_id": "r-1", "sale_id": "s-old"},
+    ],
+    "payments": [
+        {"id": "p-1", "collected_by": "u-1", "amount": 200, "created_at": "2026-10-05"},
+        {"id": "p-2", "collected_by": "u-1", "amount": 400, "created_at": "2026-10-06"},
+        {"id": "p-3", "collected_by": "u-2", "amount": 500, "created_at": "2026-10-03"},
+    ],
+    "sales_returns": [
+        {"id": "ret-1", "sale_id": "s-1", "total_return_amount": 100, "created_at": "2026-10-07",
+         "sales_return_items": [{"quantity_returned": 1}]},
+    ],
+}
+
+
+class TestCollectionReport:
+    """get_collection_report grouping and round-trip budget"""
+
+    def test_all_srs_in_fixed_queries(self):
+        client, log = _client(TABLES)
+        reports = _make_db(client).get_collection_report(from_date="2026-10-01", to_date="2026-10-31")
+
+        by_sr = {r["user_id"]: r for r in reports}
+        assert set(by_sr) == {"u-1", "u-2"}
+        karim = by_sr["u-1"]
+        assert karim["total_orders_assigned"] == 2  # s-1 (direct + route) and s-3 (route); s-old out of range
+        assert karim["total_sales_amount"] == 1300.0
+        assert karim["total_returns"] == 100.0
+        assert karim["total_collected_amount"] == 600.0
+        assert karim["current_pending_amount"] == 700.0
+        assert [p["id"] for p in karim["payment_history"]] == ["p-2", "p-1"]
+        assert by_sr["u-2"]["collection_rate"] == 100.0
+        assert len(log) == 7
+
+    def test_history_limit(self):
+        client, _ = _client(TABLES)
+        reports = _make_db(client).get_collection_report(payment_history_limit=0)
+
+        karim = next(r for r in reports if r["user_id"] == "u-1")
+        assert karim["payment_history"] == []
+        assert karim["payment_count"] == 2
+        assert karim["total_collected_amount"] == 600.0
+
+    def test_collector_payments_page(self):
+        client, _ = _client(TABLES)
+        db = _make_db(client)
+
+        assert [p["id"] for p in db.get_collector_payments("u-1", limit=1)] == ["p-2"]
+        assert [p["id"] for p in db.get_collector_payments("u-1", limit=1, offset=1)] == ["p-1"]
+
+
+class TestCollectionPayments:
+    """get_collection_payments (/api/reports/collections)"""
+
+    def test_rpc_pushes_filters(self):
+        client = Mock()
+        client.rpc.return_value.execute.return_value.data = {
+            "totals": {"total_payments": 3, "total_amount": 900},
+            "payments": [
+                {"id": "p-2", "amount": 400, "created_at": "2026-10-06T00:00:00+00:00", "collected_by": None,
+                 "joined_invoice_number": "INV-1", "joined_retailer_name": "Karim Store",
+                 "joined_route_number": "RT-1", "joined_collector_id": "u-1", "joined_collector_name": "Karim"},
+                {"id": "p-1", "amount": 200, "created_at": "2026-10-05T00:00:00+00:00", "collected_by": "u-1",
+                 "collected_by_name": "Karim", "joined_invoice_number": None},
+            ],
+        }
+        db = _make_db(client)
+
+        result = db.get_collection_payments(user_id="u-1", from_date="2026-10-01", to_date="2026-10-31", limit=2)
+
+        name, params = client.rpc.call_args[0]
+        assert name == "get_collection_payments"
+        assert params["p_user_id"] == "u-1"
+        assert params["p_approval_status"] == "approved"
+        assert params["p_to"].startswith("2026-11-01")
+        assert params["p_limit"] == 2 and params["p_cursor_id"] is None
+        first = result["payments"][0]
+        assert first["invoice_number"] == "INV-1" and first["route_number"] == "RT-1"
+        assert first["collected_by"] == "u-1" and first["collected_by_name"] == "Karim"
+        assert not any(k.startswith("joined_") for k in first)
+        assert result["total_payments"] == 3 and result["total_amount"] == 900.0
+
+        db.get_collection_payments(user_id="u-1", cursor=result["next_cursor"], limit=2)
+        params = client.rpc.call_args[0][1]
+        assert (params["p_cursor_created_at"], params["p_cursor_id"]) == ("2026-10-05T00:00:00+00:00", "p-1")
+
+    def test_bulk_fallback_pages(self):
+        payments = [
+            {"id": "p-1", "amount": 100, "collected_by": "u-1", "collected_by_name": "Karim",
+             "approval_status": "approved", "created_at": "2026-10-01"},
+            {"id": "p-2", "amount": 200, "collected_by": None, "sale_id": "s-1",
+             "approval_status": "approved", "created_at": "2026-10-02"},
+            {"id": "p-3", "amount": 300, "collected_by": None, "route_id": "r-1",
+             "approval_status": "approved", "created_at": "2026-10-03"},
+            {"id": "p-4", "amount": 400, "collected_by": "u-2",
+             "approval_status": "approved", "created_at": "2026-10-04"},
+            {"id": "p-5", "amount": 500, "collected_by": "u-1",
+             "approval_status": "pending_approval", "created_at": "2026-10-05"},
+        ]
+        tables = {
+            "payments": payments,
+            "sales": [{"id": "s-1", "invoice_number": "INV-1", "retailer_name": "Karim Store", "assigned_to": "u-1"}],
+            "routes": [{"id": "r-1", "route_number": "RT-1", "assigned_to": "u-1"}],
+            "users": [{"id": "u-1", "name": "Karim"}],
+        }
+        client, log = _client(tables)
+        error = Exception("Could not find the function public.get_collection_payments")
+        error.code = "PGRST202"
+        client.rpc.return_value.execute.side_effect = error
+        db = _make_db(client)
+
+        first = db.get_collection_payments(user_id="u-1", limit=2)
+        second = db.get_collection_payments(user_id="u-1", cursor=first["next_cursor"], limit=2)
+
+        assert [p["id"] for p in first["payments"]] == ["p-3", "p-2"]
+        assert [p["id"] for p in second["payments"]] == ["p-1"] and second["next_cursor"] is None
+        assert first["total_payments"] == 3 and first["total_amount"] == 600.0
+        assert first["payments"][0]["route_number"] == "RT-1"
+        assert first["payments"][1]["invoice_number"] == "INV-1"
+        assert first["payments"][1]["collected_by_name"] == "Karim"
+        assert log[:4] == ["payments", "sales", "routes", "users"]
+        assert client.rpc.call_count == 1
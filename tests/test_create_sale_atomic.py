@@ -0,0 +1,65 @@
+"""
+Test suite for single round-trip sale creation (create_sale_atomic RPC).
+
+Tests:
+1. create_sale sends the whole order to the RPC in one call
+2. RPC validation errors surface as ValueError (HTTP 400)
+3. Missing function falls back to the multi-call path once, then stays there
+"""
+
+import pytest
+from unittest.mock import Mock
+
+
+def _make_db(client):
+    from app.supabase_db import SupabaseDatabase
+    db = SupabaseDatabase.__new__(SupabaseDatabase)
+    db.client = client
+    return db
+
+
+class TestCreateSaleAtomic:
+    """RPC path of SupabaseDatabase.create_sale"""
+
+    def test_single_rpc_call(self):
+        client = Mock()
+        client.rpc.return_value.execute.return_value.data = {
+            "id": "sale-1",
+            "invoice_number": "INV-20261016-ABCD",
+            "items": [{"id": "item-1", "product_id": "p-1"}],
+            "stock_ledger_recorded": True,
+        }
+        db = _make_db(client)
+        items = [{"product_id": "p-1", "batch_id": "b-1", "quantity": 2, "unit_price": 10}]
+
+        sale = db.create_sale({"retailer_id": "r-1", "paid_amount": 5, "created_by": "u-1"}, items)
+
+        assert sale["id"] == "sale-1"
+        assert client.rpc.call_count == 1
+        name, params = client.rpc.call_args[0]
+        assert name == "create_sale_atomic"
+        assert params["p_items"] == items
+        assert params["p_sale"]["retailer_id"] == "r-1"
+        client.table.assert_not_called()
+
+    def test_rpc_error_becomes_value_error(self):
+        client = Mock()
+        error = Exception("Retailer not found")
+        error.message = "Retailer not found"
+        client.rpc.return_value.execute.side_effect = error
+        db = _make_db(client)
+
+        with pytest.raises(ValueError, match="Retailer not found"):
+            db.create_sale({"retailer_id": "missing"}, [])
+
+    def test_missing_function_falls_back(self):
+        client = Mock()
+        error = Exception("Could not find the function public.create_sale_atomic")
+        error.code = "PGRST202"
+        client.rpc.return_value.execute.side_effect = error
+        db = _make_db(client)
+        db._create_sale_multi_call = Mock(return_value={"id": "legacy"})
+
+        assert db.create_sale({"retailer_id": "r-1"}, [])["id"] == "legacy"
+        assert db.create_sale({"retailer_id": "r-1"}, [])["id"] == "legacy"
+        assert client.rpc.call_count == 1
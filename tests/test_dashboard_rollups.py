@@ -0,0 +1,107 @@
+"""
+Test suite for dashboard statistics from maintained rollups (app.dashboard_rollups).
+
+Tests:
+1. A dashboard_stats row maps to DashboardStats (payables fall back to unpaid purchases)
+2. Supabase reads one row of the dashboard_stats view, refreshing it when empty
+3. Without the rollup tables the source tables are aggregated
+4. Background loops started by the app are kept and cancelled on shutdown
+"""
+
+from unittest.mock import Mock
+
+from app.dashboard_rollups import stats_from_rollup
+
+ROW = {
+    "total_sales": "1250.50",
+    "total_products": 8,
+    "total_categories": 3,
+    "total_purchases": 4,
+    "total_retailers": 5,
+    "receivable_from_customers": "300.00",
+    "supplier_due": "0",
+    "purchases_unpaid": "90.00",
+    "low_stock_count": 2,
+    "expiring_soon_count": 1,
+    "sales_this_month": "400.00",
+    "collections_this_month": "150.00",
+}
+
+
+class MissingTable(Exception):
+    code = "PGRST205"
+
+
+def _make_db(view_rows, rpc_row=None):
+    from app.supabase_db import SupabaseDatabase
+
+    query = Mock()
+    for name in ("select", "limit"):
+        getattr(query, name).return_value = query
+    if isinstance(view_rows, Exception):
+        query.execute.side_effect = view_rows
+    else:
+        query.execute.return_value = Mock(data=view_rows)
+    client = Mock()
+    client.table.return_value = query
+    client.rpc.return_value.execute.return_value = Mock(data=rpc_row)
+    db = SupabaseDatabase.__new__(SupabaseDatabase)
+    db.client = client
+    return db, client
+
+
+class TestStatsFromRollup:
+    """stats_from_rollup"""
+
+    def test_fields(self):
+        stats = stats_from_rollup(ROW)
+
+        assert stats.total_sales == 1250.5 and stats.total_due == stats.receivable_from_customers == 300
+        assert stats.payable_to_supplier == 90  # no supplier dues recorded
+        assert stats.active_retailers == 5
+        assert stats.low_stock_count == 2 and stats.expiring_soon_count == 1
+        assert stats.sales_this_month == 400 and stats.collections_this_month == 150
+        assert stats_from_rollup({**ROW, "supplier_due": 40}).payable_to_supplier == 40
+
+
+class TestSupabaseDashboardStats:
+    """SupabaseDatabase.get_dashboard_stats"""
+
+    def test_single_row_read(self):
+        db, client = _make_db([ROW])
+
+        assert db.get_dashboard_stats() == stats_from_rollup(ROW)
+        client.table.assert_called_once_with("dashboard_stats")
+        client.rpc.assert_not_called()
+
+    def test_empty_view_is_refreshed(self):
+        db, client = _make_db([], rpc_row=ROW)
+
+        assert db.get_dashboard_stats().total_sales == 1250.5
+        client.rpc.assert_called_once_with("refresh_dashboard_rollups", {})
+
+    def test_missing_view_aggregates(self):
+        db, client = _make_db(MissingTable("missing"))
+        db._aggregate_dashboard_stats = Mock(return_value=stats_from_rollup(ROW))
+
+        db.get_dashboard_stats()
+        db.get_dashboard_stats()
+
+        assert db._aggregate_dashboard_stats.call_count == 2
+        assert client.table.call_count == 1  # not retried once known missing
+
+
+class TestBackgroundTasks:
+    """main._spawn_background_task handles across startup / shutdown"""
+
+    def test_cancelled_on_shutdown(self):
+        from fastapi.testclient import TestClient
+
+        from app import main
+
+        with TestClient(main.app):
+            tasks = list(main._background_tasks)
+            assert "stock-ledger-writer" in {task.get_name() for task in tasks}
+
+        assert main._background_tasks == set()
+        assert all(task.done() for task in tasks)
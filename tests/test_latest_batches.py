@@ -0,0 +1,93 @@
+"""
+Test suite for bulk latest-batch summaries (app.batches, SupabaseDatabase.get_latest_batches).
+
+Tests:
+1. latest_batch_rows keeps the newest batch per product
+2. The summaries are one cached read, refreshed after create_batch
+3. Without the latest_product_batches view, product_batches is reduced in memory
+"""
+
+from unittest.mock import Mock
+
+import pytest
+
+from app.batches import latest_batch_rows
+from app.reference_cache import reference_cache
+
+BATCHES = [
+    {"product_id": "p-1", "batch_number": "B-OLD", "expiry_date": "2027-01-01", "created_at": "2026-09-01T10:00:00+00:00"},
+    {"product_id": "p-1", "batch_number": "B-NEW", "expiry_date": "2026-12-01", "created_at": "2026-10-01T10:00:00+00:00"},
+    {"product_id": "p-2", "batch_number": "B-2", "expiry_date": "2027-03-01", "created_at": None},
+    {"product_id": "p-2", "batch_number": "B-1", "expiry_date": "2027-02-01", "created_at": None},
+]
+
+
+class MissingView(Exception):
+    code = "PGRST205"
+
+
+@pytest.fixture(autouse=True)
+def _fresh_cache():
+    reference_cache.clear()
+    yield
+    reference_cache.clear()
+
+
+def _make_db(tables):
+    from app.supabase_db import SupabaseDatabase
+
+    builders = {}
+    client = Mock()
+
+    def table(name):
+        query = builders.get(name)
+        if query is None:
+            query = builders[name] = Mock()
+            for method in ("select", "order", "range", "insert", "eq", "limit"):
+                getattr(query, method).return_value = query
+            rows = tables[name]
+            if isinstance(rows, Exception):
+                query.execute.side_effect = rows
+            else:
+                query.execute.return_value = Mock(data=rows)
+        return query
+
+    client.table.side_effect = table
+    db = SupabaseDatabase.__new__(SupabaseDatabase)
+    db.client = client
+    return db, builders
+
+
+class TestLatestBatches:
+    """Latest batch per product for GET /api/products"""
+
+    def test_latest_batch_rows(self):
+        latest = {row["product_id"]: row for row in latest_batch_rows(BATCHES)}
+
+        assert latest["p-1"]["batch_number"] == "B-NEW"
+        assert latest["p-2"]["batch_number"] == "B-2"  # no created_at: latest expiry
+        assert set(latest["p-1"]) == {"product_id", "batch_number", "expiry_date", "created_at"}
+
+    def test_cached_until_create_batch(self):
+        view_rows = latest_batch_rows(BATCHES)
+        db, builders = _make_db({"latest_product_batches": view_rows, "product_batches": [{"id": "b-9"}]})
+
+        first = db.get_latest_batches()
+        db.get_latest_batches()
+        assert builders["latest_product_batches"].execute.call_count == 1
+        assert first["p-1"]["batch_number"] == "B-NEW"
+
+        db.create_batch({"product_id": "p-1", "batch_number": "B-3", "warehouse_id": "w-1"})
+        db.get_latest_batches()
+        assert builders["latest_product_batches"].execute.call_count == 2
+
+    def test_view_fallback(self):
+        db, builders = _make_db({"latest_product_batches": MissingView("missing"), "product_batches": BATCHES})
+
+        latest = db.get_latest_batches()
+        reference_cache.invalidate("latest_product_batches")
+        db.get_latest_batches()
+
+        assert latest["p-1"]["batch_number"] == "B-NEW" and latest["p-2"]["batch_number"] == "B-2"
+        assert builders["latest_product_batches"].execute.call_count == 1  # not retried once known missing
+        assert builders["product_batches"].execute.call_count == 2
@@ -0,0 +1,204 @@
+"""
+Test suite for the resumable stock-ledger backfill job (app.ledger_backfill).
+
+Tests:
+1. Rows are planned from preloaded batch / warehouse lookups (no per-line reads)
+2. The job streams pages, checkpoints after each one and resumes after a failure
+3. A return split across a checkpoint resumes its remaining lines; live rows still skip the voucher
+4. Supabase pages vouchers by id with items embedded
+"""
+
+from unittest.mock import Mock
+
+from app import ledger_backfill as backfill
+from app.ledger_backfill import BackfillLookups, StockLedgerBackfill, is_stale, job_progress, new_stats, plan_voucher_rows
+
+BATCHES = [
+    {"id": "b-1", "product_id": "p-1", "batch_number": "B1", "warehouse_id": "w-1"},
+    {"id": "b-2", "product_id": "p-2", "batch_number": "B2", "warehouse_id": "w-2"},
+]
+WAREHOUSES = [{"id": "w-1", "name": "Main"}, {"id": "w-2", "name": "North"}]
+
+
+def _return_line(line_id, return_id, qty):
+    return {
+        "id": line_id,
+        "return_id": return_id,
+        "product_id": "p-1",
+        "batch_number": "B1",
+        "quantity_returned": qty,
+        "_return_created_at": "2026-10-02T10:00:00",
+    }
+
+
+def _sale(n):
+    return {
+        "id": f"s-{n:02d}",
+        "created_at": "2026-10-01T10:00:00",
+        "items": [{"id": f"si-{n:02d}", "product_id": "p-1", "batch_number": "B1", "quantity": n, "unit_price": 5}],
+    }
+
+
+class FakeDb:
+    """Voucher pages, job store and ledger sink of a backend."""
+
+    def __init__(self, sales, fail_on_insert=None, returns=None, ledger=None):
+        self.sales = sales
+        self.returns = returns or []
+        self.ledger = list(ledger or [])
+        self.jobs = {}
+        self.inserts = 0
+        self.fail_on_insert = fail_on_insert
+        self.get_batch = Mock()
+        self.get_warehouse = Mock()
+
+    def get_all_batches(self):
+        return BATCHES
+
+    def get_warehouses(self):
+        return WAREHOUSES
+
+    def get_stock_ledger_backfill_keys(self):
+        return {row["remarks"] for row in self.ledger}
+
+    def get_stock_ledger_voucher_keys(self):
+        return {
+            (row["voucher_type"], row["voucher_id"])
+            for row in self.ledger
+            if not str(row.get("remarks") or "").startswith("backfill:")
+        }
+
+    def iter_stock_ledger_backfill_vouchers(self, phase, after_id=None, page_size=200):
+        source = {"sale": self.sales, "sale_return": self.returns}.get(phase, [])
+        vouchers = [v for v in source if after_id is None or v["id"] > after_id]
+        for start in range(0, len(vouchers), page_size):
+            yield vouchers[start:start + page_size]
+
+    def add_stock_ledger_entries_bulk(self, rows):
+        self.inserts += 1
+        if self.inserts == self.fail_on_insert:
+            raise TimeoutError("statement timeout")
+        self.ledger.extend(rows)
+        return len(rows)
+
+    def save_stock_ledger_backfill_job(self, job):
+        self.jobs[job["id"]] = dict(job)
+        return job
+
+
+class TestPlanRows:
+    """plan_voucher_rows against preloaded lookups"""
+
+    def test_lookups(self):
+        lookups = BackfillLookups(BATCHES, WAREHOUSES)
+        stats = new_stats()
+        purchase = {
+            "id": "pu-1",
+            "created_at": "2026-10-01T10:00:00",
+            "warehouse_id": None,
+            "items": [
+                {"id": "pi-1", "product_id": "p-2", "batch_id": "b-2", "quantity": 4, "unit_price": 9},
+                {"id": "pi-2", "product_id": "p-1", "quantity": 0},
+                {"id": "pi-3", "product_id": "p-1", "quantity": 2},
+            ],
+        }
+
+        rows = list(plan_voucher_rows("purchase", purchase, lookups, {"backfill:purchase_item:pi-3"}, set(), True, stats))
+        sale_rows = list(plan_voucher_rows("sale", _sale(3), lookups, set(), set(), True, stats))
+
+        assert [(r["batch_id"], r["warehouse_id"], r["warehouse_name"], r["quantity_change"]) for r in rows] == [("b-2", "w-2", "North", 4)]
+        assert sale_rows[0]["batch_id"] == "b-1" and sale_rows[0]["warehouse_name"] == "Main"
+        assert sale_rows[0]["quantity_change"] == -3 and sale_rows[0]["remarks"] == "backfill:sale_item:si-03"
+        assert stats["purchases_lines_seen"] == 3 and stats["skipped_duplicate_remark"] == 1
+        assert stats["rows_planned"] == 2
+        assert list(plan_voucher_rows("sale", _sale(4), lookups, set(), {("sale", "s-04")}, True, stats)) == []
+        assert stats["skipped_whole_voucher"] == 1
+
+
+class TestBackfillJob:
+    """StockLedgerBackfill.run paging, checkpoints and resume"""
+
+    def test_resume_after_failure(self, monkeypatch):
+        monkeypatch.setattr(backfill, "LEDGER_BACKFILL_PAGE_SIZE", 2)
+        db = FakeDb([_sale(n) for n in range(1, 6)], fail_on_insert=2)
+        runner = StockLedgerBackfill()
+        job = runner.new_job({"include_purchases": False, "include_returns": False}, dry_run=False, created_by="u-1")
+
+        failed = runner.run(db, job)
+
+        assert failed["status"] == "failed" and "statement timeout" in failed["error"]
+        assert failed["checkpoint"] == {"phase": "sale", "after_id": "s-02"}
+        assert len(db.ledger) == 2 and runner.active_job_id() is None
+
+        done = runner.run(db, dict(db.jobs[job["id"]]))
+
+        assert done["status"] == "completed" and done["checkpoint"]["phase"] == "done"
+        assert sorted(r["voucher_id"] for r in db.ledger) == ["s-01", "s-02", "s-03", "s-04", "s-05"]
+        assert done["stats"]["rows_inserted"] == 5 and done["stats"]["pages"] == 3
+        db.get_batch.assert_not_called()
+        db.get_warehouse.assert_not_called()
+        progress = job_progress(done)
+        assert progress["rows_per_second"] >= 0 and "elapsed_seconds" in progress
+
+    def test_resume_inside_split_return(self, monkeypatch):
+        monkeypatch.setattr(backfill, "LEDGER_BACKFILL_PAGE_SIZE", 2)
+        live = {"voucher_type": "sale_return", "voucher_id": "r-2", "remarks": "Sales return", "quantity_change": 1}
+        returns = [
+            _return_line("rl-1", "r-1", 1),
+            _return_line("rl-2", "r-1", 2),
+            _return_line("rl-3", "r-1", 3),
+            _return_line("rl-4", "r-2", 4),
+        ]
+        db = FakeDb([], fail_on_insert=2, returns=returns, ledger=[live])
+        runner = StockLedgerBackfill()
+        options = {"include_purchases": False, "include_sales": False}
+        job = runner.new_job(options, dry_run=False, created_by="u-1")
+
+        failed = runner.run(db, job)
+
+        assert failed["checkpoint"] == {"phase": "sale_return", "after_id": "rl-2"}
+
+        done = runner.run(db, dict(db.jobs[job["id"]]))
+
+        assert done["status"] == "completed"
+        written = sorted(r["remarks"] for r in db.ledger if r["remarks"].startswith("backfill:"))
+        assert written == ["backfill:sreturn_item:rl-1", "backfill:sreturn_item:rl-2", "backfill:sreturn_item:rl-3"]
+        assert not any(r["voucher_id"] == "r-2" and r is not live for r in db.ledger)
+
+    def test_dry_run_and_staleness(self):
+        db = FakeDb([_sale(n) for n in range(1, 4)])
+        runner = StockLedgerBackfill()
+        job = runner.new_job({}, dry_run=True, created_by=None)
+
+        done = runner.run(db, job)
+
+        assert db.ledger == [] and done["stats"]["rows_planned"] == 3
+        assert [r["voucher_id"] for r in done["sample"]] == ["s-01", "s-02", "s-03"]
+        assert not is_stale(done)
+        assert is_stale({"heartbeat_at": "2020-01-01T00:00:00+00:00"})
+
+
+class TestSupabaseVoucherPages:
+    """SupabaseDatabase.iter_stock_ledger_backfill_vouchers"""
+
+    def test_keyset_pages(self):
+        from app.supabase_db import SupabaseDatabase
+
+        query = Mock()
+        for name in ("select", "order", "limit", "gt"):
+            getattr(query, name).return_value = query
+        query.execute.side_effect = [
+            Mock(data=[{"id": "s-1", "sale_items": [{"id": "si-1"}]}, {"id": "s-2", "sale_items": None}]),
+            Mock(data=[{"id": "s-3", "sale_items": []}]),
+        ]
+        client = Mock()
+        client.table.return_value = query
+        db = SupabaseDatabase.__new__(SupabaseDatabase)
+        db.client = client
+
+        pages = list(db.iter_stock_ledger_backfill_vouchers("sale", after_id="s-0", page_size=2))
+
+        assert [[v["id"] for v in page] for page in pages] == [["s-1", "s-2"], ["s-3"]]
+        assert pages[0][0]["items"] == [{"id": "si-1"}] and pages[0][1]["items"] == []
+        assert [c[0] for c in query.gt.call_args_list] == [("id", "s-0"), ("id", "s-2")]
+        query.select.assert_called_with("id, created_at, sale_items(*)")
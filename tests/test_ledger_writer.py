@@ -0,0 +1,143 @@
+"""
+Test suite for the per-voucher stock-ledger writer (app.ledger_writer).
+
+Tests:
+1. Lines are resolved against bulk-loaded products / batches and written in one insert
+2. A failed insert is queued instead of dropped
+3. Retries insert only the rows still missing and give up after the attempt limit
+4. A voucher whose rows could not be planned is queued as-is and planned on retry
+"""
+
+from unittest.mock import Mock
+
+from app import ledger_writer as writer_module
+from app.database import InMemoryDatabase
+from app.ledger_writer import StockLedgerWriter
+
+PRODUCTS = {"p-1": {"id": "p-1", "name": "Atta", "stock_quantity": 40}, "p-2": {"id": "p-2", "name": "Oil", "stock_quantity": 7}}
+BATCHES = {
+    "b-1": {"id": "b-1", "product_id": "p-1", "batch_number": "B1", "warehouse_id": "w-1"},
+    "b-2": {"id": "b-2", "product_id": "p-2", "batch_number": "B2", "warehouse_id": "w-2"},
+}
+ITEMS = [
+    {"product_id": "p-1", "batch_id": "b-1", "quantity": 3, "unit_price": 50},
+    {"product_id": "p-2", "batch_number": "B2", "quantity": 2, "unit_price": 90},
+]
+
+
+def _make_db():
+    db = Mock()
+    db.get_rows_by_ids.side_effect = lambda table, ids: {
+        i: {"products": PRODUCTS, "product_batches": BATCHES}[table][i] for i in ids
+    }
+    db.get_batches_by_product.side_effect = lambda pid: [b for b in BATCHES.values() if b["product_id"] == pid]
+    db.get_warehouses.return_value = [{"id": "w-1", "name": "Main"}, {"id": "w-2", "name": "North"}]
+    db.add_stock_ledger_entries_bulk.side_effect = lambda rows: len(rows)
+    return db
+
+
+def _record(writer, db):
+    return writer.record(
+        db,
+        voucher_type="sale",
+        voucher_id="s-1",
+        items=ITEMS,
+        quantity_key="quantity",
+        quantity_multiplier=-1,
+        created_by="u-1",
+        remarks="Sale INV-1",
+    )
+
+
+class TestRecordVoucher:
+    """StockLedgerWriter.record"""
+
+    def test_one_bulk_insert(self):
+        db = _make_db()
+
+        assert _record(StockLedgerWriter(), db) == 2
+
+        db.add_stock_ledger_entries_bulk.assert_called_once()
+        rows = db.add_stock_ledger_entries_bulk.call_args[0][0]
+        assert [(r["batch_id"], r["warehouse_id"], r["warehouse_name"], r["quantity_change"]) for r in rows] == [
+            ("b-1", "w-1", "Main", -3),
+            ("b-2", "w-2", "North", -2),
+        ]
+        assert rows[0]["product_name"] == "Atta" and rows[0]["quantity_after"] == 40
+        assert db.get_rows_by_ids.call_count == 2  # products + batches, not per line
+        db.get_batches_by_product.assert_called_once_with("p-2")
+        db.get_product.assert_not_called()
+        db.get_batch.assert_not_called()
+        db.get_warehouse.assert_not_called()
+
+    def test_failure_is_queued(self):
+        db = _make_db()
+        db.add_stock_ledger_entries_bulk.side_effect = TimeoutError("statement timeout")
+
+        assert _record(StockLedgerWriter(), db) == 0
+
+        entry = db.enqueue_stock_ledger_write.call_args[0][0]
+        assert entry["voucher_id"] == "s-1" and entry["status"] == "pending"
+        assert entry["expected_rows"] == 2 and len(entry["rows"]) == 2
+        assert "statement timeout" in entry["last_error"]
+
+
+class TestRetryQueue:
+    """StockLedgerWriter.drain against the in-memory backend"""
+
+    def _queued(self, rows_before=0):
+        db = InMemoryDatabase()
+        product = next(iter(db.products.values()))
+        rows = [
+            {"product_id": product["id"], "voucher_type": "sale", "voucher_id": "s-9", "quantity_change": -n}
+            for n in (1, 2, 3)
+        ]
+        db.add_stock_ledger_entries_bulk(rows[:rows_before])
+        StockLedgerWriter.enqueue(db, "sale", "s-9", rows, TimeoutError("timeout"))
+        return db
+
+    def test_inserts_missing_rows_once(self):
+        db = self._queued(rows_before=1)
+
+        assert StockLedgerWriter().drain(db) == {"done": 1}
+        assert StockLedgerWriter().drain(db) == {}
+
+        ledger = db.get_stock_ledger(voucher_type="sale", voucher_id="s-9")
+        assert sorted(r["quantity_change"] for r in ledger) == [-3, -2, -1]
+        assert next(iter(db.stock_ledger_write_queue.values()))["attempts"] == 1
+
+    def test_gives_up_after_max_attempts(self, monkeypatch):
+        monkeypatch.setattr(writer_module, "LEDGER_WRITE_MAX_ATTEMPTS", 2)
+        db = self._queued()
+        db.add_stock_ledger_entries_bulk = Mock(side_effect=TimeoutError("still down"))
+        writer = StockLedgerWriter()
+
+        assert writer.drain(db) == {"pending": 1}
+        assert writer.drain(db) == {}  # backing off
+        entry = next(iter(db.stock_ledger_write_queue.values()))
+        entry["next_attempt_at"] = "2000-01-01T00:00:00+00:00"
+
+        assert writer.drain(db) == {"failed": 1}
+        assert entry["attempts"] == 2 and "still down" in entry["last_error"]
+
+    def test_unplanned_voucher_is_planned_on_retry(self):
+        db = _make_db()
+        lookups = db.get_rows_by_ids.side_effect
+        db.get_rows_by_ids.side_effect = ConnectionError("reset by peer")
+        writer = StockLedgerWriter()
+
+        assert _record(writer, db) == 0
+        entry = db.enqueue_stock_ledger_write.call_args[0][0]
+        assert entry["rows"] == [] and entry["voucher"]["voucher_id"] == "s-1"
+        assert entry["voucher"]["items"] == ITEMS and "reset by peer" in entry["last_error"]
+        db.add_stock_ledger_entries_bulk.assert_not_called()
+
+        db.get_rows_by_ids.side_effect = lookups
+        db.get_stock_ledger_page.return_value = {"entries": []}
+        assert writer.retry(db, entry) == "done"
+
+        rows = db.add_stock_ledger_entries_bulk.call_args[0][0]
+        assert [r["quantity_change"] for r in rows] == [-3, -2]
+        assert {r["created_at"] for r in rows} == {entry["voucher"]["created_at"]}  # the voucher's time, not the retry's
+        update = db.update_stock_ledger_write.call_args[0][1]
+        assert update["status"] == "done" and update["expected_rows"] == 2 and update["voucher"] is None
@@ -0,0 +1,104 @@
+"""
+Test suite for the set-based margin report (app.margins, SupabaseDatabase.get_margin_report).
+
+Tests:
+1. Sale lines and sales are fetched once per snapshot page, not per snapshot
+2. group_by folds rows into groups in the same pass; rows can be omitted
+3. iter_margin_rows streams page by page
+"""
+
+from unittest.mock import Mock
+
+import pytest
+
+from app import supabase_db
+from app.margins import summarize_margin_rows
+
+SNAPSHOTS = [
+    {"id": "c-1", "sale_item_id": "si-1", "product_id": "p-1", "cogs_total": 60, "created_at": "2026-10-01T09:00:00"},
+    {"id": "c-2", "sale_item_id": "si-2", "product_id": "p-2", "cogs_total": 30, "created_at": "2026-10-02T09:00:00"},
+    {"id": "c-3", "sale_item_id": "si-3", "product_id": "p-1", "cogs_total": 90, "created_at": "2026-10-02T10:00:00"},
+]
+SALE_ITEMS = [
+    {"id": "si-1", "sale_id": "s-1", "product_id": "p-1", "product_name": "Atta", "quantity": 2, "total": 100},
+    {"id": "si-2", "sale_id": "s-1", "product_id": "p-2", "product_name": "Oil", "quantity": 1, "total": 50},
+    {"id": "si-3", "sale_id": "s-2", "product_id": "p-1", "product_name": "Atta", "quantity": 3, "total": 150},
+]
+SALES = [
+    {"id": "s-1", "invoice_number": "INV-1", "created_at": "2026-10-01T09:00:00", "retailer_id": "ret-a",
+     "retailer_name": "Karim Store", "assigned_to": "u-1", "assigned_to_name": "Karim"},
+    {"id": "s-2", "invoice_number": "INV-2", "created_at": "2026-10-02T10:00:00", "retailer_id": "ret-b",
+     "retailer_name": "Rahim Store", "assigned_to": None, "assigned_to_name": None},
+]
+
+
+def _builder(*pages):
+    query = Mock()
+    for name in ("select", "gte", "lte", "order", "range", "in_"):
+        getattr(query, name).return_value = query
+    query.execute.side_effect = [Mock(data=page) for page in pages]
+    return query
+
+
+def _make_db(builders):
+    client = Mock()
+    client.table.side_effect = lambda name: builders[name]
+    db = supabase_db.SupabaseDatabase.__new__(supabase_db.SupabaseDatabase)
+    db.client = client
+    db.get_products = Mock(return_value=[{"id": "p-1", "category": "Flour"}, {"id": "p-2", "category": "Oil"}])
+    return db, client
+
+
+class TestMarginReport:
+    """get_margin_report round-trips and grouping"""
+
+    def test_constant_round_trips(self):
+        builders = {
+            "sale_item_cost_snapshot": _builder(SNAPSHOTS),
+            "sale_items": _builder(SALE_ITEMS),
+            "sales": _builder(SALES),
+        }
+        db, client = _make_db(builders)
+
+        report = db.get_margin_report("2026-10-01", "2026-10-31")
+
+        assert client.table.call_count == 3
+        builders["sale_item_cost_snapshot"].gte.assert_called_with("created_at", "2026-10-01")
+        assert report["total_net_sales"] == 300.0 and report["total_margin"] == 120.0
+        first = report["rows"][0]
+        assert first["invoice_number"] == "INV-1" and first["category"] == "Flour"
+        assert first["retailer_name"] == "Karim Store" and first["margin_amount"] == 40.0
+
+    def test_group_by(self):
+        builders = {
+            "sale_item_cost_snapshot": _builder(SNAPSHOTS),
+            "sale_items": _builder(SALE_ITEMS),
+            "sales": _builder(SALES),
+        }
+        db, _ = _make_db(builders)
+        rows = list(db.iter_margin_rows())
+
+        by_product = summarize_margin_rows(rows, "product", include_rows=False)
+        assert by_product["rows"] == []
+        assert [(g["key"], g["quantity"], g["margin_amount"]) for g in by_product["groups"]] == [("p-1", 5, 100.0), ("p-2", 1, 20.0)]
+        by_sr = {g["key"]: g for g in summarize_margin_rows(rows, "sr")["groups"]}
+        assert by_sr["u-1"]["label"] == "Karim" and by_sr[None]["label"] == "Unassigned"
+        by_day = summarize_margin_rows(rows, "day")["groups"]
+        assert sorted(g["key"] for g in by_day) == ["2026-10-01", "2026-10-02"]
+        with pytest.raises(ValueError):
+            summarize_margin_rows(rows, "warehouse")
+
+    def test_streams_by_page(self, monkeypatch):
+        monkeypatch.setattr(supabase_db, "REPORT_PAGE_SIZE", 2)
+        builders = {
+            "sale_item_cost_snapshot": _builder(SNAPSHOTS[:2], SNAPSHOTS[2:]),
+            "sale_items": _builder(SALE_ITEMS[:2], SALE_ITEMS[2:]),
+            "sales": _builder(SALES[:1], SALES[1:]),
+        }
+        db, _ = _make_db(builders)
+
+        rows = db.iter_margin_rows()
+        assert [next(rows)["sale_id"], next(rows)["sale_id"]] == ["s-1", "s-1"]
+        assert builders["sale_items"].execute.call_count == 1  # second page not read yet
+        assert [r["invoice_number"] for r in rows] == ["INV-2"]
+        assert builders["sale_item_cost_snapshot"].execute.call_count == 2
@@ -0,0 +1,105 @@
+"""
+Test suite for the password hashing pool (app.password_pool).
+
+Tests:
+1. hash/verify run in the pool and are counted in stats()
+2. Legacy SHA-256 upgrades are hashed and written as one batch
+3. A rehash never overwrites a hash that changed after verification
+4. apply_password_rehashes uses one RPC call and falls back per row
+"""
+
+import asyncio
+import hashlib
+from unittest.mock import AsyncMock, Mock
+
+from app import password_pool as pool_module
+from app.password_pool import PasswordPool, is_bcrypt_hash, verify_password
+
+
+def _make_db(client):
+    from app.supabase_db import SupabaseDatabase
+    db = SupabaseDatabase.__new__(SupabaseDatabase)
+    db.client = client
+    return db
+
+
+class TestPasswordPool:
+    """PasswordPool hashing, metrics and batched rehash"""
+
+    def test_hash_and_verify_in_pool(self, monkeypatch):
+        monkeypatch.setattr(pool_module, "BCRYPT_ROUNDS", 4)
+        pool = PasswordPool(max_workers=2)
+
+        async def run():
+            hashed = await pool.hash("secret")
+            return hashed, await pool.verify("secret", hashed), await pool.verify("wrong", hashed)
+
+        hashed, ok, bad = asyncio.run(run())
+        pool.shutdown()
+
+        assert is_bcrypt_hash(hashed) and hashed.startswith("$2b$04$")
+        assert ok is True and bad is False
+        stats = pool.stats()
+        assert stats["completed"] == 3
+        assert stats["in_flight"] == 0
+        assert stats["queue_depth"] == 0
+
+    def test_legacy_rehash_is_batched(self, monkeypatch):
+        monkeypatch.setattr(pool_module, "BCRYPT_ROUNDS", 4)
+        monkeypatch.setattr(pool_module, "PASSWORD_REHASH_FLUSH_SECONDS", 0.01)
+        pool = PasswordPool(max_workers=2)
+        backend = Mock()
+        backend.apply_password_rehashes = AsyncMock(side_effect=lambda updates: len(updates))
+        legacy = {uid: hashlib.sha256(uid.encode()).hexdigest() for uid in ("u-1", "u-2", "u-3")}
+
+        async def run():
+            for uid, old in legacy.items():
+                pool.schedule_rehash(backend, uid, old, uid)
+            await pool._rehash_task
+
+        asyncio.run(run())
+        pool.shutdown()
+
+        backend.apply_password_rehashes.assert_awaited_once()
+        updates = backend.apply_password_rehashes.await_args[0][0]
+        assert [u["id"] for u in updates] == ["u-1", "u-2", "u-3"]
+        assert all(verify_password(u["id"], u["password_hash"]) for u in updates)
+        assert pool.stats()["rehashed"] == 3
+        assert pool.stats()["rehash_pending"] == 0
+
+    def test_rehash_is_guarded_by_old_hash(self):
+        from app.database import InMemoryDatabase
+        db = InMemoryDatabase()
+        user = next(iter(db.users.values()))
+        user["password_hash"] = "changed-meanwhile"
+
+        written = db.apply_password_rehashes([
+            {"id": user["id"], "old_hash": "legacy", "password_hash": "$2b$04$new"}
+        ])
+
+        assert written == 0
+        assert user["password_hash"] == "changed-meanwhile"
+
+    def test_supabase_rehash_rpc_and_fallback(self):
+        client = Mock()
+        client.rpc.return_value.execute.return_value.data = 2
+        db = _make_db(client)
+        updates = [
+            {"id": "u-1", "old_hash": "a", "password_hash": "$2b$04$x"},
+            {"id": "u-2", "old_hash": "b", "password_hash": "$2b$04$y"},
+        ]
+
+        assert db.apply_password_rehashes(updates) == 2
+        assert client.rpc.call_args[0] == ("apply_password_rehashes", {"p_updates": updates})
+
+        error = Exception("Could not find the function public.apply_password_rehashes")
+        error.code = "PGRST202"
+        client.rpc.return_value.execute.side_effect = error
+        update = client.table.return_value.update
+        update.return_value.eq.return_value.eq.return_value.execute.return_value.data = [{"id": "u", "token_version": 4}]
+
+        assert db.apply_password_rehashes(updates) == 2
+        guards = [c[0] for c in update.return_value.eq.return_value.eq.call_args_list]
+        assert ("password_hash", "b") in guards
+        assert update.call_args_list[-1][0][0] == {"token_version": 3}
+        update.return_value.eq.return_value.eq.return_value.eq.assert_called_with("token_version", 4)
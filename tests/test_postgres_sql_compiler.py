@@ -0,0 +1,73 @@
+"""
+Tests for the PostgREST-compatible SQL compiler used by PostgresDatabase.
+
+Tests:
+1. Filters are bound as typed parameters (no values inlined into SQL)
+2. Child embeds compile to a single correlated json_agg subquery
+3. Multi-row inserts fill missing columns with DEFAULT
+4. Upserts update every non-conflict column
+"""
+
+from app.postgres_db import PostgresQuery, SqlCompiler
+
+
+SALES_COLUMNS = {
+    "id": "uuid",
+    "retailer_id": "uuid",
+    "payment_status": "text",
+    "created_at": "timestamptz",
+    "total_amount": "numeric",
+}
+
+
+class TestSqlCompiler:
+    """Compile queries against a fixed column-type map"""
+
+    def test_select_binds_typed_parameters(self):
+        query = (
+            PostgresQuery(None, "sales")
+            .select("id, total_amount")
+            .eq("retailer_id", "r-1")
+            .neq("payment_status", "paid")
+            .in_("id", ["a", "b"])
+            .order("created_at", desc=True)
+            .range(0, 49)
+        )
+        compiler = SqlCompiler(SALES_COLUMNS)
+        sql = compiler.compile_select(query)
+
+        assert sql == (
+            'SELECT t."id", t."total_amount" FROM "sales" t'
+            ' WHERE t."retailer_id" = $1::text::"uuid"'
+            ' AND t."payment_status" <> $2::text::"text"'
+            ' AND t."id" = ANY($3::text[]::"uuid"[])'
+            ' ORDER BY t."created_at" DESC LIMIT 50'
+        )
+        assert compiler.args == ["r-1", "paid", ["a", "b"]]
+
+    def test_not_is_null(self):
+        query = PostgresQuery(None, "sales").select("id").not_.is_("retailer_id", "null")
+        sql = SqlCompiler(SALES_COLUMNS).compile_select(query)
+        assert sql.endswith('WHERE NOT (t."retailer_id" IS NULL)')
+
+    def test_embed_compiles_to_json_agg(self):
+        query = PostgresQuery(None, "sales").select("*, sale_items(*)")
+        sql = SqlCompiler(SALES_COLUMNS).compile_select(query)
+        assert "json_agg(c)" in sql
+        assert 'FROM "sale_items" c WHERE c."sale_id" = t."id"' in sql
+
+    def test_multi_row_insert_uses_default_for_missing_columns(self):
+        query = PostgresQuery(None, "sales").insert([
+            {"retailer_id": "r-1", "total_amount": 10},
+            {"retailer_id": "r-2"},
+        ])
+        compiler = SqlCompiler(SALES_COLUMNS)
+        sql = compiler.compile_insert(query)
+        assert "VALUES ($1::text::\"uuid\", $2::text::\"numeric\"), ($3::text::\"uuid\", DEFAULT)" in sql
+        assert sql.endswith("RETURNING t.*")
+        assert compiler.args == ["r-1", "10", "r-2"]
+
+    def test_upsert_updates_non_conflict_columns(self):
+        query = PostgresQuery(None, "sales").upsert({"id": "s-1", "total_amount": 5}, on_conflict="id")
+        sql = SqlCompiler(SALES_COLUMNS).compile_insert(query)
+        assert 'ON CONFLICT ("id") DO UPDATE SET "total_amount" = EXCLUDED."total_amount"' in sql
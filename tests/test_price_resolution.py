@@ -0,0 +1,124 @@
+"""
+Test suite for compiled price resolution (app.pricing, SupabaseDatabase.resolve_prices).
+
+Tests:
+1. Tiers, variant/uom wildcards, list priority and inactive lists
+2. A whole order resolves from one compiled index with no per-line queries
+3. Price-list writes invalidate the compiled index
+"""
+
+from unittest.mock import Mock
+
+import pytest
+
+from app.pricing import PriceIndex, price_indexes
+from app.reference_cache import reference_cache
+
+PRICE_LISTS = [
+    {"id": "pl-low", "priority": 5, "is_active": True},
+    {"id": "pl-vip", "priority": 1, "is_active": True},
+    {"id": "pl-off", "priority": 0, "is_active": False},
+]
+ITEMS = [
+    {"id": "i-1", "price_list_id": "pl-vip", "product_id": "p-1", "min_qty": 0, "unit_price": 100},
+    {"id": "i-2", "price_list_id": "pl-vip", "product_id": "p-1", "min_qty": 10, "unit_price": 90},
+    {"id": "i-3", "price_list_id": "pl-vip", "product_id": "p-1", "uom": "carton", "min_qty": 5, "unit_price": 80, "discount_percent": 10},
+    {"id": "i-4", "price_list_id": "pl-vip", "product_id": "p-1", "variant_id": "v-1", "min_qty": 2, "unit_price": 70},
+    {"id": "i-5", "price_list_id": "pl-low", "product_id": "p-2", "min_qty": 0, "unit_price": 40},
+    {"id": "i-6", "price_list_id": "pl-off", "product_id": "p-2", "min_qty": 0, "unit_price": 1},
+]
+ASSIGNMENTS = [
+    {"retailer_id": "ret-a", "price_list_id": "pl-low"},
+    {"retailer_id": "ret-a", "price_list_id": "pl-vip"},
+    {"retailer_id": "ret-a", "price_list_id": "pl-off"},
+]
+
+
+@pytest.fixture(autouse=True)
+def _fresh_caches():
+    reference_cache.clear()
+    price_indexes.clear()
+    yield
+    reference_cache.clear()
+    price_indexes.clear()
+
+
+class TestPriceIndex:
+    """PriceIndex lookup rules (same as the old per-line resolve_price)"""
+
+    def test_rules(self):
+        index = PriceIndex(PRICE_LISTS, ITEMS, ASSIGNMENTS)
+
+        assert index.price_lists_for("ret-a") == ["pl-vip", "pl-low"]
+        unranked = PriceIndex([*PRICE_LISTS, {"id": "pl-null", "priority": None}], [], [*ASSIGNMENTS, {"retailer_id": "ret-a", "price_list_id": "pl-null"}])
+        assert unranked.price_lists_for("ret-a") == ["pl-vip", "pl-low", "pl-null"]  # NULL priority sorts as 100
+        assert index.resolve("ret-a", "p-1", quantity=3)["base_price"] == 100.0
+        assert index.resolve("ret-a", "p-1", quantity=10)["base_price"] == 90.0
+        carton = index.resolve("ret-a", "p-1", quantity=6, uom="carton")
+        assert carton["base_price"] == 80.0 and carton["resolved_price"] == 72.0
+        assert index.resolve("ret-a", "p-1", quantity=12, uom="carton")["base_price"] == 90.0  # higher tier wins
+        assert index.resolve("ret-a", "p-1", variant_id="v-1", quantity=2)["base_price"] == 70.0
+        assert index.resolve("ret-a", "p-1", variant_id="v-2", quantity=2)["base_price"] == 100.0
+        assert index.resolve("ret-a", "p-1", variant_id="v-1", quantity=1)["base_price"] == 100.0  # below the variant tier
+        assert index.resolve("ret-a", "p-2", quantity=1)["price_list_id"] == "pl-low"
+        assert index.resolve("ret-b", "p-1", quantity=1) is None
+        assert index.resolve("ret-a", "p-3", quantity=1) is None
+
+
+def _make_db():
+    from app.supabase_db import SupabaseDatabase
+
+    tables = {"price_lists": PRICE_LISTS, "price_list_items": ITEMS, "retailer_price_list_assignments": ASSIGNMENTS}
+    client = Mock()
+
+    def table(name):
+        query = Mock()
+        for method in ("select", "order", "range", "eq", "limit", "update", "insert"):
+            getattr(query, method).return_value = query
+        query.execute.return_value = Mock(data=[dict(r) for r in tables.get(name, [])])
+        return query
+
+    client.table.side_effect = table
+    db = SupabaseDatabase.__new__(SupabaseDatabase)
+    db.client = client
+    db.get_rows_by_ids = Mock(return_value={"p-9": {"id": "p-9", "selling_price": 55}})
+    return db, client
+
+
+class TestResolvePrices:
+    """SupabaseDatabase.resolve_prices and index invalidation"""
+
+    def test_order_uses_compiled_index(self):
+        db, client = _make_db()
+        before = price_indexes.stats()
+        lines = [{"product_id": "p-1", "quantity": q} for q in range(1, 31)] + [{"product_id": "p-9", "quantity": 1}]
+
+        resolved = db.resolve_prices("ret-a", lines)
+        reads = client.table.call_count
+        again = db.resolve_price("ret-a", "p-1", None, 10, None)
+
+        assert reads == 3  # price_lists, price_list_items, assignments: once for the whole order
+        assert client.table.call_count == 3
+        assert [r["base_price"] for r in resolved[8:11]] == [100.0, 90.0, 90.0]
+        db.get_rows_by_ids.assert_called_once_with("products", ["p-9"])  # only the unpriced products
+        assert resolved[-1] == {
+            "price_list_id": None, "price_source": "product_default",
+            "base_price": 55.0, "resolved_price": 55.0, "discount_percent": 0,
+        }
+        assert again["base_price"] == 90.0
+        assert price_indexes.stats()["compiles"] - before["compiles"] == 1
+
+    def test_writes_invalidate(self):
+        db, _ = _make_db()
+        before = price_indexes.stats()
+        db.resolve_prices("ret-a", [{"product_id": "p-1", "quantity": 1}])
+
+        db.upsert_price_list_item({"price_list_id": "pl-vip", "product_id": "p-1", "unit_price": 95})
+        db.resolve_prices("ret-a", [{"product_id": "p-1", "quantity": 1}])
+        db.assign_price_list_to_retailer("ret-b", "pl-vip")
+        db.resolve_prices("ret-a", [{"product_id": "p-1", "quantity": 1}])
+        db.resolve_prices("ret-a", [{"product_id": "p-1", "quantity": 1}])
+
+        stats = price_indexes.stats()
+        assert stats["compiles"] - before["compiles"] == 3
+        assert stats["hits"] - before["hits"] == 1
@@ -0,0 +1,89 @@
+"""
+Test suite for receivable aging (app.aging, SupabaseDatabase.get_receivable_aging_report).
+
+Tests:
+1. Default edges keep the legacy bucket columns and boundaries
+2. as_of, custom edges and SR / market-route totals come from one pass
+3. Supabase reads sales and retailers once each, whatever the retailer count
+"""
+
+from datetime import date
+from unittest.mock import Mock
+
+import pytest
+
+from app.aging import DEFAULT_AGING_EDGES, age_receivables, bucket_keys, parse_aging_edges
+
+AS_OF = date(2026, 10, 16)
+RETAILERS = [
+    {"id": "ret-a", "shop_name": "Karim Store", "market_route_id": "mr-1"},
+    {"id": "ret-b", "name": "Rahim", "market_route_id": None},
+]
+SALES = [
+    {"retailer_id": "ret-a", "due_amount": 100, "due_date": "2026-10-09", "assigned_to": "u-1", "assigned_to_name": "Karim"},
+    {"retailer_id": "ret-a", "due_amount": 200, "due_date": "2026-10-08", "assigned_to": "u-1", "assigned_to_name": "Karim"},
+    {"retailer_id": "ret-a", "due_amount": 300, "due_date": "2026-08-01T00:00:00+00:00", "assigned_to": "u-2"},
+    {"retailer_id": "ret-b", "due_amount": 50, "due_date": None},
+    {"retailer_id": "ret-b", "due_amount": 0, "due_date": "2026-01-01"},
+    {"retailer_id": "ret-b", "due_amount": 70, "due_date": "2026-10-01", "created_at": "2026-10-20T10:00:00"},
+]
+
+
+class TestAgingEngine:
+    """age_receivables bucketing and grouping"""
+
+    def test_default_edges(self):
+        assert DEFAULT_AGING_EDGES == (7, 15, 30, 60)
+        assert bucket_keys(DEFAULT_AGING_EDGES) == ["current", "bucket_8_15", "bucket_16_30", "bucket_31_60", "bucket_60_plus"]
+
+        report = age_receivables(SALES, RETAILERS, as_of=AS_OF)
+
+        karim, rahim = report["rows"]
+        assert karim["current"] == 100.0  # exactly 7 days
+        assert karim["bucket_8_15"] == 200.0
+        assert karim["bucket_60_plus"] == 300.0
+        assert karim["total_due"] == 600.0 and karim["sale_count"] == 3
+        assert rahim["current"] == 50.0 and rahim["total_due"] == 50.0  # future sale and zero due skipped
+
+    def test_custom_edges_and_groups(self):
+        report = age_receivables(SALES, RETAILERS, parse_aging_edges("3, 10"), date(2026, 10, 25), {"mr-1": "North"})
+
+        assert report["bucket_keys"] == ["current", "bucket_4_10", "bucket_10_plus"]
+        assert report["totals"]["total_due"] == 720.0 and report["totals"]["bucket_10_plus"] == 670.0
+        by_sr = {g["user_id"]: g for g in report["by_sr"]}
+        assert by_sr["u-1"]["total_due"] == 300.0 and by_sr["u-1"]["user_name"] == "Karim"
+        assert by_sr[None]["user_name"] == "Unassigned" and by_sr[None]["current"] == 50.0
+        by_route = {g["market_route_id"]: g for g in report["by_market_route"]}
+        assert by_route["mr-1"]["market_route_name"] == "North" and by_route["mr-1"]["total_due"] == 600.0
+        assert by_route[None]["total_due"] == 120.0
+
+        for bad in ("", "10,3", "-1,5", "a,b"):
+            with pytest.raises(ValueError):
+                parse_aging_edges(bad)
+
+
+class TestSupabaseAging:
+    """get_receivable_aging_report round-trips"""
+
+    def test_constant_round_trips(self):
+        from app.supabase_db import SupabaseDatabase
+
+        builders = {}
+        for table, rows in (("sales", SALES[:3]), ("retailers", RETAILERS), ("market_routes", [{"id": "mr-1", "name": "North"}])):
+            query = Mock()
+            for name in ("select", "gt", "lt", "order", "range"):
+                getattr(query, name).return_value = query
+            query.execute.return_value = Mock(data=rows)
+            builders[table] = query
+        client = Mock()
+        client.table.side_effect = lambda name: builders[name]
+        db = SupabaseDatabase.__new__(SupabaseDatabase)
+        db.client = client
+
+        report = db.get_receivable_aging_report(as_of=AS_OF)
+
+        assert sorted(c[0][0] for c in client.table.call_args_list) == ["market_routes", "retailers", "sales"]
+        builders["sales"].gt.assert_called_with("due_amount", 0)
+        builders["sales"].lt.assert_called_with("created_at", "2026-10-17")
+        assert report["rows"][0]["total_due"] == 600.0
+        assert report["by_market_route"][0]["market_route_name"] == "North"
@@ -0,0 +1,87 @@
+"""
+Test suite for the process-wide reference-data cache (app.reference_cache).
+
+Tests:
+1. Catalog list reads hit Supabase once, then memory
+2. create/update/delete methods invalidate their table
+3. A load that races an invalidation is not stored
+4. Entries expire after the TTL
+5. Point lookups (SMS template by event) are served from the cached list
+"""
+
+from unittest.mock import Mock
+
+from app.reference_cache import ReferenceCache, reference_cache
+
+
+def _make_db(client):
+    from app.supabase_db import SupabaseDatabase
+    db = SupabaseDatabase.__new__(SupabaseDatabase)
+    db.client = client
+    return db
+
+
+class TestReferenceCache:
+    """ReferenceCache behaviour and SupabaseDatabase integration"""
+
+    def setup_method(self):
+        reference_cache.clear()
+
+    def test_units_are_read_once(self):
+        client = Mock()
+        client.table.return_value.select.return_value.execute.return_value.data = [{"id": "u-1", "name": "kg"}]
+        db = _make_db(client)
+
+        first = db.get_units()
+        first[0]["name"] = "mutated"
+        assert db.get_units() == [{"id": "u-1", "name": "kg"}]
+        assert db.get_unit("u-1")["name"] == "kg"
+        assert client.table.return_value.select.return_value.execute.call_count == 1
+        assert reference_cache.stats()["tables"]["units"]["hits"] == 2
+
+    def test_writes_invalidate(self):
+        client = Mock()
+        client.table.return_value.select.return_value.execute.return_value.data = [{"id": "u-1"}]
+        client.table.return_value.update.return_value.eq.return_value.execute.return_value.data = [{"id": "u-1"}]
+        db = _make_db(client)
+
+        db.get_units()
+        version = reference_cache.version("units")
+        db.update_unit("u-1", {"name": "pcs"})
+        db.get_units()
+
+        assert client.table.return_value.select.return_value.execute.call_count == 2
+        assert reference_cache.version("units") == version + 1
+
+    def test_load_racing_invalidation_is_discarded(self):
+        cache = ReferenceCache(ttl_seconds=60)
+
+        def load():
+            cache.invalidate("units")  # a write lands while the read is in flight
+            return [{"id": "stale"}]
+
+        assert cache.get_or_load("units", load) == [{"id": "stale"}]
+        assert cache.peek("units") is None
+
+    def test_ttl_expiry(self, monkeypatch):
+        cache = ReferenceCache(ttl_seconds=10)
+        now = [1000.0]
+        monkeypatch.setattr("app.reference_cache.time.monotonic", lambda: now[0])
+
+        cache.get_or_load("units", lambda: [{"id": "u-1"}])
+        assert cache.peek("units") == [{"id": "u-1"}]
+        now[0] += 11
+        assert cache.peek("units") is None
+
+    def test_sms_template_by_event_uses_cached_list(self):
+        client = Mock()
+        client.table.return_value.select.return_value.execute.return_value.data = [
+            {"id": "t-1", "event_type": "sale_created"},
+            {"id": "t-2", "event_type": "payment_received"},
+        ]
+        db = _make_db(client)
+
+        assert db.get_sms_template_by_event_type("payment_received")["id"] == "t-2"
+        assert db.get_sms_template_by_event_type("sale_created")["id"] == "t-1"
+        assert db.get_sms_template_by_event_type("missing") is None
+        assert client.table.return_value.select.return_value.execute.call_count == 1
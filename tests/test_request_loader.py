@@ -0,0 +1,94 @@
+"""
+Test suite for the request-scoped loader (app.dataloader).
+
+Tests:
+1. Repeated get_product in one request costs one query; counters track hits/misses
+2. prime() fetches missing ids with one chunked in_ query per table
+3. Write methods invalidate memoized rows
+4. The loader is visible inside ThreadedAsyncDatabase worker threads
+"""
+
+import asyncio
+from unittest.mock import Mock
+
+from app import dataloader
+from app.dataloader import request_scope
+
+
+def _make_db(client):
+    from app.supabase_db import SupabaseDatabase
+    db = SupabaseDatabase.__new__(SupabaseDatabase)
+    db.client = client
+    return db
+
+
+class TestRequestLoader:
+    """RequestLoader memoization and batching"""
+
+    def test_point_lookups_are_memoized(self):
+        client = Mock()
+        client.table.return_value.select.return_value.eq.return_value.execute.return_value.data = [
+            {"id": "p-1", "stock_quantity": 5}
+        ]
+        db = _make_db(client)
+
+        with request_scope(db) as loader:
+            first = db.get_product("p-1")
+            first["stock_quantity"] = 999  # callers may mutate their copy
+            second = db.get_product("p-1")
+
+        assert second["stock_quantity"] == 5
+        assert client.table.return_value.select.return_value.eq.call_count == 1
+        assert loader.stats()["hits"] == 1
+        assert loader.stats()["misses"] == 1
+
+        db.get_product("p-1")  # outside a request: no memoization
+        assert client.table.return_value.select.return_value.eq.call_count == 2
+
+    def test_prime_uses_chunked_in_query(self, monkeypatch):
+        monkeypatch.setattr(dataloader, "LOADER_CHUNK_SIZE", 2)
+        client = Mock()
+        in_ = client.table.return_value.select.return_value.in_
+        in_.side_effect = lambda column, ids: Mock(
+            execute=Mock(return_value=Mock(data=[{"id": i, "name": i} for i in ids if i != "b-3"]))
+        )
+        db = _make_db(client)
+
+        with request_scope(db) as loader:
+            dataloader.prime("product_batches", ["b-1", "b-2", "b-2", "b-3"])
+            assert db.get_batch("b-2")["name"] == "b-2"
+            assert db.get_batch("b-3") is None
+
+        assert [call[0][1] for call in in_.call_args_list] == [["b-1", "b-2"], ["b-3"]]
+        assert loader.stats()["batches"] == 2
+        assert loader.stats()["misses"] == 0
+        client.table.return_value.select.return_value.eq.assert_not_called()
+
+    def test_writes_invalidate(self):
+        client = Mock()
+        client.table.return_value.select.return_value.eq.return_value.execute.return_value.data = [
+            {"id": "p-1", "stock_quantity": 5}
+        ]
+        client.rpc.return_value.execute.return_value.data = {"products": {"p-1": 3}}
+        db = _make_db(client)
+
+        with request_scope(db):
+            db.get_product("p-1")
+            db.apply_stock_movements([{"product_id": "p-1", "delta": -2}])
+            db.get_product("p-1")
+
+        assert client.table.return_value.select.return_value.eq.call_count == 2
+
+    def test_loader_reaches_worker_threads(self):
+        from app.async_supabase_db import ThreadedAsyncDatabase
+
+        seen = []
+        adb = ThreadedAsyncDatabase(Mock(), max_workers=1)
+
+        async def run():
+            with request_scope(Mock()) as loader:
+                await adb.run_sync(lambda: seen.append(dataloader.current_loader()))
+                return loader
+
+        loader = asyncio.run(run())
+        assert seen == [loader]
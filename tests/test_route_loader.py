@@ -0,0 +1,191 @@
+"""
+Test suite for route loading and creation (SupabaseDatabase.get_routes_with_sales, create_route).
+
+Tests:
+1. get_route loads route, route_sales and sales in three queries
+2. Several routes share the same three queries, previous_due joined per route
+3. create_route reads sales and previous dues once and writes in bulk
+4. Previous dues come from retailer_previous_due, or unpaid sales without the migration
+5. DSR sale visibility reads every route owner a page needs in one query
+"""
+
+import asyncio
+from unittest.mock import AsyncMock, Mock
+
+
+def _make_db(client):
+    from app.supabase_db import SupabaseDatabase
+    db = SupabaseDatabase.__new__(SupabaseDatabase)
+    db.client = client
+    return db
+
+
+def _builder(rows):
+    """Chainable query mock that applies in_() filters and range() pages to rows."""
+    query = Mock()
+    query.select.return_value = query
+    query.order.return_value = query
+    query.range.side_effect = lambda start, end: setattr(query, "rows", query.rows[start:end + 1]) or query
+    query.in_.side_effect = lambda column, values: setattr(
+        query, "rows", [r for r in query.rows if r[column] in values]
+    ) or query
+    query.rows = rows
+    query.execute.side_effect = lambda: Mock(data=[dict(r) for r in query.rows])
+    return query
+
+
+def _client(tables):
+    client = Mock()
+    client.table.side_effect = lambda name: _builder(tables[name])
+    return client
+
+
+TABLES = {
+    "routes": [
+        {"id": "r-1", "route_number": "RT-1", "status": "pending"},
+        {"id": "r-2", "route_number": "RT-2", "status": "completed"},
+    ],
+    "route_sales": [
+        {"route_id": "r-1", "sale_id": "s-1", "previous_due": 150},
+        {"route_id": "r-1", "sale_id": "s-2", "previous_due": None},
+        {"route_id": "r-2", "sale_id": "s-3", "previous_due": 40},
+    ],
+    "sales": [
+        {"id": "s-1", "total_amount": 500, "payment_status": "due", "status": "pending", "sale_items": [{"id": "i-1"}]},
+        {"id": "s-2", "total_amount": 300, "payment_status": "paid", "status": "delivered", "sale_items": []},
+        {"id": "s-3", "total_amount": 200, "payment_status": "partial", "status": "delivered", "sale_items": []},
+    ],
+}
+
+
+class TestRouteLoader:
+    """get_route / get_routes_with_sales round-trips"""
+
+    def test_get_route_fixed_queries(self):
+        client = _client(TABLES)
+
+        route = _make_db(client).get_route("r-1")
+
+        assert [c[0][0] for c in client.table.call_args_list] == ["routes", "route_sales", "sales"]
+        assert [s["id"] for s in route["sales"]] == ["s-1", "s-2"]
+        assert route["sales"][0]["previous_due"] == 150.0
+        assert route["sales"][0]["items"] == [{"id": "i-1"}]
+        assert route["sales"][1]["previous_due"] == 0.0
+        assert len(route["route_sales"]) == 2
+
+    def test_many_routes(self):
+        client = _client(TABLES)
+
+        routes = _make_db(client).get_routes_with_sales(["r-1", "r-2", "r-1", "missing"])
+
+        assert client.table.call_count == 3
+        assert set(routes) == {"r-1", "r-2"}
+        assert [s["id"] for s in routes["r-2"]["sales"]] == ["s-3"]
+        assert routes["r-2"]["sales"][0]["previous_due"] == 40.0
+        assert _make_db(_client(TABLES)).get_routes_with_sales([]) == {}
+
+
+class TestCreateRoute:
+    """create_route round-trips and previous-due snapshots"""
+
+    def test_bulk_reads_and_writes(self):
+        candidates = [
+            {"id": "s-1", "retailer_id": "ret-a", "due_amount": 300, "total_amount": 500},
+            {"id": "s-2", "retailer_id": "ret-a", "due_amount": 100, "total_amount": 100},
+            {"id": "s-3", "retailer_id": "ret-b", "due_amount": 0, "total_amount": 200},
+            {"id": "s-4", "retailer_id": None, "due_amount": 50, "total_amount": 50},
+        ]
+        sales = Mock()
+        for name in ("select", "in_", "update"):
+            getattr(sales, name).return_value = sales
+        sales.execute.side_effect = [Mock(data=candidates), Mock(data=[])]
+        routes, route_sales = Mock(), Mock()
+        routes.insert.return_value.execute.return_value = Mock(data=[{"id": "r-new"}])
+        builders = {
+            "sales": sales,
+            "routes": routes,
+            "route_sales": route_sales,
+            "retailer_previous_due": _builder([{"retailer_id": "ret-a", "amount": 650}]),
+        }
+        client = Mock()
+        client.table.side_effect = lambda name: builders[name]
+        db = _make_db(client)
+        db.get_user_by_id = Mock(return_value={"id": "u-1", "name": "Karim"})
+        db.get_route = Mock(return_value={"id": "r-new"})
+
+        db.create_route({"assigned_to": "u-1", "route_date": "2026-10-16"}, ["s-1", "s-2", "s-3", "s-4", "s-1"])
+
+        assert sales.execute.call_count == 2  # candidates, one bulk update
+        route_row = routes.insert.call_args[0][0]
+        assert route_row["total_orders"] == 3 and route_row["total_amount"] == 800.0
+        rows = route_sales.insert.call_args[0][0]
+        assert route_sales.insert.call_count == 1
+        assert {r["sale_id"]: r["previous_due"] for r in rows} == {"s-1": 250.0, "s-2": 250.0, "s-3": 0.0}
+        sales.update.assert_called_once_with({"route_id": "r-new", "assigned_to": "u-1", "assigned_to_name": "Karim"})
+        assert sales.in_.call_args_list[-1][0] == ("id", ["s-1", "s-2", "s-3"])
+
+
+class TestPreviousDues:
+    """calculate_previous_dues bulk lookup"""
+
+    UNPAID = [
+        {"id": "s-1", "retailer_id": "ret-a", "due_amount": 300, "route_id": None},
+        {"id": "s-2", "retailer_id": "ret-a", "due_amount": 100, "route_id": "r-1"},
+        {"id": "s-3", "retailer_id": "ret-b", "due_amount": 70, "route_id": "r-2"},
+    ]
+
+    def test_maintained_balances(self):
+        client = _client({"retailer_previous_due": [{"retailer_id": "ret-a", "amount": 300}]})
+
+        dues = _make_db(client).calculate_previous_dues(["ret-a", "ret-b", "ret-a"])
+
+        assert dues == {"ret-a": 300.0, "ret-b": 0.0}
+        assert [c[0][0] for c in client.table.call_args_list] == ["retailer_previous_due"]
+
+    def test_fallbacks(self):
+        error = Exception("Could not find the table 'public.retailer_previous_due'")
+        error.code = "PGRST205"
+        missing = Mock()
+        missing.select.return_value.in_.return_value.execute.side_effect = error
+        sales = Mock()
+        for name in ("select", "in_", "neq", "order", "range"):
+            getattr(sales, name).return_value = sales
+        sales.execute.return_value = Mock(data=self.UNPAID)
+        client = Mock()
+        client.table.side_effect = lambda name: missing if name == "retailer_previous_due" else sales
+        db = _make_db(client)
+
+        assert db.calculate_previous_dues(["ret-a", "ret-b"]) == {"ret-a": 300.0, "ret-b": 0.0}
+        assert db.calculate_previous_dues(["ret-a", "ret-b"], exclude_route_id="r-1") == {"ret-a": 300.0, "ret-b": 70.0}
+        assert db.calculate_previous_due("ret-a") == 300.0
+        assert missing.select.call_count == 1
+
+
+class TestRouteAssignees:
+    """get_route_assignees and the DSR visibility checks in main.py"""
+
+    def test_one_query(self):
+        tables = {"routes": [{"id": "r-1", "assigned_to": "u-1"}, {"id": "r-2", "assigned_to": None}]}
+        client = _client(tables)
+
+        assert _make_db(client).get_route_assignees(["r-1", "r-2", "r-1", None]) == {"r-1": "u-1", "r-2": None}
+        assert client.table.call_count == 1
+
+    def test_dsr_filter_bulk(self, monkeypatch):
+        from app import main
+
+        adb = Mock()
+        adb.get_route_assignees = AsyncMock(return_value={"r-1": "u-1", "r-2": "u-9"})
+        monkeypatch.setattr(main, "adb", adb)
+        dsr = {"id": "u-1", "role": "dsr"}
+        sales = [
+            {"id": "s-1", "assigned_to": "u-1", "route_id": "r-2"},
+            {"id": "s-2", "assigned_to": None, "route_id": "r-1"},
+            {"id": "s-3", "assigned_to": None, "route_id": "r-2"},
+            {"id": "s-4", "assigned_to": None, "route_id": "r-1"},
+        ]
+
+        route_assignees = asyncio.run(main._route_assignees(sales, dsr))
+
+        assert [s["id"] for s in sales if main._sale_visible_to_user(s, dsr, route_assignees)] == ["s-1", "s-2", "s-4"]
+        adb.get_route_assignees.assert_awaited_once_with(["r-1", "r-2"])
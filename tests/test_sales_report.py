@@ -0,0 +1,88 @@
+"""
+Test suite for the set-based sales report (SupabaseDatabase.get_sales_report).
+
+Tests:
+1. Items are embedded, returns and routes come from one query each; returns are read by sale id
+2. Returns are aggregated per sale and only for sales in the report
+3. Reads page past the PostgREST row cap
+"""
+
+from unittest.mock import Mock
+
+from app import supabase_db
+
+
+def _make_db(client):
+    db = supabase_db.SupabaseDatabase.__new__(supabase_db.SupabaseDatabase)
+    db.client = client
+    return db
+
+
+def _builder(*pages):
+    """Chainable query mock whose execute() yields the given pages in order."""
+    query = Mock()
+    for name in ("select", "gte", "lt", "order", "range", "in_", "eq"):
+        getattr(query, name).return_value = query
+    query.execute.side_effect = [Mock(data=page) for page in pages]
+    return query
+
+
+SALES = [
+    {"id": "s-1", "total_amount": 1000, "paid_amount": 200, "route_id": "r-1", "assigned_to": "u-9",
+     "payment_status": "partial", "status": "delivered",
+     "sale_items": [{"quantity": 10}, {"quantity": 5}]},
+    {"id": "s-2", "total_amount": 500, "paid_amount": 500, "route_id": None, "assigned_to": "u-2",
+     "assigned_to_name": "Rahim", "payment_status": "paid", "status": "delivered",
+     "sale_items": [{"quantity": 4}]},
+]
+RETURNS = [
+    {"id": "ret-1", "sale_id": "s-1", "total_return_amount": 100, "sales_return_items": [{"quantity_returned": 2}]},
+    {"id": "ret-2", "sale_id": "s-1", "total_return_amount": 50, "sales_return_items": [{"quantity_returned": 1}]},
+    {"id": "ret-3", "sale_id": "s-old", "total_return_amount": 999, "sales_return_items": []},
+]
+
+
+class TestSalesReport:
+    """get_sales_report round-trips and aggregation"""
+
+    def test_constant_round_trips(self):
+        builders = {
+            "sales": _builder(SALES),
+            "sales_returns": _builder(RETURNS),
+            "routes": _builder([{"id": "r-1", "assigned_to": "u-1", "assigned_to_name": "Karim"}]),
+        }
+        client = Mock()
+        client.table.side_effect = lambda name: builders[name]
+        db = _make_db(client)
+
+        report, summary = db.get_sales_report("2026-10-01", "2026-10-31")
+
+        assert sorted(call[0][0] for call in client.table.call_args_list) == ["routes", "sales", "sales_returns"]
+        builders["sales"].select.assert_called_with("*, sale_items(*)")
+        builders["sales_returns"].in_.assert_called_once_with("sale_id", ["s-1", "s-2"])  # only the report's sales
+        builders["sales_returns"].gte.assert_called_with("created_at", "2026-10-01")
+
+        s1, s2 = report
+        assert s1["effective_assigned_to"] == "u-1"
+        assert s1["returned_total"] == 150.0 and s1["return_count"] == 2 and s1["returned_qty"] == 3
+        assert s1["net_items"] == 12 and s1["due_amount"] == 650.0
+        assert s2["effective_assigned_to_name"] == "Rahim" and s2["has_returns"] is False
+        assert summary["total_returns"] == 150.0
+        assert summary["sales_with_returns"] == 1
+        assert summary["total_net_items"] == 16
+
+    def test_reads_are_paged(self, monkeypatch):
+        monkeypatch.setattr(supabase_db, "REPORT_PAGE_SIZE", 1)
+        builders = {
+            "sales": _builder(SALES[:1], SALES[1:], []),
+            "sales_returns": _builder([]),
+            "routes": _builder([]),
+        }
+        client = Mock()
+        client.table.side_effect = lambda name: builders[name]
+
+        report, summary = _make_db(client).get_sales_report()
+
+        assert [s["id"] for s in report] == ["s-1", "s-2"]
+        assert [c[0] for c in builders["sales"].range.call_args_list] == [(0, 0), (1, 1), (2, 2)]
+        assert summary["total_gross"] == 1500.0
@@ -0,0 +1,99 @@
+"""
+Test suite for the keyset stock ledger query (get_stock_ledger_page).
+
+Tests:
+1. In-memory pages follow (created_at DESC, id DESC) with filters and an opening balance
+2. Supabase sends filters and the cursor to the get_stock_ledger_page RPC
+3. Without the RPC, ties on the cursor timestamp are skipped client-side
+"""
+
+from unittest.mock import Mock
+
+from app.pagination import encode_cursor
+
+
+class TestInMemoryLedgerPage:
+    """InMemoryDatabase.get_stock_ledger_page"""
+
+    def test_pages_and_opening_balance(self):
+        from app.database import InMemoryDatabase
+        db = InMemoryDatabase()
+        for day in range(1, 6):
+            for warehouse_id in ("w-1", "w-2"):
+                db.add_stock_ledger_entry({
+                    "product_id": "p-1",
+                    "warehouse_id": warehouse_id,
+                    "voucher_type": "adjustment",
+                    "quantity_change": day,
+                    "created_at": f"2026-10-0{day}T10:00:00",
+                })
+
+        first = db.get_stock_ledger_page(
+            product_id="p-1", warehouse_id="w-1", from_date="2026-10-02", to_date="2026-10-04",
+            limit=2, opening_balance=True,
+        )
+        second = db.get_stock_ledger_page(
+            product_id="p-1", warehouse_id="w-1", from_date="2026-10-02", to_date="2026-10-04",
+            limit=2, cursor=first["next_cursor"], opening_balance=True,
+        )
+
+        assert [e["quantity_change"] for e in first["entries"]] == [4, 3]
+        assert first["opening_balance"] == 1
+        assert [e["quantity_change"] for e in second["entries"]] == [2]
+        assert second["next_cursor"] is None and second["opening_balance"] is None
+        assert len(db.get_stock_ledger(voucher_type="sale")) == 0
+
+
+def _make_db(client):
+    from app.supabase_db import SupabaseDatabase
+    db = SupabaseDatabase.__new__(SupabaseDatabase)
+    db.client = client
+    return db
+
+
+class MissingRpc(Exception):
+    code = "PGRST202"
+
+
+class TestSupabaseLedgerPage:
+    """SupabaseDatabase.get_stock_ledger_page"""
+
+    def test_rpc(self):
+        entries = [{"id": "l-2", "created_at": "2026-10-02T10:00:00+00:00"}, {"id": "l-1", "created_at": "2026-10-01T10:00:00+00:00"}]
+        client = Mock()
+        client.rpc.return_value.execute.return_value = Mock(data={"entries": entries, "opening_balance": 7})
+        db = _make_db(client)
+        cursor = encode_cursor("2026-10-03T10:00:00+00:00", "l-3")
+
+        page = db.get_stock_ledger_page(batch_id="b-1", to_date="2026-10-05", cursor=cursor, limit=2, opening_balance=True)
+
+        name, params = client.rpc.call_args[0]
+        assert name == "get_stock_ledger_page"
+        assert params["p_batch_id"] == "b-1" and params["p_to"] == "2026-10-06T00:00:00"
+        assert (params["p_cursor_created_at"], params["p_cursor_id"]) == ("2026-10-03T10:00:00+00:00", "l-3")
+        assert params["p_opening_balance"] is False  # only on the first page
+        assert page["entries"] == entries and page["opening_balance"] is None
+        assert page["next_cursor"] == encode_cursor("2026-10-01T10:00:00+00:00", "l-1")
+
+    def test_fallback_skips_cursor_ties(self):
+        rows = [
+            {"id": "l-3", "created_at": "2026-10-02T10:00:00+00:00"},
+            {"id": "l-2", "created_at": "2026-10-02T10:00:00+00:00"},
+            {"id": "l-1", "created_at": "2026-10-01T10:00:00+00:00"},
+        ]
+        query = Mock()
+        for name in ("select", "eq", "lte", "order", "range"):
+            getattr(query, name).return_value = query
+        query.execute.return_value = Mock(data=rows)
+        client = Mock()
+        client.rpc.return_value.execute.side_effect = MissingRpc("missing")
+        client.table.return_value = query
+        db = _make_db(client)
+
+        page = db.get_stock_ledger_page(
+            product_id="p-1", cursor=encode_cursor("2026-10-02T10:00:00+00:00", "l-3"), limit=5
+        )
+
+        assert [e["id"] for e in page["entries"]] == ["l-2", "l-1"] and page["next_cursor"] is None
+        query.eq.assert_called_once_with("product_id", "p-1")
+        query.lte.assert_called_once_with("created_at", "2026-10-02T10:00:00+00:00")
@@ -0,0 +1,187 @@
+"""
+Test suite for bulk stock reconciliation (app.stock_reconciliation, get_stock_reconciliation_aggregates).
+
+Tests:
+1. Aggregates fold per (product, warehouse) and merge with products in one pass
+2. by_warehouse adds per-warehouse batch vs ledger rows
+3. Supabase uses the aggregate RPC, else batches folded with the ledger balances
+4. Ledger balances fold per (product, warehouse, batch); Supabase reads the maintained
+   table, falls back to a ledger scan and rebuilds through the RPC
+5. The report's product list is read page by page past the PostgREST row cap
+"""
+
+from unittest.mock import Mock
+
+from app import supabase_db
+from app.reference_cache import reference_cache
+from app.stock_reconciliation import (
+    build_reconciliation_report,
+    fold_reconciliation_aggregates,
+    ledger_balance_rows,
+    product_ledger_totals,
+)
+
+PRODUCTS = [
+    {"id": "p-1", "name": "Atta", "sku": "A-1", "stock_quantity": 30},
+    {"id": "p-2", "name": "Oil", "sku": "O-1", "stock_quantity": 12},
+    {"id": "p-3", "name": "Salt", "sku": "S-1", "stock_quantity": 0},
+]
+BATCHES = [
+    {"product_id": "p-1", "warehouse_id": "w-1", "quantity": 20},
+    {"product_id": "p-1", "warehouse_id": "w-2", "quantity": 10},
+    {"product_id": "p-2", "warehouse_id": "w-1", "quantity": 10},
+]
+LEDGER = [
+    {"product_id": "p-1", "warehouse_id": "w-1", "quantity_change": 25},
+    {"product_id": "p-1", "warehouse_id": "w-2", "quantity_change": 5},
+    {"product_id": "p-2", "warehouse_id": "w-1", "quantity_change": 10},
+    {"product_id": None, "warehouse_id": None, "quantity_change": 3},
+]
+
+
+class TestReconciliationReport:
+    """fold_reconciliation_aggregates + build_reconciliation_report"""
+
+    def test_product_rows(self):
+        aggregates = fold_reconciliation_aggregates(BATCHES, ledger_balance_rows(LEDGER))
+
+        assert aggregates["ledger_rows"] == 4 and len(aggregates["rows"]) == 3
+        report = build_reconciliation_report(PRODUCTS, aggregates)
+
+        assert report["totals"]["ledger_rows_scanned"] == 4
+        assert report["totals"]["products_checked"] == 3 and report["totals"]["rows_returned"] == 1
+        oil = report["items"][0]
+        assert oil["product_id"] == "p-2" and oil["status"] == "mismatch_stock_vs_batch"
+        assert oil["stock_vs_batch_diff"] == 2 and oil["batch_vs_ledger_diff"] == 0
+        everything = build_reconciliation_report(PRODUCTS, aggregates, include_only_mismatch=False)
+        salt = everything["items"][2]
+        assert salt["status"] == "ok" and salt["batch_vs_ledger_diff"] is None
+
+    def test_by_warehouse(self):
+        aggregates = fold_reconciliation_aggregates(BATCHES, ledger_balance_rows(LEDGER))
+
+        report = build_reconciliation_report(PRODUCTS, aggregates, by_warehouse=True, warehouse_names={"w-1": "Main"})
+
+        assert [i["product_id"] for i in report["items"]] == ["p-1", "p-2"]  # p-1 totals agree, warehouses do not
+        atta = report["items"][0]
+        assert atta["status"] == "ok"
+        assert [(w["warehouse_name"], w["batch_vs_ledger_diff"]) for w in atta["warehouses"]] == [("Main", -5), (None, 5)]
+        assert report["totals"]["mismatch_warehouse_batch_vs_ledger"] == 2
+
+
+def _builder(rows):
+    query = Mock()
+    for name in ("select", "order", "range", "delete", "gte", "insert"):
+        getattr(query, name).return_value = query
+    if isinstance(rows, Exception):
+        query.execute.side_effect = rows
+    else:
+        query.execute.return_value = Mock(data=rows)
+    return query
+
+
+class MissingRpc(Exception):
+    code = "PGRST202"
+
+
+class MissingTable(Exception):
+    code = "PGRST205"
+
+
+def _supabase_db(tables, rpc_result=None):
+    from app.supabase_db import SupabaseDatabase
+
+    builders = {name: _builder(rows) for name, rows in tables.items()}
+    client = Mock()
+    client.table.side_effect = lambda name: builders[name]
+    if isinstance(rpc_result, Exception):
+        client.rpc.return_value.execute.side_effect = rpc_result
+    else:
+        client.rpc.return_value.execute.return_value = Mock(data=rpc_result)
+    db = SupabaseDatabase.__new__(SupabaseDatabase)
+    db.client = client
+    return db, client, builders
+
+
+class TestSupabaseAggregates:
+    """SupabaseDatabase.get_stock_reconciliation_aggregates"""
+
+    def _make_db(self, rpc_result, balances=None):
+        tables = {"product_batches": BATCHES, "stock_ledger": LEDGER, "stock_ledger_balances": balances or MissingTable("missing")}
+        return _supabase_db(tables, rpc_result)
+
+    def test_rpc(self):
+        rows = [{"product_id": "p-1", "warehouse_id": "w-1", "batch_quantity": 20, "ledger_quantity": 25, "ledger_entries": 1}]
+        db, client, _ = self._make_db({"rows": rows, "ledger_rows": 4})
+
+        assert db.get_stock_reconciliation_aggregates() == {"rows": rows, "ledger_rows": 4}
+        client.rpc.assert_called_once_with("get_stock_reconciliation_aggregates", {})
+        client.table.assert_not_called()
+
+    def test_scan_fallback(self):
+        db, client, builders = self._make_db(MissingRpc("missing"))
+
+        aggregates = db.get_stock_reconciliation_aggregates()
+        db.get_stock_reconciliation_aggregates()
+
+        assert aggregates == fold_reconciliation_aggregates(BATCHES, ledger_balance_rows(LEDGER))
+        assert client.rpc.call_count == 1  # not retried once known missing
+        builders["product_batches"].select.assert_called_with("id, product_id, warehouse_id, quantity")
+        assert builders["stock_ledger"].execute.call_count == 2
+        assert builders["stock_ledger_balances"].execute.call_count == 1  # not retried once known missing
+
+    def test_balances_table(self):
+        db, _, builders = self._make_db(MissingRpc("missing"), balances=ledger_balance_rows(LEDGER))
+
+        assert db.get_stock_reconciliation_aggregates() == fold_reconciliation_aggregates(BATCHES, ledger_balance_rows(LEDGER))
+        builders["stock_ledger"].execute.assert_not_called()
+
+
+class TestLedgerBalances:
+    """ledger_balance_rows, product_ledger_totals and SupabaseDatabase.rebuild_stock_ledger_balances"""
+
+    def test_fold(self):
+        ledger = LEDGER + [{"product_id": "p-1", "warehouse_id": "w-1", "batch_id": "b-9", "quantity_change": -4}]
+
+        balances = ledger_balance_rows(ledger)
+
+        assert [(b["product_id"], b["warehouse_id"], b["batch_id"], b["quantity"], b["entries"]) for b in balances] == [
+            ("p-1", "w-1", None, 25, 1),
+            ("p-1", "w-2", None, 5, 1),
+            ("p-2", "w-1", None, 10, 1),
+            (None, None, None, 3, 1),
+            ("p-1", "w-1", "b-9", -4, 1),
+        ]
+        assert product_ledger_totals(balances) == ({"p-1": 26, "p-2": 10}, {"p-1": 3, "p-2": 1}, 5)
+
+    def test_rebuild_rpc(self):
+        db, client, builders = _supabase_db({"stock_ledger": LEDGER}, {"balances": 4, "ledger_rows": 4})
+
+        assert db.rebuild_stock_ledger_balances() == {"balances": 4, "ledger_rows": 4}
+        client.rpc.assert_called_once_with("rebuild_stock_ledger_balances", {})
+        builders["stock_ledger"].execute.assert_not_called()
+
+    def test_rebuild_fallback(self):
+        db, _, builders = _supabase_db({"stock_ledger": LEDGER, "stock_ledger_balances": []}, MissingRpc("missing"))
+
+        assert db.rebuild_stock_ledger_balances() == {"balances": 4, "ledger_rows": 4}
+        table = builders["stock_ledger_balances"]
+        table.delete.assert_called_once()
+        table.insert.assert_called_once_with(ledger_balance_rows(LEDGER))
+
+
+class TestReportProducts:
+    """SupabaseDatabase.get_products for the reconciliation report"""
+
+    def test_products_paged(self, monkeypatch):
+        monkeypatch.setattr(supabase_db, "REPORT_PAGE_SIZE", 2)
+        reference_cache.clear()
+        db, _, builders = _supabase_db({"products": []})
+        builders["products"].execute.side_effect = [Mock(data=PRODUCTS[:2]), Mock(data=PRODUCTS[2:])]
+
+        try:
+            assert [p["id"] for p in db.get_products()] == ["p-1", "p-2", "p-3"]
+        finally:
+            reference_cache.clear()
+        assert [c[0] for c in builders["products"].range.call_args_list] == [(0, 1), (2, 3)]
+        builders["products"].order.assert_called_with("id")